@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of L{txsolr.bulk.BulkIndexer} against a local fake C{/update}
+endpoint with a fixed latency per request.
+
+Run it from the root of the source tree:
+
+$ python benchmarks/bulk.py
+"""
+import sys
+
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks
+
+from txsolr.bulk import BulkIndexer
+from txsolr.client import SolrClient
+
+from fakeserver import FakeUpdateResource, listen
+
+
+DOCUMENTS = 20000
+LATENCY = 0.02
+
+
+def _documents(count):
+    for i in xrange(count):
+        yield {'id': 'doc-%d' % i,
+               'title': u'Document number %d' % i,
+               'tags': ['tag%d' % (i % 10), 'tag%d' % (i % 7)]}
+
+
+@inlineCallbacks
+def main():
+    resource = FakeUpdateResource(latency=LATENCY)
+    listeningPort, url = listen({'update': resource})
+    client = SolrClient(url)
+
+    print 'Indexing %d documents, %.0f ms per request' % (DOCUMENTS,
+                                                        LATENCY * 1000)
+    for concurrency, targetLatency in ((1, None), (4, None), (8, None),
+                                       (8, 0.25)):
+        indexer = BulkIndexer(client, batchSize=200, concurrency=concurrency,
+                              targetLatency=targetLatency)
+        stats = yield indexer.add(_documents(DOCUMENTS))
+        print ('concurrency=%d adaptive=%-5s %8.0f docs/s %8.0f KB/s '
+               '%4d batches %d failures' % (
+                   concurrency, targetLatency is not None,
+                   stats.documentsPerSecond, stats.bytesPerSecond / 1024,
+                   stats.batches, len(stats.failures)))
+
+    yield listeningPort.stopListening()
+
+
+def run():
+    def stop(result):
+        reactor.stop()
+        return result
+
+    reactor.callWhenRunning(lambda: main().addBoth(stop).addErrback(
+        lambda failure: failure.printTraceback(sys.stderr)))
+    reactor.run()
+
+
+if __name__ == '__main__':
+    run()
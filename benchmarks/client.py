@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the client side overhead of L{txsolr.client.SolrClient}.
+
+The client uses a L{FakeSolrTransport}, so no network is involved and the
+numbers only reflect the work done by txSolr: encoding the requests and
+decoding the responses.
+
+Run it from the root of the source tree:
+
+$ python benchmarks/client.py
+"""
+import time
+
+from txsolr.client import SolrClient
+from txsolr.testing import FakeSolrTransport
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def _bench(name, function, number):
+    latencies = []
+    started = time.time()
+    for i in xrange(number):
+        before = time.time()
+        function(i)
+        latencies.append(time.time() - before)
+    elapsed = time.time() - started
+    print '%-24s %9.0f ops/s  p50 %7.1f us  p99 %7.1f us' % (
+        name, number / elapsed, _percentile(latencies, 50) * 1e6,
+        _percentile(latencies, 99) * 1e6)
+
+
+def main():
+    transport = FakeSolrTransport()
+    client = SolrClient('http://localhost:8983/solr', transport=transport)
+
+    def add(i):
+        client.add({'id': 'doc-%d' % i, 'title': u'Document %d' % i,
+                    'tags': ['a', 'b', 'c']})
+
+    _bench('add', add, 5000)
+    client.commit()
+    _bench('search', lambda i: client.search('id:doc-%d' % i), 2000)
+    _bench('get', lambda i: client.get('doc-%d' % i), 5000)
+    _bench('ping', lambda i: client.ping(), 5000)
+
+
+if __name__ == '__main__':
+    main()
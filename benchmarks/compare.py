@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares two result files written by C{benchmarks/run.py --json}.
+
+For each benchmark present in both files it prints the throughput and the
+median latency of both runs, and the ratio of the new throughput to the old
+one. Ratios above 1 mean the new run is faster.
+
+$ python benchmarks/compare.py old.json new.json
+"""
+import json
+import sys
+
+
+def _load(path):
+    with open(path) as results:
+        return json.load(results)
+
+
+def compare(old, new):
+    """Yields C{(name, oldResult, newResult, ratio)} for each benchmark."""
+    for name in sorted(set(old['benchmarks']) & set(new['benchmarks'])):
+        before = old['benchmarks'][name]
+        after = new['benchmarks'][name]
+        yield (name, before, after,
+               after['opsPerSecond'] / before['opsPerSecond'])
+
+
+def main(oldPath, newPath):
+    old = _load(oldPath)
+    new = _load(newPath)
+    print 'old: %s (Python %s)' % (old['revision'], old['python'])
+    print 'new: %s (Python %s)' % (new['revision'], new['python'])
+    print
+    print '%-28s %12s %12s %10s %10s %7s' % (
+        'benchmark', 'old ops/s', 'new ops/s', 'old p50', 'new p50',
+        'ratio')
+    for name, before, after, ratio in compare(old, new):
+        print '%-28s %12.0f %12.0f %10.1f %10.1f %6.2fx' % (
+            name, before['opsPerSecond'], after['opsPerSecond'],
+            before['p50'], after['p50'], ratio)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('Usage: %s old.json new.json' % sys.argv[0])
+    main(sys.argv[1], sys.argv[2])
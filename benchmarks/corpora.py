@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Fixed synthetic corpora used by the benchmarks.
+
+Each corpus is generated from a fixed seed, so every run of the benchmarks
+works on exactly the same documents.
+"""
+import random
+import string
+from datetime import datetime, timedelta
+
+
+_WORDS = ['solr', 'twisted', 'search', 'index', 'document', 'query', 'field',
+          'facet', 'commit', 'shard', 'replica', 'python', 'deferred']
+
+_UNICODE_WORDS = [u'カカシ外伝', u'戦場のボーイズライフ', u'☝☜', u'ナルト',
+                  u'ブリーチ', u'Ελληνικά', u'русский', u'العربية',
+                  u'\U0001d1b6', u'naïve', u'façade']
+
+
+def _text(rng, words, count):
+    return u' '.join(rng.choice(words) for _ in range(count))
+
+
+def small(count=1000, seed=0):
+    """Documents with a handful of short fields."""
+    rng = random.Random(seed)
+    epoch = datetime(2010, 1, 1)
+    return [{'id': 'small-%d' % i,
+             'title': _text(rng, _WORDS, 4),
+             'popularity': rng.randint(0, 100),
+             'published_dt': epoch + timedelta(seconds=rng.randint(0, 1e8)),
+             'active_b': rng.random() < 0.5}
+            for i in range(count)]
+
+
+def wide(count=200, fields=200, seed=1):
+    """Documents with many single-valued fields."""
+    rng = random.Random(seed)
+    documents = []
+    for i in range(count):
+        document = {'id': 'wide-%d' % i}
+        for field in range(fields):
+            document['field%d_s' % field] = ''.join(
+                rng.choice(string.ascii_letters) for _ in range(12))
+        documents.append(document)
+    return documents
+
+
+def multivalued(count=200, values=50, seed=2):
+    """Documents with a few fields holding many values each."""
+    rng = random.Random(seed)
+    return [{'id': 'multi-%d' % i,
+             'tags': [rng.choice(_WORDS) for _ in range(values)],
+             'scores_i': [rng.randint(0, 1000) for _ in range(values)],
+             'links': ['http://example.com/%d/%d' % (i, j)
+                       for j in range(values)]}
+            for i in range(count)]
+
+
+def unicodeHeavy(count=500, seed=3):
+    """Documents with long non-ASCII text fields."""
+    rng = random.Random(seed)
+    return [{'id': u'unicode-%d-%s' % (i, rng.choice(_UNICODE_WORDS)),
+             'title': _text(rng, _UNICODE_WORDS, 8),
+             'info_t': _text(rng, _UNICODE_WORDS + _WORDS, 120)}
+            for i in range(count)]
+
+
+CORPORA = [('small', small), ('wide', wide), ('multivalued', multivalued),
+           ('unicode', unicodeHeavy)]
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark comparing L{txsolr.input.escapeTerm} with the original
+character by character implementation.
+
+Run it from the root of the source tree:
+
+$ python benchmarks/escaping.py
+"""
+import random
+import string
+import timeit
+
+from txsolr.input import escapeTerm, joinTerms, termsQuery
+
+
+def originalEscapeTerm(term):
+    """The implementation of L{escapeTerm} shipped with txSolr 0.1."""
+    specialChars = set(r'\ + - & | ! ( ) { } [ ] ^ " ~ * ? :'.split())
+    return ''.join(('\\' + c if c in specialChars else c) for c in term)
+
+
+def _randomTerm(size):
+    chars = string.letters + string.digits + r'+-&|!(){}[]^"~*?:\/ '
+    return ''.join(random.choice(chars) for _ in range(size))
+
+
+def _bench(name, function, number):
+    seconds = min(timeit.repeat(function, number=number, repeat=3))
+    print '%-40s %10.0f ops/s' % (name, number / seconds)
+
+
+def main():
+    random.seed(0)
+    shortTerms = [_randomTerm(8) for _ in range(1000)]
+    longTerms = [_randomTerm(200) for _ in range(1000)]
+    ids = ['doc-%d' % i for i in range(10000)]
+
+    for label, terms in (('short terms', shortTerms),
+                         ('long terms', longTerms)):
+        _bench('original escapeTerm (%s)' % label,
+               lambda: [originalEscapeTerm(term) for term in terms], 100)
+        _bench('escapeTerm (%s)' % label,
+               lambda: [escapeTerm(term) for term in terms], 100)
+
+    _bench('original OR group (10000 ids)',
+           lambda: '(' + ' OR '.join(originalEscapeTerm(i)
+                                     for i in ids) + ')', 20)
+    _bench('joinTerms (10000 ids)', lambda: joinTerms(ids), 20)
+    _bench('termsQuery (10000 ids)', lambda: termsQuery('id', ids), 20)
+
+
+if __name__ == '__main__':
+    main()
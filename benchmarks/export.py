@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Memory benchmark of L{txsolr.client.SolrClient.export} against
+L{txsolr.client.SolrClient.search} on a local fake C{/export} endpoint.
+
+The server generates the documents while it writes the body, paced by the
+client, so it doesn't need the whole export in memory either. The number of
+documents is given with the C{rows} parameter, which the real C{/export}
+handler ignores. The peak resident memory of the process is printed after
+each run: it stays flat for exports of any size, and grows with the number
+of rows of a search. The peak can only grow, so the exports are run first.
+
+Run it from the root of the source tree:
+
+$ python benchmarks/export.py
+"""
+import json
+import resource
+from timeit import default_timer
+
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.protocol import Factory, Protocol
+
+from txsolr.client import SolrClient
+
+
+SIZES = (10000, 100000, 1000000)
+SEARCH_SIZES = (10000, 100000)
+BATCH = 500
+
+
+def _peakMemory():
+    """Returns the peak resident memory of the process in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class ExportingSolr(Protocol):
+    """
+    Answers each request with C{rows} generated documents, written in batches
+    when the transport asks for more.
+    """
+
+    def connectionMade(self):
+        self.buffer = ''
+
+    def dataReceived(self, data):
+        self.buffer += data
+        if '\r\n\r\n' not in self.buffer:
+            return
+        requestLine = self.buffer.split('\r\n', 1)[0]
+        self.remaining = int(requestLine.split('rows=')[1].split('&')[0]
+                             .split(' ')[0])
+        self.position = 0
+        self.transport.write('HTTP/1.1 200 OK\r\n'
+                             'Content-Type: application/json\r\n'
+                             'Connection: close\r\n\r\n'
+                             '{"responseHeader":{"status":0,"QTime":0},'
+                             '"response":{"numFound":%d,"start":0,"docs":['
+                             % self.remaining)
+        self.transport.registerProducer(self, False)
+
+    def resumeProducing(self):
+        count = min(BATCH, self.remaining)
+        documents = ','.join(
+            json.dumps({'id': 'doc-%d' % i, 'price': i * 0.5,
+                        'tags': ['a', 'b', 'c']})
+            for i in xrange(self.position, self.position + count))
+        if self.position and count:
+            documents = ',' + documents
+        self.position += count
+        self.remaining -= count
+        self.transport.write(documents)
+        if not self.remaining:
+            self.transport.unregisterProducer()
+            self.transport.write(']}}')
+            self.transport.loseConnection()
+
+    def pauseProducing(self):
+        pass
+
+    def stopProducing(self):
+        pass
+
+
+@inlineCallbacks
+def export(client, rows):
+    stream = client.export(u'*:*', 'id asc', 'id,price,tags', rows=rows)
+    count = 0
+    while True:
+        document = yield stream.next()
+        if document is None:
+            break
+        count += 1
+    assert count == rows
+
+
+@inlineCallbacks
+def search(client, rows):
+    response = yield client.search(u'*:*', rows=rows)
+    assert len(response.results.docs) == rows
+
+
+@inlineCallbacks
+def main():
+    factory = Factory()
+    factory.protocol = ExportingSolr
+    port = reactor.listenTCP(0, factory, interface='127.0.0.1')
+    client = SolrClient('http://127.0.0.1:%d/solr' % port.getHost().port)
+
+    print '%-8s %10s %10s %14s' % ('handler', 'documents', 'seconds',
+                                   'peak memory')
+    runs = ([('export', export, rows) for rows in SIZES] +
+            [('search', search, rows) for rows in SEARCH_SIZES])
+    for name, run, rows in runs:
+        started = default_timer()
+        yield run(client, rows)
+        print '%-8s %10d %10.2f %11.1f MB' % (
+            name, rows, default_timer() - started, _peakMemory())
+    yield port.stopListening()
+
+
+if __name__ == '__main__':
+    def stop(result):
+        if result is not None:
+            result.printTraceback()
+        reactor.stop()
+
+    reactor.callWhenRunning(lambda: main().addBoth(stop))
+    reactor.run()
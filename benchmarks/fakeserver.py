@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+A fake Solr HTTP server used by the benchmarks.
+
+It answers every request without doing any real work, so the benchmarks
+measure the overhead of txSolr and not the one of Solr.
+"""
+import json
+
+from twisted.internet import reactor
+from twisted.web.resource import Resource
+from twisted.web.server import Site, NOT_DONE_YET
+
+
+_HEADER = {'status': 0, 'QTime': 0}
+
+
+class FakeUpdateResource(Resource):
+    """
+    A fake C{/update} handler.
+
+    @param latency: The number of seconds to wait before answering each
+        request, to simulate the time Solr spends indexing a batch.
+    """
+
+    isLeaf = True
+
+    def __init__(self, latency=0):
+        Resource.__init__(self)
+        self.latency = latency
+        self.requests = 0
+        self.bytes = 0
+
+    def render_POST(self, request):
+        self.requests += 1
+        self.bytes += len(request.content.read())
+        request.setHeader('Content-Type', 'application/json')
+        body = json.dumps({'responseHeader': _HEADER})
+
+        if not self.latency:
+            return body
+
+        def finish():
+            request.write(body)
+            request.finish()
+
+        reactor.callLater(self.latency, finish)
+        return NOT_DONE_YET
+
+
+def listen(resources, port=0):
+    """
+    Starts a fake Solr server on localhost.
+
+    @param resources: A C{dict} mapping handler names, like C{update}, to
+        L{Resource}s.
+    @param port: The TCP port to listen on. Default is a random free port.
+    @return: A C{tuple} with the L{IListeningPort} and the Solr URL.
+    """
+    core = Resource()
+    for name, resource in resources.iteritems():
+        core.putChild(name, resource)
+    solr = Resource()
+    solr.putChild('solr', core)
+    site = Site(solr)
+    site.noisy = False
+    listeningPort = reactor.listenTCP(port, site, interface='127.0.0.1')
+    url = 'http://127.0.0.1:%d/solr' % listeningPort.getHost().port
+    return listeningPort, url
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of L{txsolr.transport.PipeliningTransport} against
+L{txsolr.transport.AgentTransport} on a local server with a simulated network
+round trip time.
+
+The server answers each request C{RTT} seconds after receiving it, like a
+distant server that does no work. Without pipelining, each query on a
+persistent connection pays a full round trip, so C{DEPTH} queries in flight
+need C{DEPTH} connections. With pipelining, they share one connection and
+one round trip.
+
+Run it from the root of the source tree:
+
+$ python benchmarks/pipelining.py
+"""
+import json
+from timeit import default_timer
+
+from twisted.internet import reactor
+from twisted.internet.defer import (DeferredSemaphore, gatherResults,
+                                    inlineCallbacks)
+from twisted.internet.protocol import Factory, Protocol
+from twisted.web.client import HTTPConnectionPool
+
+from txsolr.client import SolrClient
+from txsolr.transport import AgentTransport, PipeliningTransport
+
+
+QUERIES = 200
+RTT = 0.02
+DEPTH = 8
+
+_BODY = json.dumps({'responseHeader': {'status': 0, 'QTime': 0},
+                    'response': {'numFound': 0, 'start': 0, 'docs': []}})
+
+
+class DistantSolr(Protocol):
+    """Answers each request C{RTT} seconds after it arrives, in order."""
+
+    def connectionMade(self):
+        self.buffer = ''
+
+    def dataReceived(self, data):
+        self.buffer += data
+        while '\r\n\r\n' in self.buffer:
+            _, self.buffer = self.buffer.split('\r\n\r\n', 1)
+            reactor.callLater(RTT, self.transport.write,
+                              'HTTP/1.1 200 OK\r\n'
+                              'Content-Type: application/json\r\n'
+                              'Content-Length: %d\r\n\r\n%s'
+                              % (len(_BODY), _BODY))
+
+
+@inlineCallbacks
+def run(name, transport, url, concurrency):
+    client = SolrClient(url, transport=transport)
+    semaphore = DeferredSemaphore(concurrency)
+    started = default_timer()
+    yield gatherResults([semaphore.run(client.search, u'id:%d' % i)
+                         for i in range(QUERIES)])
+    elapsed = default_timer() - started
+    print '%-24s %6.2f s  %8.1f queries/s  %5.1f ms/query' % (
+        name, elapsed, QUERIES / elapsed, elapsed / QUERIES * 1000)
+
+
+@inlineCallbacks
+def main():
+    factory = Factory()
+    factory.protocol = DistantSolr
+    port = reactor.listenTCP(0, factory, interface='127.0.0.1')
+    url = 'http://127.0.0.1:%d/solr' % port.getHost().port
+    print '%d queries, %.0f ms round trip' % (QUERIES, RTT * 1000)
+
+    for connections in (1, DEPTH):
+        pool = HTTPConnectionPool(reactor)
+        pool.maxPersistentPerHost = connections
+        agent = AgentTransport(reactor, pool)
+        yield run('keep-alive, %d conn.' % connections, agent, url,
+                  connections)
+        yield pool.closeCachedConnections()
+
+    pipelining = PipeliningTransport(reactor, maxConnections=1,
+                                     maxPipelineDepth=DEPTH)
+    yield run('pipelining, 1 conn.', pipelining, url, DEPTH)
+    for connections in pipelining._connections.values():
+        for connection in connections:
+            connection.transport.loseConnection()
+    yield port.stopListening()
+
+
+if __name__ == '__main__':
+    def stop(result):
+        if result is not None:
+            result.printTraceback()
+        reactor.stop()
+
+    reactor.callWhenRunning(lambda: main().addBoth(stop))
+    reactor.run()
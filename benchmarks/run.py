@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Runs the txSolr benchmark suite.
+
+The suite measures the hot paths of the client on the fixed corpora of
+L{corpora}: encoding C{add} requests, encoding C{/select} parameters,
+buffering response bodies, parsing JSON responses and converting large
+facet lists. It also measures the end-to-end request throughput against a
+local fake Solr HTTP server, with L{SolrClient} and, if trollius is
+installed, with L{AsyncioSolrClient} running in its own thread.
+
+For each benchmark it reports the number of operations per second, the
+latency percentiles and the number of objects allocated per operation. The
+allocations are counted with C{tracemalloc} when it's available. Otherwise,
+they are the net number of objects tracked by the garbage collector that
+were created by each operation.
+
+Run it from the root of the source tree:
+
+$ python benchmarks/run.py --json results.json
+
+and compare two runs with:
+
+$ python benchmarks/compare.py old.json new.json
+"""
+import gc
+import json
+import optparse
+import platform
+import subprocess
+import sys
+from datetime import date, datetime
+from timeit import default_timer
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import trollius as asyncio
+    from trollius import From
+except ImportError:
+    asyncio = None
+
+from twisted.internet import reactor
+from twisted.internet.defer import (Deferred, DeferredSemaphore,
+                                    inlineCallbacks, gatherResults,
+                                    returnValue)
+from twisted.internet.threads import deferToThread
+from twisted.python.failure import Failure
+from twisted.web.client import HTTPConnectionPool, ResponseDone
+from twisted.web.resource import Resource
+
+import twisted
+from txsolr.client import SolrClient
+from txsolr.input import SimpleXMLInputFactory
+from txsolr.response import (FacetField, JSONSolrResponse, ResponseConsumer,
+                             StreamingDocumentConsumer, StreamingFacetConsumer)
+from txsolr.testing import FakeSolrTransport
+from txsolr.transport import AgentTransport
+
+if asyncio is not None:
+    from txsolr.aio import AsyncioSolrClient, AsyncioTransport
+
+import corpora
+from fakeserver import FakeUpdateResource, listen
+
+
+# The size of the chunks in which response bodies are delivered.
+CHUNK_SIZE = 4096
+
+# The number of documents of each response page.
+PAGE_SIZE = 100
+
+# The number of terms of the facet benchmarks.
+FACET_TERMS = 100000
+
+
+def _percentile(values, percent):
+    index = min(len(values) - 1, int(len(values) * percent / 100.0))
+    return values[index]
+
+
+def _countAllocations(operation, number):
+    """Returns the number of objects allocated per call of C{operation}."""
+    if tracemalloc is not None:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        for i in xrange(number):
+            operation(i)
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        blocks = sum(stat.count_diff
+                     for stat in after.compare_to(before, 'filename'))
+        return float(blocks) / number
+
+    gc.collect()
+    gc.disable()
+    try:
+        before = gc.get_count()[0]
+        for i in xrange(number):
+            operation(i)
+        return float(gc.get_count()[0] - before) / number
+    finally:
+        gc.enable()
+
+
+def measure(operation, number):
+    """Measures a synchronous operation.
+
+    @param operation: A callable taking the number of the operation.
+    @param number: The number of operations to be measured.
+    @return: A C{dict} with the results.
+    """
+    for i in xrange(max(1, number // 10)):
+        operation(i)
+
+    latencies = []
+    timer = default_timer
+    started = timer()
+    for i in xrange(number):
+        before = timer()
+        operation(i)
+        latencies.append(timer() - before)
+    elapsed = timer() - started
+
+    return _results(number, elapsed, latencies,
+                    _countAllocations(operation, min(number, 100)))
+
+
+def _results(number, elapsed, latencies, allocations=None):
+    latencies.sort()
+    return {'operations': number,
+            'opsPerSecond': number / elapsed,
+            'p50': _percentile(latencies, 50) * 1e6,
+            'p90': _percentile(latencies, 90) * 1e6,
+            'p99': _percentile(latencies, 99) * 1e6,
+            'max': latencies[-1] * 1e6,
+            'allocationsPerOperation': allocations}
+
+
+def _jsonDefault(value):
+    if isinstance(value, (datetime, date)):
+        return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+    raise TypeError(value)
+
+
+def responseBody(documents):
+    """Returns the body of a Solr JSON response with the given documents."""
+    return json.dumps({'responseHeader': {'status': 0, 'QTime': 1},
+                       'response': {'numFound': len(documents), 'start': 0,
+                                    'docs': documents}},
+                      default=_jsonDefault)
+
+
+class _NullResponse(object):
+    """A response class that does not parse the body at all."""
+
+    def __init__(self, body):
+        self.body = body
+
+
+def syncBenchmarks():
+    """Yields the name and the callable of each synchronous benchmark."""
+    factory = SimpleXMLInputFactory()
+    for name, corpus in corpora.CORPORA:
+        documents = corpus()
+        size = len(documents)
+        body = responseBody(documents[:PAGE_SIZE])
+        chunks = [body[i:i + CHUNK_SIZE]
+                  for i in xrange(0, len(body), CHUNK_SIZE)]
+
+        def createAdd(i, documents=documents, size=size):
+            factory.createAdd(documents[i % size])
+
+        def consume(i, chunks=chunks):
+            consumer = ResponseConsumer(Deferred(), _NullResponse)
+            for chunk in chunks:
+                consumer.dataReceived(chunk)
+            consumer.connectionLost(Failure(ResponseDone()))
+
+        def parse(i, body=body):
+            JSONSolrResponse(body)
+
+        def stream(i, chunks=chunks):
+            consumer = StreamingDocumentConsumer(Deferred(), JSONSolrResponse,
+                                                 lambda document: None)
+            for chunk in chunks:
+                consumer.dataReceived(chunk)
+            consumer.connectionLost(Failure(ResponseDone()))
+
+        yield 'createAdd.%s' % name, createAdd, 2000
+        yield 'consumer.%s' % name, consume, 500
+        yield 'parse.%s' % name, parse, 200
+        yield 'stream.%s' % name, stream, 200
+
+    client = SolrClient('http://localhost:8983/solr',
+                        transport=FakeSolrTransport())
+    ids = ['doc-%d' % i for i in range(500)]
+
+    def encodeSmall(i):
+        client._encodeParameters({'q': u'title:solr', 'rows': 10,
+                                  'fl': 'id,score', 'wt': 'json'})
+
+    def encodeLarge(i):
+        client._encodeParameters({'q': u'*:*', 'fq': u'id:(%s)' %
+                                  u' OR '.join(ids), 'wt': 'json'})
+
+    yield 'select.encode.small', encodeSmall, 5000
+    yield 'select.encode.large', encodeLarge, 500
+
+    terms = ['term-%d' % i for i in xrange(FACET_TERMS)]
+    flat = [value for i, term in enumerate(terms)
+            for value in (term, FACET_TERMS - i)]
+    facetBody = json.dumps({'responseHeader': {'status': 0, 'QTime': 1},
+                            'facet_counts': {'facet_fields': {'tag': flat}}})
+    facetChunks = [facetBody[i:i + CHUNK_SIZE]
+                   for i in xrange(0, len(facetBody), CHUNK_SIZE)]
+
+    # All the facet benchmarks decode the body received in chunks and
+    # convert the facet list, so they compare the whole parsing.
+    def decodeFacets():
+        body = json.loads(''.join(facetChunks))
+        return body['facet_counts']['facet_fields']['tag']
+
+    def facetsDict(i):
+        values = decodeFacets()
+        dict(zip(values[::2], values[1::2]))
+
+    def facetsField(i):
+        FacetField.fromList('tag', decodeFacets())
+
+    def facetsStream(i):
+        consumer = StreamingFacetConsumer(Deferred(), JSONSolrResponse)
+        for chunk in facetChunks:
+            consumer.dataReceived(chunk)
+        consumer.connectionLost(Failure(ResponseDone()))
+
+    yield 'facets.dict', facetsDict, 20
+    yield 'facets.field', facetsField, 20
+    yield 'facets.stream', facetsStream, 5
+
+
+@inlineCallbacks
+def endToEnd(number=2000, concurrency=8):
+    """Measures the request throughput against a local fake HTTP Solr.
+
+    @return: A L{Deferred} that fires with a C{dict} mapping benchmark names
+        to results.
+    """
+    documents = corpora.small(PAGE_SIZE)
+    select = Resource()
+    select.isLeaf = True
+    body = responseBody(documents[:10])
+    select.render_GET = lambda request: body
+    listeningPort, url = listen({'select': select,
+                                 'update': FakeUpdateResource()})
+
+    pool = HTTPConnectionPool(reactor)
+    pool.maxPersistentPerHost = concurrency
+    client = SolrClient(url, transport=AgentTransport(reactor, pool))
+    results = {}
+    for name, operation in (
+            ('e2e.select', lambda i: client.search(u'title:solr', rows=10)),
+            ('e2e.update', lambda i: client.add(
+                documents[i % len(documents)]))):
+        latencies = []
+        semaphore = DeferredSemaphore(concurrency)
+
+        def timed(i, operation=operation, latencies=latencies):
+            before = default_timer()
+            d = operation(i)
+            d.addCallback(lambda _: latencies.append(default_timer() - before))
+            return d
+
+        started = default_timer()
+        yield gatherResults([semaphore.run(timed, i)
+                             for i in xrange(number)])
+        results[name] = _results(number, default_timer() - started,
+                                 latencies)
+
+    yield pool.closeCachedConnections()
+    if asyncio is not None:
+        # The server keeps running in the reactor thread.
+        results.update((yield deferToThread(
+            asyncioEndToEnd, url, documents, number, concurrency)))
+    yield listeningPort.stopListening()
+    returnValue(results)
+
+
+def asyncioEndToEnd(url, documents, number, concurrency):
+    """Measures the request throughput of an L{AsyncioSolrClient} in a new
+    event loop.
+
+    @return: A C{dict} mapping benchmark names to results.
+    """
+    loop = asyncio.new_event_loop()
+    transport = AsyncioTransport(loop, maxConnections=concurrency)
+    client = AsyncioSolrClient(url, transport=transport, loop=loop)
+    results = {}
+    for name, operation in (
+            ('e2e.aio.select', lambda i: client.search(u'title:solr',
+                                                       rows=10)),
+            ('e2e.aio.update', lambda i: client.add(
+                documents[i % len(documents)]))):
+        latencies = []
+        semaphore = asyncio.Semaphore(concurrency, loop=loop)
+
+        @asyncio.coroutine
+        def timed(i, operation=operation, latencies=latencies,
+                  semaphore=semaphore):
+            with (yield From(semaphore)):
+                before = default_timer()
+                yield From(operation(i))
+                latencies.append(default_timer() - before)
+
+        started = default_timer()
+        loop.run_until_complete(asyncio.gather(
+            *[timed(i) for i in xrange(number)], loop=loop))
+        results[name] = _results(number, default_timer() - started,
+                                 latencies)
+
+    transport.close()
+    loop.close()
+    return results
+
+
+def _revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print(name, result):
+    allocations = result['allocationsPerOperation']
+    print '%-28s %10.0f ops/s  p50 %9.1f us  p99 %9.1f us  %s' % (
+        name, result['opsPerSecond'], result['p50'], result['p99'],
+        '' if allocations is None else '%.1f allocs/op' % allocations)
+
+
+def main(options):
+    results = {}
+    for name, operation, number in syncBenchmarks():
+        if options.filter and options.filter not in name:
+            continue
+        results[name] = measure(operation, number)
+        _print(name, results[name])
+
+    def done(endToEndResults):
+        for name in sorted(endToEndResults):
+            results[name] = endToEndResults[name]
+            _print(name, results[name])
+
+        report = {'revision': _revision(),
+                  'python': platform.python_version(),
+                  'twisted': twisted.__version__,
+                  'allocationCounter': ('tracemalloc' if tracemalloc
+                                        else 'gc'),
+                  'benchmarks': results}
+        if options.json:
+            with open(options.json, 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+
+    if options.filter and 'e2e' not in options.filter:
+        done({})
+        return
+
+    def run():
+        d = endToEnd(options.requests)
+        d.addCallback(done)
+        d.addErrback(lambda failure: failure.printTraceback(sys.stderr))
+        d.addBoth(lambda _: reactor.stop())
+
+    reactor.callWhenRunning(run)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--json', help='Write the results to this JSON file.')
+    parser.add_option('--filter',
+                      help='Only run the benchmarks containing this text.')
+    parser.add_option('--requests', type='int', default=2000,
+                      help='The number of end-to-end requests.')
+    options, _ = parser.parse_args()
+    main(options)
@@ -21,14 +21,27 @@ Solr Bindings for Python and Twisted
 
 import logging
 
+from admin import SolrAdmin
+from bulk import BulkIndexer
+from cache import ValidatorCache
 from client import SolrClient
-from input import escapeTerm
+from cloud import AffinityRouter, CloudSolrClient
+from commit import CommitScheduler
+from fanout import FanOutSearcher
+from hedge import HedgingPolicy
+from input import escapeTerm, joinTerms, termsQuery
+from metrics import StatsPoller
+from schema import SchemaCache, SchemaInputFactory
 from errors import (
-    InputError, HTTPWrongStatus, SolrResponseError, HTTPRequestError)
+    InputError, HTTPWrongStatus, VersionConflictError, SolrResponseError,
+    HTTPRequestError, AdminRequestError)
 
 # Used to ignore pyflakes errors.
-_ = (SolrClient, escapeTerm, InputError, HTTPWrongStatus,
-     SolrResponseError, HTTPRequestError)
+_ = (SolrAdmin, BulkIndexer, ValidatorCache, SolrClient, CloudSolrClient,
+     AffinityRouter, CommitScheduler, FanOutSearcher, HedgingPolicy,
+     escapeTerm, joinTerms, termsQuery, StatsPoller, SchemaCache,
+     SchemaInputFactory, InputError, HTTPWrongStatus, VersionConflictError,
+     SolrResponseError, HTTPRequestError, AdminRequestError)
 
 __author__ = 'Manuel Cerón'
 __license__ = 'http://www.apache.org/licenses/LICENSE-2.0'
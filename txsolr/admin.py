@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Core and collection administration.
+
+This module contains a client for the CoreAdmin API, at C{/admin/cores},
+and the Collections API, at C{/admin/collections}, of a Solr server. Slow
+collection operations can be sent as asynchronous requests, whose status is
+polled with an exponential backoff until they complete.
+"""
+import logging
+import uuid
+
+from twisted.internet.defer import TimeoutError, inlineCallbacks, returnValue
+from twisted.internet.task import deferLater
+
+from txsolr.client import SolrClient
+from txsolr.errors import AdminRequestError
+
+
+__all__ = ['SolrAdmin']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+# The states of an asynchronous request that won't change anymore.
+_FINAL_STATES = frozenset(['completed', 'failed', 'notfound'])
+
+
+class SolrAdmin(object):
+    """Administers the cores and the collections of a Solr server.
+
+    All the methods return a L{Deferred} that fires with the L{SolrResponse}
+    of the admin request, with the sections of the response, like C{status}
+    or C{aliases}, as attributes.
+
+    The collection operations accept an C{asynchronous} argument. If it's
+    C{True}, the operation is sent as an asynchronous request and its status
+    is polled, waiting C{pollInterval} seconds first and doubling the wait
+    up to C{maxPollInterval}. The L{Deferred} fires with the final status
+    response once the operation completed, or fails with
+    L{AdminRequestError} if it failed.
+
+    @param url: The URL of the Solr server, like C{http://localhost:8983/solr},
+        without a core.
+    @param transport: The L{ISolrTransport} used to send the HTTP requests.
+        Default is an L{AgentTransport}.
+    @param pollInterval: The number of seconds before the first status
+        request of an asynchronous operation.
+    @param maxPollInterval: The maximum number of seconds between two status
+        requests.
+    @param timeout: Optionally, the maximum number of seconds to wait for an
+        asynchronous operation. The wait fails with L{TimeoutError}, but the
+        operation is not cancelled in Solr.
+    @param clock: The L{IReactorTime} provider used to wait between the
+        status requests. Default is the global reactor.
+    """
+
+    def __init__(self, url, transport=None, pollInterval=0.5,
+                 maxPollInterval=10, timeout=None, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.client = SolrClient(url, transport=transport)
+        self.pollInterval = pollInterval
+        self.maxPollInterval = maxPollInterval
+        self.timeout = timeout
+        self.clock = clock
+
+    def _cores(self, action, **params):
+        params['action'] = action
+        return self.client._query('/admin/cores', params)
+
+    def _collections(self, action, asynchronous=False, **params):
+        params['action'] = action
+        if not asynchronous:
+            return self.client._query('/admin/collections', params)
+
+        requestId = params['async'] = uuid.uuid4().hex
+        d = self.client._query('/admin/collections', params)
+        d.addCallback(lambda _: self._wait(requestId))
+        return d
+
+    @inlineCallbacks
+    def _wait(self, requestId):
+        """Polls the status of an asynchronous request until it's final.
+
+        @return: A L{Deferred} that fires with the final status response.
+        """
+        delay = self.pollInterval
+        # The time spent in the status requests counts too.
+        started = self.clock.seconds()
+        while True:
+            wait = delay
+            if self.timeout is not None:
+                remaining = started + self.timeout - self.clock.seconds()
+                if remaining <= 0:
+                    raise TimeoutError('Request %s did not complete in %s '
+                                       'seconds' % (requestId, self.timeout))
+                wait = min(delay, remaining)
+            yield deferLater(self.clock, wait, lambda: None)
+            delay = min(delay * 2, self.maxPollInterval)
+
+            response = yield self.requestStatus(requestId)
+            state = response.status.get('state')
+            if state in _FINAL_STATES:
+                break
+            _logger.debug('Request %s is %s' % (requestId, state))
+
+        try:
+            yield self.deleteStatus(requestId)
+        except Exception, e:
+            _logger.warning("Can't delete the status of request %s: %s"
+                            % (requestId, e))
+        if state != 'completed':
+            raise AdminRequestError(requestId, state,
+                                    response.status.get('msg'))
+        returnValue(response)
+
+    def coreStatus(self, core=None):
+        """Gets the status of a core, or of all the cores.
+
+        @param core: Optionally, the name of a core.
+        @return: A L{Deferred} that fires with a L{SolrResponse}. Its
+            C{status} maps the names of the cores to their status.
+        """
+        if core is None:
+            return self._cores('STATUS')
+        return self._cores('STATUS', core=core)
+
+    def reloadCore(self, core):
+        """Reloads the configuration and the schema of a core.
+
+        @param core: The name of the core.
+        @return: A L{Deferred} that fires with a L{SolrResponse}.
+        """
+        return self._cores('RELOAD', core=core)
+
+    def swapCores(self, core, other):
+        """Atomically swaps the names of two cores.
+
+        Swapping a core with a freshly reindexed one switches the searches
+        to the new index without downtime.
+
+        @param core: The name of a core.
+        @param other: The name of the other core.
+        @return: A L{Deferred} that fires with a L{SolrResponse}.
+        """
+        return self._cores('SWAP', core=core, other=other)
+
+    def createCollection(self, name, numShards=1, replicationFactor=1,
+                         configName=None, asynchronous=False, **kwargs):
+        """Creates a collection.
+
+        @param name: The name of the collection.
+        @param numShards: The number of shards.
+        @param replicationFactor: The number of replicas of each shard.
+        @param configName: Optionally, the name of the configuration set in
+            ZooKeeper.
+        @param asynchronous: If C{True}, the collection is created with an
+            asynchronous request, waiting until it completes.
+        @param *kwargs: Additional parameters of the C{CREATE} action, like
+            C{router_field}.
+        @return: A L{Deferred} that fires with a L{SolrResponse}.
+        """
+        kwargs.update(name=name, numShards=numShards,
+                      replicationFactor=replicationFactor)
+        if configName is not None:
+            kwargs['collection_configName'] = configName
+        return self._collections('CREATE', asynchronous, **kwargs)
+
+    def reloadCollection(self, name, asynchronous=False):
+        """Reloads all the replicas of a collection.
+
+        @param name: The name of the collection.
+        @param asynchronous: If C{True}, the collection is reloaded with an
+            asynchronous request, waiting until it completes.
+        @return: A L{Deferred} that fires with a L{SolrResponse}.
+        """
+        return self._collections('RELOAD', asynchronous, name=name)
+
+    def deleteCollection(self, name, asynchronous=False):
+        """Deletes a collection.
+
+        @param name: The name of the collection.
+        @param asynchronous: If C{True}, the collection is deleted with an
+            asynchronous request, waiting until it completes.
+        @return: A L{Deferred} that fires with a L{SolrResponse}.
+        """
+        return self._collections('DELETE', asynchronous, name=name)
+
+    def createAlias(self, name, collections, asynchronous=False):
+        """Creates an alias, or points an existing one to other collections.
+
+        Pointing the alias used by the searches to a freshly reindexed
+        collection switches them to the new index without downtime.
+
+        @param name: The name of the alias.
+        @param collections: The name of a collection, or a sequence of names.
+        @param asynchronous: If C{True}, the alias is created with an
+            asynchronous request, waiting until it completes.
+        @return: A L{Deferred} that fires with a L{SolrResponse}.
+        """
+        if not isinstance(collections, basestring):
+            collections = ','.join(collections)
+        return self._collections('CREATEALIAS', asynchronous, name=name,
+                                 collections=collections)
+
+    def deleteAlias(self, name, asynchronous=False):
+        """Deletes an alias.
+
+        @param name: The name of the alias.
+        @param asynchronous: If C{True}, the alias is deleted with an
+            asynchronous request, waiting until it completes.
+        @return: A L{Deferred} that fires with a L{SolrResponse}.
+        """
+        return self._collections('DELETEALIAS', asynchronous, name=name)
+
+    def listAliases(self):
+        """Lists the aliases.
+
+        @return: A L{Deferred} that fires with a L{SolrResponse}. Its
+            C{aliases} maps the names of the aliases to their collections.
+        """
+        return self._collections('LISTALIASES')
+
+    def clusterStatus(self, collection=None):
+        """Gets the status of the cluster, like the state of the replicas.
+
+        @param collection: Optionally, the name of a collection.
+        @return: A L{Deferred} that fires with a L{SolrResponse}. Its
+            C{cluster} has the collections, the aliases and the live nodes.
+        """
+        if collection is None:
+            return self._collections('CLUSTERSTATUS')
+        return self._collections('CLUSTERSTATUS', collection=collection)
+
+    def requestStatus(self, requestId):
+        """Gets the status of an asynchronous request.
+
+        @param requestId: The id of the request.
+        @return: A L{Deferred} that fires with a L{SolrResponse}. Its
+            C{status} has the C{state} of the request, like C{running} or
+            C{completed}, and a C{msg}.
+        """
+        return self._collections('REQUESTSTATUS', requestid=requestId)
+
+    def deleteStatus(self, requestId):
+        """Deletes the stored status of a final asynchronous request.
+
+        @param requestId: The id of the request.
+        @return: A L{Deferred} that fires with a L{SolrResponse}.
+        """
+        return self._collections('DELETESTATUS', requestid=requestId)
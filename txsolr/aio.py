@@ -0,0 +1,705 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+asyncio front-end.
+
+L{AsyncioSolrClient} has the methods of L{SolrClient}, but it runs on an
+asyncio event loop and returns asyncio futures instead of L{Deferred}s. It
+doesn't use the Twisted reactor: its requests are sent with an
+L{AsyncioTransport}, which keeps persistent connections to Solr. The
+requests are built by L{txsolr.request} and the input factory, and the
+responses are decoded by the consumers and the L{SolrResponse} classes of
+L{txsolr.response}, like for L{SolrClient}.
+
+Twisted is still needed: the response consumers are shared with
+L{SolrClient}, so they are Twisted protocols firing L{Deferred}s, and the
+end of a body is given to them as a L{Failure}, like C{ResponseDone}. These
+L{Deferred}s stay inside the module, which only returns asyncio futures
+and coroutines.
+
+On Python 2, the asyncio API is provided by trollius, which must be
+installed to use this module::
+
+    loop = trollius.get_event_loop()
+    client = AsyncioSolrClient('http://localhost:8983/solr/core')
+    response = loop.run_until_complete(client.search(u'title:solr'))
+"""
+import logging
+import urlparse
+
+import trollius as asyncio
+from trollius import From, Return
+from twisted.internet.defer import Deferred
+from twisted.internet.error import ConnectionDone, ConnectionLost
+from twisted.python.failure import Failure
+from twisted.web.client import (ResponseDone, ResponseFailed,
+                                ResponseNeverReceived)
+from twisted.web.http_headers import Headers
+
+from txsolr.client import (SolrClient, _lookupFields, _lookupKeys,
+                           _mergeLookup)
+from txsolr.errors import HTTPRequestError
+from txsolr.input import diffDocuments
+from txsolr.request import checkStatus
+from txsolr.response import (ResponseConsumer, DiscardingResponseConsumer,
+                             JSONSolrResponse)
+from txsolr.transport import _parseResponseHead
+
+
+__all__ = ['AsyncioTransport', 'AsyncioSolrClient', 'AsyncioDocumentStream']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+def _future(deferred, loop):
+    """Returns an asyncio future that fires with the result of a
+    L{Deferred}."""
+    future = asyncio.Future(loop=loop)
+
+    def callback(result):
+        if not future.done():
+            future.set_result(result)
+
+    def errback(failure):
+        if not future.done():
+            future.set_exception(failure.value)
+
+    deferred.addCallbacks(callback, errback)
+    return future
+
+
+class _BodyDecoder(object):
+    """Decodes the body of a response.
+
+    @param length: The length of the body, or C{None} if the body is
+        chunked or ends with the connection.
+    @param chunked: C{True} if the body uses the chunked transfer encoding.
+    @param dataCallback: A callable taking each part of the body.
+    @param finishCallback: A callable taking the data received after the
+        body, once the whole body was received.
+    """
+
+    def __init__(self, length, chunked, dataCallback, finishCallback):
+        self._length = length
+        self._chunked = chunked
+        self._dataCallback = dataCallback
+        self._finishCallback = finishCallback
+        self._buffer = ''
+        self._state = 'size'
+        self._remaining = 0
+        self._finished = False
+
+    def dataReceived(self, data):
+        """Decodes the data received.
+
+        @raise ValueError: If a chunk is malformed.
+        """
+        if self._finished:
+            return
+        if self._chunked:
+            self._buffer += data
+            self._decodeChunks()
+        elif self._length is None:
+            self._dataCallback(data)
+        else:
+            part, rest = data[:self._length], data[self._length:]
+            self._length -= len(part)
+            if part:
+                self._dataCallback(part)
+            if not self._length:
+                self._finished = True
+                self._finishCallback(rest)
+
+    def _decodeChunks(self):
+        while not self._finished:
+            if self._state == 'data':
+                if not self._buffer:
+                    return
+                part = self._buffer[:self._remaining]
+                self._buffer = self._buffer[len(part):]
+                self._remaining -= len(part)
+                if not self._remaining:
+                    self._state = 'end'
+                self._dataCallback(part)
+                continue
+
+            line, separator, rest = self._buffer.partition('\r\n')
+            if not separator:
+                return
+            self._buffer = rest
+            if self._state == 'size':
+                size = line.split(';', 1)[0].strip()
+                try:
+                    self._remaining = int(size, 16)
+                except ValueError:
+                    self._remaining = -1
+                if self._remaining < 0:
+                    raise ValueError('Malformed chunk size: %r' % line)
+                self._state = 'data' if self._remaining else 'trailer'
+            elif self._state == 'end':
+                if line:
+                    raise ValueError('Malformed chunk end: %r' % line)
+                self._state = 'size'
+            elif not line:
+                # The empty line after the trailer ends the body.
+                self._finished = True
+                self._finishCallback(self._buffer)
+
+
+class _BodyTransport(object):
+    """The transport given to the protocol consuming a L{_StreamedResponse}.
+    """
+
+    def __init__(self, connection, response):
+        self._connection = connection
+        self._response = response
+
+    def pauseProducing(self):
+        if not self._response.done:
+            self._connection.pauseReading()
+
+    def resumeProducing(self):
+        if not self._response.done:
+            self._connection.resumeReading()
+
+    def stopProducing(self):
+        if not self._response.done:
+            self._connection.abort()
+
+
+class _StreamedResponse(object):
+    """An L{IResponse} whose body is delivered while it's received.
+
+    The parts of the body received before L{deliverBody} is called are
+    buffered.
+
+    @ivar done: C{True} once the whole body was received, or the connection
+        was lost.
+    """
+
+    def __init__(self, connection, version, code, phrase, headers):
+        self.version = version
+        self.code = code
+        self.phrase = phrase
+        self.headers = headers
+        self.done = False
+        self._connection = connection
+        self._protocol = None
+        self._parts = []
+        self._reason = None
+
+    def deliverBody(self, protocol):
+        self._protocol = protocol
+        protocol.makeConnection(_BodyTransport(self._connection, self))
+        parts, self._parts = self._parts, None
+        for part in parts:
+            protocol.dataReceived(part)
+        if self._reason is not None:
+            protocol.connectionLost(self._reason)
+
+    def _dataReceived(self, data):
+        if self._protocol is None:
+            self._parts.append(data)
+        else:
+            self._protocol.dataReceived(data)
+
+    def _finished(self, reason):
+        self.done = True
+        if self._protocol is None:
+            self._reason = reason
+        else:
+            self._protocol.connectionLost(reason)
+
+
+class _HTTPConnection(asyncio.Protocol):
+    """An HTTP/1.1 client connection of an L{AsyncioTransport}.
+
+    One request is sent at a time. The connection is given back to the
+    transport once the whole response was received, unless the server
+    closes it.
+
+    @ivar key: The C{(scheme, host, port)} of the server.
+    @ivar closed: C{True} once the connection is lost.
+    @ivar inUse: C{True} while a request is sent or its response received.
+    @ivar requests: The number of requests sent on the connection.
+    """
+
+    def __init__(self, pool, key):
+        self.key = key
+        self.transport = None
+        self.closed = False
+        self.inUse = False
+        self.requests = 0
+        self._pool = pool
+        self._method = None
+        self._head = None
+        self._response = None
+        self._buffer = ''
+        self._decoder = None
+        self._closing = False
+        self._untilClosed = False
+        self._paused = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def send(self, method, path, host, headers, body):
+        """Sends a request.
+
+        @return: An asyncio future that fires with a L{_StreamedResponse}
+            once the response head is received.
+        """
+        self._head = asyncio.Future(loop=self._pool.loop)
+        if self.closed:
+            self._head.set_exception(ResponseNeverReceived(
+                [Failure(ConnectionDone())]))
+            self._pool._release(self, False)
+            return self._head
+
+        lines = ['%s %s HTTP/1.1' % (method, path), 'Host: %s' % host]
+        for name, values in headers.getAllRawHeaders():
+            lines.extend('%s: %s' % (name, value) for value in values)
+        if body is not None:
+            lines.append('Content-Length: %d' % len(body))
+        self.transport.write('\r\n'.join(lines) + '\r\n\r\n' + (body or ''))
+        self.requests += 1
+        self._method = method
+        return self._head
+
+    def data_received(self, data):
+        try:
+            if self._decoder is not None:
+                self._decoder.dataReceived(data)
+            else:
+                self._headReceived(data)
+        except ValueError as e:
+            # The request fails when the connection is lost.
+            _logger.error('Malformed response: %s' % e)
+            self._buffer = ''
+            self._decoder = None
+            self.abort()
+
+    def _headReceived(self, data):
+        self._buffer += data
+        head, separator, rest = self._buffer.partition('\r\n\r\n')
+        if not separator or self._head is None:
+            return
+        self._buffer = ''
+
+        version, code, phrase, headers = _parseResponseHead(head)
+        connection = ','.join(headers.getRawHeaders('connection', []))
+        # HTTP/1.0 servers close the connection after each response.
+        self._closing = (version < ('HTTP', 1, 1) or
+                         'close' in connection.lower())
+        self._response = _StreamedResponse(self, version, code, phrase,
+                                           headers)
+        waiting, self._head = self._head, None
+        if not waiting.done():
+            waiting.set_result(self._response)
+
+        encoding = ','.join(headers.getRawHeaders('transfer-encoding', []))
+        length = headers.getRawHeaders('content-length')
+        if (self._method == 'HEAD' or code in (204, 304)
+                or 100 <= code < 200 or length == ['0']):
+            self._finish(rest)
+            return
+        elif 'chunked' in encoding.lower():
+            self._decoder = _BodyDecoder(None, True,
+                                         self._response._dataReceived,
+                                         self._finish)
+        elif length:
+            self._decoder = _BodyDecoder(int(length[0]), False,
+                                         self._response._dataReceived,
+                                         self._finish)
+        else:
+            # The body ends when the connection is closed.
+            self._closing = True
+            self._untilClosed = True
+            self._decoder = _BodyDecoder(None, False,
+                                         self._response._dataReceived,
+                                         self._finish)
+        if rest:
+            self._decoder.dataReceived(rest)
+
+    def _finish(self, rest):
+        response = self._response
+        self._response = None
+        self._decoder = None
+        self._untilClosed = False
+        # The protocol may have paused the connection with the last part of
+        # the body.
+        self.resumeReading()
+        if self._closing:
+            self.transport.close()
+        self._pool._release(self, not self._closing)
+        response._finished(Failure(ResponseDone()))
+
+    def pauseReading(self):
+        if not self._paused and not self.closed:
+            self._paused = True
+            self.transport.pause_reading()
+
+    def resumeReading(self):
+        if self._paused and not self.closed:
+            self._paused = False
+            self.transport.resume_reading()
+
+    def abort(self):
+        """Closes the connection, dropping the request in progress."""
+        if not self.closed:
+            self.transport.abort()
+
+    def connection_lost(self, exc):
+        self.closed = True
+        if self._untilClosed and self._decoder is not None:
+            # The end of the connection is the end of the response.
+            self._finish('')
+
+        if exc is None:
+            reason = Failure(ConnectionDone())
+        else:
+            reason = Failure(ConnectionLost(str(exc)))
+        if self._head is not None:
+            waiting, self._head = self._head, None
+            if not waiting.done():
+                waiting.set_exception(ResponseNeverReceived([reason]))
+        elif self._response is not None:
+            response, self._response = self._response, None
+            self._decoder = None
+            response._finished(Failure(ResponseFailed([reason])))
+        self._pool._connectionLost(self)
+
+
+class AsyncioTransport(object):
+    """A transport sending HTTP/1.1 requests on an asyncio event loop.
+
+    The connections are kept open between requests and reused. At most
+    C{maxConnections} connections are made to each server: beyond it,
+    requests wait for a connection to be free.
+
+    The transport has the interface of an L{ISolrTransport}, except that
+    L{request} takes the body of the request as a C{str} and returns an
+    asyncio future.
+
+    @param loop: The event loop. Default is the current event loop.
+    @param maxConnections: The maximum number of connections to each
+        server.
+    """
+
+    def __init__(self, loop=None, maxConnections=10):
+        if loop is None:
+            loop = asyncio.get_event_loop()
+
+        self.loop = loop
+        self.maxConnections = maxConnections
+        self._idle = {}
+        self._slots = {}
+
+    @asyncio.coroutine
+    def request(self, method, url, headers, body=None):
+        """Sends an HTTP request.
+
+        If the server closed a persistent connection while a C{GET} request
+        was sent on it, the request is sent again on a new connection.
+
+        @param method: The HTTP method of the request, like C{GET}.
+        @param url: The full URL of the request.
+        @param headers: A L{Headers} instance with the request headers.
+        @param body: The body of the request as a C{str}, or C{None}.
+        @return: An asyncio future that fires with an L{IResponse} provider
+            once the response head is received. The body of the response
+            must be delivered, even if it's not needed, to release the
+            connection. Cancelling it closes the connection.
+        """
+        parsed = urlparse.urlparse(url)
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        key = (parsed.scheme, parsed.hostname, port)
+        path = urlparse.urlunparse(('', '', parsed.path or '/',
+                                    parsed.params, parsed.query, ''))
+        while True:
+            connection = yield From(self._connect(key))
+            reused = connection.requests > 0
+            try:
+                response = yield From(connection.send(
+                    method, path, parsed.netloc, headers, body))
+            except ResponseNeverReceived:
+                if reused and method in ('GET', 'HEAD'):
+                    _logger.debug('Retrying a request on a new connection')
+                    continue
+                raise
+            except BaseException:
+                connection.abort()
+                raise
+            raise Return(response)
+
+    @asyncio.coroutine
+    def _connect(self, key):
+        """Waits for a free connection to a server.
+
+        @return: An asyncio future that fires with an L{_HTTPConnection}.
+        """
+        slots = self._slots.get(key)
+        if slots is None:
+            slots = asyncio.Semaphore(self.maxConnections, loop=self.loop)
+            self._slots[key] = slots
+        yield From(slots.acquire())
+
+        idle = self._idle.get(key)
+        while idle:
+            connection = idle.pop()
+            if not connection.closed:
+                connection.inUse = True
+                raise Return(connection)
+
+        scheme, host, port = key
+        try:
+            _, connection = yield From(self.loop.create_connection(
+                lambda: _HTTPConnection(self, key), host, port,
+                ssl=scheme == 'https'))
+        except BaseException:
+            slots.release()
+            raise
+        connection.inUse = True
+        raise Return(connection)
+
+    def _release(self, connection, reusable):
+        """Frees a connection once its response was received."""
+        if not connection.inUse:
+            return
+        connection.inUse = False
+        if reusable and not connection.closed:
+            self._idle.setdefault(connection.key, []).append(connection)
+        self._slots[connection.key].release()
+
+    def _connectionLost(self, connection):
+        idle = self._idle.get(connection.key, [])
+        if connection in idle:
+            idle.remove(connection)
+        self._release(connection, False)
+
+    def close(self):
+        """Closes the connections that are not in use."""
+        for idle in self._idle.values():
+            for connection in idle:
+                connection.transport.close()
+        self._idle.clear()
+
+
+class AsyncioDocumentStream(object):
+    """A L{DocumentStream} read with asyncio futures.
+
+    As with a L{DocumentStream}, a stream that is not read until its end
+    must be closed::
+
+        while True:
+            document = yield From(stream.next())
+            if document is None:
+                break
+
+    @param stream: The L{DocumentStream} fed with the documents.
+    @param request: The asyncio future of the request.
+    @param loop: The event loop.
+    """
+
+    def __init__(self, stream, request, loop):
+        self._stream = stream
+        self._request = request
+        self._loop = loop
+        request.add_done_callback(self._finished)
+
+    @property
+    def response(self):
+        """The L{SolrResponse} of the query, like for L{DocumentStream}."""
+        return self._stream.response
+
+    @property
+    def eof(self):
+        """The C{EOF} tuple of a L{TupleStream}, once received."""
+        return getattr(self._stream, 'eof', None)
+
+    def _finished(self, request):
+        if request.cancelled():
+            self._stream.failed(Failure(asyncio.CancelledError()))
+        elif request.exception() is not None:
+            self._stream.failed(Failure(request.exception()))
+        else:
+            self._stream.finished(request.result())
+
+    def next(self):
+        """Takes the next document of the stream.
+
+        @return: An asyncio future that fires with a document, or with
+            C{None} at the end of the stream. It fails if the query failed.
+        """
+        return _future(self._stream.next(), self._loop)
+
+    def close(self):
+        """Stops receiving the documents and ends the stream.
+
+        The request is cancelled if the response was not received yet.
+        """
+        self._stream.close()
+        self._request.cancel()
+
+
+class AsyncioSolrClient(SolrClient):
+    """A L{SolrClient} for asyncio applications.
+
+    It has the same methods as L{SolrClient}, but they return asyncio
+    futures instead of L{Deferred}s, and the streaming methods return
+    L{AsyncioDocumentStream}s. The requests are sent as soon as the methods
+    are called. Cancelling a future cancels its request. The
+    C{schemaCache} of L{SolrClient} is not supported, as L{SchemaCache}
+    works with L{Deferred}s.
+
+    @param url: The URL of the Solr core.
+    @param inputFactory: The input body generator, like for L{SolrClient}.
+    @param transport: The transport used to send the HTTP requests, with
+        the interface of an L{AsyncioTransport}. Default is an
+        L{AsyncioTransport}.
+    @param maxGetLength: The maximum length of the full URL of a query sent
+        with a GET request, like for L{SolrClient}.
+    @param cache: Optionally, a L{ValidatorCache}, like for L{SolrClient}.
+    @param loop: The event loop. Default is the current event loop.
+    """
+
+    def __init__(self, url, inputFactory=None, transport=None,
+                 maxGetLength=4096, cache=None, loop=None):
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        if transport is None:
+            transport = AsyncioTransport(loop)
+
+        SolrClient.__init__(self, url, inputFactory, transport, maxGetLength,
+                            cache)
+        self.loop = loop
+
+    def _request(self, method, path, headers, bodyProducer,
+                 consumerFactory=None, cache=None):
+        """Performs a request to Solr. See L{SolrClient._request}.
+
+        @return: An asyncio future that fires with a L{SolrResponse} object.
+            Cancelling it cancels the request, or stops receiving the body
+            if the response was already received.
+        """
+        body = bodyProducer.body if bodyProducer is not None else None
+        return asyncio.ensure_future(
+            self._send(method, path, headers, body, consumerFactory, cache),
+            loop=self.loop)
+
+    @asyncio.coroutine
+    def _send(self, method, path, headers, body, consumerFactory, cache):
+        if consumerFactory is None:
+            consumerFactory = lambda deferred: ResponseConsumer(
+                deferred, JSONSolrResponse)
+
+        url = self.url + path
+        cached = cache.lookup(url) if cache is not None else None
+        if cached is not None:
+            headers.update(cached.validators())
+        headers.update({'User-Agent': ['txSolr']})
+        _logger.debug('Requesting: [%s] %s' % (method, url))
+        try:
+            response = yield From(self.transport.request(
+                method, url, Headers(headers), body))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _logger.error(e)
+            raise HTTPRequestError(e)
+
+        _logger.debug('Received response from ' + url)
+        if response.code == 304 and cached is not None:
+            response.deliverBody(DiscardingResponseConsumer())
+            cache.hits += 1
+            raise Return(cached.response)
+        if response.code != 200:
+            response.deliverBody(DiscardingResponseConsumer())
+            checkStatus(response.code)
+
+        consumed = Deferred()
+        deliveryProtocol = consumerFactory(consumed)
+        response.deliverBody(deliveryProtocol)
+        try:
+            solrResponse = yield From(_future(consumed, self.loop))
+        except asyncio.CancelledError:
+            if deliveryProtocol.transport is not None:
+                deliveryProtocol.transport.stopProducing()
+            raise
+        if cache is not None:
+            cache.store(url, response.headers, solrResponse)
+        raise Return(solrResponse)
+
+    def addChanges(self, old, new, uniqueKey='id', checkVersion=False,
+                   commitWithin=None):
+        """Sends only the fields that changed in a document, as an atomic
+        update. See L{SolrClient.addChanges}.
+
+        @return: An asyncio future that fires with a L{SolrResponse} object,
+            or with C{None} if nothing changed.
+        """
+        update = diffDocuments(old, new, uniqueKey, checkVersion)
+        if update is None:
+            unchanged = asyncio.Future(loop=self.loop)
+            unchanged.set_result(None)
+            return unchanged
+        return self.add(update, commitWithin=commitWithin)
+
+    def getByIds(self, ids, fields=None, realtime=True, uniqueKey='id',
+                 chunkSize=1000, concurrency=4):
+        """Fetches many documents given their unique keys. See
+        L{SolrClient.getByIds}.
+
+        @return: An asyncio future that fires with a L{LookupResults}
+            object with the documents in the same order as C{ids}.
+        """
+        return asyncio.ensure_future(
+            self._getByIds(ids, fields, realtime, uniqueKey, chunkSize,
+                           concurrency), loop=self.loop)
+
+    @asyncio.coroutine
+    def _getByIds(self, ids, fields, realtime, uniqueKey, chunkSize,
+                  concurrency):
+        keys = _lookupKeys(ids)
+        fields = _lookupFields(fields, uniqueKey)
+        semaphore = asyncio.Semaphore(concurrency, loop=self.loop)
+
+        @asyncio.coroutine
+        def fetch(chunk):
+            with (yield From(semaphore)):
+                response = yield From(
+                    self._lookup(chunk, fields, realtime, uniqueKey))
+            raise Return(response)
+
+        responses = yield From(asyncio.gather(
+            *[fetch(keys[i:i + chunkSize])
+              for i in xrange(0, len(keys), chunkSize)], loop=self.loop))
+        raise Return(_mergeLookup(responses, keys, uniqueKey))
+
+    def _stream(self, path, params, stream, responseClass, arrayPath):
+        """Sends a query whose documents are given to a L{DocumentStream}.
+        See L{SolrClient._stream}.
+
+        @return: An L{AsyncioDocumentStream} reading the stream.
+        """
+        maxGetLength = params.pop('maxGetLength', None)
+        request = self._query(path, params,
+                              lambda deferred: stream.consumer(
+                                  deferred, responseClass, arrayPath),
+                              maxGetLength)
+        return AsyncioDocumentStream(stream, request, self.loop)
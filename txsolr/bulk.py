@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Bulk indexing.
+
+This module contains a L{BulkIndexer} that sends large amounts of documents
+to Solr, keeping several C{/update} requests in flight at the same time.
+"""
+import logging
+from itertools import islice
+
+from twisted.internet.defer import Deferred
+from twisted.python.failure import Failure
+
+from txsolr.errors import VersionConflictError
+
+
+__all__ = ['BulkIndexer', 'IndexingStats', 'BatchFailure']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+class BatchFailure(object):
+    """
+    A batch that could not be sent to Solr.
+
+    @ivar number: The number of the batch, starting from C{0}.
+    @ivar items: The C{list} of documents or IDs of the batch.
+    @ivar failure: The L{Failure} of the last attempt.
+    @ivar attempts: The number of times the batch was sent.
+    """
+
+    def __init__(self, number, items, failure, attempts):
+        self.number = number
+        self.items = items
+        self.failure = failure
+        self.attempts = attempts
+
+
+class IndexingStats(object):
+    """
+    Statistics of a bulk indexing run.
+
+    @ivar documents: The number of documents or IDs acknowledged by Solr.
+    @ivar bytes: The number of body bytes acknowledged by Solr.
+    @ivar batches: The number of batches acknowledged by Solr.
+    @ivar retries: The number of batches sent again after a failure.
+    @ivar failures: A C{list} of L{BatchFailure} for the batches that could
+        not be sent.
+    @ivar acknowledged: The number of batches that are finished, either
+        acknowledged or failed, without gaps from the first one.
+    @ivar batchSize: The current batch size.
+    @ivar elapsed: The number of seconds since the run started.
+    """
+
+    def __init__(self, batchSize):
+        self.documents = 0
+        self.bytes = 0
+        self.batches = 0
+        self.retries = 0
+        self.failures = []
+        self.acknowledged = 0
+        self.batchSize = batchSize
+        self.elapsed = 0.0
+
+    @property
+    def documentsPerSecond(self):
+        """The number of documents acknowledged per second."""
+        return self.documents / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def bytesPerSecond(self):
+        """The number of body bytes acknowledged per second."""
+        return self.bytes / self.elapsed if self.elapsed else 0.0
+
+
+class BulkIndexer(object):
+    """Sends documents to Solr in batches, with many batches in flight.
+
+    Failed batches are sent again up to C{maxRetries} times, except the ones
+    rejected with a L{VersionConflictError}. Batches that still fail are
+    recorded in L{IndexingStats.failures} and the run goes on with the next
+    batches. If the iterable of documents or the C{progress} callback raises
+    an exception, no more batches are sent and the run fails with it.
+
+    If C{targetLatency} is given, the batch size is adapted to the observed
+    latency of the requests: it's halved when a batch takes longer than
+    C{targetLatency} and increased by a quarter when a batch takes less than
+    half of it.
+
+    @param client: The L{SolrClient} used to send the batches.
+    @param batchSize: The number of documents of each batch.
+    @param concurrency: The maximum number of batches in flight.
+    @param maxRetries: The number of times a failed batch is sent again.
+    @param retryDelay: The number of seconds to wait before the first retry
+        of a batch. The delay is doubled on each retry.
+    @param targetLatency: Optionally, the desired number of seconds per
+        batch, used to adapt the batch size.
+    @param minBatchSize: The minimum batch size when adapting it.
+    @param maxBatchSize: The maximum batch size when adapting it.
+    @param progress: Optionally, a callable called with an L{IndexingStats}
+        each time a batch is acknowledged. Batches are acknowledged in the
+        order they were read, so C{stats.acknowledged} never has gaps.
+    @param clock: The L{IReactorTime} provider used to measure the latency
+        and to delay retries. Default is the global reactor.
+    """
+
+    def __init__(self, client, batchSize=100, concurrency=4, maxRetries=3,
+                 retryDelay=1.0, targetLatency=None, minBatchSize=10,
+                 maxBatchSize=10000, progress=None, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.client = client
+        self.batchSize = batchSize
+        self.concurrency = concurrency
+        self.maxRetries = maxRetries
+        self.retryDelay = retryDelay
+        self.targetLatency = targetLatency
+        self.minBatchSize = minBatchSize
+        self.maxBatchSize = maxBatchSize
+        self.progress = progress
+        self.clock = clock
+
+    def add(self, documents, overwrite=None, commitWithin=None):
+        """Adds all the given documents to Solr.
+
+        @param documents: An iterable of C{dict}s representing the documents.
+            It's consumed lazily, so it can be a generator.
+        @param overwrite: Newer documents will replace previously added
+            documents with the same C{uniqueKey}.
+        @param commitWithin: Each batch will be committed within that time.
+        @return: A L{Deferred} that fires with an L{IndexingStats} when all
+            the batches are finished.
+        """
+        factory = self.client.inputFactory
+        return _BulkRun(self, documents, lambda batch: factory.createAdd(
+            batch, overwrite, commitWithin)).start()
+
+    def delete(self, ids):
+        """Deletes all the documents with the given IDs from Solr.
+
+        @param ids: An iterable of document IDs.
+        @return: A L{Deferred} that fires with an L{IndexingStats} when all
+            the batches are finished.
+        """
+        factory = self.client.inputFactory
+        return _BulkRun(self, ids, factory.createDelete).start()
+
+
+class _BulkRun(object):
+    """The state of a single L{BulkIndexer} run.
+
+    @param indexer: The L{BulkIndexer} with the settings of the run.
+    @param items: An iterable of documents or IDs.
+    @param createInput: A callable that creates the L{IBodyProducer} for a
+        batch of items.
+    """
+
+    def __init__(self, indexer, items, createInput):
+        self.indexer = indexer
+        self.items = iter(items)
+        self.createInput = createInput
+        self.stats = IndexingStats(indexer.batchSize)
+        self.started = indexer.clock.seconds()
+        self.inFlight = 0
+        self.nextNumber = 0
+        self.finished = {}
+        self.exhausted = False
+        self.wanted = 0
+        self.sending = False
+        self.deferred = Deferred()
+
+    def start(self):
+        for _ in range(self.indexer.concurrency):
+            self._sendNext()
+        return self.deferred
+
+    def _sendNext(self):
+        """
+        Acknowledges the finished batches, and reads the next batch and
+        sends it, or finishes the run.
+        """
+        # Batches acknowledged synchronously would call this method
+        # recursively for each batch, so the calls are run in a loop instead.
+        self.wanted += 1
+        if self.sending or self.deferred.called:
+            return
+
+        self.sending = True
+        try:
+            while self.wanted:
+                self.wanted -= 1
+                self._acknowledge()
+                self._sendOne()
+        except Exception:
+            # The iterator of the items or the progress callback failed, so
+            # the run can't go on.
+            self.wanted = 0
+            if not self.deferred.called:
+                self.deferred.errback()
+        finally:
+            self.sending = False
+
+    def _sendOne(self):
+        batch = []
+        if not self.exhausted:
+            batch = list(islice(self.items, self.stats.batchSize))
+            self.exhausted = len(batch) < self.stats.batchSize
+
+        if not batch:
+            if self.inFlight == 0 and not self.deferred.called:
+                self._updateElapsed()
+                self.deferred.callback(self.stats)
+            return
+
+        number = self.nextNumber
+        self.nextNumber += 1
+        self.inFlight += 1
+        self._send(number, batch, 1)
+
+    def _send(self, number, batch, attempt):
+        clock = self.indexer.clock
+        started = clock.seconds()
+        try:
+            input = self.createInput(batch)
+        except Exception:
+            # Encoding errors won't go away by sending the batch again.
+            _logger.error('Unable to encode batch %d' % number)
+            self.stats.failures.append(
+                BatchFailure(number, batch, Failure(), 0))
+            self._finish(number)
+            return
+
+        d = self.indexer.client._update(input)
+
+        def succeeded(response):
+            self._adaptBatchSize(clock.seconds() - started)
+            self.stats.documents += len(batch)
+            self.stats.bytes += input.length
+            self.stats.batches += 1
+            self._finish(number)
+
+        def failed(failure):
+            # A version conflict fails again with the same versions.
+            retryable = not failure.check(VersionConflictError)
+            if retryable and attempt <= self.indexer.maxRetries:
+                _logger.warning('Batch %d failed, retrying: %s' %
+                                (number, failure.getErrorMessage()))
+                self.stats.retries += 1
+                delay = self.indexer.retryDelay * 2 ** (attempt - 1)
+                clock.callLater(delay, self._send, number, batch, attempt + 1)
+            else:
+                _logger.error('Batch %d failed: %s' %
+                              (number, failure.getErrorMessage()))
+                self.stats.failures.append(
+                    BatchFailure(number, batch, failure, attempt))
+                self._finish(number)
+
+        d.addCallbacks(succeeded, failed)
+
+    def _adaptBatchSize(self, latency):
+        indexer = self.indexer
+        if indexer.targetLatency is None:
+            return
+
+        batchSize = self.stats.batchSize
+        if latency > indexer.targetLatency:
+            batchSize = batchSize // 2
+        elif latency < indexer.targetLatency / 2.0:
+            batchSize = batchSize + max(1, batchSize // 4)
+        self.stats.batchSize = max(indexer.minBatchSize,
+                                   min(indexer.maxBatchSize, batchSize))
+
+    def _finish(self, number):
+        """Records a finished batch and sends the next."""
+        self.inFlight -= 1
+        self.finished[number] = True
+        self._sendNext()
+
+    def _acknowledge(self):
+        """Acknowledges the finished batches in order."""
+        while self.finished.pop(self.stats.acknowledged, False):
+            self.stats.acknowledged += 1
+            self._updateElapsed()
+            if self.indexer.progress is not None:
+                self.indexer.progress(self.stats)
+
+    def _updateElapsed(self):
+        self.stats.elapsed = self.indexer.clock.seconds() - self.started
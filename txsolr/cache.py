@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+HTTP caching.
+
+When Solr's HTTP caching is enabled, the responses of GET queries include
+an C{ETag} and a C{Last-Modified} header that change when the index
+changes. This module contains a cache of those validators and of the
+decoded responses, so a query repeated while the index didn't change is
+answered by Solr with a bodyless C{304 Not Modified} response, and the
+client reuses the response it already decoded.
+"""
+from collections import OrderedDict
+
+
+__all__ = ['ValidatorCache', 'CachedResponse']
+
+
+class CachedResponse(object):
+    """A response in a L{ValidatorCache}.
+
+    @ivar etag: The value of the C{ETag} header, or C{None}.
+    @ivar lastModified: The value of the C{Last-Modified} header, or
+        C{None}.
+    @ivar response: The decoded L{SolrResponse}.
+    """
+
+    __slots__ = ('etag', 'lastModified', 'response')
+
+    def __init__(self, etag, lastModified, response):
+        self.etag = etag
+        self.lastModified = lastModified
+        self.response = response
+
+    def validators(self):
+        """
+        Returns a C{dict} with the C{If-None-Match} and C{If-Modified-Since}
+        headers to revalidate the response.
+        """
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = [self.etag]
+        if self.lastModified is not None:
+            headers['If-Modified-Since'] = [self.lastModified]
+        return headers
+
+
+class ValidatorCache(object):
+    """
+    A least recently used cache of the validators and responses of GET
+    requests, keyed by URL.
+
+    The cached L{SolrResponse}s are shared by all the callers that get them,
+    so they must not be modified.
+
+    @param maxEntries: The maximum number of responses kept.
+    @ivar hits: The number of requests answered with C{304 Not Modified}.
+    @ivar misses: The number of requests answered with a full response.
+    """
+
+    def __init__(self, maxEntries=1000):
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, url):
+        """Returns the L{CachedResponse} of a URL, or C{None}."""
+        entry = self._entries.pop(url, None)
+        if entry is not None:
+            self._entries[url] = entry
+        return entry
+
+    def store(self, url, headers, response):
+        """Stores a response if it has validators.
+
+        @param url: The URL of the request.
+        @param headers: The L{Headers} of the HTTP response.
+        @param response: The decoded L{SolrResponse}.
+        """
+        self.misses += 1
+        etag = headers.getRawHeaders('etag', [None])[0]
+        lastModified = headers.getRawHeaders('last-modified', [None])[0]
+        cacheControl = ','.join(headers.getRawHeaders('cache-control', []))
+        self._entries.pop(url, None)
+        if etag is None and lastModified is None:
+            return
+        if 'no-store' in cacheControl.lower():
+            return
+
+        self._entries[url] = CachedResponse(etag, lastModified, response)
+        while len(self._entries) > self.maxEntries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Removes all the cached responses."""
+        self._entries.clear()
@@ -24,17 +24,21 @@ instance. All operations return Twisted's deferreds for asynchronous
 programming.
 """
 import logging
-import urllib
 
-from twisted.internet import reactor
-from twisted.internet.defer import Deferred
-from twisted.web.client import Agent
+from twisted.internet.defer import (CancelledError, Deferred,
+                                    DeferredSemaphore, FirstError,
+                                    gatherResults, succeed)
 from twisted.web.http_headers import Headers
 
-from txsolr.input import SimpleXMLInputFactory, StringProducer
-from txsolr.errors import HTTPWrongStatus, HTTPRequestError
+from txsolr.input import (SimpleXMLInputFactory, StringProducer, termsQuery,
+                          diffDocuments)
+from txsolr.errors import HTTPRequestError
+from txsolr.request import (checkStatus, encodeParameters, queryRequest,
+                            updateRequest)
 from txsolr.response import (ResponseConsumer, DiscardingResponseConsumer,
-                             JSONSolrResponse)
+                             StreamingFacetConsumer, JSONSolrResponse,
+                             LookupResults, DocumentStream, TupleStream)
+from txsolr.transport import AgentTransport
 
 
 __all__ = ['SolrClient']
@@ -43,6 +47,51 @@ __all__ = ['SolrClient']
 _logger = logging.getLogger('txsolr')
 
 
+def _lookupKeys(ids):
+    """Returns the unique keys of a lookup as strings."""
+    return [key if isinstance(key, basestring) else unicode(key)
+            for key in ids]
+
+
+def _lookupFields(fields, uniqueKey):
+    """
+    Returns the C{fl} parameter of a lookup, always including the unique key
+    field, or C{None} to return all the fields.
+    """
+    if fields is None:
+        return None
+    fields = list(fields)
+    if uniqueKey not in fields:
+        fields.append(uniqueKey)
+    return ','.join(fields)
+
+
+def _mergeLookup(responses, keys, uniqueKey):
+    """
+    Returns the L{LookupResults} of the documents found in the responses of
+    a lookup, in the same order as C{keys}.
+    """
+    found = {}
+    for response in responses:
+        for doc in response.results.docs:
+            # The keys were requested as strings, but numeric keys are
+            # returned as numbers.
+            key = doc[uniqueKey]
+            if not isinstance(key, basestring):
+                key = unicode(key)
+            found[key] = doc
+
+    docs = []
+    missing = []
+    for key in keys:
+        doc = found.get(key)
+        if doc is None:
+            missing.append(key)
+        else:
+            docs.append(doc)
+    return LookupResults(docs, missing)
+
+
 # TODO: decouple from JSON
 class SolrClient(object):
     """Solr client class used to perform requests to a Solr instance.
@@ -54,14 +103,34 @@ class SolrClient(object):
     @param inputFactory: The input body generator. For advanced uses this
         argument is used to create custom body generators for the requests
         using Twisted's IProducer.
+    @param transport: The L{ISolrTransport} used to send the HTTP requests.
+        Default is an L{AgentTransport}.
+    @param maxGetLength: The maximum length of the full URL of a query sent
+        with a GET request. Longer queries are sent with a POST request.
+    @param cache: Optionally, a L{ValidatorCache} used to revalidate the
+        responses of C{/select} GET requests with the C{ETag} and
+        C{Last-Modified} headers sent by Solr.
+    @ivar schemaCache: Optionally, a L{SchemaCache} of the core. The
+        documents of the responses of L{search}, L{get} and L{getByIds} are
+        decoded with its schema, and L{add} waits for the schema to be
+        fetched before encoding the documents. Default is C{None}.
     """
 
-    def __init__(self, url, inputFactory=None):
+    def __init__(self, url, inputFactory=None, transport=None,
+                 maxGetLength=4096, cache=None):
         self.url = url.rstrip('/')
         if inputFactory is None:
-            self.inputFactory = SimpleXMLInputFactory()
-
-    def _request(self, method, path, headers, bodyProducer):
+            inputFactory = SimpleXMLInputFactory()
+        self.inputFactory = inputFactory
+        if transport is None:
+            transport = AgentTransport()
+        self.transport = transport
+        self.maxGetLength = maxGetLength
+        self.cache = cache
+        self.schemaCache = None
+
+    def _request(self, method, path, headers, bodyProducer,
+                 consumerFactory=None, cache=None):
         """Performs a request to a Solr client
 
         The request examines the response to look for wrong header status.
@@ -74,33 +143,83 @@ class SolrClient(object):
         @param headers: The headers of the request.
         @bodyProducer: The L{IBodyProducer} that generates the body of the
             request.
+        @param consumerFactory: Optionally, a callable taking the resulting
+            L{Deferred} and returning the protocol that consumes the body of
+            a successful response. Default is a L{ResponseConsumer} creating
+            a L{JSONSolrResponse}.
+        @param cache: Optionally, a L{ValidatorCache} used to revalidate the
+            response of a GET request.
         @return: A L{Deferred} that fires with a L{SolrResponse} object.
+            Cancelling it cancels the request, or stops receiving the body
+            if the response was already received.
         """
-        result = Deferred()
+        delivering = []
+        cancelled = []
+
+        def cancel(result):
+            cancelled.append(True)
+            d.cancel()
+            for protocol in delivering:
+                if protocol.transport is not None:
+                    protocol.transport.stopProducing()
+
+        result = Deferred(cancel)
+        if consumerFactory is None:
+            consumerFactory = lambda deferred: ResponseConsumer(
+                deferred, JSONSolrResponse)
 
         url = self.url + path
+        cached = cache.lookup(url) if cache is not None else None
+        if cached is not None:
+            headers.update(cached.validators())
         headers.update({'User-Agent': ['txSolr']})
         headers = Headers(headers)
         _logger.debug('Requesting: [%s] %s' % (method, url))
-        agent = Agent(reactor)
-        d = agent.request(method, url, headers, bodyProducer)
+        d = self.transport.request(method, url, headers, bodyProducer)
 
         def responseCallback(response):
             _logger.debug('Received response from ' + url)
             try:
                 if response.code == 200:
-                    deliveryProtocol = ResponseConsumer(result,
-                                                        JSONSolrResponse)
+                    # The body is delivered through another Deferred, which
+                    # is ignored once the result was cancelled: stopping the
+                    # transport makes the consumer fire it again.
+                    consumed = Deferred()
+                    if cache is not None:
+                        consumed.addCallback(store, response.headers)
+                    consumed.addCallbacks(deliver, deliverFailure)
+                    deliveryProtocol = consumerFactory(consumed)
+                    delivering.append(deliveryProtocol)
                     response.deliverBody(deliveryProtocol)
+                elif response.code == 304 and cached is not None:
+                    response.deliverBody(DiscardingResponseConsumer())
+                    cache.hits += 1
+                    result.callback(cached.response)
                 else:
-                    deliveryProtocol = DiscardingResponseConsumer()
-                    response.deliverBody(deliveryProtocol)
-                    result.errback(HTTPWrongStatus(response.code))
+                    response.deliverBody(DiscardingResponseConsumer())
+                    checkStatus(response.code)
             except Exception as e:
                 result.errback(e)
 
+        def store(solrResponse, responseHeaders):
+            cache.store(url, responseHeaders, solrResponse)
+            return solrResponse
+
+        def deliver(solrResponse):
+            if not result.called:
+                result.callback(solrResponse)
+
+        def deliverFailure(failure):
+            if not result.called:
+                result.errback(failure)
+
         def responseErrback(failure):
-            """Unknown error from Agent.request."""
+            """Unknown error from the transport."""
+            if cancelled or failure.check(CancelledError):
+                # The Agent wraps the cancellation of a request in
+                # ResponseNeverReceived or ResponseFailed.
+                result.errback(CancelledError())
+                return
             result.errback(HTTPRequestError(failure.value))
             _logger.error(failure.value)
 
@@ -108,6 +227,11 @@ class SolrClient(object):
 
         return result
 
+    def _unwrapFirstError(self, failure):
+        """Returns the original failure of a failed L{gatherResults} call."""
+        failure.trap(FirstError)
+        return failure.value.subFailure
+
     def _update(self, input):
         """Performs a request to the /update method of Solr.
 
@@ -115,59 +239,130 @@ class SolrClient(object):
             request.
         @return: A L{Deferred} that fires with a L{SolrResponse} object.
         """
-        method = 'POST'
-        path = '/update?wt=json'
-        headers = {'Content-Type': [self.inputFactory.contentType]}
+        request = updateRequest(self.inputFactory.contentType, input.body)
         _logger.debug('Updating:\n%s' % input.body)
-        return self._request(method, path, headers, input)
+        return self._request(request.method, request.path, request.headers,
+                             input)
+
+    def _encodeParameters(self, params):
+        """Encodes the parameters of a query request.
+
+        See L{txsolr.request.encodeParameters}.
+        """
+        return encodeParameters(params)
 
-    def _select(self, params):
+    def _query(self, path, params, consumerFactory=None, maxGetLength=None,
+               cache=None):
+        """Performs a query request to the given handler of Solr.
+
+        Queries whose full URL fits in C{maxGetLength} are sent with a GET
+        request, which can be cached. Longer queries are sent in the body of
+        a POST request. The parameters are encoded only once, for the URL or
+        for the body.
+
+        @param path: The path of the request handler, like C{/select}.
+        @param params: A C{dict} with the request parameters as C{unicode}
+            used for the query.
+        @param consumerFactory: Optionally, the factory of the protocol that
+            consumes the response body. See L{SolrClient._request}.
+        @param maxGetLength: Optionally, the maximum length of the URL of a
+            GET request for this query. Default is the C{maxGetLength} of the
+            client.
+        @param cache: Optionally, a L{ValidatorCache} used to revalidate the
+            response if the query is sent with a GET request.
+        @return: A L{Deferred} that fires with a L{SolrResponse} object.
+        """
+        if maxGetLength is None:
+            maxGetLength = self.maxGetLength
+        request = queryRequest(self.url, path, params, maxGetLength)
+        if request.body is None:
+            input = None
+        else:
+            input = StringProducer(request.body)
+            cache = None
+
+        return self._request(request.method, request.path, request.headers,
+                             input, consumerFactory, cache)
+
+    def _select(self, params, maxGetLength=None):
         """Performs a request to the /select method of Solr.
 
+        GET requests are revalidated with the C{cache} of the client, if
+        any.
+
         @param params: A C{dict} with the request parameters as C{unicode}
             used for the query.
+        @param maxGetLength: Optionally, the maximum length of the URL of a
+            GET request for this query.
         @return: A L{Deferred} that fires with a L{SolrResponse} object.
         """
-        # force JSON response for now
-        params.update(wt=u'json')
+        d = self._query('/select', params, maxGetLength=maxGetLength,
+                        cache=self.cache)
+        return self._decodeDocuments(d)
 
-        encodedParameters = {}
-        for key, value in params.iteritems():
-            # Some solr params contains dots (i.e: ht.fl) We use underscores.
-            key = key.replace('_', '.')
-            if isinstance(value, unicode):
-                value = value.encode('UTF-8')
-            encodedParameters[key] = value
+    def _decodeDocuments(self, d):
+        """Decodes the documents of a response with the schema of the
+        C{schemaCache}, if any.
 
-        query = urllib.urlencode(encodedParameters)
+        @param d: A L{Deferred} that fires with a L{SolrResponse} object.
+        @return: The same L{Deferred}.
+        """
+        if self.schemaCache is None:
+            return d
 
-        if len(query) < 1024:
-            method = 'GET'
-            path = '/select' + '?' + query
-            headers = {}
-            input = None
-        else:
-            method = 'POST'
-            path = '/select'
-            headers = {'Content-type': ['application/x-www-form-urlencoded']}
-            input = StringProducer(query)
+        def decode(response):
+            fetched = self.schemaCache.get()
+            fetched.addCallback(lambda schema: schema.decodeResponse(response))
+            return fetched
 
-        return self._request(method, path, headers, input)
+        return d.addCallback(decode)
 
     def add(self, documents, overwrite=None, commitWithin=None):
         """Add one or many documents to a Solr Instance.
 
         @param documents: A C{dict} or C{list} of dicts representing the
             documents. The dict's keys should be field names and the values
-            field content.
+            field content, or a C{dict} with an atomic update of the field,
+            like C{{'set': value}} or C{{'inc': 1}}.
         @param overwrite: Newer documents will replace previously added
             documents with the same C{uniqueKey}.
         @param commitWithin: the addition will be committed within that time.
-        @return: A L{Deferred} that fires with a L{SolrResponse} object.
+        @return: A L{Deferred} that fires with a L{SolrResponse} object. It
+            fails with L{VersionConflictError} if a document has a
+            C{_version_} that doesn't match the stored one.
         """
+        if self.schemaCache is not None:
+            d = self.schemaCache.get()
+            d.addCallback(lambda schema: self._update(
+                self.inputFactory.createAdd(documents, overwrite,
+                                            commitWithin)))
+            return d
+
         input = self.inputFactory.createAdd(documents, overwrite, commitWithin)
         return self._update(input)
 
+    def addChanges(self, old, new, uniqueKey='id', checkVersion=False,
+                   commitWithin=None):
+        """Sends only the fields that changed in a document, as an atomic
+        update.
+
+        See L{diffDocuments}.
+
+        @param old: The current version of the document, as returned by Solr.
+        @param new: The complete new version of the document.
+        @param uniqueKey: The name of the unique key field.
+        @param checkVersion: If C{True}, the update is rejected with a
+            L{VersionConflictError} if the document was modified since the
+            old version was read. The old version must have a C{_version_}.
+        @param commitWithin: the update will be committed within that time.
+        @return: A L{Deferred} that fires with a L{SolrResponse} object, or
+            with C{None} if nothing changed.
+        """
+        update = diffDocuments(old, new, uniqueKey, checkVersion)
+        if update is None:
+            return succeed(None)
+        return self.add(update, commitWithin=commitWithin)
+
     def delete(self, ids):
         """Delete one or many documents given the ID or IDs of the documents.
 
@@ -189,7 +384,8 @@ class SolrClient(object):
         input = self.inputFactory.createDeleteByQuery(query)
         return self._update(input)
 
-    def commit(self, waitFlush=None, waitSearcher=None, expungeDeletes=None):
+    def commit(self, waitFlush=None, waitSearcher=None, expungeDeletes=None,
+               softCommit=None, openSearcher=None):
         """Issues a commit action to Sorl.
 
         @param waitFlush: Server will block until index changes are flushed to
@@ -197,10 +393,15 @@ class SolrClient(object):
         @param waitSearcher: Server will  block until a new searcher is opened
             and registered as the main query searchers.
         @param expungeDeletes: Merge segments with deletes away.
+        @param softCommit: Make the changes visible without flushing them to
+            disk. Requires Solr 4.0 or newer.
+        @param openSearcher: If C{False}, a hard commit flushes the changes to
+            disk without making them visible. Requires Solr 4.0 or newer.
         @return: A L{Deferred} that fires with a L{SolrResponse} object.
         """
         input = self.inputFactory.createCommit(waitFlush, waitSearcher,
-                                               expungeDeletes)
+                                               expungeDeletes, softCommit,
+                                               openSearcher)
         return self._update(input)
 
     def rollback(self):
@@ -231,14 +432,199 @@ class SolrClient(object):
         @param query: A C{unicode} query. (See Solr query syntax).
         @param *kwargs: Additional parameters for the server. For instance:
             'hl' for highlighting, 'sort' for sorting, etc. See Solr
-            documentation for all available options.
+            documentation for all available options. The C{maxGetLength}
+            keyword argument is not sent to Solr; it overrides the
+            C{maxGetLength} of the client for this query.
         @return: A L{Deferred} that fires with a L{SolrResponse} object.
         """
         params = {}
         params.update(kwargs)
+        maxGetLength = params.pop('maxGetLength', None)
         params.update(q=query)
+        return self._select(params, maxGetLength)
+
+    def streamFacets(self, query, callback=None, **kwargs):
+        """Performs a faceted query, parsing the facet field counts while the
+        response is received.
+
+        This is meant for very large facet lists, like the ones returned with
+        C{facet.limit=-1} on fields with many terms. See
+        L{StreamingFacetConsumer}.
+
+        @param query: A C{unicode} query. (See Solr query syntax).
+        @param callback: Optionally, a callable taking a field name, a term
+            and its count, called for each facet field count as it arrives.
+            If given, the counts are not kept in the response.
+        @param *kwargs: Additional parameters for the server, like
+            C{facet_field}.
+        @return: A L{Deferred} that fires with a L{SolrResponse} object.
+        """
+        params = dict(kwargs)
+        maxGetLength = params.pop('maxGetLength', None)
+        params.update(q=query, facet=u'true', json_nl=u'flat')
+        return self._query('/select', params, lambda deferred:
+                           StreamingFacetConsumer(deferred, JSONSolrResponse,
+                                                  callback), maxGetLength)
+
+    def streamDocuments(self, query, bufferSize=100, **kwargs):
+        """Performs a query, giving the documents found one by one as the
+        response is received.
+
+        This is meant for queries returning many documents, like exports of
+        large result sets, which would take a lot of memory if all of them
+        were decoded at once. See L{DocumentStream}.
+
+        @param query: A C{unicode} query. (See Solr query syntax).
+        @param bufferSize: The maximum number of documents buffered before
+            the response is paused, waiting for them to be taken.
+        @param *kwargs: Additional parameters for the server, like for
+            L{search}.
+        @return: A L{DocumentStream} of the documents found.
+        """
+        params = dict(kwargs)
+        params['q'] = query
+        return self._stream('/select', params, DocumentStream(bufferSize),
+                            JSONSolrResponse, ('response', 'docs'))
+
+    def export(self, query, sort, fields, bufferSize=100, **kwargs):
+        """Exports all the documents matching a query with the C{/export}
+        handler, reading them one by one as they are received.
+
+        Solr streams the sorted results from the doc values of the fields,
+        without building the whole result set in memory. See
+        L{streamDocuments}.
+
+        @param query: A C{unicode} query. (See Solr query syntax).
+        @param sort: The sort specification, like C{id asc}. It's required
+            by the C{/export} handler.
+        @param fields: The C{fl} parameter with the fields to be exported.
+            They must have doc values.
+        @param bufferSize: The maximum number of documents buffered before
+            the response is paused, waiting for them to be taken.
+        @param *kwargs: Additional parameters for the server, like C{fq}.
+        @return: A L{TupleStream} of the documents found. Its C{response}
+            has the number of documents found, once all of them have been
+            received.
+        """
+        params = dict(kwargs)
+        params.update(q=query, sort=sort, fl=fields)
+        return self._stream('/export', params, TupleStream(bufferSize),
+                            JSONSolrResponse, ('response', 'docs'))
+
+    def streamExpression(self, expression, bufferSize=100, **kwargs):
+        """Evaluates a streaming expression with the C{/stream} handler,
+        reading its tuples one by one as they are received.
+
+        @param expression: The C{unicode} streaming expression, like
+            C{search(core, q=*:*, fl=id, sort="id asc", qt=/export)}.
+        @param bufferSize: The maximum number of tuples buffered before the
+            response is paused, waiting for them to be taken.
+        @param *kwargs: Additional parameters for the server.
+        @return: A L{TupleStream} of the tuples, which ends with the C{EOF}
+            tuple and fails if the expression raises an exception.
+        """
+        params = dict(kwargs)
+        params['expr'] = expression
+        return self._stream('/stream', params, TupleStream(bufferSize),
+                            None, ('result-set', 'docs'))
+
+    def _stream(self, path, params, stream, responseClass, arrayPath):
+        """Sends a query whose documents are given to a L{DocumentStream}.
+
+        @param path: The path of the request handler.
+        @param params: A C{dict} with the request parameters.
+        @param stream: The L{DocumentStream} fed with the documents.
+        @param responseClass: The L{SolrResponse} subclass used to parse the
+            rest of the body, or C{None}.
+        @param arrayPath: The keys of the objects containing the array of
+            documents in the body.
+        @return: The stream.
+        """
+        maxGetLength = params.pop('maxGetLength', None)
+        d = self._query(path, params,
+                        lambda deferred: stream.consumer(
+                            deferred, responseClass, arrayPath),
+                        maxGetLength)
+        d.addCallbacks(stream.finished, stream.failed)
+        return stream
+
+    def get(self, ids, **kwargs):
+        """Fetches documents with the real-time get handler of Solr.
+
+        The real-time get handler returns the latest version of the documents,
+        even if they have not been committed yet, without using Solr's query
+        caches. This requires the C{/get} handler and the update log to be
+        enabled in the Solr configuration.
+
+        @param ids: A C{unicode} unique key or a sequence of unique keys of the
+            documents to be fetched.
+        @param *kwargs: Additional parameters for the server. For instance:
+            'fl' for the fields to be returned or 'fq' to filter the documents.
+        @return: A L{Deferred} that fires with a L{SolrResponse} object. Its
+            C{results} contains the documents found.
+        """
+        params = dict((key, value) for key, value in kwargs.iteritems()
+                      if value is not None)
+        maxGetLength = params.pop('maxGetLength', None)
+        # The real-time get handler omits the header by default.
+        params.update(id=ids, omitHeader=u'false')
+        d = self._query('/get', params, maxGetLength=maxGetLength)
+        return self._decodeDocuments(d)
+
+    def getByIds(self, ids, fields=None, realtime=True, uniqueKey='id',
+                 chunkSize=1000, concurrency=4):
+        """Fetches many documents given their unique keys.
+
+        Large sets of keys are split in chunks that are requested in parallel.
+        Each chunk is sent with a POST request if it is too long for a GET
+        request.
+
+        @param ids: A sequence with the unique keys of the documents.
+        @param fields: Optionally, a sequence with the names of the fields to
+            be returned. The unique key field is always returned.
+        @param realtime: If C{True}, the default, the documents are fetched
+            with the real-time get handler (C{/get}), which also returns
+            documents that have not been committed yet. Otherwise, they are
+            fetched from C{/select} with a C{{!terms}} filter query.
+        @param uniqueKey: The name of the unique key field. Default is C{id}.
+        @param chunkSize: The maximum number of keys fetched in one request.
+        @param concurrency: The maximum number of requests sent in parallel.
+        @return: A L{Deferred} that fires with a L{LookupResults} object with
+            the documents in the same order as C{ids}.
+        """
+        keys = _lookupKeys(ids)
+        fields = _lookupFields(fields, uniqueKey)
+        semaphore = DeferredSemaphore(concurrency)
+        deferreds = [semaphore.run(self._lookup, keys[i:i + chunkSize],
+                                   fields, realtime, uniqueKey)
+                     for i in xrange(0, len(keys), chunkSize)]
+        d = gatherResults(deferreds, consumeErrors=True)
+        d.addCallbacks(_mergeLookup, self._unwrapFirstError,
+                       (keys, uniqueKey))
+        return d
+
+    def _lookup(self, keys, fields, realtime, uniqueKey):
+        """Fetches a chunk of the documents of L{getByIds}.
+
+        @return: A L{Deferred} that fires with a L{SolrResponse} object.
+        """
+        if realtime:
+            return self.get(keys, fl=fields)
+        params = {'q': '*:*',
+                  'fq': termsQuery(uniqueKey, keys, None),
+                  'rows': len(keys)}
+        if fields is not None:
+            params['fl'] = fields
         return self._select(params)
 
+    def getSchema(self):
+        """Fetches the schema of the core with the Schema API.
+
+        @return: A L{Deferred} that fires with a L{SolrResponse} object. The
+            schema is in the C{schema} key of its C{responseDict}.
+        """
+        return self._query('/schema', {})
+
     def ping(self):
         """Ping the server to know if it's alive.
 
@@ -0,0 +1,734 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+SolrCloud routing.
+
+Updates sent to any node of a SolrCloud cluster are forwarded by that node
+to the leaders of the shards of their documents. This module contains a
+client that loads the state of the cluster and hashes the document IDs like
+the C{compositeId} router of Solr, so each update is split by shard and sent
+straight to the shard leaders, in parallel.
+"""
+import bisect
+import logging
+import math
+import struct
+
+from twisted.internet.defer import (CancelledError, Deferred, gatherResults,
+                                    succeed)
+from twisted.internet.error import ConnectError
+
+from txsolr.admin import SolrAdmin
+from txsolr.client import SolrClient
+from txsolr.errors import HTTPRequestError, HTTPWrongStatus, InputError
+from txsolr.transport import AgentTransport
+
+
+__all__ = ['murmurHash3', 'compositeIdHash', 'queryKey', 'Shard',
+           'ClusterState', 'AffinityRouter', 'CloudSolrClient']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+_MASK = 0xffffffff
+
+
+def _signed(value):
+    """Converts an unsigned 32-bit integer to a signed one, like Java's."""
+    if value & 0x80000000:
+        return value - 0x100000000
+    return value
+
+
+def _rotate(value, bits):
+    return ((value << bits) | (value >> (32 - bits))) & _MASK
+
+
+def murmurHash3(data, seed=0):
+    """Computes the 32-bit x86 MurmurHash3 of a string, like Solr does.
+
+    @param data: A C{str}, or a C{unicode} hashed as UTF-8.
+    @param seed: The seed of the hash.
+    @return: The hash as a signed 32-bit C{int}.
+    """
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    length = len(data)
+    blocks = length // 4
+    h = seed
+    for k in struct.unpack('<%dI' % blocks, data[:blocks * 4]):
+        k = _rotate((k * 0xcc9e2d51) & _MASK, 15)
+        h ^= (k * 0x1b873593) & _MASK
+        h = (_rotate(h, 13) * 5 + 0xe6546b64) & _MASK
+
+    tail = data[blocks * 4:]
+    if tail:
+        k = 0
+        for i, char in enumerate(tail):
+            k |= ord(char) << (8 * i)
+        k = _rotate((k * 0xcc9e2d51) & _MASK, 15)
+        h ^= (k * 0x1b873593) & _MASK
+
+    h ^= length
+    h ^= h >> 16
+    h = (h * 0x85ebca6b) & _MASK
+    h ^= h >> 13
+    h = (h * 0xc2b2ae35) & _MASK
+    h ^= h >> 16
+    return _signed(h)
+
+
+def _prefix(part, defaultBits, maxBits):
+    """
+    Returns a prefix of a composite ID without its C{/bits} suffix, and the
+    number of bits of the hash taken from it.
+    """
+    if '/' in part:
+        part, bits = part.rsplit('/', 1)
+        try:
+            return part, max(0, min(maxBits, int(bits)))
+        except ValueError:
+            pass
+    return part, defaultBits
+
+
+def compositeIdHash(key):
+    """Hashes a document ID like the C{compositeId} router of Solr.
+
+    Plain IDs are hashed with L{murmurHash3}. For IDs with a prefix, like
+    C{tenant!doc}, the highest 16 bits of the hash come from the hash of the
+    prefix, so all the documents of a tenant are in the same shard. With two
+    prefixes, like C{region!tenant!doc}, each prefix gives 8 bits. The number
+    of bits can be given after the prefix, like C{tenant/4!doc}.
+
+    @param key: The C{unicode} ID of a document.
+    @return: The hash as a signed 32-bit C{int}.
+    """
+    parts = key.split('!', 2)
+    if len(parts) == 1:
+        return murmurHash3(key)
+
+    if len(parts) == 2:
+        first, bits = _prefix(parts[0], 16, 16)
+        mask = (_MASK << (32 - bits)) & _MASK if bits else 0
+        return _signed((murmurHash3(first) & mask) |
+                       (murmurHash3(parts[1]) & ~mask & _MASK))
+
+    first, firstBits = _prefix(parts[0], 8, 8)
+    second, secondBits = _prefix(parts[1], 8, 8)
+    firstMask = (_MASK << (32 - firstBits)) & _MASK if firstBits else 0
+    secondMask = ((_MASK << (32 - firstBits - secondBits)) & _MASK &
+                  ~firstMask)
+    if not secondBits:
+        secondMask = 0
+    lastMask = ~(firstMask | secondMask) & _MASK
+    return _signed((murmurHash3(first) & firstMask) |
+                   (murmurHash3(second) & secondMask) |
+                   (murmurHash3(parts[2]) & lastMask))
+
+
+class Shard(object):
+    """An active shard of a collection.
+
+    @ivar name: The name of the shard, like C{shard1}.
+    @ivar minHash: The lowest hash of its range, as a signed C{int}.
+    @ivar maxHash: The highest hash of its range, as a signed C{int}.
+    @ivar leader: The URL of the core of its leader, or C{None} if the shard
+        has no leader right now.
+    """
+
+    __slots__ = ('name', 'minHash', 'maxHash', 'leader')
+
+    def __init__(self, name, minHash, maxHash, leader):
+        self.name = name
+        self.minHash = minHash
+        self.maxHash = maxHash
+        self.leader = leader
+
+    def __repr__(self):
+        return '<Shard %s %08x-%08x %s>' % (self.name, self.minHash & _MASK,
+                                            self.maxHash & _MASK, self.leader)
+
+
+class ClusterState(object):
+    """The shards of a collection and their leaders.
+
+    @param collection: The name of the collection.
+    @param shards: A C{list} of the active L{Shard}s.
+    @param router: The name of the router of the collection, like
+        C{compositeId} or C{implicit}.
+    @param routerField: Optionally, the field hashed instead of the unique
+        key to route the documents.
+    @param nodes: The URLs of the nodes with active replicas of the
+        collection, like C{http://host:8983/solr}.
+    """
+
+    def __init__(self, collection, shards, router='compositeId',
+                 routerField=None, nodes=()):
+        self.collection = collection
+        self.shards = sorted(shards, key=lambda shard: shard.minHash)
+        self.router = router
+        self.routerField = routerField
+        self.nodes = sorted(nodes)
+
+    @classmethod
+    def fromClusterStatus(cls, collection, cluster):
+        """
+        Creates a L{ClusterState} from the C{cluster} object of the response
+        of a C{CLUSTERSTATUS} request.
+
+        @raise KeyError: If the collection is not in the cluster.
+        """
+        state = cluster['collections'][collection]
+        router = state.get('router') or {}
+        shards = []
+        nodes = set()
+        for name, shard in state.get('shards', {}).iteritems():
+            # The parents of split shards stay in the state until they are
+            # deleted, but don't receive updates anymore.
+            if shard.get('state', 'active') != 'active':
+                continue
+            hashRange = shard.get('range')
+            if not hashRange:
+                continue
+            minHash, maxHash = [_signed(int(value, 16))
+                                for value in hashRange.split('-')]
+            leader = None
+            for replica in shard.get('replicas', {}).itervalues():
+                if replica.get('state', 'active') != 'active':
+                    continue
+                node = replica['base_url'].rstrip('/')
+                nodes.add(node)
+                if replica.get('leader') == 'true':
+                    leader = '%s/%s' % (node, replica['core'])
+            shards.append(Shard(name, minHash, maxHash, leader))
+        return cls(collection, shards, router.get('name', 'compositeId'),
+                   router.get('field'), nodes)
+
+    @property
+    def routable(self):
+        """Whether the documents can be routed to their shards."""
+        return self.router == 'compositeId' and bool(self.shards)
+
+    def shardFor(self, key):
+        """Returns the L{Shard} of a document ID, or C{None}.
+
+        @param key: The C{unicode} ID of the document, or the value of the
+            router field of the collection.
+        """
+        hashValue = compositeIdHash(key)
+        for shard in self.shards:
+            if shard.minHash <= hashValue <= shard.maxHash:
+                return shard
+        return None
+
+
+def queryKey(query, params):
+    """Returns the key used to route a query to a node.
+
+    Queries with the same filters use the same entries of the
+    C{filterCache}, so the key is the set of C{fq} parameters, ignoring their
+    order and surrounding whitespace. Queries without filters are keyed by
+    their query.
+
+    @param query: The C{unicode} query.
+    @param params: A C{dict} with the other parameters of the query.
+    @return: The key as C{unicode}.
+    """
+    filters = params.get('fq')
+    if not filters:
+        return query
+    if isinstance(filters, basestring):
+        filters = [filters]
+    return u'\x00'.join(sorted(set(fq.strip() for fq in filters)))
+
+
+class AffinityRouter(object):
+    """Routes the queries with the same key to the same node.
+
+    The nodes are placed on a consistent hash ring, so adding or removing a
+    node only moves the keys of that node. To keep hot keys from
+    overloading a node, the loads are bounded: a key goes to the next node
+    on the ring when its node already has more than C{balanceFactor} times
+    the average number of requests in flight. Nodes that failed are tried
+    last for C{failureTimeout} seconds.
+
+    @param points: The number of points of each node on the ring. More
+        points spread the keys more evenly.
+    @param balanceFactor: The maximum load of a node relative to the
+        average load, greater than C{1}.
+    @param failureTimeout: The number of seconds a failed node is avoided.
+    @param clock: The L{IReactorTime} provider used to expire the failures.
+        Default is the global reactor.
+    @ivar inFlight: A C{dict} mapping nodes to their number of requests in
+        flight.
+    """
+
+    def __init__(self, points=64, balanceFactor=1.25, failureTimeout=30,
+                 clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.points = points
+        self.balanceFactor = balanceFactor
+        self.failureTimeout = failureTimeout
+        self.clock = clock
+        self.nodes = ()
+        self.inFlight = {}
+        self._hashes = []
+        self._ring = []
+        self._failed = {}
+
+    def setNodes(self, nodes):
+        """Sets the nodes of the ring.
+
+        @param nodes: A sequence with the URLs of the nodes.
+        """
+        nodes = tuple(sorted(set(nodes)))
+        if nodes == self.nodes:
+            return
+        self.nodes = nodes
+        ring = sorted((murmurHash3('%s#%d' % (node, point)), node)
+                      for node in nodes for point in xrange(self.points))
+        self._hashes = [hashValue for hashValue, _ in ring]
+        self._ring = [node for _, node in ring]
+
+    def candidates(self, key):
+        """Returns the nodes in the order they should be tried for a key.
+
+        The nodes follow the ring from the hash of the key. Nodes over the
+        load bound come after the other ones, and failed nodes come last.
+
+        @param key: The C{unicode} affinity key of a query.
+        @return: A C{list} of node URLs.
+        """
+        if not self._ring:
+            return []
+        ordered = []
+        start = bisect.bisect_left(self._hashes, murmurHash3(key))
+        for position in xrange(len(self._ring)):
+            node = self._ring[(start + position) % len(self._ring)]
+            if node not in ordered:
+                ordered.append(node)
+                if len(ordered) == len(self.nodes):
+                    break
+
+        now = self.clock.seconds()
+        up = [node for node in ordered if self._failed.get(node, 0) <= now]
+        if not up:
+            return ordered
+        load = sum(self.inFlight.get(node, 0) for node in up)
+        capacity = math.ceil(self.balanceFactor * (load + 1) / len(up))
+        preferred = [node for node in up
+                     if self.inFlight.get(node, 0) < capacity]
+        return (preferred + [node for node in up if node not in preferred] +
+                [node for node in ordered if node not in up])
+
+    def acquire(self, node):
+        """Records a request sent to a node."""
+        self.inFlight[node] = self.inFlight.get(node, 0) + 1
+
+    def release(self, node, failed=False):
+        """Records the end of a request sent to a node.
+
+        @param failed: Whether the node failed to answer, so it's avoided
+            for C{failureTimeout} seconds.
+        """
+        self.inFlight[node] -= 1
+        if failed:
+            self._failed[node] = self.clock.seconds() + self.failureTimeout
+        else:
+            self._failed.pop(node, None)
+
+
+# The modifiers of atomic updates that give the same document when they are
+# applied twice.
+_IDEMPOTENT_MODIFIERS = frozenset(['set', 'remove', 'removeregex',
+                                   'add-distinct'])
+
+
+def _isIdempotent(items):
+    """Whether a group of documents or IDs can be sent twice."""
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        for value in item.itervalues():
+            if (isinstance(value, dict) and
+                    not _IDEMPOTENT_MODIFIERS.issuperset(value)):
+                return False
+    return True
+
+
+def _isNodeFailure(failure):
+    """
+    Whether a failed request should be sent to another node: the node is
+    unreachable or answered with a server error.
+    """
+    if failure.check(HTTPRequestError):
+        return True
+    return (bool(failure.check(HTTPWrongStatus)) and
+            failure.value.args[0] >= 500)
+
+
+def _neverSent(failure):
+    """Whether a failed request was never received by the node."""
+    return (bool(failure.check(HTTPRequestError)) and
+            isinstance(failure.value.args[0], ConnectError))
+
+
+class CloudSolrClient(object):
+    """A client for a SolrCloud collection sending updates to shard leaders.
+
+    The state of the cluster is loaded with a C{CLUSTERSTATUS} request to
+    one of the nodes, trying the next node if it fails, and kept for
+    C{refreshInterval} seconds. Documents and IDs are grouped by the shard
+    of their ID, and each group is sent to the leader of its shard, in
+    parallel. If a group fails, the state is loaded again and the group is
+    sent once more, routed with the new state, so leader elections and shard
+    splits are followed. Updates that can't be routed, like the ones of
+    collections with the C{implicit} router, are sent to the collection on
+    any node.
+
+    Searches are sent to the collection on the first node, unless a
+    C{queryRouter} is given. Then each search is sent to the node of its
+    affinity key, asking Solr to prefer the replicas of that node for the
+    shard requests, so queries with the same filters hit the same warm
+    caches. If the node fails, the search is sent to the next node of the
+    key. With a C{hedging} policy, searches and real-time gets that are
+    slow to answer are also sent to the next node, taking the first
+    response. Other requests, like commits, are sent to the collection with
+    L{CloudSolrClient.client}.
+
+    @param urls: A sequence with the URLs of some nodes of the cluster, like
+        C{http://host:8983/solr}.
+    @param collection: The name of the collection.
+    @param uniqueKey: The unique key field of the collection.
+    @param inputFactory: The input body generator of the clients.
+    @param transport: The L{ISolrTransport} used to send the HTTP requests.
+        Default is an L{AgentTransport}, shared by all the nodes.
+    @param refreshInterval: The number of seconds after which the state of
+        the cluster is loaded again.
+    @param queryRouter: Optionally, an L{AffinityRouter} used to pick the
+        node of each search.
+    @param hedging: Optionally, a L{HedgingPolicy} used to hedge searches and
+        real-time gets.
+    @param clock: The L{IReactorTime} provider used to know the age of the
+        state. Default is the global reactor.
+    @ivar state: The current L{ClusterState}, or C{None}.
+    @ivar client: The L{SolrClient} of the collection on the first node.
+    """
+
+    def __init__(self, urls, collection, uniqueKey='id', inputFactory=None,
+                 transport=None, refreshInterval=60, queryRouter=None,
+                 hedging=None, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        if transport is None:
+            transport = AgentTransport()
+
+        self.urls = [url.rstrip('/') for url in urls]
+        self.collection = collection
+        self.uniqueKey = uniqueKey
+        self.inputFactory = inputFactory
+        self.transport = transport
+        self.refreshInterval = refreshInterval
+        self.queryRouter = queryRouter
+        self.hedging = hedging
+        self.clock = clock
+        self.state = None
+        self.client = self._client('%s/%s' % (self.urls[0], collection))
+        self._clients = {}
+        self._loaded = None
+        self._waiting = None
+
+    def _client(self, url):
+        return SolrClient(url, inputFactory=self.inputFactory,
+                          transport=self.transport)
+
+    def _clientFor(self, url):
+        client = self._clients.get(url)
+        if client is None:
+            client = self._clients[url] = self._client(url)
+        return client
+
+    def getState(self):
+        """Returns the state of the cluster, loading it if it's too old.
+
+        @return: A L{Deferred} that fires with a L{ClusterState}.
+        """
+        if (self.state is not None and
+                self.clock.seconds() - self._loaded < self.refreshInterval):
+            return succeed(self.state)
+
+        d = Deferred()
+        if self._waiting is not None:
+            self._waiting.append(d)
+            return d
+
+        self._waiting = [d]
+        self._load(0)
+        return d
+
+    def invalidate(self):
+        """Forces the state to be loaded again the next time it's used."""
+        self.state = None
+
+    def _load(self, node):
+        admin = SolrAdmin(self.urls[node], transport=self.transport,
+                          clock=self.clock)
+
+        def loaded(response):
+            return ClusterState.fromClusterStatus(self.collection,
+                                                  response.cluster)
+
+        def failed(failure):
+            _logger.warning("Can't load the cluster state from %s: %s"
+                            % (self.urls[node], failure.getErrorMessage()))
+            if node + 1 < len(self.urls):
+                self._load(node + 1)
+            else:
+                self._finish(failure)
+
+        d = admin.clusterStatus(self.collection)
+        d.addCallback(loaded)
+        d.addCallbacks(self._finish, failed)
+
+    def _finish(self, result):
+        if isinstance(result, ClusterState):
+            self.state = result
+            self._loaded = self.clock.seconds()
+        waiting, self._waiting = self._waiting, None
+        for d in waiting:
+            if isinstance(result, ClusterState):
+                d.callback(result)
+            else:
+                d.errback(result)
+
+    def _route(self, state, items, keyFunction):
+        """Groups items by the leader of their shard.
+
+        @return: A C{dict} mapping leader URLs to lists of items. Items that
+            can't be routed are under C{None}.
+        """
+        groups = {}
+        for item in items:
+            leader = None
+            key = keyFunction(state, item)
+            if key is not None and state.routable:
+                shard = state.shardFor(key)
+                if shard is not None:
+                    leader = shard.leader
+            groups.setdefault(leader, []).append(item)
+        return groups
+
+    def _send(self, items, keyFunction, send, retry=True):
+        """
+        Sends items grouped by shard leader, sending the groups that failed
+        because of their leader again once with a fresh state.
+
+        Groups rejected by Solr, like with a L{VersionConflictError}, are
+        not sent again. Groups with atomic updates that can't be applied
+        twice, like C{inc}, are only sent again if the connection to the
+        leader failed, as the leader may have applied them otherwise.
+
+        @param items: A C{list} of documents or IDs.
+        @param keyFunction: A callable taking the L{ClusterState} and an
+            item, returning the key hashed to route it, or C{None} if it
+            can't be routed.
+        @param send: A callable taking a L{SolrClient} and a group of items,
+            returning a L{Deferred} that fires with a L{SolrResponse}.
+        @return: A L{Deferred} that fires with a C{list} of L{SolrResponse}s.
+        """
+        def route(state):
+            deferreds = []
+            groups = self._route(state, items, keyFunction)
+            for leader, group in groups.iteritems():
+                client = self.client
+                if leader is not None:
+                    client = self._clientFor(leader)
+                d = send(client, group)
+                d.addCallback(lambda response: [response])
+                if retry:
+                    d.addErrback(resend, group)
+                deferreds.append(d)
+            d = gatherResults(deferreds, consumeErrors=True)
+            d.addCallbacks(lambda results: sum(results, []),
+                           self.client._unwrapFirstError)
+            return d
+
+        def resend(failure, group):
+            if not _isNodeFailure(failure):
+                return failure
+            if not _isIdempotent(group) and not _neverSent(failure):
+                return failure
+            _logger.warning('Update to a shard failed, reloading the '
+                            'cluster state: %s' % failure.getErrorMessage())
+            self.invalidate()
+            return self._send(group, keyFunction, send, retry=False)
+
+        return self.getState().addCallback(route)
+
+    def _documentKey(self, state, document):
+        field = state.routerField or self.uniqueKey
+        try:
+            value = document[field]
+        except KeyError:
+            raise InputError('Document without a %s field' % field)
+        if not isinstance(value, basestring):
+            value = unicode(value)
+        return value
+
+    def _idKey(self, state, id):
+        if state.routerField is not None:
+            return None
+        if not isinstance(id, basestring):
+            id = unicode(id)
+        return id
+
+    def add(self, documents, overwrite=None, commitWithin=None):
+        """Adds documents, sending them straight to their shard leaders.
+
+        @param documents: A C{dict} or a C{list} of C{dict}s, like for
+            L{SolrClient.add}.
+        @param overwrite: Like for L{SolrClient.add}.
+        @param commitWithin: Like for L{SolrClient.add}.
+        @return: A L{Deferred} that fires with a C{list} with the
+            L{SolrResponse} of each shard.
+        """
+        if isinstance(documents, dict):
+            documents = [documents]
+
+        def send(client, group):
+            return client.add(group, overwrite, commitWithin)
+
+        return self._send(list(documents), self._documentKey, send)
+
+    def delete(self, ids):
+        """Deletes documents by ID, sending them straight to their shard
+        leaders.
+
+        If the collection routes the documents by another field than the
+        unique key, the IDs are sent to the collection instead.
+
+        @param ids: An ID or a C{list} of IDs.
+        @return: A L{Deferred} that fires with a C{list} with the
+            L{SolrResponse} of each shard.
+        """
+        if not isinstance(ids, (list, tuple)):
+            ids = [ids]
+
+        def send(client, group):
+            return client.delete(group)
+
+        return self._send(list(ids), self._idKey, send)
+
+    def search(self, query, affinityKey=None, **kwargs):
+        """Searches the collection.
+
+        @param query: A C{unicode} query. (See Solr query syntax).
+        @param affinityKey: Optionally, the C{unicode} key used to route the
+            search when there is a C{queryRouter}, like the ID of a tenant.
+            Default is the key given by L{queryKey}.
+        @param *kwargs: Additional parameters for the server, like for
+            L{SolrClient.search}.
+        @return: A L{Deferred} that fires with a L{SolrResponse} object.
+        """
+        if self.queryRouter is None and self.hedging is None:
+            return self.client.search(query, **kwargs)
+        if self.queryRouter is not None:
+            if affinityKey is None:
+                affinityKey = queryKey(query, kwargs)
+            # The shard requests go to the replicas of the node, if it has
+            # one.
+            kwargs.setdefault('shards_preference', u'replica.location:local')
+        return self._read(affinityKey,
+                          lambda client: client.search(query, **kwargs))
+
+    def get(self, ids, **kwargs):
+        """Fetches documents with the real-time get handler of Solr.
+
+        @param ids: A C{unicode} unique key or a sequence of unique keys.
+        @param *kwargs: Additional parameters for the server, like for
+            L{SolrClient.get}.
+        @return: A L{Deferred} that fires with a L{SolrResponse} object.
+        """
+        if self.hedging is None:
+            return self.client.get(ids, **kwargs)
+        return self._read(None, lambda client: client.get(ids, **kwargs))
+
+    def _nodes(self, state, key):
+        """Returns the nodes in the order they should be tried for a read."""
+        if self.queryRouter is None or key is None:
+            return self.urls + [node for node in state.nodes
+                                if node not in self.urls]
+        self.queryRouter.setNodes(state.nodes or self.urls)
+        return self.queryRouter.candidates(key)
+
+    def _read(self, key, request):
+        """Sends an idempotent request to the nodes of a key, hedging it to
+        the next node if there is a C{hedging} policy.
+
+        @param key: The C{unicode} affinity key, or C{None}.
+        @param request: A callable taking the L{SolrClient} of the collection
+            on a node, returning a L{Deferred}.
+        """
+        def route(state):
+            nodes = self._nodes(state, key)
+            if self.hedging is None or len(nodes) < 2:
+                return self._readFrom(nodes, request)
+            return self.hedging.run(lambda: self._readFrom(nodes, request),
+                                    lambda: self._readFrom(nodes[1:], request))
+
+        return self.getState().addCallback(route)
+
+    def _readFrom(self, nodes, request):
+        """
+        Sends a request to the first node, and to the next ones if the
+        previous ones fail.
+        """
+        node = nodes[0]
+        client = self._clientFor('%s/%s' % (node, self.collection))
+        if self.queryRouter is not None:
+            self.queryRouter.acquire(node)
+
+        def succeeded(response):
+            if self.queryRouter is not None:
+                self.queryRouter.release(node)
+            return response
+
+        def failed(failure):
+            if failure.check(CancelledError):
+                # Like the losing request of a hedge: the node is healthy.
+                if self.queryRouter is not None:
+                    self.queryRouter.release(node)
+                return failure
+            nodeFailed = _isNodeFailure(failure)
+            if self.queryRouter is not None:
+                self.queryRouter.release(node, nodeFailed)
+            if not nodeFailed or len(nodes) == 1:
+                return failure
+            _logger.warning('Request failed on %s, trying the next node: %s'
+                            % (node, failure.getErrorMessage()))
+            self.invalidate()
+            return self._readFrom(nodes[1:], request)
+
+        return request(client).addCallbacks(succeeded, failed)
+
+    def commit(self, **kwargs):
+        """Commits the collection. See L{SolrClient.commit}."""
+        return self.client.commit(**kwargs)
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Commit scheduling.
+
+Every commit forces Solr to open and warm a new searcher. This module contains
+a scheduler that coalesces the commits requested by different parts of an
+application into as few commit requests as possible.
+"""
+import logging
+
+from twisted.internet.defer import Deferred
+from twisted.internet.task import deferLater
+from twisted.python.failure import Failure
+
+
+__all__ = ['CommitScheduler']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+class CommitScheduler(object):
+    """Coalesces concurrent commit requests for a L{SolrClient}.
+
+    Commits requested in the same reactor iteration, or while another commit
+    is in progress, are sent to Solr as a single commit. The L{Deferred}s of
+    all the coalesced requests fire together with the same result.
+
+    A commit requested while another one is in progress is never satisfied by
+    the one in progress, because it could have been requested for changes
+    sent after the commit in progress started.
+
+    @param client: The L{SolrClient} used to send the commits.
+    @param minInterval: The minimum number of seconds between two hard
+        commits. Soft commits are not delayed.
+    @param commitWithin: Optionally, a number of milliseconds. If given, the
+        documents added with L{CommitScheduler.add} are sent with this
+        C{commitWithin} value and hard commits without options are not sent
+        to Solr at all. Instead, the L{Deferred} returned by
+        L{CommitScheduler.commit} fires once Solr committed the documents
+        added so far, C{commitWithin} after it received the last of them.
+    @param clock: The L{IReactorTime} provider used to schedule the commits.
+        Default is the global reactor.
+    """
+
+    def __init__(self, client, minInterval=0, commitWithin=None, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.client = client
+        self.minInterval = minInterval
+        self.commitWithin = commitWithin
+        self.clock = clock
+
+        self._pending = []
+        self._inProgress = False
+        self._delayedCall = None
+        self._lastHardCommit = None
+        self._addsInProgress = 0
+        self._waitingForAdds = []
+        self._committedAt = None
+
+    def add(self, documents, overwrite=None, commitWithin=None):
+        """Add one or many documents using the scheduler C{commitWithin}.
+
+        See L{SolrClient.add}.
+        """
+        if commitWithin is None:
+            commitWithin = self.commitWithin
+        d = self.client.add(documents, overwrite, commitWithin)
+        if commitWithin is not None:
+            self._addsInProgress += 1
+            d.addBoth(self._added, commitWithin)
+        return d
+
+    def _added(self, result, commitWithin):
+        """Records the time by which an added document is committed."""
+        self._addsInProgress -= 1
+        if not isinstance(result, Failure):
+            # Solr received the documents before it answered.
+            committedAt = self.clock.seconds() + commitWithin / 1000.0
+            if self._committedAt is None or committedAt > self._committedAt:
+                self._committedAt = committedAt
+        if not self._addsInProgress:
+            waiting, self._waitingForAdds = self._waitingForAdds, []
+            for deferred in waiting:
+                deferred.callback(None)
+        return result
+
+    def commit(self, softCommit=None, openSearcher=None, waitSearcher=None,
+               expungeDeletes=None):
+        """Requests a commit.
+
+        When coalesced requests ask for different options, the commit sent to
+        Solr satisfies all of them: it is a hard commit if any request is a
+        hard commit, and it opens a new searcher unless every request says
+        otherwise.
+
+        @param softCommit: Make the changes visible without flushing them to
+            disk.
+        @param openSearcher: If C{False}, a hard commit flushes the changes to
+            disk without making them visible.
+        @param waitSearcher: Server will block until a new searcher is opened
+            and registered as the main query searcher.
+        @param expungeDeletes: Merge segments with deletes away.
+        @return: A L{Deferred} that fires with the L{SolrResponse} of the
+            commit sent to Solr, or with C{None} if the commit was translated
+            into C{commitWithin}. In that case, it fires once the documents
+            added with L{CommitScheduler.add} are committed, waiting for the
+            adds in progress, or C{commitWithin} after the call if no
+            documents were added with it. A hard commit with any of the
+            C{openSearcher}, C{waitSearcher} or C{expungeDeletes} options is
+            always sent to Solr.
+        """
+        if (self.commitWithin is not None and not softCommit and
+                openSearcher is None and waitSearcher is None and
+                expungeDeletes is None):
+            return self._waitForCommitWithin()
+
+        deferred = Deferred()
+        self._pending.append((deferred, softCommit, openSearcher,
+                              waitSearcher, expungeDeletes))
+        self._schedule()
+        return deferred
+
+    def _waitForCommitWithin(self):
+        """
+        Returns a L{Deferred} that fires once the documents added so far are
+        committed by C{commitWithin}.
+        """
+        def wait(_):
+            if self._committedAt is None:
+                delay = self.commitWithin / 1000.0
+            else:
+                delay = max(0, self._committedAt - self.clock.seconds())
+            return deferLater(self.clock, delay, lambda: None)
+
+        d = Deferred()
+        if self._addsInProgress:
+            self._waitingForAdds.append(d)
+        else:
+            d.callback(None)
+        return d.addCallback(wait)
+
+    def _schedule(self):
+        """Schedules a commit for the pending requests, if needed."""
+        if self._inProgress or self._delayedCall is not None:
+            return
+
+        if not self._pending:
+            return
+
+        self._delayedCall = self.clock.callLater(self._delay(), self._commit)
+
+    def _delay(self):
+        """
+        Returns the number of seconds to wait before committing the pending
+        requests, which is not zero for a hard commit sent less than
+        C{minInterval} seconds after the previous one.
+        """
+        hard = not all(softCommit for _, softCommit, _, _, _ in self._pending)
+        if not hard or self._lastHardCommit is None:
+            return 0
+        elapsed = self.clock.seconds() - self._lastHardCommit
+        return max(0, self.minInterval - elapsed)
+
+    def _commit(self):
+        """Sends a single commit for all the pending requests."""
+        # A hard commit may have joined a soft commit scheduled right away.
+        delay = self._delay()
+        if delay > 0:
+            self._delayedCall = self.clock.callLater(delay, self._commit)
+            return
+
+        self._delayedCall = None
+        pending, self._pending = self._pending, []
+
+        deferreds = [deferred for deferred, _, _, _, _ in pending]
+        softCommit = all(soft for _, soft, _, _, _ in pending)
+        openSearcherValues = [value for _, _, value, _, _ in pending]
+        if all(value is False for value in openSearcherValues):
+            openSearcher = False
+        elif True in openSearcherValues:
+            openSearcher = True
+        else:
+            openSearcher = None
+        waitSearcher = any(wait for _, _, _, wait, _ in pending) or None
+        expungeDeletes = any(expunge for _, _, _, _, expunge in pending)
+        expungeDeletes = expungeDeletes or None
+
+        if softCommit:
+            _logger.debug('Sending soft commit for %d requests' % len(pending))
+        else:
+            _logger.debug('Sending hard commit for %d requests' % len(pending))
+            self._lastHardCommit = self.clock.seconds()
+
+        self._inProgress = True
+        d = self.client.commit(waitSearcher=waitSearcher,
+                               expungeDeletes=expungeDeletes,
+                               softCommit=softCommit or None,
+                               openSearcher=openSearcher)
+
+        def succeeded(response):
+            self._inProgress = False
+            for deferred in deferreds:
+                deferred.callback(response)
+            self._schedule()
+
+        def failed(failure):
+            self._inProgress = False
+            for deferred in deferreds:
+                deferred.errback(failure)
+            self._schedule()
+
+        d.addCallbacks(succeeded, failed)
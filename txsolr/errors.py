@@ -19,8 +19,9 @@ Exception classes for txSolr.
 """
 
 
-__all__ = ['HTTPWrongStatus', 'SolrResponseError', 'HTTPRequestError',
-           'InputError']
+__all__ = ['HTTPWrongStatus', 'VersionConflictError', 'SolrResponseError',
+           'HTTPRequestError', 'InputError', 'SpoolFullError',
+           'AdminRequestError']
 
 
 class InputError(ValueError):
@@ -34,9 +35,28 @@ class HTTPWrongStatus(ValueError):
     """
 
 
+class VersionConflictError(HTTPWrongStatus):
+    """
+    Raised when an update is rejected with C{409 Conflict} because the
+    C{_version_} it was based on is not the current version of the document.
+    """
+
+
 class SolrResponseError(Exception):
     """Raised when a problem decoding a Solr Response is found."""
 
 
 class HTTPRequestError(Exception):
     """Raised when a problem is found when performing a request to Solr."""
+
+
+class SpoolFullError(Exception):
+    """Raised when an update does not fit in the disk budget of a spool."""
+
+
+class AdminRequestError(Exception):
+    """
+    Raised when an asynchronous admin request failed or is unknown to Solr.
+    The arguments are the id of the request, its state and the message of
+    Solr.
+    """
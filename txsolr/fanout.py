@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Fan-out search.
+
+This module contains a searcher that sends the same query to many Solr cores
+or collections in parallel and merges their results on the client, for
+applications that keep their data split in independent cores, like one core
+per tenant.
+"""
+import heapq
+import logging
+from functools import total_ordering
+from itertools import islice
+
+from twisted.internet.defer import (DeferredSemaphore, TimeoutError,
+                                    gatherResults)
+from twisted.python.failure import Failure
+
+from txsolr.response import FacetCounts, MergedResults
+
+
+__all__ = ['FanOutSearcher']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+@total_ordering
+class _Descending(object):
+    """Wraps a sort value to reverse its order."""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return self.value > other.value
+
+
+def _splitClauses(text):
+    """
+    Splits a comma-separated list, like a sort spec or a field list, keeping
+    the commas inside the parentheses of functions and inside quotes.
+    """
+    clauses = []
+    current = []
+    depth = 0
+    quote = None
+    for char in text:
+        if quote is not None:
+            if char == quote:
+                quote = None
+        elif char in '\'"':
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth = max(depth - 1, 0)
+        elif char == ',' and not depth:
+            clauses.append(''.join(current).strip())
+            current = []
+            continue
+        current.append(char)
+    clauses.append(''.join(current).strip())
+    return [clause for clause in clauses if clause]
+
+
+def _parseSort(sort):
+    """Returns a C{list} of C{(field, descending)} tuples from a sort spec.
+
+    Functions, like C{div(price,rate)}, are kept whole as the field: it's
+    also the name of the pseudo-field Solr returns for them.
+    """
+    fields = []
+    for clause in _splitClauses(sort):
+        parts = clause.rsplit(None, 1)
+        if len(parts) == 2 and parts[1].lower() in ('asc', 'desc'):
+            fields.append((parts[0], parts[1].lower() == 'desc'))
+        else:
+            fields.append((clause, False))
+    return fields
+
+
+def _facetLimits(params):
+    """
+    Returns the C{facet.limit} of a query and a C{dict} mapping fields to
+    their own C{f.<field>.facet.limit}, with the names the parameters have
+    once encoded.
+    """
+    limit = None
+    fieldLimits = {}
+    for name, value in params.iteritems():
+        name = name.replace('_', '.')
+        if name == 'facet.limit':
+            limit = int(value)
+        elif name.startswith('f.') and name.endswith('.facet.limit'):
+            fieldLimits[name[2:-len('.facet.limit')]] = int(value)
+    return limit, fieldLimits
+
+
+def _sortKey(doc, fields):
+    """
+    Returns the key to sort a document by the given fields. Documents
+    without a value for a field are sorted after the ones with a value, in
+    both directions, like Solr does with C{sortMissingLast}.
+    """
+    key = []
+    for field, descending in fields:
+        value = doc.get(field)
+        if value is None:
+            key.append((1, None))
+        elif descending:
+            key.append((0, _Descending(value)))
+        else:
+            key.append((0, value))
+    return tuple(key)
+
+
+def _mergeFacetCounts(responses, limit, fieldLimits):
+    """Adds up the facet counts of many responses.
+
+    @param limit: The maximum number of terms of each field, or C{None}.
+    @param fieldLimits: A C{dict} mapping fields to their own limit.
+    """
+    fields = {}
+    queries = {}
+    for response in responses:
+        facetCounts = response.facetCounts
+        if facetCounts is None:
+            continue
+        for name, facet in facetCounts.fields.iteritems():
+            merged = fields.setdefault(name, {})
+            for term, count in facet:
+                merged[term] = merged.get(term, 0) + count
+        for query, count in facetCounts.queries.iteritems():
+            queries[query] = queries.get(query, 0) + count
+
+    facetFields = {}
+    for field, counts in fields.iteritems():
+        terms = sorted(counts.iteritems(),
+                       key=lambda (term, count): (-count, term))
+        fieldLimit = fieldLimits.get(field, limit)
+        if fieldLimit is not None and fieldLimit >= 0:
+            terms = terms[:fieldLimit]
+        facetFields[field] = [value for term in terms for value in term]
+    return FacetCounts({'facet_fields': facetFields,
+                        'facet_queries': queries})
+
+
+class FanOutSearcher(object):
+    """Searches many Solr cores in parallel and merges their results.
+
+    Each core is asked for its own top C{start + rows} documents, which are
+    merged with a heap by score or by the requested sort fields. Ties are
+    broken by the name of the core and the position of the document in its
+    results. The number of documents found and the facet counts of the cores
+    are added up.
+
+    Cores that fail or don't answer within C{timeout} are reported in the
+    C{failures} of the L{MergedResults}, and the results of the other cores
+    are returned anyway.
+
+    @param clients: A C{dict} mapping core names to L{SolrClient}s.
+    @param concurrency: The maximum number of queries sent in parallel.
+    @param timeout: Optionally, the maximum number of seconds to wait for the
+        response of each core. Cores that don't answer in time fail with
+        L{TimeoutError}, and their request is cancelled.
+    @param clock: The L{IReactorTime} provider used for the timeouts.
+        Default is the global reactor.
+    """
+
+    def __init__(self, clients, concurrency=8, timeout=None, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.clients = clients
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.clock = clock
+
+    def search(self, query, start=0, rows=10, sort=None, **kwargs):
+        """Sends a query to all the cores and merges the results.
+
+        The score and the sort fields are added to the C{fl} parameter when
+        needed, because they are required to merge the results. Sort
+        functions are added as pseudo-fields. The facet counts are cut to
+        C{facet.limit} and to the C{f.<field>.facet.limit} of each field.
+
+        @param query: A C{unicode} query.
+        @param start: The position of the first merged document returned.
+        @param rows: The number of merged documents returned.
+        @param sort: Optionally, a Solr sort specification, like
+            C{price desc, id asc}. Default is C{score desc}.
+        @param *kwargs: Additional parameters for the server, like for
+            L{SolrClient.search}.
+        @return: A L{Deferred} that fires with a L{MergedResults} object, or
+            fails with the error of the first core if all of them failed.
+        """
+        sortFields = _parseSort(sort or 'score desc')
+        params = dict(kwargs)
+        params.update(start=0, rows=start + rows)
+        if sort is not None:
+            params['sort'] = sort
+
+        # The score and the functions are not returned by '*'.
+        required = [field for field, _ in sortFields]
+        computed = [field for field in required
+                    if field == 'score' or '(' in field]
+        if 'fl' in params:
+            fields = _splitClauses(params['fl'])
+            missing = [field for field in required
+                       if field not in fields and
+                       (field in computed or '*' not in fields)]
+            if missing:
+                params['fl'] = ','.join(fields + missing)
+        elif computed:
+            params['fl'] = ','.join(['*'] + computed)
+
+        names = sorted(self.clients)
+        responses = {}
+        failures = {}
+        semaphore = DeferredSemaphore(self.concurrency)
+
+        def searchCore(name):
+            d = self._search(name, self.clients[name], query, params)
+
+            def succeeded(response):
+                responses[name] = response
+
+            def failed(failure):
+                _logger.warning('Search on core %s failed: %s'
+                                % (name, failure.getErrorMessage()))
+                failures[name] = failure
+
+            return d.addCallbacks(succeeded, failed)
+
+        def merge(_):
+            if failures and not responses:
+                return failures[names[0]]
+            return self._merge(names, responses, failures, start, rows,
+                               sortFields, _facetLimits(params))
+
+        d = gatherResults([semaphore.run(searchCore, name)
+                           for name in names])
+        d.addCallback(merge)
+        return d
+
+    def _search(self, name, client, query, params):
+        d = client.search(query, **params)
+        if self.timeout is None:
+            return d
+
+        timedOut = []
+
+        def expire():
+            timedOut.append(True)
+            d.cancel()
+
+        delayedCall = self.clock.callLater(self.timeout, expire)
+
+        def finished(result):
+            if delayedCall.active():
+                delayedCall.cancel()
+            # Transports may wrap the cancellation of the request in their
+            # own error.
+            if timedOut and isinstance(result, Failure):
+                raise TimeoutError('Core %s did not answer in %s seconds'
+                                   % (name, self.timeout))
+            return result
+
+        return d.addBoth(finished)
+
+    def _merge(self, names, responses, failures, start, rows, sortFields,
+               facetLimits):
+        sequences = []
+        numFound = 0
+        maxScores = []
+        for index, name in enumerate(names):
+            response = responses.get(name)
+            if response is None or response.results is None:
+                continue
+            results = response.results
+            numFound += results.numFound
+            maxScore = response.responseDict['response'].get('maxScore')
+            if maxScore is not None:
+                maxScores.append(maxScore)
+            sequences.append([(_sortKey(doc, sortFields), index, position,
+                               name, doc)
+                              for position, doc in enumerate(results.docs)])
+
+        merged = islice(heapq.merge(*sequences), start, start + rows)
+        hits = [(name, doc) for _, _, _, name, doc in merged]
+        facetCounts = _mergeFacetCounts(
+            [responses[name] for name in names if name in responses],
+            *facetLimits)
+        return MergedResults(numFound, start, hits,
+                             max(maxScores) if maxScores else None,
+                             facetCounts, responses, failures)
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Hedged requests.
+
+A search waiting on a replica paused by garbage collection takes as long as
+the pause. Hedging sends the same idempotent request to a second endpoint
+when the first one doesn't answer within a delay, like the 95th percentile
+of the observed latencies, and takes the first response, cancelling the
+other request. Only the slowest requests are hedged, and a budget caps the
+extra load on the servers.
+
+L{HedgingPolicy} works with any two ways of sending a request, like two
+L{SolrClient}s for replicas of the same core::
+
+    policy = HedgingPolicy(delay=0.05, percentile=95)
+    d = policy.run(lambda: first.search(query), lambda: second.search(query))
+
+L{CloudSolrClient} uses it to hedge searches to the next node of the
+collection.
+"""
+import logging
+from collections import deque
+
+from twisted.internet.defer import CancelledError, Deferred
+
+
+__all__ = ['HedgeStats', 'HedgingPolicy']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+class HedgeStats(object):
+    """The counters of a L{HedgingPolicy}.
+
+    @ivar requests: The number of requests run.
+    @ivar hedged: The number of requests for which a hedge was sent.
+    @ivar wins: The number of hedges that answered first.
+    @ivar skipped: The number of hedges not sent because the budget was
+        exhausted.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.hedged = 0
+        self.wins = 0
+        self.skipped = 0
+
+    @property
+    def hedgeRate(self):
+        """The ratio of requests that were hedged, or C{None}."""
+        if not self.requests:
+            return None
+        return float(self.hedged) / self.requests
+
+    @property
+    def winRate(self):
+        """The ratio of hedges that answered first, or C{None}."""
+        if not self.hedged:
+            return None
+        return float(self.wins) / self.hedged
+
+
+class HedgingPolicy(object):
+    """Sends a second request when the first one is slow.
+
+    The budget is a token bucket: each request adds C{budget} tokens, up to
+    C{burst}, and each hedge takes one. With the default C{budget} of
+    C{0.05}, at most one request in twenty is hedged in the long run.
+
+    @param delay: The number of seconds to wait for the first request before
+        sending the hedge. If C{percentile} is given, it's only used until
+        enough latencies are observed.
+    @param percentile: Optionally, the percentile of the observed latencies
+        used as the delay, like C{95}.
+    @param budget: The maximum ratio of hedged requests.
+    @param burst: The maximum number of hedges sent in a row when the budget
+        was not used for a while.
+    @param window: The number of latest latencies kept to compute the
+        percentile.
+    @param clock: The L{IReactorTime} provider used to wait for the delay
+        and to measure the latencies. Default is the global reactor.
+    @ivar stats: The L{HedgeStats} of the policy.
+    """
+
+    # The number of latencies observed before the percentile is used, and
+    # between two computations of the percentile.
+    minSamples = 20
+
+    def __init__(self, delay=0.05, percentile=None, budget=0.05, burst=10,
+                 window=1000, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.delay = delay
+        self.percentile = percentile
+        self.budget = budget
+        self.burst = burst
+        self.clock = clock
+        self.stats = HedgeStats()
+        self._tokens = float(burst)
+        self._latencies = deque(maxlen=window)
+        self._newSamples = 0
+
+    def _record(self, latency):
+        """Records the latency of a request, updating the delay."""
+        if self.percentile is None:
+            return
+        self._latencies.append(latency)
+        self._newSamples += 1
+        if (len(self._latencies) >= self.minSamples and
+                self._newSamples >= self.minSamples):
+            self._newSamples = 0
+            latencies = sorted(self._latencies)
+            index = int(len(latencies) * self.percentile / 100.0)
+            self.delay = latencies[min(index, len(latencies) - 1)]
+
+    def run(self, primary, secondary):
+        """Runs a request, hedging it if it's slow.
+
+        If the first request fails before the hedge is sent, the failure is
+        returned without hedging. Once both are sent, the first response
+        wins, and the failure of the first request is returned if both
+        fail.
+
+        @param primary: A callable sending the request, returning a
+            L{Deferred}.
+        @param secondary: A callable sending the same request to another
+            endpoint, returning a L{Deferred}.
+        @return: A L{Deferred} that fires with the first result. Cancelling
+            it cancels all the requests in flight.
+        """
+        self.stats.requests += 1
+        self._tokens = min(self.burst, self._tokens + self.budget)
+        pending = []
+        failures = []
+        timer = []
+
+        def cancel(result):
+            if timer:
+                timer.pop().cancel()
+            for d in list(pending):
+                d.cancel()
+
+        result = Deferred(cancel)
+
+        def start(send, hedge):
+            started = self.clock.seconds()
+            d = send()
+            pending.append(d)
+            d.addCallbacks(succeeded, failed, (d, started, hedge), None,
+                           (d, started, hedge))
+
+        def succeeded(response, d, started, hedge):
+            pending.remove(d)
+            if result.called:
+                return
+            self._record(self.clock.seconds() - started)
+            if hedge:
+                self.stats.wins += 1
+            if timer:
+                timer.pop().cancel()
+            result.callback(response)
+            for other in list(pending):
+                other.cancel()
+
+        def failed(failure, d, started, hedge):
+            pending.remove(d)
+            if result.called:
+                if failure.check(CancelledError) and not hedge:
+                    # The latency of the slow request is at least this.
+                    self._record(self.clock.seconds() - started)
+                return
+            failures.append(failure)
+            if pending:
+                return
+            if timer:
+                timer.pop().cancel()
+            result.errback(failures[0])
+
+        def sendHedge():
+            timer.pop()
+            if self._tokens < 1:
+                self.stats.skipped += 1
+                return
+            self._tokens -= 1
+            self.stats.hedged += 1
+            _logger.debug('Hedging a request after %.3f seconds'
+                          % self.delay)
+            start(secondary, True)
+
+        start(primary, False)
+        if not result.called:
+            timer.append(self.clock.callLater(self.delay, sendHedge))
+        return result
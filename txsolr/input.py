@@ -28,7 +28,38 @@ from twisted.web.iweb import IBodyProducer
 
 from txsolr.errors import InputError
 
-__all__ = ['StringProducer', 'SimpleXMLInputFactory', 'escapeTerm']
+__all__ = ['StringProducer', 'SimpleXMLInputFactory', 'escapeTerm',
+           'escapeTerms', 'joinTerms', 'termsQuery', 'diffDocuments']
+
+
+# The modifiers of atomic updates supported by Solr.
+_MODIFIERS = frozenset(['set', 'add', 'add-distinct', 'remove', 'removeregex',
+                        'inc'])
+
+
+# Characters with a special meaning in the Lucene Query Syntax and their
+# escaped version. The backslash must be the first one, otherwise the escape
+# characters added for the other characters would be escaped again. The two
+# character operators C{&&} and C{||} are covered by escaping every C{&} and
+# C{|}.
+_ESCAPES = tuple((c, '\\' + c) for c in '\\+-&|!(){}[]^"~*?:/')
+
+# Same as L{_ESCAPES} but also escapes whitespace, so an escaped term can be
+# safely joined with other terms in a boolean group.
+_ESCAPES_AND_SPACES = _ESCAPES + tuple((c, '\\' + c) for c in ' \t\n\r\f\v')
+
+# The separators tried in order for a terms query when none is given.
+_TERMS_SEPARATORS = (',', '|', ';', '\t')
+
+
+def _escape(term, escapes):
+    # Replacing each special character with str.replace is faster than a
+    # regular expression or a per-character join, because most terms contain
+    # none or just a few of the special characters.
+    for char, escaped in escapes:
+        if char in term:
+            term = term.replace(char, escaped)
+    return term
 
 
 def escapeTerm(term):
@@ -38,8 +69,163 @@ def escapeTerm(term):
     @param term: The term to be escaped.
     @return the term with all the special characters escaped.
     """
-    specialChars = set(r'\ + - & | ! ( ) { } [ ] ^ " ~ * ? :'.split())
-    return ''.join(('\\' + c if c in specialChars else c) for c in term)
+    return _escape(term, _ESCAPES)
+
+
+def escapeTerms(terms):
+    """
+    Escapes a sequence of terms so they can be used inside a boolean group.
+
+    Unlike L{escapeTerm}, whitespace is also escaped, so a term containing
+    spaces is still handled by Solr as a single term.
+
+    @param terms: An iterable of terms to be escaped.
+    @return: A C{list} with the escaped terms.
+    """
+    return [_escape(term, _ESCAPES_AND_SPACES) for term in terms]
+
+
+def joinTerms(terms, field=None, operator='OR'):
+    """
+    Escapes and joins a sequence of terms in a single boolean group.
+
+    For example, C{joinTerms(['a', 'b:c'], 'id')} returns
+    C{'id:(a OR b\\:c)'}.
+
+    @param terms: An iterable of terms to be joined.
+    @param field: Optionally, the name of the field the group applies to.
+    @param operator: The boolean operator used to join the terms. Default is
+        C{OR}.
+    @raise InputError: If C{terms} is empty.
+    @return: The query for the boolean group.
+    """
+    escaped = escapeTerms(terms)
+    if not escaped:
+        raise InputError('Unable to join an empty list of terms')
+
+    group = '(' + (' %s ' % operator).join(escaped) + ')'
+    if field is not None:
+        group = field + ':' + group
+    return group
+
+
+def termsQuery(field, terms, separator=','):
+    """
+    Builds a query for the C{terms} query parser.
+
+    The C{terms} query parser does not use the Lucene Query Syntax, so the
+    terms are not escaped. It is much faster than a boolean group for large
+    lists of terms and is not limited by Solr's C{maxBooleanClauses}.
+
+    @param field: The name of the field to be matched.
+    @param terms: An iterable of terms.
+    @param separator: The separator used to join the terms. Default is C{,}.
+        If it's C{None}, the first of C{,}, C{|}, C{;} and a tab that is not
+        in any of the terms is used, or a long enough run of C{|}.
+    @raise InputError: If C{terms} is empty or one of the terms contains the
+        separator.
+    @return: A query like C{{!terms f=id}a,b,c}.
+    """
+    terms = list(terms)
+    if not terms:
+        raise InputError('Unable to build a terms query without terms')
+
+    if separator is None:
+        separator = _termsSeparator(terms)
+    elif any(separator in term for term in terms):
+        raise InputError('Terms can not contain the separator %r' % separator)
+
+    if separator == ',':
+        localParams = '{!terms f=%s}' % field
+    else:
+        localParams = "{!terms f=%s separator='%s'}" % (field, separator)
+    return localParams + separator.join(terms)
+
+
+def _termsSeparator(terms):
+    """Returns a separator for a terms query that is not in the terms."""
+    for separator in _TERMS_SEPARATORS:
+        if not any(separator in term for term in terms):
+            return separator
+    separator = '||'
+    while any(separator in term for term in terms):
+        separator += '|'
+    return separator
+
+
+def _escapeText(text):
+    """Escapes the text of an XML element like L{ElementTree} does."""
+    if '&' in text:
+        text = text.replace('&', '&amp;')
+    if '<' in text:
+        text = text.replace('<', '&lt;')
+    if '>' in text:
+        text = text.replace('>', '&gt;')
+    return text
+
+
+def _escapeAttribute(text):
+    """Escapes the value of an XML attribute like L{ElementTree} does."""
+    text = _escapeText(text)
+    if '"' in text:
+        text = text.replace('"', '&quot;')
+    if '\n' in text:
+        text = text.replace('\n', '&#10;')
+    return text
+
+
+def _encodeName(name):
+    """
+    Escapes the name of a field for an attribute and encodes it in UTF-8.
+    Names given as C{str} are assumed to be in UTF-8 already.
+    """
+    name = _escapeAttribute(name)
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    return name
+
+
+def _startTag(tags, name):
+    """Returns the start tag of a field, caching it in C{tags}."""
+    tag = tags.get(name)
+    if tag is None:
+        tag = tags[name] = '<field name="%s">' % _encodeName(name)
+    return tag
+
+
+def diffDocuments(old, new, uniqueKey='id', checkVersion=False):
+    """
+    Builds an atomic update with the fields that changed between two versions
+    of a document.
+
+    Changed and new fields are replaced with C{set}, and fields missing in
+    the new version are removed. For instance, C{diffDocuments({'id': 'a',
+    'x': 1, 'y': 2}, {'id': 'a', 'x': 3})} returns C{{'id': 'a', 'x': {'set':
+    3}, 'y': {'set': None}}}.
+
+    @param old: The current version of the document, as returned by Solr.
+    @param new: The complete new version of the document.
+    @param uniqueKey: The name of the unique key field.
+    @param checkVersion: If C{True}, the C{_version_} of the old document is
+        included, so Solr rejects the update with a L{VersionConflictError}
+        if the document was modified since it was read.
+    @return: A document with the atomic update, or C{None} if nothing
+        changed.
+    """
+    update = {}
+    for name, value in new.iteritems():
+        if name not in (uniqueKey, '_version_') and old.get(name) != value:
+            update[name] = {'set': value}
+    for name in old:
+        if name not in new and name not in (uniqueKey, '_version_'):
+            update[name] = {'set': None}
+    if not update:
+        return None
+
+    update[uniqueKey] = new[uniqueKey]
+    if checkVersion and '_version_' in old:
+        update['_version_'] = old['_version_']
+    return update
 
 
 class StringProducer(object):
@@ -88,9 +274,99 @@ class SimpleXMLInputFactory(object):
         except UnicodeError:
             raise InputError('Unable to decode value %r' % value)
 
+    def _encodeField(self, name, value):
+        """Encodes a value of the field with the given name."""
+        return self._encodeValue(value)
+
+    def _writeDocument(self, parts, document, tags):
+        """Writes the XML of a document and of its children.
+
+        @param parts: The C{list} of C{str} parts of the body.
+        @param document: The C{dict} of the document.
+        @param tags: A C{dict} caching the start tags of the fields.
+        """
+        start = len(parts)
+        parts.append('<doc>')
+        children = ()
+        for key, value in document.iteritems():
+            if key == '_childDocuments_':
+                children = value if isinstance(value, list) else [value]
+                continue
+
+            if isinstance(value, dict):
+                self._writeUpdates(parts, key, value)
+                continue
+
+            if isinstance(value, (tuple, list, set)):
+                values = value
+                if value and isinstance(value, (tuple, list)) and \
+                        isinstance(value[0], dict):
+                    # Labeled child documents.
+                    for child in value:
+                        parts.append(_startTag(tags, key))
+                        self._writeDocument(parts, child, tags)
+                        parts.append('</field>')
+                    continue
+            else:
+                values = [value]
+
+            for v in values:
+                if v is None:
+                    continue
+                parts.append(_startTag(tags, key))
+                parts.append(
+                    _escapeText(self._encodeField(key, v)).encode('utf-8'))
+                parts.append('</field>')
+
+        for child in children:
+            self._writeDocument(parts, child, tags)
+
+        if len(parts) == start + 1:
+            parts[start] = '<doc />'
+        else:
+            parts.append('</doc>')
+
+    def _writeUpdates(self, parts, name, updates):
+        """Writes the fields of an atomic update of a field.
+
+        @param updates: A C{dict} mapping modifiers, like C{set} or C{inc},
+            to a value or a sequence of values.
+        """
+        prefix = '<field name="%s" ' % _encodeName(name)
+        for modifier, value in updates.iteritems():
+            if modifier not in _MODIFIERS:
+                raise InputError('Unknown atomic update %r of field %s'
+                                 % (modifier, name))
+
+            if isinstance(value, (tuple, list, set)):
+                values = [v for v in value if v is not None]
+            else:
+                values = [] if value is None else [value]
+
+            if not values:
+                # Removes all the values of the field.
+                parts.append('%snull="true" update="%s" />'
+                             % (prefix, modifier))
+
+            for v in values:
+                parts.append('%supdate="%s">' % (prefix, modifier))
+                parts.append(
+                    _escapeText(self._encodeField(name, v)).encode('utf-8'))
+                parts.append('</field>')
+
     def createAdd(self, document, overwrite=None, commitWithin=None):
         """
         Create an add request in XML format
+
+        The value of a field can be a C{dict} mapping the modifiers of an
+        atomic update, like C{set}, C{add}, C{remove}, C{removeregex} or
+        C{inc}, to values. Documents with such fields update the stored
+        document instead of replacing it.
+
+        Child documents, for block joins, are given in the
+        C{_childDocuments_} key of their parent, or as a C{list} of C{dict}s
+        in a field of the parent, for labeled children. The body is written
+        directly, without building an XML tree.
         """
 
         if isinstance(document, (tuple, list, set)):
@@ -98,37 +374,26 @@ class SimpleXMLInputFactory(object):
         else:
             documents = [document]
 
-        addElement = ElementTree.Element('add')
+        # The attributes are sorted, like ElementTree wrote them.
+        attributes = ''
+        if commitWithin is not None:
+            attributes += ' commitWithin="%s"' % _escapeAttribute(
+                str(commitWithin))
 
         if overwrite is not None:
-            overwrite = 'true' if overwrite else 'false'
-            addElement.set('overwrite', overwrite)
-
-        if commitWithin is not None:
-            commitWithin = str(commitWithin)
-            addElement.set('commitWithin', commitWithin)
+            attributes += ' overwrite="%s"' % ('true' if overwrite
+                                               else 'false')
 
+        parts = []
+        tags = {}
         for doc in documents:
+            self._writeDocument(parts, doc, tags)
 
-            docElement = ElementTree.Element('doc')
-            for key, value in doc.iteritems():
-
-                if isinstance(value, (tuple, list, set)):
-                    values = value
-                else:
-                    values = [value]
-
-                for v in values:
-                    if v is None:
-                        continue
-
-                    fieldElement = ElementTree.Element('field', name=key)
-                    fieldElement.text = self._encodeValue(v)
-                    docElement.append(fieldElement)
-            addElement.append(docElement)
-
-        result = ElementTree.tostring(addElement, encoding='utf-8')
-        return StringProducer(result)
+        if not parts:
+            return StringProducer('<add%s />' % attributes)
+        parts.insert(0, '<add%s>' % attributes)
+        parts.append('</add>')
+        return StringProducer(''.join(parts))
 
     def createDelete(self, id):
         if isinstance(id, (tuple, list, set)):
@@ -157,7 +422,9 @@ class SimpleXMLInputFactory(object):
 
     def createCommit(self, waitFlush=None,
                            waitSearcher=None,
-                           expungeDeletes=None):
+                           expungeDeletes=None,
+                           softCommit=None,
+                           openSearcher=None):
 
         commitElement = ElementTree.Element('commit')
 
@@ -173,6 +440,14 @@ class SimpleXMLInputFactory(object):
             expungeDeletes = 'true' if expungeDeletes else 'false'
             commitElement.set('expungeDeletes', expungeDeletes)
 
+        if softCommit is not None:
+            softCommit = 'true' if softCommit else 'false'
+            commitElement.set('softCommit', softCommit)
+
+        if openSearcher is not None:
+            openSearcher = 'true' if openSearcher else 'false'
+            commitElement.set('openSearcher', openSearcher)
+
         result = ElementTree.tostring(commitElement)
         return StringProducer(result)
 
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Index and cache statistics.
+
+This module polls the statistics of a Solr core, the index from the Luke
+handler at C{/admin/luke} and the caches from the MBeans handler at
+C{/admin/mbeans}, and keeps them as snapshots. The difference between two
+snapshots gives rates over the polling interval, like the hit ratio of the
+C{filterCache} during the last minute, which can be used to tune the
+indexing and commit settings of the client.
+"""
+import logging
+
+from twisted.internet.defer import gatherResults
+
+
+__all__ = ['IndexStats', 'CacheStats', 'StatsSnapshot', 'StatsDelta',
+           'StatsPoller', 'adaptBatchSize', 'adaptCommitInterval']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+class IndexStats(object):
+    """The statistics of the index of a core.
+
+    @ivar numDocs: The number of live documents.
+    @ivar maxDoc: The number of documents, including the deleted ones that
+        were not merged away yet.
+    @ivar deletedDocs: The number of deleted documents.
+    @ivar segmentCount: The number of segments.
+    @ivar sizeInBytes: The size of the index, or C{None} if Solr doesn't
+        report it.
+    @ivar version: The version of the index, which changes on each commit.
+    """
+
+    __slots__ = ('numDocs', 'maxDoc', 'deletedDocs', 'segmentCount',
+                 'sizeInBytes', 'version')
+
+    def __init__(self, numDocs, maxDoc, deletedDocs, segmentCount,
+                 sizeInBytes=None, version=None):
+        self.numDocs = numDocs
+        self.maxDoc = maxDoc
+        self.deletedDocs = deletedDocs
+        self.segmentCount = segmentCount
+        self.sizeInBytes = sizeInBytes
+        self.version = version
+
+    @classmethod
+    def fromLuke(cls, index):
+        """
+        Creates an L{IndexStats} from the C{index} object of the response of
+        the Luke handler.
+        """
+        numDocs = index.get('numDocs', 0)
+        maxDoc = index.get('maxDoc', numDocs)
+        return cls(numDocs, maxDoc, index.get('deletedDocs', maxDoc - numDocs),
+                   index.get('segmentCount', 0), index.get('sizeInBytes'),
+                   index.get('version'))
+
+
+class CacheStats(object):
+    """The statistics of a cache of a core since the core was loaded.
+
+    Solr resets the C{lookups} and C{hits} of a cache each time a new
+    searcher is opened, so the cumulative values are used when Solr reports
+    them.
+
+    @ivar name: The name of the cache, like C{filterCache}.
+    @ivar lookups: The number of lookups.
+    @ivar hits: The number of lookups that found an entry.
+    @ivar evictions: The number of entries evicted to make room.
+    @ivar size: The current number of entries.
+    @ivar warmupTime: The milliseconds spent autowarming the cache for the
+        current searcher.
+    """
+
+    __slots__ = ('name', 'lookups', 'hits', 'evictions', 'size',
+                 'warmupTime')
+
+    def __init__(self, name, lookups, hits, evictions=0, size=0,
+                 warmupTime=0):
+        self.name = name
+        self.lookups = lookups
+        self.hits = hits
+        self.evictions = evictions
+        self.size = size
+        self.warmupTime = warmupTime
+
+    @classmethod
+    def fromMBean(cls, name, stats):
+        """
+        Creates a L{CacheStats} from the C{stats} of a cache in the response
+        of the MBeans handler. Newer versions of Solr prefix the names of
+        the statistics, like C{CACHE.searcher.filterCache.hits}.
+        """
+        values = dict((key.rsplit('.', 1)[-1], value)
+                      for key, value in stats.iteritems())
+
+        def get(key):
+            return values.get('cumulative_' + key, values.get(key, 0))
+
+        return cls(name, get('lookups'), get('hits'), get('evictions'),
+                   values.get('size', 0), values.get('warmupTime', 0))
+
+    @property
+    def hitRatio(self):
+        """The ratio of lookups that were hits, or C{None} without lookups."""
+        if not self.lookups:
+            return None
+        return float(self.hits) / self.lookups
+
+
+class StatsSnapshot(object):
+    """The statistics of a core at a point in time.
+
+    @ivar time: The time of the snapshot, in seconds since the epoch.
+    @ivar index: The L{IndexStats} of the core.
+    @ivar caches: A C{dict} mapping cache names to L{CacheStats}.
+    """
+
+    __slots__ = ('time', 'index', 'caches')
+
+    def __init__(self, time, index, caches):
+        self.time = time
+        self.index = index
+        self.caches = caches
+
+    @property
+    def warmupTime(self):
+        """
+        The milliseconds spent autowarming all the caches for the current
+        searcher, the main cost of opening a searcher after a commit.
+        """
+        return sum(cache.warmupTime for cache in self.caches.itervalues())
+
+    def delta(self, previous):
+        """
+        Returns the L{StatsDelta} between a previous snapshot and this one.
+        """
+        return StatsDelta(previous, self)
+
+
+class StatsDelta(object):
+    """The change of the statistics of a core between two snapshots.
+
+    @ivar previous: The older L{StatsSnapshot}.
+    @ivar current: The newer L{StatsSnapshot}.
+    @ivar interval: The number of seconds between the snapshots.
+    """
+
+    def __init__(self, previous, current):
+        self.previous = previous
+        self.current = current
+        self.interval = current.time - previous.time
+
+    @property
+    def documents(self):
+        """The change in the number of live documents."""
+        return self.current.index.numDocs - self.previous.index.numDocs
+
+    @property
+    def segments(self):
+        """The change in the number of segments."""
+        return (self.current.index.segmentCount -
+                self.previous.index.segmentCount)
+
+    def _counts(self, name):
+        """
+        Returns the lookups, hits and evictions of a cache between the
+        snapshots. If the counters went back, the core was reloaded between
+        the snapshots and the current counters are used.
+        """
+        current = self.current.caches.get(name)
+        if current is None:
+            return 0, 0, 0
+        previous = self.previous.caches.get(name)
+        if previous is None or current.lookups < previous.lookups:
+            return current.lookups, current.hits, current.evictions
+        return (current.lookups - previous.lookups,
+                current.hits - previous.hits,
+                max(0, current.evictions - previous.evictions))
+
+    def lookups(self, name):
+        """Returns the number of lookups of a cache between the snapshots."""
+        return self._counts(name)[0]
+
+    def evictions(self, name):
+        """
+        Returns the number of evictions of a cache between the snapshots.
+        """
+        return self._counts(name)[2]
+
+    def hitRatio(self, name):
+        """Returns the hit ratio of a cache between the snapshots.
+
+        @param name: The name of the cache, like C{filterCache}.
+        @return: A C{float} between 0 and 1, or C{None} if the cache had no
+            lookups.
+        """
+        lookups, hits, _ = self._counts(name)
+        if not lookups:
+            return None
+        return float(hits) / lookups
+
+
+class StatsPoller(object):
+    """Polls the statistics of a core on a schedule.
+
+    Each poll sends two cheap requests in parallel: one to the Luke handler
+    without term statistics, and one to the MBeans handler for the caches
+    only. A poll is skipped if the previous one didn't finish yet, and
+    failed polls are logged and don't stop the schedule.
+
+    @param client: The L{SolrClient} of the core.
+    @param interval: The number of seconds between two polls.
+    @param clock: The L{IReactorTime} provider used to schedule the polls.
+        Default is the global reactor.
+    @ivar snapshot: The latest L{StatsSnapshot}, or C{None}.
+    @ivar previous: The L{StatsSnapshot} before the latest one, or C{None}.
+    """
+
+    def __init__(self, client, interval=60, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.client = client
+        self.interval = interval
+        self.clock = clock
+        self.snapshot = None
+        self.previous = None
+        self._observers = []
+        self._delayedCall = None
+        self._polling = False
+
+    def addObserver(self, observer):
+        """Adds a callable called after each poll.
+
+        @param observer: A callable called with the new L{StatsSnapshot}
+            and the L{StatsDelta} from the previous one, or C{None} after
+            the first poll.
+        """
+        self._observers.append(observer)
+
+    def removeObserver(self, observer):
+        """Removes an observer added with L{StatsPoller.addObserver}."""
+        self._observers.remove(observer)
+
+    @property
+    def delta(self):
+        """The L{StatsDelta} of the last two snapshots, or C{None}."""
+        if self.previous is None:
+            return None
+        return self.snapshot.delta(self.previous)
+
+    def start(self):
+        """Polls now and every C{interval} seconds until stopped."""
+        if self._delayedCall is None:
+            self._run()
+
+    def stop(self):
+        """Stops polling. A poll in progress is not cancelled."""
+        if self._delayedCall is not None:
+            self._delayedCall.cancel()
+            self._delayedCall = None
+
+    def _run(self):
+        self._delayedCall = self.clock.callLater(self.interval, self._run)
+        if self._polling:
+            _logger.debug('Skipping a poll of the statistics, the previous '
+                          'one did not finish')
+            return
+        self.poll().addErrback(self._failed)
+
+    def _failed(self, failure):
+        _logger.warning("Can't poll the statistics: %s"
+                        % failure.getErrorMessage())
+
+    def poll(self):
+        """Polls the statistics once.
+
+        @return: A L{Deferred} that fires with the new L{StatsSnapshot},
+            after the observers are called.
+        """
+        self._polling = True
+        luke = self.client._query('/admin/luke', {'numTerms': 0,
+                                                  'show': 'index'})
+        mbeans = self.client._query('/admin/mbeans', {'cat': 'CACHE',
+                                                      'stats': 'true'})
+        d = gatherResults([luke, mbeans], consumeErrors=True)
+        d.addCallbacks(self._received, self.client._unwrapFirstError)
+        d.addBoth(self._done)
+        return d
+
+    def _done(self, result):
+        self._polling = False
+        return result
+
+    def _received(self, responses):
+        luke, mbeans = responses
+        index = IndexStats.fromLuke(luke.responseDict.get('index', {}))
+        caches = {}
+        # The MBeans are a flat list alternating categories and their beans.
+        beans = mbeans.responseDict.get('solr-mbeans', [])
+        for category, values in zip(beans[::2], beans[1::2]):
+            if category != 'CACHE':
+                continue
+            for name, bean in values.iteritems():
+                caches[name] = CacheStats.fromMBean(name,
+                                                    bean.get('stats') or {})
+
+        snapshot = StatsSnapshot(self.clock.seconds(), index, caches)
+        self.previous, self.snapshot = self.snapshot, snapshot
+        delta = self.delta
+        for observer in list(self._observers):
+            try:
+                observer(snapshot, delta)
+            except Exception:
+                _logger.exception('Statistics observer %r failed'
+                                  % (observer,))
+        return snapshot
+
+
+def adaptBatchSize(indexer, maxSegments):
+    """
+    Returns a L{StatsPoller} observer that limits the batch size of a
+    L{BulkIndexer} while the merges of the index fall behind.
+
+    When the index has more than C{maxSegments} segments, the
+    C{maxBatchSize} of the indexer is halved, down to its C{minBatchSize}.
+    Once the index is back under C{maxSegments}, it's doubled up to its
+    original value. The indexer only adapts its batch size within these
+    limits if it has a C{targetLatency}.
+
+    @param indexer: The L{BulkIndexer}.
+    @param maxSegments: The number of segments above which the merges are
+        considered to fall behind.
+    """
+    original = indexer.maxBatchSize
+
+    def observer(snapshot, delta):
+        if snapshot.index.segmentCount > maxSegments:
+            indexer.maxBatchSize = max(indexer.minBatchSize,
+                                       indexer.maxBatchSize // 2)
+        else:
+            indexer.maxBatchSize = min(original, indexer.maxBatchSize * 2)
+
+    return observer
+
+
+def adaptCommitInterval(scheduler, factor=2.0):
+    """
+    Returns a L{StatsPoller} observer that keeps the hard commits of a
+    L{CommitScheduler} slower than the searchers are warmed.
+
+    Commits that open searchers faster than their caches are autowarmed
+    pile up warming searchers in Solr. The C{minInterval} of the scheduler
+    is set to C{factor} times the last warmup time of the caches, and never
+    below its original value.
+
+    @param scheduler: The L{CommitScheduler}.
+    @param factor: The multiple of the warmup time to keep between commits.
+    """
+    original = scheduler.minInterval
+
+    def observer(snapshot, delta):
+        scheduler.minInterval = max(original,
+                                    factor * snapshot.warmupTime / 1000.0)
+
+    return observer
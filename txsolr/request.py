@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Solr requests.
+
+This module builds the HTTP requests sent to Solr and checks the status of
+their responses without doing any I/O, so the same requests are sent by
+L{SolrClient} and by any other front-end using a different HTTP library or
+event loop. The bodies are decoded by the consumers of L{txsolr.response}.
+"""
+import urllib
+
+from txsolr.errors import HTTPWrongStatus, VersionConflictError
+
+
+__all__ = ['SolrRequest', 'encodeParameters', 'queryRequest',
+           'updateRequest', 'checkStatus']
+
+
+class SolrRequest(object):
+    """An HTTP request to a Solr core.
+
+    @ivar method: The HTTP method, C{GET} or C{POST}.
+    @ivar path: The path of the request relative to the URL of the core,
+        including the query string.
+    @ivar headers: A C{dict} mapping header names to lists of values.
+    @ivar body: The body of the request as a C{str}, or C{None}.
+    """
+
+    __slots__ = ('method', 'path', 'headers', 'body')
+
+    def __init__(self, method, path, headers, body=None):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+
+    def __repr__(self):
+        return '<SolrRequest %s %s>' % (self.method, self.path)
+
+
+def encodeParameters(params):
+    """Encodes the parameters of a query request.
+
+    Underscores in the names of the parameters are replaced by dots, so
+    parameters like C{hl.fl} can be given as keyword arguments.
+
+    @param params: A C{dict} with the request parameters. Values can be
+        C{unicode} or sequences of values for multi-valued parameters.
+    @return: The URL encoded parameters as a C{str}.
+    """
+    encodedParameters = []
+    for key, value in params.iteritems():
+        key = key.replace('_', '.')
+        if isinstance(value, (tuple, list)):
+            values = value
+        else:
+            values = [value]
+
+        for value in values:
+            if isinstance(value, unicode):
+                value = value.encode('UTF-8')
+            encodedParameters.append((key, value))
+
+    return urllib.urlencode(encodedParameters)
+
+
+def queryRequest(url, path, params, maxGetLength):
+    """Builds a query request to the given handler of Solr.
+
+    The query is sent with a GET request if its full URL fits in
+    C{maxGetLength}, and in the body of a POST request otherwise. The
+    parameters are encoded only once, for the URL or for the body. JSON
+    responses are always requested.
+
+    @param url: The URL of the core, used to compute the length of the full
+        URL.
+    @param path: The path of the request handler, like C{/select}.
+    @param params: A C{dict} with the request parameters. It's updated with
+        the C{wt} parameter.
+    @param maxGetLength: The maximum length of the full URL of a GET request.
+    @return: A L{SolrRequest}.
+    """
+    params.update(wt=u'json')
+    query = encodeParameters(params)
+    if len(url) + len(path) + 1 + len(query) <= maxGetLength:
+        return SolrRequest('GET', path + '?' + query, {})
+    return SolrRequest(
+        'POST', path,
+        {'Content-type': ['application/x-www-form-urlencoded']}, query)
+
+
+def updateRequest(contentType, body):
+    """Builds a request to the C{/update} handler of Solr.
+
+    @param contentType: The content type of the body, like the one of an
+        input factory.
+    @param body: The body of the request as a C{str}.
+    @return: A L{SolrRequest}.
+    """
+    return SolrRequest('POST', '/update?wt=json',
+                       {'Content-Type': [contentType]}, body)
+
+
+def checkStatus(code):
+    """Checks the status code of the response of a Solr request.
+
+    @param code: The HTTP status code of the response.
+    @raise VersionConflictError: If the status code is C{409}.
+    @raise HTTPWrongStatus: If the status code is not C{200}.
+    """
+    if code == 409:
+        raise VersionConflictError(code)
+    if code != 200:
+        raise HTTPWrongStatus(code)
@@ -23,15 +23,26 @@ Requests.
 """
 import json
 import logging
+import re
+from array import array
+from collections import deque
+from itertools import izip, islice
+from json.decoder import scanstring
 
+from twisted.internet.defer import Deferred, fail, succeed
 from twisted.internet.protocol import Protocol
+from twisted.python.failure import Failure
 from twisted.web.client import ResponseDone
 from twisted.web.http import PotentialDataLoss
 
 from txsolr.errors import SolrResponseError
 
 
-__all__ = ['ResponseConsumer', 'DiscardingResponseConsumer', 'QueryResults',
+__all__ = ['ResponseConsumer', 'DiscardingResponseConsumer',
+           'StreamingFacetConsumer', 'StreamingDocumentConsumer',
+           'DocumentStream', 'TupleStream', 'QueryResults', 'LookupResults',
+           'MergedResults', 'FacetField', 'FacetRange', 'FacetPivot',
+           'FacetCounts', 'Group', 'GroupCommand', 'Grouping', 'Hit',
            'SolrResponse', 'JSONSolrResponse']
 
 
@@ -89,6 +100,314 @@ class DiscardingResponseConsumer(Protocol):
         _logger.debug('Consumer data received:\n' + bytes)
 
 
+# A JSON token: a string, a structural character or another literal.
+_TOKEN = re.compile(r'\s*(?:("[^"\\]*(?:\\.[^"\\]*)*")|([{}\[\],:])|'
+                    r'([^\s{}\[\],:"]+))')
+
+# A term and its count in a flat facet list, and the separator after them.
+_FACET_PAIR = re.compile(r'\s*("[^"\\]*(?:\\.[^"\\]*)*"|null)\s*,'
+                         r'\s*(-?\d+)\s*([,\]])')
+
+# A run of terms and counts in a flat facet list, each followed by a comma.
+_FACET_PAIRS = re.compile(r'(?:\s*(?:"[^"\\]*(?:\\.[^"\\]*)*"|null)\s*,'
+                          r'\s*-?\d+\s*,)*')
+
+_WHITESPACE = re.compile(r'\s*')
+_SEPARATOR = re.compile(r'\s*([,\]])')
+_ARRAY_END = re.compile(r'\s*\]')
+
+_DECODER = json.JSONDecoder()
+
+
+class _StreamingConsumer(Protocol):
+    """
+    Base class of the consumers that parse some arrays of a JSON response
+    while the body is received, instead of keeping them in memory.
+
+    The body is scanned token by token to know the path of the value being
+    received. The elements of the arrays at the streamed paths are given to
+    L{_scanArray}, and those arrays are left empty in the body parsed by the
+    C{responseClass} once it has been received.
+
+    @param deferred: A L{Deferred} that will be fired with the response when
+        all the body is consumed.
+    @param responseClass: A L{SolrResponse} subclass able to parse the body.
+    """
+
+    def __init__(self, deferred, responseClass):
+        self.deferred = deferred
+        self.responseClass = responseClass
+
+        self._buffer = ''
+        self._kept = []
+        # A [key, expectingKey] list for each object being parsed and None
+        # for each array.
+        self._stack = []
+        self._array = None
+        self._arrayStart = False
+
+    def _streamedArray(self, stack):
+        """
+        Returns a name for the array starting inside the given stack of
+        objects and arrays, or C{None} if it must not be streamed.
+        """
+        raise NotImplementedError()
+
+    def _scanArray(self, buffer, position):
+        """
+        Parses the elements of the streamed array in the buffer, calling
+        L{_endArray} at its end.
+
+        @return: The position of the first byte not parsed yet.
+        """
+        raise NotImplementedError()
+
+    def _finished(self, response):
+        """Called with the L{SolrResponse} once the body is parsed."""
+        return response
+
+    def dataReceived(self, bytes):
+        self._buffer += bytes
+        self._scan(False)
+
+    def _scan(self, final):
+        buffer = self._buffer
+        position = 0
+        while position < len(buffer):
+            if self._array is not None:
+                if self._arrayStart:
+                    position = _WHITESPACE.match(buffer, position).end()
+                    if position == len(buffer):
+                        break
+                    self._arrayStart = False
+                    match = _ARRAY_END.match(buffer, position)
+                    if match is not None:
+                        self._endArray()
+                        position = match.end()
+                        continue
+                position = self._scanArray(buffer, position)
+                if self._array is not None:
+                    break
+                continue
+
+            match = _TOKEN.match(buffer, position)
+            if match is None:
+                break
+            if match.group(3) and match.end() == len(buffer) and not final:
+                # The literal could continue in the next chunk.
+                break
+            self._kept.append(buffer[position:match.end()])
+            position = match.end()
+            self._token(match)
+        self._buffer = buffer[position:]
+
+    def _token(self, match):
+        stack = self._stack
+        top = stack[-1] if stack else None
+        string, structural = match.group(1), match.group(2)
+        if string is not None:
+            if top is not None and top[1]:
+                top[0] = scanstring(string, 1)[0]
+                top[1] = False
+        elif structural is None:
+            return
+        elif structural == '{':
+            stack.append([None, True])
+        elif structural == '[':
+            self._array = self._streamedArray(stack)
+            if self._array is None:
+                stack.append(None)
+            else:
+                self._arrayStart = True
+        elif structural in '}]':
+            stack.pop()
+        elif structural == ',' and top is not None:
+            top[1] = True
+
+    def _endArray(self):
+        self._kept.append(']')
+        self._array = None
+
+    def connectionLost(self, reason):
+        if not reason.check(ResponseDone, PotentialDataLoss):
+            self.deferred.errback(reason)
+            return
+
+        try:
+            self._scan(True)
+            if self._buffer.strip() or self._array is not None:
+                raise SolrResponseError('Incomplete response body')
+            response = None
+            if self.responseClass is not None:
+                response = self.responseClass(''.join(self._kept))
+            response = self._finished(response)
+        except Exception, e:
+            _logger.error("Can't decode streamed response body")
+            self.deferred.errback(e)
+        else:
+            self.deferred.callback(response)
+
+
+class StreamingFacetConsumer(_StreamingConsumer):
+    """
+    A consumer that parses the C{facet_fields} of a JSON response while the
+    body is received, without keeping the facet lists in memory.
+
+    Facet lists with millions of terms, like the ones of C{facet.limit=-1}
+    on high-cardinality fields, take a lot of memory when the whole body is
+    kept and decoded as JSON. This consumer decodes them as they arrive,
+    giving each term and count to a callback or collecting them in compact
+    L{FacetField}s. The rest of the body is parsed as usual, once it has
+    been received.
+
+    Streaming trades some CPU for memory: it takes about 20% more time than
+    decoding the whole body and converting the facet lists with
+    L{FacetField.fromList}, as measured by the C{facets} benchmarks.
+
+    The facet lists must use the default flat format of Solr
+    (C{json.nl=flat}).
+
+    @param deferred: A L{Deferred} that will be fired with the response when
+        all the body is consumed.
+    @param responseClass: A L{SolrResponse} subclass able to parse the body.
+    @param callback: Optionally, a callable taking the name of a field, a
+        term and its count, called for each facet count as it's parsed. If
+        it's given, the facet counts are not kept. Otherwise, they are
+        available in the C{facetCounts} of the response.
+    """
+
+    def __init__(self, deferred, responseClass, callback=None):
+        _StreamingConsumer.__init__(self, deferred, responseClass)
+        self.callback = callback
+        self.fields = {}
+
+    def _streamedArray(self, stack):
+        if (len(stack) == 3 and stack[0][0] == 'facet_counts' and
+                stack[1][0] == 'facet_fields'):
+            return stack[2][0]
+
+    def _scanArray(self, buffer, position):
+        field = self._array
+        callback = self.callback
+        if callback is None:
+            facet = self.fields.get(field)
+            if facet is None:
+                facet = self.fields[field] = FacetField(field, [],
+                                                        array('l'))
+
+        values, position = self._decodePairs(buffer, position)
+        match = _FACET_PAIR.match(buffer, position)
+        while match is not None:
+            term = match.group(1)
+            values.append(None if term == 'null'
+                          else scanstring(term, 1)[0])
+            values.append(int(match.group(2)))
+            position = match.end()
+            if match.group(3) == ']':
+                self._endArray()
+                break
+            match = _FACET_PAIR.match(buffer, position)
+
+        if callback is None:
+            facet.terms.extend(values[::2])
+            facet.counts.extend(values[1::2])
+        else:
+            for index in xrange(0, len(values), 2):
+                callback(field, values[index], values[index + 1])
+        return position
+
+    def _decodePairs(self, buffer, position):
+        """
+        Decodes the complete pairs at the start of the buffer at once with
+        the C decoder of the json module. Decoding them one by one in Python
+        is several times slower than decoding the whole body.
+
+        The pairs end at the last comma following a count. If that comma is
+        inside a term, the decoder fails because the term is not terminated,
+        and the pairs are found with a regular expression instead, which
+        takes about as long as decoding them.
+
+        @return: A C{list} with the terms and counts, and the position of
+            the first byte not decoded.
+        """
+        end = buffer.rfind(',', position)
+        while end > position and not buffer[end - 1].isdigit():
+            end = buffer.rfind(',', position, end)
+        if end <= position:
+            return [], position
+        try:
+            values = _DECODER.decode('[%s]' % buffer[position:end])
+        except ValueError:
+            end = _FACET_PAIRS.match(buffer, position).end() - 1
+            if end <= position:
+                return [], position
+            values = _DECODER.decode('[%s]' % buffer[position:end])
+        return values, end + 1
+
+    def _finished(self, response):
+        if response.facetCounts is not None:
+            response.facetCounts._fields.update(self.fields)
+        return response
+
+
+class StreamingDocumentConsumer(_StreamingConsumer):
+    """
+    A consumer that parses the documents of a JSON response one by one while
+    the body is received, without keeping them in memory.
+
+    Each document is decoded as soon as it's complete and given to a
+    callback. The rest of the body is parsed once it has been received, and
+    the C{results} of the response have an empty C{docs} list.
+
+    The documents can also be read from another array of the response, like
+    the tuples of a streaming expression in C{result-set.docs}.
+
+    @param deferred: A L{Deferred} that will be fired with the response when
+        all the body is consumed.
+    @param responseClass: A L{SolrResponse} subclass able to parse the body,
+        or C{None} if the rest of the body must not be parsed. In that case,
+        the deferred fires with C{None}.
+    @param callback: A callable taking a document as a C{dict}.
+    @param path: The keys of the objects containing the array of documents.
+    """
+
+    def __init__(self, deferred, responseClass, callback,
+                 path=('response', 'docs')):
+        _StreamingConsumer.__init__(self, deferred, responseClass)
+        self.callback = callback
+        self.path = list(path)
+        self._afterDocument = False
+
+    def _streamedArray(self, stack):
+        if (len(stack) == len(self.path) and None not in stack and
+                [entry[0] for entry in stack] == self.path):
+            return self.path[-1]
+
+    def _scanArray(self, buffer, position):
+        while True:
+            if self._afterDocument:
+                match = _SEPARATOR.match(buffer, position)
+                if match is None:
+                    return position
+                self._afterDocument = False
+                position = match.end()
+                if match.group(1) == ']':
+                    self._endArray()
+                    return position
+
+            start = _WHITESPACE.match(buffer, position).end()
+            if start == len(buffer):
+                return position
+            try:
+                document, end = _DECODER.raw_decode(buffer, start)
+            except ValueError:
+                # The document is not complete yet.
+                return position
+            self._afterDocument = True
+            position = end
+            self.callback(document)
+
+
 class QueryResults(object):
     """
     This is a simple class used to store the results of a query in a Solr
@@ -106,6 +425,449 @@ class QueryResults(object):
         self.docs = docs
 
 
+class LookupResults(QueryResults):
+    """
+    The results of looking up documents by their unique keys.
+
+    @ivar docs: A C{list} with the documents found, in the same order as the
+        requested keys.
+    @ivar missing: A C{list} with the requested keys that were not found.
+    """
+
+    def __init__(self, docs, missing):
+        QueryResults.__init__(self, len(docs), 0, docs)
+        self.missing = missing
+
+
+class MergedResults(QueryResults):
+    """
+    The results of the same query sent to many Solr cores, merged by the
+    client.
+
+    @ivar numFound: The sum of the number of documents found by each core
+        that answered.
+    @ivar docs: A C{list} with the top documents of all the cores.
+    @ivar hits: A C{list} of C{(name, doc)} tuples with the same documents
+        as C{docs} and the name of the core that returned each one.
+    @ivar maxScore: The maximum score of all the cores, or C{None} if the
+        scores were not returned.
+    @ivar facetCounts: A L{FacetCounts} object with the counts of the facet
+        fields and facet queries of all the cores added up.
+    @ivar responses: A C{dict} mapping the names of the cores that answered
+        to their L{SolrResponse}.
+    @ivar failures: A C{dict} mapping the names of the cores that failed or
+        timed out to a L{Failure}.
+    """
+
+    def __init__(self, numFound, start, hits, maxScore, facetCounts,
+                 responses, failures):
+        QueryResults.__init__(self, numFound, start,
+                              [doc for _, doc in hits])
+        self.hits = hits
+        self.maxScore = maxScore
+        self.facetCounts = facetCounts
+        self.responses = responses
+        self.failures = failures
+
+    @property
+    def partial(self):
+        """C{True} if some of the cores did not answer."""
+        return bool(self.failures)
+
+
+class FacetField(object):
+    """The facet counts of a field.
+
+    The terms and their counts are stored in parallel sequences, in the
+    order returned by Solr, which is much more compact and faster to build
+    than a C{dict} for large facet lists. A C{dict} view is built on demand.
+
+    @ivar name: The name of the field.
+    @ivar terms: A C{list} with the terms.
+    @ivar counts: An C{array} with the count of each term.
+    """
+
+    __slots__ = ('name', 'terms', 'counts', '_dict')
+
+    def __init__(self, name, terms, counts):
+        self.name = name
+        self.terms = terms
+        self.counts = counts
+        self._dict = None
+
+    @classmethod
+    def fromList(cls, name, values):
+        """Creates a L{FacetField} from the facet counts of a JSON response.
+
+        @param values: The counts as returned by Solr. Usually a flat C{list}
+            with alternating terms and counts. The C{json.nl=map} and
+            C{json.nl=arrarr} formats are also supported.
+        """
+        if isinstance(values, dict):
+            return cls(name, values.keys(), array('l', values.values()))
+        if values and isinstance(values[0], list):
+            return cls(name, [term for term, _ in values],
+                       array('l', [count for _, count in values]))
+        return cls(name, values[::2], array('l', values[1::2]))
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __iter__(self):
+        """Iterates over the C{(term, count)} tuples in order."""
+        return izip(self.terms, self.counts)
+
+    def __contains__(self, term):
+        return term in self.asDict()
+
+    def __getitem__(self, term):
+        return self.asDict()[term]
+
+    def get(self, term, default=None):
+        """Returns the count of a term, or C{default} if it's missing."""
+        return self.asDict().get(term, default)
+
+    def asDict(self):
+        """Returns a C{dict} mapping the terms to their counts."""
+        if self._dict is None:
+            self._dict = dict(izip(self.terms, self.counts))
+        return self._dict
+
+    def top(self, count):
+        """Returns the first C{count} C{(term, count)} tuples."""
+        return list(islice(self, count))
+
+    def __repr__(self):
+        return '<%s %s: %d terms>' % (self.__class__.__name__, self.name,
+                                      len(self))
+
+
+class FacetRange(FacetField):
+    """The range facet counts of a field.
+
+    The C{terms} are the lower bounds of the ranges.
+
+    @ivar gap: The size of the ranges.
+    @ivar start: The lower bound of the first range.
+    @ivar end: The upper bound of the last range.
+    @ivar before: The count of the values before C{start}, if requested.
+    @ivar after: The count of the values after C{end}, if requested.
+    @ivar between: The count of the values between C{start} and C{end}, if
+        requested.
+    """
+
+    __slots__ = ('gap', 'start', 'end', 'before', 'after', 'between')
+
+    @classmethod
+    def fromDict(cls, name, values):
+        """Creates a L{FacetRange} from a range of a JSON response."""
+        facet = cls.fromList(name, values.get('counts', []))
+        for key in cls.__slots__:
+            setattr(facet, key, values.get(key))
+        return facet
+
+
+class FacetPivot(object):
+    """A node of a pivot facet.
+
+    @ivar field: The name of the field.
+    @ivar value: The value of the field.
+    @ivar count: The number of documents with the value.
+    """
+
+    __slots__ = ('field', 'value', 'count', '_pivot', '_children')
+
+    def __init__(self, field, value, count, pivot=None):
+        self.field = field
+        self.value = value
+        self.count = count
+        self._pivot = pivot
+        self._children = None
+
+    @classmethod
+    def fromList(cls, values):
+        """Creates a C{list} of L{FacetPivot}s from a JSON response."""
+        return [cls(value['field'], value['value'], value['count'],
+                    value.get('pivot'))
+                for value in values]
+
+    @property
+    def children(self):
+        """A C{list} with the L{FacetPivot}s of the next field."""
+        if self._children is None:
+            self._children = FacetPivot.fromList(self._pivot or [])
+            self._pivot = None
+        return self._children
+
+    def __repr__(self):
+        return '<FacetPivot %s=%r: %d>' % (self.field, self.value,
+                                           self.count)
+
+
+class FacetCounts(object):
+    """The facet counts of a response.
+
+    The facets are converted from the raw JSON response only when they are
+    accessed, and each field is converted separately.
+
+    @param facetCounts: The C{facet_counts} C{dict} of a JSON response.
+    """
+
+    def __init__(self, facetCounts):
+        self.raw = facetCounts
+        self._fields = {}
+        self._ranges = {}
+        self._pivots = {}
+
+    @property
+    def queries(self):
+        """A C{dict} mapping the facet queries to their counts."""
+        return self.raw.get('facet_queries', {})
+
+    def field(self, name):
+        """Returns the L{FacetField} of a field, or C{None}."""
+        facet = self._fields.get(name)
+        if facet is None:
+            values = self.raw.get('facet_fields', {}).get(name)
+            if values is None:
+                return None
+            facet = self._fields[name] = FacetField.fromList(name, values)
+        return facet
+
+    @property
+    def fields(self):
+        """A C{dict} mapping field names to their L{FacetField}."""
+        names = set(self.raw.get('facet_fields', {})) | set(self._fields)
+        return dict((name, self.field(name)) for name in names)
+
+    def range(self, name):
+        """Returns the L{FacetRange} of a field, or C{None}."""
+        facet = self._ranges.get(name)
+        if facet is None:
+            values = self.raw.get('facet_ranges', {}).get(name)
+            if values is None:
+                return None
+            facet = self._ranges[name] = FacetRange.fromDict(name, values)
+        return facet
+
+    @property
+    def ranges(self):
+        """A C{dict} mapping field names to their L{FacetRange}."""
+        return dict((name, self.range(name))
+                    for name in self.raw.get('facet_ranges', {}))
+
+    def pivot(self, name):
+        """
+        Returns the top level L{FacetPivot}s of a pivot, like C{cat,inStock},
+        or C{None}.
+        """
+        facet = self._pivots.get(name)
+        if facet is None:
+            values = self.raw.get('facet_pivot', {}).get(name)
+            if values is None:
+                return None
+            facet = self._pivots[name] = FacetPivot.fromList(values)
+        return facet
+
+    @property
+    def pivots(self):
+        """A C{dict} mapping pivot names to their top level L{FacetPivot}s."""
+        return dict((name, self.pivot(name))
+                    for name in self.raw.get('facet_pivot', {}))
+
+
+class Group(object):
+    """A group of documents of a grouped or expanded response.
+
+    The group keeps the raw document list of the response, so creating it
+    doesn't copy the documents.
+
+    @ivar value: The value shared by the documents of the group, C{None}
+        for the documents without a value.
+    """
+
+    __slots__ = ('value', '_doclist')
+
+    def __init__(self, value, doclist):
+        self.value = value
+        self._doclist = doclist
+
+    @property
+    def numFound(self):
+        """The number of documents in the group."""
+        return self._doclist['numFound']
+
+    @property
+    def start(self):
+        """The position of the first document returned."""
+        return self._doclist.get('start', 0)
+
+    @property
+    def docs(self):
+        """The C{list} of the documents returned for the group."""
+        return self._doclist['docs']
+
+    @property
+    def results(self):
+        """The documents of the group as L{QueryResults}."""
+        return QueryResults(self.numFound, self.start, self.docs)
+
+    def __repr__(self):
+        return '<Group %r numFound=%d>' % (self.value, self.numFound)
+
+
+class GroupCommand(object):
+    """The results of a field, function or query grouping command.
+
+    Iterating over a command yields its L{Group}s, which are created as they
+    are needed. Query commands and commands with C{group.format=simple}
+    have no groups: their documents are in C{results}.
+
+    @ivar name: The field, function or query of the command.
+    @ivar matches: The number of documents matching the query.
+    @ivar ngroups: The number of groups, if C{group.ngroups} was requested,
+        or C{None}.
+    """
+
+    def __init__(self, name, raw):
+        self.name = name
+        self.matches = raw.get('matches')
+        self.ngroups = raw.get('ngroups')
+        self._groups = raw.get('groups', [])
+        self._doclist = raw.get('doclist')
+        self._byValue = None
+
+    def __len__(self):
+        return len(self._groups)
+
+    def __iter__(self):
+        for group in self._groups:
+            yield Group(group.get('groupValue'), group['doclist'])
+
+    def __getitem__(self, index):
+        group = self._groups[index]
+        return Group(group.get('groupValue'), group['doclist'])
+
+    def group(self, value):
+        """Returns the L{Group} with the given value, or C{None}."""
+        if self._byValue is None:
+            self._byValue = dict((group.get('groupValue'), group['doclist'])
+                                 for group in self._groups)
+        doclist = self._byValue.get(value)
+        if doclist is None:
+            return None
+        return Group(value, doclist)
+
+    @property
+    def results(self):
+        """
+        The documents of a query command or a simple command as
+        L{QueryResults}, or C{None}.
+        """
+        if self._doclist is None:
+            return None
+        return QueryResults(self._doclist['numFound'],
+                            self._doclist.get('start', 0),
+                            self._doclist['docs'])
+
+    def docs(self):
+        """Iterates over the documents of all the groups, in order."""
+        if self._doclist is not None:
+            return iter(self._doclist['docs'])
+        return (doc for group in self._groups
+                for doc in group['doclist']['docs'])
+
+    def __repr__(self):
+        return '<GroupCommand %r matches=%r>' % (self.name, self.matches)
+
+
+class Grouping(object):
+    """The C{grouped} section of a response, with a L{GroupCommand} for
+    each C{group.field}, C{group.func} and C{group.query} parameter.
+    """
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._commands = {}
+
+    def __iter__(self):
+        """Iterates over the commands."""
+        for name in self._raw:
+            yield self[name]
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __contains__(self, name):
+        return name in self._raw
+
+    def __getitem__(self, name):
+        command = self._commands.get(name)
+        if command is None:
+            command = self._commands[name] = GroupCommand(name,
+                                                          self._raw[name])
+        return command
+
+    def get(self, name):
+        """Returns the L{GroupCommand} with the given name, or C{None}."""
+        if name not in self._raw:
+            return None
+        return self[name]
+
+    @property
+    def names(self):
+        """The names of the commands."""
+        return list(self._raw)
+
+
+class Hit(object):
+    """A document of a response joined with its per-document sections.
+
+    @ivar doc: The document, as a C{dict}.
+    @ivar key: The unique key of the document.
+    @ivar highlighting: A C{dict} mapping field names to the highlighted
+        snippets of the document, or C{None}.
+    @ivar explain: The score explanation of the document, from the debug
+        section or the C{[explain]} document transformer, or C{None}.
+    @ivar moreLikeThis: A C{dict} with the similar documents found by the
+        C{MoreLikeThis} component, or C{None}.
+    """
+
+    __slots__ = ('doc', 'key', 'highlighting', 'explain', 'moreLikeThis')
+
+    def __init__(self, doc, key, highlighting=None, explain=None,
+                 moreLikeThis=None):
+        self.doc = doc
+        self.key = key
+        self.highlighting = highlighting
+        self.explain = explain
+        self.moreLikeThis = moreLikeThis
+
+    @property
+    def score(self):
+        """The score of the document, if it was requested."""
+        return self.doc.get('score')
+
+    def children(self, label=None):
+        """
+        Returns the child documents of the document, as returned by the
+        C{[child]} document transformer.
+
+        @param label: Optionally, the name of the field with the labeled
+            children. By default, the anonymous children are returned.
+        @return: A C{list} of C{dict}s, empty if there are no children.
+        """
+        children = self.doc.get(label or '_childDocuments_')
+        if children is None:
+            return []
+        if isinstance(children, dict):
+            return [children]
+        return children
+
+    def __repr__(self):
+        return '<Hit %r>' % (self.key,)
+
+
 class SolrResponse(object):
     """Used to represent a response given by a request to a Solr server.
 
@@ -122,12 +884,27 @@ class SolrResponse(object):
     @ivar header: The header of the response. This is usually represented as
         'responseHeader' in the response.
     @ivar results: If this is a response of a query request, it will return the
-        results represented by a L{QueryResults}
+        results represented by a L{QueryResults}. Responses of the real-time
+        get handler are also represented by a L{QueryResults}, even when a
+        single document is returned.
+    @ivar facetCounts: A L{FacetCounts} object with the facets of the
+        response, or C{None} if the response doesn't have facets. The raw
+        facets are still available as C{facet_counts}.
+    @ivar grouping: A L{Grouping} object with the results of a grouped
+        query, or C{None} if the response is not grouped. The raw groups
+        are still available as C{grouped}.
+    @ivar hits: A C{list} of L{Hit}s joining the documents of the results
+        with their highlighting snippets, score explanations and similar
+        documents. It's built once, when it's first accessed.
+    @ivar uniqueKey: The name of the unique key field, used to join the
+        per-document sections. Default is C{id}. It must be set before
+        accessing C{hits}.
 
     @param response: The raw response to be decoded.
     """
 
     decoder = None
+    uniqueKey = 'id'
 
     def __init__(self, response):
         assert self.decoder is not None
@@ -135,6 +912,10 @@ class SolrResponse(object):
         self.responseDict = None
         self.header = None
         self.results = None
+        self._facetCounts = None
+        self._grouping = None
+        self._hits = None
+        self._hitsByKey = None
 
         self.rawResponse = response
         self.responseDict = self._decodeResponse(response)
@@ -157,17 +938,99 @@ class SolrResponse(object):
         if 'response' in response:
             try:
                 self.results = QueryResults(response['response']['numFound'],
-                                       response['response']['start'],
+                                       response['response'].get('start', 0),
                                        response['response']['docs'])
             except KeyError:
                 raise SolrResponseError('Wrong results')
 
+        elif 'doc' in response:
+            # The real-time get handler returns a single document for a
+            # single ID, or null if the document doesn't exist.
+            doc = response['doc']
+            docs = [doc] if doc is not None else []
+            self.results = QueryResults(len(docs), 0, docs)
+
         for key, value in response.iteritems():
             if key in ('response', 'responseHeader'):
                 continue
+            if isinstance(getattr(type(self), key, None), property):
+                # Don't hide the accessors of the response.
+                continue
 
             setattr(self, key, value)
 
+    @property
+    def facetCounts(self):
+        if self._facetCounts is None and 'facet_counts' in self.responseDict:
+            self._facetCounts = FacetCounts(self.responseDict['facet_counts'])
+        return self._facetCounts
+
+    @property
+    def grouping(self):
+        if self._grouping is None and 'grouped' in self.responseDict:
+            self._grouping = Grouping(self.responseDict['grouped'])
+        return self._grouping
+
+    def expandedGroups(self, field):
+        """
+        Joins the documents of a collapsed query with the groups returned by
+        the expand component.
+
+        @param field: The field the results were collapsed on.
+        @return: An iterator of C{(doc, group)} tuples, with each head
+            document of the results and the L{Group} with the other
+            documents of its group, or C{None} if it has none.
+        """
+        expanded = self.responseDict.get('expanded') or {}
+        docs = self.results.docs if self.results is not None else []
+        for doc in docs:
+            value = doc.get(field)
+            # The groups are keyed by the value as a string.
+            key = (value if value is None or isinstance(value, basestring)
+                   else unicode(value))
+            doclist = expanded.get(key)
+            yield doc, (Group(value, doclist) if doclist is not None
+                        else None)
+
+    @property
+    def hits(self):
+        if self._hits is None:
+            self._joinHits()
+        return self._hits
+
+    def hit(self, key):
+        """Returns the L{Hit} of the document with the given unique key.
+
+        @raise KeyError: If the document is not in the results.
+        """
+        if self._hitsByKey is None:
+            self._joinHits()
+        return self._hitsByKey[key]
+
+    def _joinHits(self):
+        response = self.responseDict
+        highlighting = response.get('highlighting') or {}
+        explain = (response.get('debug') or {}).get('explain') or {}
+        moreLikeThis = response.get('moreLikeThis') or {}
+        docs = self.results.docs if self.results is not None else []
+
+        hits = []
+        hitsByKey = {}
+        uniqueKey = self.uniqueKey
+        for doc in docs:
+            key = doc.get(uniqueKey)
+            # The sections are keyed by the unique key as a string.
+            sectionKey = (key if key is None or isinstance(key, basestring)
+                          else unicode(key))
+            hit = Hit(doc, key, highlighting.get(sectionKey),
+                      explain.get(sectionKey, doc.get('[explain]')),
+                      moreLikeThis.get(sectionKey))
+            hits.append(hit)
+            hitsByKey[key] = hit
+
+        self._hits = hits
+        self._hitsByKey = hitsByKey
+
     def _decodeResponse(self, response):
         try:
             return self.decoder.decode(response)
@@ -187,3 +1050,182 @@ class JSONSolrResponse(SolrResponse):
     """
 
     decoder = json.JSONDecoder()
+
+
+try:
+    StopAsyncIteration = StopAsyncIteration
+except NameError:
+    class StopAsyncIteration(Exception):
+        """Signals the end of an asynchronous iterator."""
+
+
+class DocumentStream(object):
+    """An asynchronous stream of the documents of a query.
+
+    The documents are given to the consumer of the stream as they are parsed
+    from the response body by a L{StreamingDocumentConsumer}, so a large
+    result set can be processed without keeping it in memory. At most
+    C{bufferSize} documents are buffered: when the consumer of the stream is
+    slower than the server, the transport is paused until half of them have
+    been taken.
+
+    With L{inlineCallbacks}::
+
+        while True:
+            document = yield stream.next()
+            if document is None:
+                break
+
+    The stream is also an asynchronous iterator, for C{async for} loops on
+    Python 3.
+
+    A stream that is not read until its end must be closed with L{close},
+    otherwise its transport stays paused and the connection is never
+    released.
+
+    @param bufferSize: The maximum number of documents received and not
+        taken yet before the transport is paused.
+    @ivar response: The L{SolrResponse} of the query, with an empty list of
+        documents, once all of them have been received. C{None} before.
+    """
+
+    def __init__(self, bufferSize=100):
+        self.bufferSize = bufferSize
+        self.response = None
+        self._documents = deque()
+        self._waiting = deque()
+        self._consumer = None
+        self._paused = False
+        self._done = False
+        self._closed = False
+        self._failure = None
+
+    def consumer(self, deferred, responseClass=JSONSolrResponse,
+                 path=('response', 'docs')):
+        """
+        Returns a L{StreamingDocumentConsumer} feeding this stream. It can be
+        used as the C{consumerFactory} of a request.
+
+        @param responseClass: The L{SolrResponse} subclass used to parse the
+            rest of the body, or C{None}.
+        @param path: The keys of the objects containing the array of
+            documents.
+        """
+        self._consumer = StreamingDocumentConsumer(deferred, responseClass,
+                                                   self._parsed, path)
+        return self._consumer
+
+    def close(self):
+        """Stops receiving the documents and ends the stream.
+
+        The documents not taken yet are dropped, the pending readers get
+        C{None} and the transport is stopped, closing the connection. If
+        the response was not received yet, its transport is stopped as soon
+        as a document is received.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._documents.clear()
+        self._stopProducing()
+        if not self._done:
+            self._end()
+
+    def _stopProducing(self):
+        transport = self._consumer and self._consumer.transport
+        if transport is not None:
+            self._paused = False
+            transport.stopProducing()
+
+    def finished(self, response):
+        """Ends the stream with the response of the query."""
+        self.response = response
+        self._end()
+
+    def failed(self, failure):
+        """Ends the stream with an error, given to the pending readers."""
+        if self._done:
+            # The stream already ended, and the error is not relevant.
+            return
+        self._failure = failure
+        self._done = True
+        while self._waiting:
+            self._waiting.popleft().errback(failure)
+
+    def _end(self):
+        self._done = True
+        while self._waiting:
+            self._waiting.popleft().callback(None)
+
+    def next(self):
+        """Takes the next document of the stream.
+
+        @return: A L{Deferred} that fires with a document, or with C{None} at
+            the end of the stream. It fails if the query failed.
+        """
+        if self._documents:
+            document = self._documents.popleft()
+            if self._paused and len(self._documents) <= self.bufferSize // 2:
+                self._paused = False
+                self._consumer.transport.resumeProducing()
+            return succeed(document)
+        if self._failure is not None:
+            return fail(self._failure)
+        if self._done:
+            return succeed(None)
+        d = Deferred()
+        self._waiting.append(d)
+        return d
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        def stop(document):
+            if document is None:
+                raise StopAsyncIteration()
+            return document
+
+        return self.next().addCallback(stop)
+
+    def _parsed(self, document):
+        if self._closed:
+            self._stopProducing()
+        else:
+            self._received(document)
+
+    def _received(self, document):
+        if self._waiting:
+            self._waiting.popleft().callback(document)
+            return
+        self._documents.append(document)
+        if not self._paused and len(self._documents) >= self.bufferSize:
+            transport = self._consumer.transport
+            if transport is not None:
+                self._paused = True
+                transport.pauseProducing()
+
+
+class TupleStream(DocumentStream):
+    """An asynchronous stream of the tuples of a streaming expression or an
+    export.
+
+    Streaming expressions end their tuples with an C{EOF} tuple, which ends
+    the stream and is kept in C{eof}. An C{EOF} tuple with an C{EXCEPTION}
+    makes the stream fail with a L{SolrResponseError} once the tuples before
+    it have been taken.
+
+    @ivar eof: The C{EOF} tuple, once received, with metadata like the
+        C{RESPONSE_TIME}.
+    """
+
+    eof = None
+
+    def _received(self, document):
+        if 'EXCEPTION' in document:
+            self.failed(Failure(SolrResponseError(document['EXCEPTION'])))
+        elif document.get('EOF'):
+            self.eof = document
+            self._end()
+        elif not self._done:
+            DocumentStream._received(self, document)
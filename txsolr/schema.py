@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Schema-aware encoding and decoding.
+
+L{SimpleXMLInputFactory} guesses how to encode each value from its Python
+type, and the values of the responses are the ones of the JSON body, with
+dates as strings. This module uses the schema of the core, fetched with the
+Schema API, to pick an encoder and a decoder for each field once, so
+documents are converted with a table lookup: dates are sent with their
+milliseconds and converted to UTC, and date fields are returned as
+C{datetime} objects.
+
+A client keeps using the current schema of its core with a L{SchemaCache}::
+
+    client = SolrClient('http://localhost:8983/solr/core')
+    client.schemaCache = SchemaCache(client)
+    client.inputFactory = SchemaInputFactory(client.schemaCache)
+"""
+import logging
+from datetime import date, datetime
+from fnmatch import fnmatchcase
+
+from twisted.internet.defer import Deferred, succeed
+
+from txsolr.errors import InputError
+from txsolr.input import SimpleXMLInputFactory
+
+
+__all__ = ['Schema', 'SchemaCache', 'SchemaInputFactory', 'encodeDate',
+           'decodeDate']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+# The values of a DateRangeField that are not full dates, like ranges or
+# truncated dates, are left unchanged by decodeDate.
+_DATE_TYPES = frozenset(['DateField', 'TrieDateField', 'DatePointField',
+                         'DateRangeField'])
+_BOOL_TYPES = frozenset(['BoolField'])
+_FLOAT_TYPES = frozenset(['FloatField', 'DoubleField', 'TrieFloatField',
+                          'TrieDoubleField', 'FloatPointField',
+                          'DoublePointField'])
+
+
+def encodeDate(value):
+    """Encodes a date in the format of Solr.
+
+    Aware C{datetime}s are converted to UTC, naive ones are assumed to be in
+    UTC already. Milliseconds are kept.
+
+    @param value: A C{datetime}, a C{date} or a C{unicode} date already
+        formatted.
+    @return: The date as C{unicode}, like C{2011-03-04T05:06:07.890Z}.
+    """
+    if isinstance(value, datetime):
+        offset = value.utcoffset()
+        if offset:
+            value = value - offset
+        encoded = u'%04d-%02d-%02dT%02d:%02d:%02d' % (
+            value.year, value.month, value.day, value.hour, value.minute,
+            value.second)
+        if value.microsecond:
+            encoded += u'.%03d' % (value.microsecond // 1000)
+        return encoded + u'Z'
+    elif isinstance(value, date):
+        return u'%04d-%02d-%02dT00:00:00Z' % (value.year, value.month,
+                                              value.day)
+    return unicode(value)
+
+
+def decodeDate(value):
+    """Decodes a date returned by Solr.
+
+    @param value: A date like C{2011-03-04T05:06:07Z} or
+        C{2011-03-04T05:06:07.89Z}.
+    @return: A naive C{datetime} in UTC, or the value unchanged if it's not
+        a date in that format.
+    """
+    try:
+        microsecond = 0
+        if len(value) > 21 and value[19] == '.':
+            microsecond = int((value[20:-1] + '00000')[:6])
+        return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                        int(value[11:13]), int(value[14:16]),
+                        int(value[17:19]), microsecond)
+    except (ValueError, TypeError):
+        return value
+
+
+def _encodeBool(value):
+    if isinstance(value, basestring):
+        return unicode(value)
+    return u'true' if value else u'false'
+
+
+def _encodeFloat(value):
+    if isinstance(value, float):
+        # repr keeps all the significant digits, unlike unicode.
+        return unicode(repr(value))
+    return unicode(value)
+
+
+def _encodeText(value):
+    if value.__class__ is unicode:
+        return value
+    if isinstance(value, bool):
+        return _encodeBool(value)
+    if isinstance(value, date):
+        return encodeDate(value)
+    try:
+        return unicode(value)
+    except UnicodeError:
+        raise InputError('Unable to decode value %r' % value)
+
+
+class Schema(object):
+    """The fields of a Solr core and their encoders and decoders.
+
+    The encoder and the decoder of each field are chosen from the class of
+    its field type when the schema is loaded. Fields matching a dynamic
+    field get the ones of the dynamic field the first time they're used.
+
+    @param fields: A C{list} with the definitions of the fields, as
+        returned by the Schema API.
+    @param dynamicFields: A C{list} with the definitions of the dynamic
+        fields.
+    @param fieldTypes: A C{list} with the definitions of the field types.
+    @param uniqueKey: The name of the unique key field, or C{None}.
+    """
+
+    def __init__(self, fields, dynamicFields=(), fieldTypes=(),
+                 uniqueKey=None):
+        self.uniqueKey = uniqueKey
+        self.fieldTypes = dict((fieldType['name'], fieldType)
+                               for fieldType in fieldTypes)
+        self.fields = dict((field['name'], field) for field in fields)
+        self._encoders = {}
+        self._decoders = {}
+        for field in fields:
+            self._addField(field['name'], field)
+        # Longer patterns are more specific, and Solr tries them first.
+        self._dynamicFields = sorted(
+            dynamicFields, key=lambda field: -len(field['name']))
+
+    @classmethod
+    def fromDict(cls, schema):
+        """
+        Creates a L{Schema} from the C{schema} object of the response of the
+        Schema API.
+        """
+        return cls(schema.get('fields', []), schema.get('dynamicFields', []),
+                   schema.get('fieldTypes', []), schema.get('uniqueKey'))
+
+    def _addField(self, name, field):
+        fieldType = self.fieldTypes.get(field.get('type'), {})
+        className = fieldType.get('class', '').rsplit('.', 1)[-1]
+        if className in _DATE_TYPES:
+            self._encoders[name] = encodeDate
+            self._decoders[name] = decodeDate
+        elif className in _BOOL_TYPES:
+            self._encoders[name] = _encodeBool
+        elif className in _FLOAT_TYPES:
+            self._encoders[name] = _encodeFloat
+        else:
+            # Text, strings and integers.
+            self._encoders[name] = _encodeText
+
+    def _match(self, name):
+        """
+        Adds the codecs of the dynamic field matching a field name, or
+        remembers that there is none.
+        """
+        for field in self._dynamicFields:
+            if fnmatchcase(name, field['name']):
+                self._addField(name, field)
+                return
+        self._encoders[name] = None
+
+    def encoder(self, name):
+        """
+        Returns the function encoding the values of a field, or C{None} if
+        it's not in the schema.
+        """
+        if name not in self._encoders:
+            self._match(name)
+        return self._encoders[name]
+
+    def decoder(self, name):
+        """
+        Returns the function decoding the values of a field, or C{None} if
+        they don't need to be decoded.
+        """
+        if name not in self._encoders:
+            self._match(name)
+        return self._decoders.get(name)
+
+    def decodeDocument(self, document):
+        """Decodes the values of a document in place.
+
+        @param document: A C{dict} mapping field names to values.
+        @return: The same document.
+        """
+        for name, value in document.iteritems():
+            decoder = self.decoder(name)
+            if decoder is None:
+                continue
+            if isinstance(value, list):
+                document[name] = [decoder(item) for item in value]
+            else:
+                document[name] = decoder(value)
+        return document
+
+    def decodeResponse(self, response):
+        """Decodes the documents of a L{SolrResponse} in place.
+
+        @return: The same response.
+        """
+        if response.results is not None:
+            for document in response.results.docs:
+                self.decodeDocument(document)
+        return response
+
+
+class SchemaInputFactory(SimpleXMLInputFactory):
+    """
+    An input factory encoding the values of the fields with the encoders of
+    a L{Schema}. Fields that are not in the schema are encoded like
+    L{SimpleXMLInputFactory} does.
+
+    @param schema: The L{Schema} of the core, or a L{SchemaCache} whose
+        current schema is used each time a document is encoded. Until the
+        cache has fetched the schema, the values are encoded like
+        L{SimpleXMLInputFactory} does.
+    """
+
+    def __init__(self, schema):
+        SimpleXMLInputFactory.__init__(self)
+        self.schema = schema
+
+    def _encodeField(self, name, value):
+        schema = self.schema
+        if isinstance(schema, SchemaCache):
+            schema = schema.schema
+        encoder = schema.encoder(name) if schema is not None else None
+        if encoder is None:
+            return self._encodeValue(value)
+        return encoder(value)
+
+
+class SchemaCache(object):
+    """Fetches the L{Schema} of a core and keeps it for a while.
+
+    Concurrent requests for the schema while it's being fetched share the
+    same request to Solr.
+
+    Set as the C{schemaCache} of a L{SolrClient}, it's used to decode the
+    documents of its responses, and the documents added wait for the schema
+    to be fetched, so a L{SchemaInputFactory} using the cache encodes them
+    with the current schema.
+
+    @param client: The L{SolrClient} of the core.
+    @param refreshInterval: The number of seconds after which the schema is
+        fetched again.
+    @param clock: The L{IReactorTime} provider used to know the age of the
+        schema. Default is the global reactor.
+    """
+
+    def __init__(self, client, refreshInterval=3600, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.client = client
+        self.refreshInterval = refreshInterval
+        self.clock = clock
+        self.schema = None
+        self._fetched = None
+        self._waiting = None
+
+    def get(self):
+        """Returns the schema, fetching it if it's missing or too old.
+
+        @return: A L{Deferred} that fires with a L{Schema}.
+        """
+        if (self.schema is not None and
+                self.clock.seconds() - self._fetched < self.refreshInterval):
+            return succeed(self.schema)
+
+        d = Deferred()
+        if self._waiting is not None:
+            self._waiting.append(d)
+            return d
+
+        self._waiting = [d]
+        self.client.getSchema().addCallbacks(self._received, self._failed)
+        return d
+
+    def invalidate(self):
+        """Forces the schema to be fetched again the next time it's used."""
+        self.schema = None
+
+    def _received(self, response):
+        self.schema = Schema.fromDict(response.responseDict['schema'])
+        self._fetched = self.clock.seconds()
+        waiting, self._waiting = self._waiting, None
+        for d in waiting:
+            d.callback(self.schema)
+
+    def _failed(self, failure):
+        _logger.error("Can't fetch the schema: %s" % failure.getErrorMessage())
+        waiting, self._waiting = self._waiting, None
+        for d in waiting:
+            d.errback(failure)
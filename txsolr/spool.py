@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Durable spooling of updates.
+
+This module contains an on-disk spool where update requests are stored
+before being sent to Solr, so they are not lost when Solr is unreachable,
+and an updater that replays the spooled requests once Solr is available.
+
+The spool is a directory of append-only segment files. Each record is the
+body of an C{/update} request preceded by its length and its CRC-32 checksum.
+A checkpoint file stores the position of the first record not acknowledged
+by Solr yet.
+"""
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+from twisted.internet.defer import succeed, fail
+
+from txsolr.errors import HTTPWrongStatus, SpoolFullError
+from txsolr.input import StringProducer
+
+
+__all__ = ['UpdateSpool', 'SpooledUpdater']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+# The length and the CRC-32 checksum of the body of a record.
+_HEADER = struct.Struct('>II')
+
+_SEGMENT_SUFFIX = '.spool'
+_CHECKPOINT = 'checkpoint'
+
+
+def _checksum(body):
+    return zlib.crc32(body) & 0xffffffff
+
+
+class UpdateSpool(object):
+    """A durable first-in first-out queue of update request bodies.
+
+    Records are appended to the last segment file and read back with
+    memory-mapped segments. A record that was only partially written, for
+    example because the process crashed, is discarded when the spool is
+    opened.
+
+    @param directory: The path of the directory where the segments are
+        stored. It's created if it doesn't exist.
+    @param maxBytes: The maximum number of bytes used by the segments.
+    @param segmentSize: The size in bytes after which a new segment is
+        started.
+    @param sync: If C{True}, each record and checkpoint is flushed to disk
+        with C{fsync} before returning. This survives operating system
+        crashes, at the cost of a higher latency.
+    """
+
+    def __init__(self, directory, maxBytes=1024 ** 3,
+                 segmentSize=64 * 1024 ** 2, sync=False):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.segmentSize = segmentSize
+        self.sync = sync
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._segments = sorted(
+            int(name[:-len(_SEGMENT_SUFFIX)])
+            for name in os.listdir(directory)
+            if name.endswith(_SEGMENT_SUFFIX))
+        if not self._segments:
+            self._segments.append(0)
+
+        self._position = self._readCheckpoint()
+        self._recover(self._segments[-1])
+        self.size = sum(os.path.getsize(self._path(number))
+                        for number in self._segments
+                        if os.path.exists(self._path(number)))
+        self._openWriter(self._segments[-1])
+
+    def _path(self, number):
+        return os.path.join(self.directory,
+                            '%020d%s' % (number, _SEGMENT_SUFFIX))
+
+    def _readCheckpoint(self):
+        path = os.path.join(self.directory, _CHECKPOINT)
+        if os.path.exists(path):
+            with open(path) as checkpoint:
+                number, offset = checkpoint.read().split()
+            position = (int(number), int(offset))
+            if position[0] >= self._segments[0]:
+                return position
+        return (self._segments[0], 0)
+
+    def _writeCheckpoint(self):
+        path = os.path.join(self.directory, _CHECKPOINT)
+        with open(path + '.tmp', 'w') as checkpoint:
+            checkpoint.write('%d %d\n' % self._position)
+            checkpoint.flush()
+            if self.sync:
+                os.fsync(checkpoint.fileno())
+        os.rename(path + '.tmp', path)
+
+    def _recover(self, number):
+        """Truncates the segment after its last complete record."""
+        path = self._path(number)
+        if not os.path.exists(path):
+            return
+
+        valid = 0
+        for _, end in self._scan(number, 0):
+            valid = end
+        if valid < os.path.getsize(path):
+            _logger.warning('Discarding %d bytes of incomplete records in %s'
+                            % (os.path.getsize(path) - valid, path))
+            with open(path, 'r+b') as segment:
+                segment.truncate(valid)
+
+    def _openWriter(self, number):
+        self._writer = open(self._path(number), 'ab')
+        self._writerNumber = number
+        self._writerSize = self._writer.tell()
+
+    def _scan(self, number, offset):
+        """Yields the valid records of a segment starting at C{offset}.
+
+        @return: An iterator of C{(body, end)} tuples, where C{end} is the
+            offset after the record.
+        """
+        path = self._path(number)
+        if not os.path.exists(path):
+            return
+
+        with open(path, 'rb') as segment:
+            size = os.fstat(segment.fileno()).st_size
+            if size <= offset:
+                return
+
+            mapped = mmap.mmap(segment.fileno(), size,
+                               access=mmap.ACCESS_READ)
+            try:
+                while offset + _HEADER.size <= size:
+                    length, checksum = _HEADER.unpack_from(mapped, offset)
+                    start = offset + _HEADER.size
+                    end = start + length
+                    if end > size:
+                        break
+
+                    body = mapped[start:end]
+                    if _checksum(body) != checksum:
+                        _logger.error('Corrupt record at offset %d of %s'
+                                      % (offset, path))
+                        break
+
+                    yield body, end
+                    offset = end
+            finally:
+                mapped.close()
+
+    def append(self, body):
+        """Appends the body of an update request to the spool.
+
+        @param body: The body of the request as a C{str}.
+        @raise SpoolFullError: If the record does not fit in C{maxBytes}.
+        """
+        record = _HEADER.pack(len(body), _checksum(body)) + body
+        if self.size + len(record) > self.maxBytes:
+            raise SpoolFullError('Spool %s is full' % self.directory)
+
+        segmentFull = self._writerSize + len(record) > self.segmentSize
+        if self._writerSize and segmentFull:
+            self._rotate()
+
+        self._writer.write(record)
+        self._writer.flush()
+        if self.sync:
+            os.fsync(self._writer.fileno())
+        self._writerSize += len(record)
+        self.size += len(record)
+
+    def _rotate(self):
+        self._writer.close()
+        number = self._writerNumber + 1
+        self._segments.append(number)
+        self._openWriter(number)
+
+    def read(self, maxRecords):
+        """Reads the records that were not acknowledged yet.
+
+        @param maxRecords: The maximum number of records to be read.
+        @return: A C{list} of C{(body, position)} tuples in the order the
+            records were appended. C{position} can be given to
+            L{UpdateSpool.acknowledge}.
+        """
+        records = []
+        number, offset = self._position
+        for segment in self._segments:
+            if segment < number:
+                continue
+            for body, end in self._scan(segment, offset):
+                records.append((body, (segment, end)))
+                if len(records) == maxRecords:
+                    return records
+            offset = 0
+        return records
+
+    def acknowledge(self, position):
+        """Removes the records up to the given position from the spool.
+
+        @param position: The position of the last record to be removed, as
+            returned by L{UpdateSpool.read}.
+        """
+        self._position = position
+        number, offset = position
+
+        if number == self._writerNumber and offset == self._writerSize:
+            # Everything was acknowledged, so there is no need to keep the
+            # current segment.
+            self._rotate()
+            self._position = (self._writerNumber, 0)
+
+        while self._segments[0] < self._position[0]:
+            path = self._path(self._segments.pop(0))
+            if os.path.exists(path):
+                self.size -= os.path.getsize(path)
+                os.remove(path)
+
+        self._writeCheckpoint()
+
+    def close(self):
+        """Closes the segment being written."""
+        self._writer.close()
+
+
+class SpooledUpdater(object):
+    """Sends updates to Solr through an L{UpdateSpool}.
+
+    Updates are acknowledged as soon as they are written to the spool, so the
+    callers see the same latency whether Solr is available or not. The
+    spooled updates are replayed in order, in batches, while Solr accepts
+    them. When a batch fails, it's retried with exponential backoff.
+
+    A batch rejected by Solr with a 4xx status is replayed one update at a
+    time, and a single update rejected with a 4xx status is discarded, so one
+    bad document does not block the spool forever.
+
+    The batches are sent as a single XML message with an C{update} root
+    element, so this updater requires an XML input factory.
+
+    @param client: The L{SolrClient} used to send the updates.
+    @param spool: The L{UpdateSpool} where the updates are stored.
+    @param batchSize: The maximum number of updates sent in one request.
+    @param retryDelay: The number of seconds to wait before retrying a failed
+        batch. It's doubled on each consecutive failure.
+    @param maxRetryDelay: The maximum number of seconds between retries.
+    @param clock: The L{IReactorTime} provider used to schedule the retries.
+        Default is the global reactor.
+    @ivar discarded: The number of updates discarded because Solr rejected
+        them.
+    """
+
+    def __init__(self, client, spool, batchSize=100, retryDelay=1.0,
+                 maxRetryDelay=60.0, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.client = client
+        self.spool = spool
+        self.batchSize = batchSize
+        self.retryDelay = retryDelay
+        self.maxRetryDelay = maxRetryDelay
+        self.clock = clock
+        self.discarded = 0
+
+        self._replaying = False
+        self._delayedCall = None
+        self._failures = 0
+        # The number of updates still to be sent one at a time after a batch
+        # was rejected.
+        self._singleUpdates = 0
+
+    def _spool(self, input):
+        try:
+            self.spool.append(input.body)
+        except SpoolFullError:
+            return fail()
+        self.replay()
+        return succeed(None)
+
+    def add(self, documents, overwrite=None, commitWithin=None):
+        """Spools the addition of one or many documents.
+
+        See L{SolrClient.add}.
+
+        @return: A L{Deferred} that fires with C{None} once the update is
+            spooled, or fails with L{SpoolFullError}.
+        """
+        input = self.client.inputFactory.createAdd(documents, overwrite,
+                                                   commitWithin)
+        return self._spool(input)
+
+    def delete(self, ids):
+        """Spools the deletion of one or many documents.
+
+        See L{SolrClient.delete}.
+        """
+        return self._spool(self.client.inputFactory.createDelete(ids))
+
+    def deleteByQuery(self, query):
+        """Spools the deletion of the documents matching a query.
+
+        See L{SolrClient.deleteByQuery}.
+        """
+        return self._spool(self.client.inputFactory.createDeleteByQuery(query))
+
+    def commit(self, **kwargs):
+        """Spools a commit, sent after all the updates spooled before it.
+
+        See L{SolrClient.commit}.
+        """
+        return self._spool(self.client.inputFactory.createCommit(**kwargs))
+
+    def replay(self):
+        """Starts sending the spooled updates, unless it's already doing it.
+
+        This is called automatically when an update is spooled. It should be
+        called once after creating the updater, to replay the updates spooled
+        by a previous process.
+        """
+        if self._replaying or self._delayedCall is not None:
+            return
+
+        batchSize = 1 if self._singleUpdates else self.batchSize
+        records = self.spool.read(batchSize)
+        if not records:
+            return
+
+        self._replaying = True
+        bodies = [body for body, _ in records]
+        position = records[-1][1]
+        if len(bodies) == 1:
+            body = bodies[0]
+        else:
+            body = '<update>' + ''.join(bodies) + '</update>'
+
+        d = self.client._update(StringProducer(body))
+
+        def succeeded(response):
+            self._replaying = False
+            self._failures = 0
+            if self._singleUpdates:
+                self._singleUpdates -= 1
+            self.spool.acknowledge(position)
+            self._replayLater()
+
+        def failed(failure):
+            self._replaying = False
+            rejected = (failure.check(HTTPWrongStatus) and
+                        400 <= failure.value.args[0] < 500)
+            if rejected and len(bodies) > 1:
+                # All the updates of the batch are sent one at a time, so
+                # the updates before the rejected one don't make another
+                # batch fail.
+                self._singleUpdates = len(bodies)
+                self._replayLater()
+            elif rejected:
+                _logger.error('Discarding update rejected by Solr: %r'
+                              % bodies[0])
+                self.discarded += 1
+                if self._singleUpdates:
+                    self._singleUpdates -= 1
+                self.spool.acknowledge(position)
+                self._replayLater()
+            else:
+                self._failures += 1
+                delay = min(self.maxRetryDelay,
+                            self.retryDelay * 2 ** (self._failures - 1))
+                _logger.warning('Unable to replay updates, retrying in %d '
+                                'seconds: %s' % (delay,
+                                                 failure.getErrorMessage()))
+                self._delayedCall = self.clock.callLater(delay, self._retry)
+
+        d.addCallbacks(succeeded, failed)
+
+    def _replayLater(self):
+        # Replaying in the next reactor iteration avoids a recursive call for
+        # each batch when the requests finish synchronously.
+        self._delayedCall = self.clock.callLater(0, self._retry)
+
+    def _retry(self):
+        self._delayedCall = None
+        self.replay()
@@ -0,0 +1,168 @@
+import json
+from urlparse import parse_qs, urlparse
+
+from twisted.internet.defer import TimeoutError, succeed
+from twisted.internet.task import Clock, deferLater
+from twisted.trial.unittest import TestCase
+
+from txsolr.admin import SolrAdmin
+from txsolr.errors import AdminRequestError, HTTPWrongStatus
+from txsolr.testing import FakeResponse
+
+
+def _response(**sections):
+    sections['responseHeader'] = {'status': 0, 'QTime': 1}
+    return FakeResponse(200, json.dumps(sections))
+
+
+class ScriptedTransport(object):
+    """
+    A transport answering the requests with the responses given for each
+    action, in order.
+    """
+
+    def __init__(self, **responses):
+        self.responses = responses
+        self.requests = []
+
+    def request(self, method, url, headers, bodyProducer):
+        parsed = urlparse(url)
+        params = dict((key, values[0]) for key, values
+                      in parse_qs(parsed.query).iteritems())
+        self.requests.append((parsed.path, params))
+        responses = self.responses[params['action']]
+        if len(responses) > 1:
+            return succeed(responses.pop(0))
+        return succeed(responses[0])
+
+
+class SolrAdminTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+
+    def _admin(self, **responses):
+        self.transport = ScriptedTransport(**responses)
+        return SolrAdmin('http://solr', transport=self.transport,
+                         pollInterval=1, maxPollInterval=4, clock=self.clock)
+
+    def testCoreActions(self):
+        """
+        The core operations are sent to C{/admin/cores}, and the sections of
+        the response are attributes of the L{SolrResponse}.
+        """
+        admin = self._admin(
+            STATUS=[_response(status={'core1': {'name': 'core1'}})],
+            SWAP=[_response()])
+        response = self.successResultOf(admin.coreStatus('core1'))
+        self.assertEqual(response.status, {'core1': {'name': 'core1'}})
+        self.successResultOf(admin.swapCores('core1', 'core2'))
+        self.assertEqual(
+            self.transport.requests,
+            [('/admin/cores', {'action': 'STATUS', 'core': 'core1',
+                               'wt': 'json'}),
+             ('/admin/cores', {'action': 'SWAP', 'core': 'core1',
+                               'other': 'core2', 'wt': 'json'})])
+
+    def testCollectionActions(self):
+        """
+        The collection operations are sent to C{/admin/collections}, and
+        errors of Solr fail the L{Deferred}.
+        """
+        admin = self._admin(CREATEALIAS=[_response()],
+                            RELOAD=[FakeResponse(400, '{}')])
+        self.successResultOf(admin.createAlias('live', ['c1', 'c2']))
+        self.assertEqual(self.transport.requests[0],
+                         ('/admin/collections',
+                          {'action': 'CREATEALIAS', 'name': 'live',
+                           'collections': 'c1,c2', 'wt': 'json'}))
+        self.failureResultOf(admin.reloadCollection('c1'), HTTPWrongStatus)
+
+    def testAsynchronous(self):
+        """
+        Asynchronous operations are polled with an exponential backoff until
+        they complete, then their status is deleted.
+        """
+        running = _response(status={'state': 'running'})
+        admin = self._admin(
+            CREATE=[_response(requestid='ignored')],
+            REQUESTSTATUS=[running, running, running,
+                           _response(status={'state': 'completed'})],
+            DELETESTATUS=[_response()])
+        d = admin.createCollection('c1', numShards=2, configName='conf',
+                                   asynchronous=True)
+        _, create = self.transport.requests[0]
+        self.assertEqual(create['numShards'], '2')
+        self.assertEqual(create['collection.configName'], 'conf')
+        requestId = create['async']
+
+        # Polled after 1, 2, 4 and 4 seconds.
+        for delay in (1, 2, 4):
+            self.clock.advance(delay)
+            self.assertNoResult(d)
+        self.clock.advance(3)
+        self.assertNoResult(d)
+        self.clock.advance(1)
+        response = self.successResultOf(d)
+        self.assertEqual(response.status['state'], 'completed')
+        self.assertEqual(
+            [(params['action'], params['requestid'])
+             for _, params in self.transport.requests[1:]],
+            [('REQUESTSTATUS', requestId)] * 4 +
+            [('DELETESTATUS', requestId)])
+
+    def testAsynchronousFailure(self):
+        """
+        A failed asynchronous operation fails the L{Deferred} with
+        L{AdminRequestError}, even if its status can't be deleted.
+        """
+        admin = self._admin(
+            RELOAD=[_response()],
+            REQUESTSTATUS=[_response(status={'state': 'failed',
+                                             'msg': 'boom'})],
+            DELETESTATUS=[FakeResponse(500, '')])
+        d = admin.reloadCollection('c1', asynchronous=True)
+        self.clock.advance(1)
+        error = self.failureResultOf(d, AdminRequestError).value
+        self.assertEqual(error.args[1:], ('failed', 'boom'))
+
+    def testAsynchronousTimeout(self):
+        """
+        The wait for an asynchronous operation fails with L{TimeoutError}
+        after the timeout of the admin client.
+        """
+        admin = self._admin(
+            DELETE=[_response()],
+            REQUESTSTATUS=[_response(status={'state': 'running'})])
+        admin.timeout = 5
+        d = admin.deleteCollection('c1', asynchronous=True)
+        self.clock.advance(1)
+        self.clock.advance(2)
+        self.assertNoResult(d)
+        # The last wait is shortened to end at the timeout.
+        self.clock.advance(2)
+        self.failureResultOf(d, TimeoutError)
+        self.assertEqual(len(self.transport.requests), 4)
+
+    def testSlowStatusRequests(self):
+        """
+        The time spent in the status requests counts in the timeout.
+        """
+        admin = self._admin(
+            DELETE=[_response()],
+            REQUESTSTATUS=[_response(status={'state': 'running'})])
+        admin.timeout = 5
+        request = self.transport.request
+        self.transport.request = lambda *args: deferLater(
+            self.clock, 2, lambda: None).addCallback(
+                lambda _: request(*args))
+        d = admin.deleteCollection('c1', asynchronous=True)
+        # The request is accepted after 2 seconds. The status is requested
+        # after 3 seconds and received after 5 seconds, and requested again
+        # after 7 seconds and received after 9 seconds.
+        for i in range(8):
+            self.clock.advance(1)
+        self.assertNoResult(d)
+        self.clock.advance(1)
+        self.failureResultOf(d, TimeoutError)
+        self.assertEqual(len(self.transport.requests), 3)
@@ -0,0 +1,392 @@
+import json
+
+from twisted.trial.unittest import TestCase
+from twisted.web.client import ResponseFailed
+
+from txsolr.cache import ValidatorCache
+from txsolr.errors import (HTTPRequestError, HTTPWrongStatus,
+                           VersionConflictError)
+from txsolr.input import StringProducer
+from txsolr.testing import FakeSolrTransport
+
+try:
+    import trollius as asyncio
+except ImportError:
+    skip = 'trollius is not installed'
+else:
+    from txsolr.aio import AsyncioSolrClient, AsyncioTransport
+
+
+def _response(body, headers=None):
+    """Returns an HTTP response with the given body."""
+    lines = ['HTTP/1.1 200 OK', 'Content-Type: application/json']
+    if headers is None:
+        lines.append('Content-Length: %d' % len(body))
+    else:
+        lines.extend(headers)
+    return '\r\n'.join(lines) + '\r\n\r\n' + body
+
+
+def _chunked(body, size=7):
+    """Returns an HTTP response with the body in chunks."""
+    chunks = ['%x\r\n%s\r\n' % (len(body[i:i + size]), body[i:i + size])
+              for i in xrange(0, len(body), size)]
+    return _response(''.join(chunks) + '0\r\n\r\n',
+                     ['Transfer-Encoding: chunked'])
+
+
+_PING = json.dumps({'responseHeader': {'status': 0, 'QTime': 0},
+                    'status': 'OK'})
+
+
+class FakeAsyncioTransport(object):
+    """An L{AsyncioTransport} answering requests with a L{FakeSolrTransport}.
+    """
+
+    def __init__(self, loop, index=None):
+        self.loop = loop
+        self.fake = FakeSolrTransport(index)
+
+    def request(self, method, url, headers, body=None):
+        producer = StringProducer(body) if body is not None else None
+        future = asyncio.Future(loop=self.loop)
+        d = self.fake.request(method, url, headers, producer)
+        d.addCallback(future.set_result)
+        return future
+
+
+class ServerProtocol(object):
+    """A connection to a L{FakeServer}, answering the requests with its
+    handler."""
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.lost = False
+        self._buffer = ''
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.connections.append(self)
+
+    def data_received(self, data):
+        self._buffer += data
+        while True:
+            head, separator, rest = self._buffer.partition('\r\n\r\n')
+            if not separator:
+                return
+            length = 0
+            for line in head.split('\r\n')[1:]:
+                name, value = line.split(':', 1)
+                if name.lower() == 'content-length':
+                    length = int(value)
+            if len(rest) < length:
+                return
+            self._buffer = rest[length:]
+            method, path, _ = head.split(' ', 2)
+            self.server.received(self, method, path, rest[:length])
+
+    def eof_received(self):
+        return None
+
+    def connection_lost(self, exc):
+        self.lost = True
+        self.server.lost.append(self)
+
+
+class FakeServer(object):
+    """An HTTP server on an asyncio event loop.
+
+    @param handler: A callable taking the L{ServerProtocol}, the method and
+        the path of a request, writing the response.
+    @ivar requests: The C{(method, path, body)} of the requests received.
+    @ivar connections: The L{ServerProtocol}s of the connections made.
+    @ivar lost: The L{ServerProtocol}s of the connections lost.
+    """
+
+    def __init__(self, loop, handler):
+        self.loop = loop
+        self.handler = handler
+        self.requests = []
+        self.connections = []
+        self.lost = []
+        self._server = loop.run_until_complete(loop.create_server(
+            lambda: ServerProtocol(self), '127.0.0.1', 0))
+        port = self._server.sockets[0].getsockname()[1]
+        self.url = 'http://127.0.0.1:%d/solr' % port
+
+    def received(self, protocol, method, path, body):
+        self.requests.append((method, path, body))
+        self.handler(protocol, method, path)
+
+    def close(self):
+        self._server.close()
+        for protocol in self.connections:
+            protocol.transport.close()
+        self.loop.run_until_complete(self._server.wait_closed())
+
+
+class AsyncioTestCase(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def wait(self, future):
+        return self.loop.run_until_complete(future)
+
+    def waitFor(self, condition):
+        """Runs the event loop until C{condition} returns C{True}."""
+        for i in xrange(1000):
+            if condition():
+                return
+            self.wait(asyncio.sleep(0.005, loop=self.loop))
+        self.fail('The condition was never met')
+
+    def assertFails(self, future, exceptionType):
+        try:
+            self.wait(future)
+        except exceptionType as e:
+            return e
+        self.fail('%s not raised' % exceptionType.__name__)
+
+
+class AsyncioSolrClientTest(AsyncioTestCase):
+
+    def setUp(self):
+        AsyncioTestCase.setUp(self)
+        self.transport = FakeAsyncioTransport(self.loop)
+        self.client = AsyncioSolrClient('http://solr/core',
+                                        transport=self.transport,
+                                        loop=self.loop)
+
+    def testUpdateAndSearch(self):
+        """
+        L{AsyncioSolrClient} has the methods of L{SolrClient}, returning
+        futures that fire with the same L{SolrResponse}s.
+        """
+        self.wait(self.client.add([{'id': 'a', 'title': u'Solr'},
+                                   {'id': 'b', 'title': u'Lucene'}]))
+        self.wait(self.client.commit())
+        response = self.wait(self.client.search(u'title:Solr'))
+        self.assertEqual([doc['id'] for doc in response.results.docs],
+                         ['a'])
+
+        self.wait(self.client.delete('a'))
+        response = self.wait(self.client.get(['a', 'b']))
+        self.assertEqual([doc['id'] for doc in response.results.docs],
+                         ['b'])
+        self.assertEqual(self.wait(self.client.ping()).status, 'OK')
+        self.assertEqual(self.wait(self.client.getSchema()).responseDict[
+            'schema']['uniqueKey'], 'id')
+
+    def testAddChanges(self):
+        """
+        L{AsyncioSolrClient.addChanges} gives C{None} without sending a
+        request if nothing changed.
+        """
+        old = {'id': 'a', 'title': u'Solr'}
+        self.assertIdentical(self.wait(self.client.addChanges(old, old)),
+                             None)
+        self.assertEqual(self.transport.fake.requests, [])
+        self.wait(self.client.addChanges(old, {'id': 'a', 'title': u'Lucene'}))
+        self.assertEqual(self.transport.fake.index.get('a')['title'],
+                         u'Lucene')
+
+    def testGetByIds(self):
+        """
+        L{AsyncioSolrClient.getByIds} fetches the documents in chunks, with
+        the real-time get handler or with a C{{!terms}} query.
+        """
+        self.wait(self.client.add([{'id': unicode(i)} for i in range(5)]))
+        self.wait(self.client.commit())
+        for realtime in (True, False):
+            results = self.wait(self.client.getByIds(
+                [3, u'1', u'9', u'0'], fields=['title'], realtime=realtime,
+                chunkSize=2, concurrency=1))
+            self.assertEqual([doc['id'] for doc in results.docs],
+                             [u'3', u'1', u'0'])
+            self.assertEqual(results.missing, [u'9'])
+
+    def testErrors(self):
+        """
+        Error responses fail with the errors of L{SolrClient}, and transport
+        errors with L{HTTPRequestError}.
+        """
+        self.assertFails(self.client.add({'id': 'a', '_version_': 5}),
+                         VersionConflictError)
+        self.assertFails(self.client._query('/missing', {}),
+                         HTTPWrongStatus)
+
+        client = AsyncioSolrClient(
+            'http://127.0.0.1:1/solr', loop=self.loop,
+            transport=AsyncioTransport(self.loop))
+        self.assertFails(client.ping(), HTTPRequestError)
+
+    def testCache(self):
+        """
+        A L{ValidatorCache} revalidates the responses of C{/select} GET
+        requests.
+        """
+        cache = ValidatorCache()
+        self.client.cache = cache
+        first = self.wait(self.client.search(u'*:*'))
+        self.assertIdentical(self.wait(self.client.search(u'*:*')), first)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def testStreamDocuments(self):
+        """
+        L{AsyncioSolrClient.streamDocuments} and
+        L{AsyncioSolrClient.export} return streams read with futures.
+        """
+        index = self.transport.fake.index
+        for i in range(5):
+            index.add({'id': u'doc-%d' % i})
+        index.commit()
+
+        for stream in (self.client.streamDocuments(u'*:*', bufferSize=2),
+                       self.client.export(u'*:*', u'id asc', u'id')):
+            ids = []
+            while True:
+                document = self.wait(stream.next())
+                if document is None:
+                    break
+                ids.append(document['id'])
+            self.assertEqual(ids, [u'doc-%d' % i for i in range(5)])
+            self.assertEqual(stream.response.results.numFound, 5)
+
+
+class AsyncioTransportTest(AsyncioTestCase):
+
+    def _listen(self, handler, maxConnections=10):
+        self.server = FakeServer(self.loop, handler)
+        self.addCleanup(self.server.close)
+        transport = AsyncioTransport(self.loop, maxConnections)
+        self.addCleanup(transport.close)
+        return AsyncioSolrClient(self.server.url, transport=transport,
+                                 loop=self.loop)
+
+    def testPersistentConnections(self):
+        """
+        L{AsyncioTransport} sends the requests of an L{AsyncioSolrClient},
+        reusing its connections, and reads chunked bodies.
+        """
+        client = self._listen(lambda protocol, method, path:
+                              protocol.transport.write(_chunked(_PING)))
+        for i in range(3):
+            self.assertEqual(self.wait(client.ping()).status, 'OK')
+        self.wait(client.add({'id': 'a'}))
+        self.assertEqual(len(self.server.connections), 1)
+        self.assertEqual([method for method, _, _ in self.server.requests],
+                         ['GET', 'GET', 'GET', 'POST'])
+        self.assertEqual(self.server.requests[0][1],
+                         '/solr/admin/ping?wt=json')
+        self.assertIn('<add>', self.server.requests[-1][2])
+
+    def testChunkExtensions(self):
+        """
+        The extensions of the chunks and the trailer of a chunked body are
+        ignored.
+        """
+        response = _response(
+            '%x;name=value\r\n%s\r\n0\r\nTrailer: yes\r\n\r\n' % (
+                len(_PING), _PING), ['Transfer-Encoding: chunked'])
+        client = self._listen(lambda protocol, method, path:
+                              protocol.transport.write(response))
+        for i in range(2):
+            self.assertEqual(self.wait(client.ping()).status, 'OK')
+        self.assertEqual(len(self.server.connections), 1)
+
+    def testMalformedResponse(self):
+        """
+        A request fails with L{HTTPRequestError} if its response head is
+        malformed, and with L{ResponseFailed} if a chunk of its body is
+        malformed, like with L{SolrClient}. The connection is closed.
+        """
+        responses = ['garbage\r\n\r\n',
+                     _response('zz\r\n', ['Transfer-Encoding: chunked'])]
+        client = self._listen(lambda protocol, method, path:
+                              protocol.transport.write(responses.pop(0)))
+        self.assertFails(client.ping(), HTTPRequestError)
+        self.waitFor(lambda: len(self.server.lost) == 1)
+        self.assertFails(client.ping(), ResponseFailed)
+        self.waitFor(lambda: len(self.server.lost) == 2)
+
+    def testCloseDelimited(self):
+        """
+        A response without a length ends when the server closes the
+        connection, which is not reused.
+        """
+        def handler(protocol, method, path):
+            protocol.transport.write(_response(_PING, []))
+            protocol.transport.close()
+
+        client = self._listen(handler)
+        for i in range(2):
+            self.assertEqual(self.wait(client.ping()).status, 'OK')
+        self.assertEqual(len(self.server.connections), 2)
+
+    def testMaxConnections(self):
+        """
+        At most C{maxConnections} connections are made to a server, and the
+        other requests wait for a free connection.
+        """
+        pending = []
+        client = self._listen(lambda protocol, method, path:
+                              pending.append(protocol), maxConnections=2)
+        requests = [client.ping() for i in range(4)]
+        self.waitFor(lambda: len(pending) == 2)
+        while pending:
+            pending.pop(0).transport.write(_response(_PING))
+            self.waitFor(lambda: pending or all(request.done()
+                                                for request in requests))
+        self.wait(asyncio.gather(*requests, loop=self.loop))
+        self.assertEqual(len(self.server.connections), 2)
+        self.assertEqual(len(self.server.requests), 4)
+
+    def testCancel(self):
+        """
+        Cancelling a request closes its connection and frees it for the
+        next requests.
+        """
+        answer = []
+
+        def handler(protocol, method, path):
+            if answer:
+                protocol.transport.write(_response(_PING))
+
+        client = self._listen(handler, maxConnections=1)
+        request = client.ping()
+        self.waitFor(lambda: self.server.requests)
+        request.cancel()
+        self.assertRaises(asyncio.CancelledError, self.wait, request)
+        self.waitFor(lambda: self.server.lost)
+
+        answer.append(True)
+        self.assertEqual(self.wait(client.ping()).status, 'OK')
+        self.assertEqual(len(self.server.connections), 2)
+
+    def testCloseStream(self):
+        """
+        Closing a stream while its body is received closes the connection
+        and frees it for the next requests.
+        """
+        body = ('{"responseHeader": {"status": 0, "QTime": 1}, "response": '
+                '{"numFound": 3, "start": 0, "docs": [{"id": "a"}, ')
+
+        def handler(protocol, method, path):
+            if 'ping' in path:
+                protocol.transport.write(_response(_PING))
+            else:
+                protocol.transport.write(_response(body, [
+                    'Content-Length: %d' % (len(body) + 100)]))
+
+        client = self._listen(handler, maxConnections=1)
+        stream = client.streamDocuments(u'*:*')
+        self.assertEqual(self.wait(stream.next()), {'id': 'a'})
+        stream.close()
+        self.assertIdentical(self.wait(stream.next()), None)
+        self.waitFor(lambda: self.server.lost)
+
+        self.assertEqual(self.wait(client.ping()).status, 'OK')
+        self.assertEqual(len(self.server.connections), 2)
@@ -0,0 +1,224 @@
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from txsolr.bulk import BulkIndexer
+from txsolr.errors import VersionConflictError
+from txsolr.input import SimpleXMLInputFactory
+
+
+class FakeClient(object):
+    """A fake L{SolrClient} that records the update requests it receives."""
+
+    def __init__(self):
+        self.inputFactory = SimpleXMLInputFactory()
+        self.requests = []
+
+    def _update(self, input):
+        deferred = Deferred()
+        self.requests.append((input, deferred))
+        return deferred
+
+
+class BulkIndexerTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.client = FakeClient()
+        self.progress = []
+
+    def _documents(self, count):
+        return ({'id': i} for i in xrange(count))
+
+    def _indexer(self, **kwargs):
+        return BulkIndexer(self.client, clock=self.clock,
+                           progress=self._recordProgress, **kwargs)
+
+    def _recordProgress(self, stats):
+        self.progress.append(stats.acknowledged)
+
+    def testConcurrency(self):
+        """
+        L{BulkIndexer.add} keeps C{concurrency} batches in flight and sends
+        the next batch as soon as one of them is acknowledged.
+        """
+        indexer = self._indexer(batchSize=10, concurrency=3)
+        deferred = indexer.add(self._documents(45))
+        self.assertEqual(len(self.client.requests), 3)
+
+        self.client.requests[0][1].callback(None)
+        self.assertEqual(len(self.client.requests), 4)
+
+        for _, request in self.client.requests[1:]:
+            request.callback(None)
+        self.client.requests[-1][1].callback(None)
+
+        stats = self.successResultOf(deferred)
+        self.assertEqual(stats.documents, 45)
+        self.assertEqual(stats.batches, 5)
+        self.assertEqual(stats.failures, [])
+        self.assertTrue(stats.bytes > 0)
+
+    def testOrderedAcknowledgement(self):
+        """
+        L{BulkIndexer} acknowledges the batches in the order they were read,
+        even if Solr answers out of order.
+        """
+        indexer = self._indexer(batchSize=10, concurrency=3)
+        indexer.add(self._documents(30))
+        self.client.requests[2][1].callback(None)
+        self.client.requests[1][1].callback(None)
+        self.assertEqual(self.progress, [])
+
+        self.client.requests[0][1].callback(None)
+        self.assertEqual(self.progress, [1, 2, 3])
+
+    def testRetry(self):
+        """
+        L{BulkIndexer} sends a failed batch again after C{retryDelay}
+        seconds.
+        """
+        indexer = self._indexer(batchSize=10, concurrency=1, retryDelay=2)
+        deferred = indexer.add(self._documents(10))
+        self.client.requests[0][1].errback(ValueError('boom'))
+        self.assertEqual(len(self.client.requests), 1)
+
+        self.clock.advance(2)
+        self.assertEqual(len(self.client.requests), 2)
+        self.assertEqual(self.client.requests[1][0].body,
+                         self.client.requests[0][0].body)
+        self.client.requests[1][1].callback(None)
+
+        stats = self.successResultOf(deferred)
+        self.assertEqual(stats.documents, 10)
+        self.assertEqual(stats.retries, 1)
+
+    def testFailureDoesNotAbort(self):
+        """
+        L{BulkIndexer} records batches that fail after C{maxRetries} retries
+        and goes on with the next batches.
+        """
+        indexer = self._indexer(batchSize=10, concurrency=1, maxRetries=1,
+                                retryDelay=1)
+        deferred = indexer.add(self._documents(20))
+        self.client.requests[0][1].errback(ValueError('boom'))
+        self.clock.advance(1)
+        self.client.requests[1][1].errback(ValueError('boom'))
+        self.client.requests[2][1].callback(None)
+
+        stats = self.successResultOf(deferred)
+        self.assertEqual(stats.documents, 10)
+        self.assertEqual(len(stats.failures), 1)
+        failure = stats.failures[0]
+        self.assertEqual(failure.number, 0)
+        self.assertEqual(failure.attempts, 2)
+        self.assertEqual(failure.items, [{'id': i} for i in range(10)])
+        failure.failure.trap(ValueError)
+        self.assertEqual(self.progress, [1, 2])
+
+    def testVersionConflict(self):
+        """
+        L{BulkIndexer} doesn't retry batches rejected with a version
+        conflict, which would fail again.
+        """
+        indexer = self._indexer(batchSize=10, concurrency=1)
+        deferred = indexer.add(self._documents(10))
+        self.client.requests[0][1].errback(VersionConflictError(409))
+        stats = self.successResultOf(deferred)
+        self.assertEqual(len(self.client.requests), 1)
+        self.assertEqual(stats.retries, 0)
+        self.assertEqual(stats.failures[0].attempts, 1)
+        stats.failures[0].failure.trap(VersionConflictError)
+
+    def testEncodingErrors(self):
+        """
+        L{BulkIndexer} records batches that can't be encoded without sending
+        them.
+        """
+        indexer = self._indexer(batchSize=1, concurrency=1)
+        deferred = indexer.add(['not a document'])
+        stats = self.successResultOf(deferred)
+        self.assertEqual(self.client.requests, [])
+        stats.failures[0].failure.trap(AttributeError)
+
+    def testItemsError(self):
+        """
+        L{BulkIndexer} fails the run with the error of the iterator of the
+        items, and doesn't send more batches.
+        """
+        def documents():
+            for i in range(10):
+                yield {'id': i}
+            raise ValueError('boom')
+
+        indexer = self._indexer(batchSize=10, concurrency=2)
+        deferred = indexer.add(documents())
+        self.failureResultOf(deferred, ValueError)
+        self.client.requests[0][1].callback(None)
+        self.assertEqual(len(self.client.requests), 1)
+
+    def testProgressError(self):
+        """
+        L{BulkIndexer} fails the run with the error of the progress callback.
+        """
+        def progress(stats):
+            raise ValueError('boom')
+
+        indexer = BulkIndexer(self.client, batchSize=10, concurrency=1,
+                              progress=progress, clock=self.clock)
+        deferred = indexer.add(self._documents(20))
+        self.client.requests[0][1].callback(None)
+        self.failureResultOf(deferred, ValueError)
+        self.assertEqual(len(self.client.requests), 1)
+
+    def testAdaptiveBatchSize(self):
+        """
+        L{BulkIndexer} halves the batch size when a batch is slower than
+        C{targetLatency}, and increases it when it's much faster.
+        """
+        indexer = self._indexer(batchSize=100, concurrency=1,
+                                targetLatency=1.0, minBatchSize=10)
+        indexer.add(self._documents(1000))
+        self.clock.advance(2)
+        self.client.requests[0][1].callback(None)
+        self.assertEqual(len(self.client.requests[1][0].body.split('<doc>')),
+                         51)
+
+        self.clock.advance(0.1)
+        self.client.requests[1][1].callback(None)
+        self.assertEqual(len(self.client.requests[2][0].body.split('<doc>')),
+                         63)
+
+    def testThroughput(self):
+        """L{IndexingStats} reports the throughput of the run."""
+        indexer = self._indexer(batchSize=10, concurrency=1)
+        deferred = indexer.add(self._documents(10))
+        self.clock.advance(2)
+        input, request = self.client.requests[0]
+        request.callback(None)
+        stats = self.successResultOf(deferred)
+        self.assertEqual(stats.elapsed, 2)
+        self.assertEqual(stats.documentsPerSecond, 5)
+        self.assertEqual(stats.bytesPerSecond, input.length / 2.0)
+
+    def testDelete(self):
+        """L{BulkIndexer.delete} deletes the given IDs in batches."""
+        indexer = self._indexer(batchSize=2, concurrency=2)
+        deferred = indexer.delete(['1', '2', '3'])
+        bodies = [input.body for input, _ in self.client.requests]
+        self.assertEqual(bodies, ['<delete><id>1</id><id>2</id></delete>',
+                                  '<delete><id>3</id></delete>'])
+        for _, request in self.client.requests:
+            request.callback(None)
+        self.assertEqual(self.successResultOf(deferred).documents, 3)
+
+    def testSynchronousAcknowledgements(self):
+        """
+        L{BulkIndexer} handles many batches acknowledged synchronously without
+        exhausting the stack.
+        """
+        self.client._update = lambda input: succeed(None)
+        indexer = self._indexer(batchSize=1, concurrency=2)
+        stats = self.successResultOf(indexer.add(self._documents(5000)))
+        self.assertEqual(stats.documents, 5000)
+        self.assertEqual(stats.acknowledged, 5000)
@@ -0,0 +1,84 @@
+from twisted.trial.unittest import TestCase
+from twisted.web.http_headers import Headers
+
+from txsolr.cache import ValidatorCache
+from txsolr.client import SolrClient
+from txsolr.testing import FakeSolrTransport
+
+
+class ValidatorCacheTest(TestCase):
+
+    def testStore(self):
+        """
+        L{ValidatorCache.store} keeps the responses with an C{ETag} or a
+        C{Last-Modified} header, and L{ValidatorCache.lookup} returns them
+        with their conditional request headers.
+        """
+        cache = ValidatorCache()
+        cache.store('/a', Headers({'ETag': ['"1"']}), 'a')
+        cache.store('/b', Headers({'Last-Modified': ['Mon, 01 Jan 2024']}),
+                    'b')
+        cache.store('/c', Headers(), 'c')
+        cache.store('/d', Headers({'ETag': ['"1"'],
+                                   'Cache-Control': ['no-store']}), 'd')
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.lookup('/a').response, 'a')
+        self.assertEqual(cache.lookup('/a').validators(),
+                         {'If-None-Match': ['"1"']})
+        self.assertEqual(cache.lookup('/b').validators(),
+                         {'If-Modified-Since': ['Mon, 01 Jan 2024']})
+        self.assertEqual(cache.lookup('/c'), None)
+        self.assertEqual(cache.misses, 4)
+
+    def testLeastRecentlyUsed(self):
+        """
+        L{ValidatorCache} removes the least recently used response when it
+        has more than C{maxEntries}.
+        """
+        cache = ValidatorCache(maxEntries=2)
+        cache.store('/a', Headers({'ETag': ['"1"']}), 'a')
+        cache.store('/b', Headers({'ETag': ['"1"']}), 'b')
+        cache.lookup('/a')
+        cache.store('/c', Headers({'ETag': ['"1"']}), 'c')
+        self.assertEqual(cache.lookup('/b'), None)
+        self.assertEqual(cache.lookup('/a').response, 'a')
+        self.assertEqual(cache.lookup('/c').response, 'c')
+
+
+class ClientCacheTest(TestCase):
+
+    def setUp(self):
+        self.transport = FakeSolrTransport()
+        self.cache = ValidatorCache()
+        self.client = SolrClient('http://solr/core', transport=self.transport,
+                                 cache=self.cache)
+
+    def testRevalidate(self):
+        """
+        L{SolrClient.search} revalidates the cached responses, and reuses
+        them when Solr answers that they were not modified.
+        """
+        self.successResultOf(self.client.add({'id': 'a'}))
+        self.successResultOf(self.client.commit())
+
+        first = self.successResultOf(self.client.search(u'*:*'))
+        second = self.successResultOf(self.client.search(u'*:*'))
+        self.assertIdentical(first, second)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        self.successResultOf(self.client.add({'id': 'b'}))
+        self.successResultOf(self.client.commit())
+        third = self.successResultOf(self.client.search(u'*:*'))
+        self.assertEqual(third.results.numFound, 2)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+    def testPostNotCached(self):
+        """
+        Queries sent with a POST request are neither revalidated nor cached.
+        """
+        self.successResultOf(self.client.search(u'*:*', maxGetLength=0))
+        self.successResultOf(self.client.search(u'*:*', maxGetLength=0))
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual([method for method, _, _ in self.transport.requests],
+                         ['POST', 'POST'])
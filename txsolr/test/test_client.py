@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
+import json
 import random
 import string
 import datetime
+import urlparse
 
 from twisted.trial import unittest
 from twisted.internet import reactor
-from twisted.internet.defer import inlineCallbacks, Deferred
+from twisted.internet.defer import inlineCallbacks, Deferred, succeed
 
 from txsolr.client import SolrClient
+from txsolr.response import JSONSolrResponse
+from txsolr.testing import FakeSolrTransport
 
 
 # TODO: Add tests for exceptions.
@@ -615,3 +619,176 @@ class CommitingTestCase(unittest.TestCase):
         r = yield self.client.search('id:%s' % doc['id'])
         self.assertEqual(r.results.numFound, 1,
                          'Optimize did not work')
+
+
+class RealTimeGetTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.client = SolrClient(SOLR_URL)
+        self.client._request = self._request
+        self.documents = dict((str(i), {'id': str(i), 'name': 'doc%d' % i})
+                              for i in range(10))
+        self.requests = []
+
+    def _request(self, method, path, headers, bodyProducer,
+                 consumerFactory=None, cache=None):
+        """Answers a query request with the documents in C{self.documents}."""
+        if method == 'GET':
+            path, query = path.split('?', 1)
+        else:
+            query = bodyProducer.body
+        self.requests.append((method, path, query))
+        params = urlparse.parse_qs(query)
+
+        if path == '/get':
+            ids = params['id']
+        else:
+            localParams, terms = params['fq'][0].split('}', 1)
+            separator = ','
+            if "separator='" in localParams:
+                separator = localParams.split("'")[1]
+            ids = terms.split(separator)
+        docs = [self.documents[id] for id in ids if id in self.documents]
+
+        if path == '/get' and len(ids) == 1:
+            response = {'doc': docs[0] if docs else None}
+        else:
+            response = {'response': {'numFound': len(docs), 'start': 0,
+                                     'docs': docs}}
+        response['responseHeader'] = {'status': 0, 'QTime': 1}
+        return succeed(JSONSolrResponse(json.dumps(response)))
+
+    @inlineCallbacks
+    def testGet(self):
+        """
+        L{SolrClient.get} fetches documents from the real-time get handler.
+        """
+        response = yield self.client.get('1', fl='id')
+        self.assertEqual(response.results.docs, [self.documents['1']])
+        method, path, query = self.requests[0]
+        params = urlparse.parse_qs(query)
+        self.assertEqual((method, path), ('GET', '/get'))
+        self.assertEqual(params['id'], ['1'])
+        self.assertEqual(params['fl'], ['id'])
+        self.assertEqual(params['omitHeader'], ['false'])
+
+        response = yield self.client.get(['1', '2'])
+        self.assertEqual(response.results.docs,
+                         [self.documents['1'], self.documents['2']])
+
+    @inlineCallbacks
+    def testGetByIds(self):
+        """
+        L{SolrClient.getByIds} returns the documents in the order of the given
+        IDs and reports the missing ones.
+        """
+        results = yield self.client.getByIds(['3', 'missing', 1, '2'])
+        self.assertEqual([doc['id'] for doc in results.docs], ['3', '1', '2'])
+        self.assertEqual(results.numFound, 3)
+        self.assertEqual(results.missing, ['missing'])
+        self.assertEqual([path for _, path, _ in self.requests], ['/get'])
+
+    @inlineCallbacks
+    def testGetByIdsSingleId(self):
+        """
+        L{SolrClient.getByIds} handles the single document returned by the
+        real-time get handler for a single ID.
+        """
+        results = yield self.client.getByIds(['4'])
+        self.assertEqual(results.docs, [self.documents['4']])
+
+        results = yield self.client.getByIds(['missing'])
+        self.assertEqual(results.docs, [])
+        self.assertEqual(results.missing, ['missing'])
+
+    @inlineCallbacks
+    def testGetByIdsWithChunks(self):
+        """
+        L{SolrClient.getByIds} splits the IDs in chunks of at most
+        C{chunkSize} IDs.
+        """
+        ids = [str(i) for i in range(10)]
+        results = yield self.client.getByIds(ids, chunkSize=3)
+        self.assertEqual([doc['id'] for doc in results.docs], ids)
+        self.assertEqual(len(self.requests), 4)
+
+    @inlineCallbacks
+    def testGetByIdsWithTermsFilter(self):
+        """
+        L{SolrClient.getByIds} uses a C{{!terms}} filter query when
+        C{realtime} is C{False}, and always requests the unique key field.
+        """
+        results = yield self.client.getByIds(['1', '2'], fields=['name'],
+                                             realtime=False)
+        self.assertEqual(len(results.docs), 2)
+        method, path, query = self.requests[0]
+        params = urlparse.parse_qs(query)
+        self.assertEqual(path, '/select')
+        self.assertEqual(params['fq'], ['{!terms f=id}1,2'])
+        self.assertEqual(params['fl'], ['name,id'])
+
+    @inlineCallbacks
+    def testGetByIdsNumericKeys(self):
+        """
+        L{SolrClient.getByIds} finds the documents whose unique keys are
+        returned as numbers.
+        """
+        self.documents['5']['id'] = 5
+        for realtime in (True, False):
+            results = yield self.client.getByIds([5, '1'], realtime=realtime)
+            self.assertEqual([doc['id'] for doc in results.docs], [5, '1'])
+            self.assertEqual(results.missing, [])
+
+    @inlineCallbacks
+    def testGetByIdsWithSeparator(self):
+        """
+        L{SolrClient.getByIds} uses another separator in the C{{!terms}}
+        filter query if an ID contains a comma.
+        """
+        self.documents['a,b'] = {'id': 'a,b'}
+        results = yield self.client.getByIds(['a,b', '1'], realtime=False)
+        self.assertEqual([doc['id'] for doc in results.docs], ['a,b', '1'])
+        params = urlparse.parse_qs(self.requests[0][2])
+        self.assertEqual(params['fq'], ["{!terms f=id separator='|'}a,b|1"])
+
+    @inlineCallbacks
+    def testGetByIdsWithPost(self):
+        """
+        L{SolrClient.getByIds} sends long lists of IDs in the body of a POST
+        request.
+        """
+        ids = [_randomString(20) for _ in range(300)]
+        results = yield self.client.getByIds(ids)
+        self.assertEqual(results.missing, ids)
+        self.assertEqual([method for method, _, _ in self.requests], ['POST'])
+
+
+class QueryEncodingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.transport = FakeSolrTransport()
+        self.client = SolrClient('http://solr/core', transport=self.transport,
+                                 maxGetLength=100)
+
+    def testGetOrPost(self):
+        """
+        L{SolrClient} sends a query with a GET request if its full URL fits in
+        C{maxGetLength}, and with a POST request otherwise.
+        """
+        self.client.search(u'id:' + u'a' * 40)
+        self.client.search(u'id:' + u'a' * 80)
+        [(firstMethod, url, _), (secondMethod, _, body)] = \
+            self.transport.requests
+        self.assertEqual((firstMethod, secondMethod), ('GET', 'POST'))
+        self.assertTrue(len(url) <= 100)
+        self.assertEqual(urlparse.parse_qs(body)['q'], ['id:' + 'a' * 80])
+
+    def testMaxGetLengthPerCall(self):
+        """
+        The C{maxGetLength} keyword argument of L{SolrClient.search}
+        overrides the one of the client, and is not sent to Solr.
+        """
+        self.client.search(u'id:' + u'a' * 80, maxGetLength=1000)
+        [(method, url, _)] = self.transport.requests
+        self.assertEqual(method, 'GET')
+        self.assertNotIn('maxGetLength', url)
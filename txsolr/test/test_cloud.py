@@ -0,0 +1,509 @@
+import json
+import urlparse
+
+from twisted.internet import reactor
+from twisted.internet.defer import (Deferred, fail, gatherResults,
+                                    inlineCallbacks, succeed)
+from twisted.internet.error import ConnectionLost, ConnectionRefusedError
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET, Site
+
+from txsolr.cloud import (AffinityRouter, CloudSolrClient, ClusterState,
+                          compositeIdHash, murmurHash3, queryKey)
+from txsolr.errors import (HTTPRequestError, HTTPWrongStatus,
+                           VersionConflictError)
+from txsolr.hedge import HedgingPolicy
+from txsolr.testing import FakeResponse, FakeSolrTransport
+from txsolr.transport import AgentTransport
+
+
+def _clusterStatus(leaders, router='compositeId', routerField=None):
+    """
+    Returns the C{cluster} object of a C{CLUSTERSTATUS} response for a
+    collection with two shards, with their leaders on the given nodes.
+    """
+    shards = {}
+    ranges = ('80000000-ffffffff', '0-7fffffff')
+    for number, (node, hashRange) in enumerate(zip(leaders, ranges)):
+        name = 'shard%d' % (number + 1)
+        shards[name] = {
+            'range': hashRange, 'state': 'active',
+            'replicas': {
+                'core_node%d' % number: {
+                    'core': 'c_%s_replica' % name, 'state': 'active',
+                    'base_url': 'http://%s/solr' % node, 'leader': 'true'}}}
+    router = {'name': router}
+    if routerField is not None:
+        router['field'] = routerField
+    return {'collections': {'c': {'shards': shards, 'router': router}},
+            'live_nodes': ['node1:8983_solr', 'node2:8983_solr']}
+
+
+class FakeCluster(object):
+    """
+    A transport for a fake cluster of two nodes, answering the updates of
+    each node with its own L{FakeSolrTransport}.
+    """
+
+    def __init__(self):
+        self.nodes = {'node1': FakeSolrTransport(),
+                      'node2': FakeSolrTransport()}
+        self.cluster = _clusterStatus(['node1', 'node2'])
+        self.statusRequests = []
+        self.down = set()
+        self.refused = set()
+        self.lost = set()
+        self.errors = {}
+        self.slow = set()
+        self.cancelled = []
+
+    def request(self, method, url, headers, bodyProducer):
+        parsed = urlparse.urlparse(url)
+        if parsed.netloc in self.down:
+            return succeed(FakeResponse(503, 'Unavailable'))
+        if parsed.netloc in self.refused:
+            return fail(ConnectionRefusedError())
+        if parsed.netloc in self.lost:
+            self.nodes[parsed.netloc].requests.append((method, url, None))
+            return fail(ConnectionLost())
+        if parsed.netloc in self.errors:
+            self.nodes[parsed.netloc].requests.append((method, url, None))
+            return succeed(FakeResponse(self.errors[parsed.netloc], 'Error'))
+        if parsed.path.endswith('/admin/collections'):
+            self.statusRequests.append(parsed.netloc)
+            body = {'responseHeader': {'status': 0, 'QTime': 0},
+                    'cluster': self.cluster}
+            return succeed(FakeResponse(200, json.dumps(body)))
+        if parsed.netloc in self.slow:
+            return Deferred(lambda _: self.cancelled.append(parsed.netloc))
+        return self.nodes[parsed.netloc].request(method, url, headers,
+                                                 bodyProducer)
+
+    def paths(self, node):
+        return [urlparse.urlparse(url).path
+                for _, url, _ in self.nodes[node].requests]
+
+
+class NodeResource(Resource):
+    """
+    A node of a real HTTP cluster, answering C{CLUSTERSTATUS} requests and
+    searches, or leaving the searches unanswered if it's C{stalled}.
+    """
+
+    isLeaf = True
+
+    def __init__(self, stalled=False):
+        Resource.__init__(self)
+        self.stalled = stalled
+        self.cluster = None
+        self.statusRequests = 0
+        self.searches = 0
+        self.finished = []
+
+    def render_GET(self, request):
+        if request.path.endswith('/admin/collections'):
+            self.statusRequests += 1
+            body = {'cluster': self.cluster}
+        else:
+            self.searches += 1
+            if self.stalled:
+                self.finished.append(
+                    request.notifyFinish().addErrback(lambda _: None))
+                return NOT_DONE_YET
+            body = {'response': {'numFound': 0, 'start': 0, 'docs': []}}
+        body['responseHeader'] = {'status': 0, 'QTime': 0}
+        request.setHeader('Content-Type', 'application/json')
+        return json.dumps(body)
+
+
+class HashTest(TestCase):
+
+    def testMurmurHash3(self):
+        """
+        L{murmurHash3} gives the signed 32-bit MurmurHash3 of the UTF-8
+        bytes, like Solr.
+        """
+        self.assertEqual(murmurHash3(''), 0)
+        self.assertEqual(murmurHash3('hello'), 613153351)
+        self.assertEqual(murmurHash3('Hello, world!'), -1070186941)
+        self.assertEqual(murmurHash3('abcde'), -392455434)
+        self.assertEqual(murmurHash3(u'caf\xe9'), 605818632)
+
+    def testCompositeIdHash(self):
+        """
+        The prefixes of composite IDs give the highest bits of their hash,
+        16 bits by default or the number of bits given with the prefix.
+        """
+        self.assertEqual(compositeIdHash(u'doc-1'), murmurHash3('doc-1'))
+        first, second = (compositeIdHash(u'tenant!doc-1'),
+                         compositeIdHash(u'tenant!doc-2'))
+        self.assertEqual(first & 0xffff0000, second & 0xffff0000)
+        self.assertEqual(first & 0xffff0000,
+                         murmurHash3('tenant') & 0xffff0000)
+        self.assertEqual(first & 0xffff, murmurHash3('doc-1') & 0xffff)
+
+        hashed = compositeIdHash(u'tenant/4!doc-1')
+        self.assertEqual(hashed & 0xf0000000,
+                         murmurHash3('tenant') & 0xf0000000)
+        self.assertEqual(hashed & 0x0fffffff,
+                         murmurHash3('doc-1') & 0x0fffffff)
+
+        hashed = compositeIdHash(u'eu!tenant!doc-1')
+        self.assertEqual(hashed & 0xff000000,
+                         murmurHash3('eu') & 0xff000000)
+        self.assertEqual(hashed & 0x00ff0000,
+                         murmurHash3('tenant') & 0x00ff0000)
+        self.assertEqual(hashed & 0xffff, murmurHash3('doc-1') & 0xffff)
+
+
+class ClusterStateTest(TestCase):
+
+    def testFromClusterStatus(self):
+        """
+        The shards of the state have the URL of the core of their leader,
+        and inactive shards are ignored.
+        """
+        cluster = _clusterStatus(['node1', 'node2'])
+        cluster['collections']['c']['shards']['shard0'] = {
+            'range': '80000000-7fffffff', 'state': 'inactive',
+            'replicas': {}}
+        state = ClusterState.fromClusterStatus('c', cluster)
+        self.assertEqual([(shard.name, shard.leader)
+                          for shard in state.shards],
+                         [('shard1', 'http://node1/solr/c_shard1_replica'),
+                          ('shard2', 'http://node2/solr/c_shard2_replica')])
+        self.assertEqual(state.shardFor(u'hello').name, 'shard2')
+        self.assertEqual(state.shardFor(u'abcde').name, 'shard1')
+
+
+class CloudSolrClientTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.cluster = FakeCluster()
+        self.client = CloudSolrClient(
+            ['http://node1/solr', 'http://node2/solr'], 'c',
+            transport=self.cluster, clock=self.clock)
+
+    def _ids(self, node):
+        index = self.cluster.nodes[node].index
+        index.commit()
+        return sorted(index.documents)
+
+    def testAdd(self):
+        """
+        Documents are sent to the leaders of their shards, and the state is
+        loaded once.
+        """
+        ids = [u'hello', u'abcde', u'doc-1', u'tenant!doc-1']
+        responses = self.successResultOf(
+            self.client.add([{'id': id} for id in ids]))
+        self.assertEqual(len(responses), 2)
+        self.assertEqual(self._ids('node1'),
+                         [u'abcde', u'doc-1', u'tenant!doc-1'])
+        self.assertEqual(self._ids('node2'), [u'hello'])
+        self.assertEqual(self.cluster.paths('node1'),
+                         ['/solr/c_shard1_replica/update'])
+
+        self.successResultOf(self.client.delete([u'hello', u'abcde']))
+        self.assertEqual(self._ids('node1'), [u'doc-1', u'tenant!doc-1'])
+        self.assertEqual(self._ids('node2'), [])
+        self.assertEqual(self.cluster.statusRequests, ['node1'])
+
+    def testRefresh(self):
+        """
+        The state is loaded again after the refresh interval, and from the
+        next node if a node fails.
+        """
+        self.successResultOf(self.client.getState())
+        self.clock.advance(60)
+        self.cluster.down.add('node1')
+        self.cluster.cluster = _clusterStatus(['node2', 'node2'])
+        state = self.successResultOf(self.client.getState())
+        self.assertEqual(self.cluster.statusRequests, ['node1', 'node2'])
+        self.assertEqual(state.shards[0].leader,
+                         'http://node2/solr/c_shard1_replica')
+
+        self.cluster.down.add('node2')
+        self.client.invalidate()
+        self.failureResultOf(self.client.getState(), HTTPWrongStatus)
+
+    def testLeaderChange(self):
+        """
+        If a leader fails, the state is loaded again and its documents are
+        sent to the new leader.
+        """
+        self.successResultOf(self.client.getState())
+        self.cluster.down.add('node1')
+        self.cluster.cluster = _clusterStatus(['node2', 'node2'])
+        self.successResultOf(
+            self.client.add([{'id': u'hello'}, {'id': u'abcde'}]))
+        self.assertEqual(self._ids('node2'), [u'abcde', u'hello'])
+        self.assertEqual(self.cluster.statusRequests, ['node1', 'node2'])
+
+        self.cluster.down.add('node2')
+        self.failureResultOf(self.client.add({'id': u'abcde'}),
+                             HTTPWrongStatus)
+
+    def testRejectedUpdates(self):
+        """
+        Updates rejected by a leader, like with a version conflict, are not
+        sent again.
+        """
+        self.successResultOf(self.client.getState())
+        self.failureResultOf(
+            self.client.add({'id': u'hello', '_version_': 5}),
+            VersionConflictError)
+        self.cluster.errors['node2'] = 400
+        self.failureResultOf(self.client.add({'id': u'hello'}),
+                             HTTPWrongStatus)
+        self.assertEqual(len(self.cluster.nodes['node2'].requests), 2)
+        self.assertEqual(self.cluster.statusRequests, ['node1'])
+
+    def testAtomicUpdates(self):
+        """
+        Atomic updates that can't be applied twice are only sent again if
+        the connection to the leader failed.
+        """
+        self.successResultOf(self.client.getState())
+        self.cluster.lost.add('node2')
+        self.failureResultOf(
+            self.client.add({'id': u'hello', 'count': {'inc': 1}}),
+            HTTPRequestError)
+        self.assertEqual(len(self.cluster.nodes['node2'].requests), 1)
+        self.assertEqual(self.cluster.statusRequests, ['node1'])
+
+        self.cluster.lost.clear()
+        self.cluster.refused.add('node2')
+        self.cluster.cluster = _clusterStatus(['node1', 'node1'])
+        self.successResultOf(
+            self.client.add({'id': u'hello', 'count': {'inc': 1}}))
+        self.assertEqual(self._ids('node1'), [u'hello'])
+
+        self.cluster.refused.clear()
+        self.cluster.lost.add('node1')
+        self.client.invalidate()
+        self.successResultOf(self.client.getState())
+        self.cluster.cluster = _clusterStatus(['node2', 'node2'])
+        self.successResultOf(
+            self.client.add({'id': u'hello', 'title': {'set': u'Solr'}}))
+        self.assertEqual(self._ids('node2'), [u'hello'])
+
+    def testUnroutable(self):
+        """
+        Updates of collections that don't use the C{compositeId} router on
+        the unique key are sent to the collection.
+        """
+        self.cluster.cluster = _clusterStatus(['node1', 'node2'],
+                                              routerField='tenant')
+        self.successResultOf(self.client.delete([u'hello', u'abcde']))
+        self.assertEqual(self.cluster.paths('node1'), ['/solr/c/update'])
+
+        self.cluster.cluster = _clusterStatus(['node1', 'node2'],
+                                              router='implicit')
+        self.client.invalidate()
+        self.successResultOf(self.client.add({'id': u'hello'}))
+        self.assertEqual(self.cluster.paths('node1')[-1], '/solr/c/update')
+
+
+class AffinityRouterTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.router = AffinityRouter(balanceFactor=1.5, failureTimeout=30,
+                                     clock=self.clock)
+        self.nodes = ['http://node%d/solr' % i for i in range(4)]
+        self.router.setNodes(self.nodes)
+        self.keys = [u'tenant-%d' % i for i in range(200)]
+
+    def testQueryKey(self):
+        """
+        L{queryKey} ignores the order and the whitespace of the filters, and
+        uses the query if there are none.
+        """
+        self.assertEqual(queryKey(u'q', {'fq': [u'a:1 ', u'b:2']}),
+                         queryKey(u'other', {'fq': [u'b:2', u'a:1']}))
+        self.assertEqual(queryKey(u'q', {'fq': u'a:1'}), u'a:1')
+        self.assertEqual(queryKey(u'q', {}), u'q')
+
+    def testConsistentHashing(self):
+        """
+        Keys always go to the same node, are spread over all the nodes, and
+        only the keys of a removed node move.
+        """
+        first = dict((key, self.router.candidates(key)[0])
+                     for key in self.keys)
+        self.assertEqual(sorted(set(first.values())), self.nodes)
+        self.assertEqual(sorted(self.router.candidates(u'tenant-1')),
+                         self.nodes)
+
+        self.router.setNodes(self.nodes[:3])
+        for key in self.keys:
+            if first[key] != self.nodes[3]:
+                self.assertEqual(self.router.candidates(key)[0], first[key])
+
+    def testBoundedLoad(self):
+        """
+        A key goes to the next node of the ring while its node is over the
+        load bound.
+        """
+        nodes = self.router.candidates(u'hot')
+        for _ in range(3):
+            self.router.acquire(nodes[0])
+        self.assertEqual(self.router.candidates(u'hot'),
+                         nodes[1:] + nodes[:1])
+        for _ in range(3):
+            self.router.release(nodes[0])
+        self.assertEqual(self.router.candidates(u'hot'), nodes)
+
+    def testFailure(self):
+        """
+        Failed nodes are tried last until the failure timeout expires.
+        """
+        nodes = self.router.candidates(u'key')
+        self.router.acquire(nodes[0])
+        self.router.release(nodes[0], failed=True)
+        self.assertEqual(self.router.candidates(u'key'),
+                         nodes[1:] + nodes[:1])
+        self.clock.advance(30)
+        self.assertEqual(self.router.candidates(u'key'), nodes)
+
+
+class CloudSearchTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.cluster = FakeCluster()
+        self.router = AffinityRouter(clock=self.clock)
+        self.client = CloudSolrClient(
+            ['http://node1/solr', 'http://node2/solr'], 'c',
+            transport=self.cluster, queryRouter=self.router, clock=self.clock)
+
+    def _searches(self):
+        searches = []
+        for node in sorted(self.cluster.nodes):
+            for _, url, _ in self.cluster.nodes[node].requests:
+                parsed = urlparse.urlparse(url)
+                if parsed.path.endswith('/select'):
+                    searches.append(
+                        (node, urlparse.parse_qs(parsed.query)))
+        return searches
+
+    def testAffinity(self):
+        """
+        Searches with the same filters are sent to the same node, asking it
+        to prefer its own replicas.
+        """
+        for fq in ([u'a:1', u'b:2'], [u'b:2', u'a:1']):
+            self.successResultOf(self.client.search(u'*:*', fq=fq))
+        searches = self._searches()
+        self.assertEqual(len(searches), 2)
+        self.assertEqual(searches[0][0], searches[1][0])
+        self.assertEqual(searches[0][1]['shards.preference'],
+                         [u'replica.location:local'])
+        self.assertEqual(self.router.inFlight[
+            'http://%s/solr' % searches[0][0]], 0)
+
+        for transport in self.cluster.nodes.itervalues():
+            del transport.requests[:]
+        self.successResultOf(self.client.search(u'*:*',
+                                                affinityKey=u'tenant-1'))
+        [(node, _)] = self._searches()
+        self.assertEqual('http://%s/solr' % node,
+                         self.router.candidates(u'tenant-1')[0])
+
+    def testFailover(self):
+        """
+        If the node of a search fails, the search is sent to the next node
+        of its key, and the failed node is avoided.
+        """
+        self.successResultOf(self.client.search(u'*:*', affinityKey=u'key'))
+        for transport in self.cluster.nodes.itervalues():
+            del transport.requests[:]
+        first, second = self.router.candidates(u'key')
+        self.cluster.down.add(urlparse.urlparse(first).netloc)
+        self.successResultOf(self.client.search(u'*:*', affinityKey=u'key'))
+        self.assertEqual([node for node, _ in self._searches()],
+                         [urlparse.urlparse(second).netloc])
+        self.assertEqual(self.router.candidates(u'key'), [second, first])
+
+        self.cluster.down.add(urlparse.urlparse(second).netloc)
+        self.failureResultOf(
+            self.client.search(u'*:*', affinityKey=u'key'), HTTPWrongStatus)
+
+
+class HedgedSearchTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.cluster = FakeCluster()
+        self.hedging = HedgingPolicy(delay=0.1, clock=self.clock)
+        self.client = CloudSolrClient(
+            ['http://node1/solr', 'http://node2/solr'], 'c',
+            transport=self.cluster, hedging=self.hedging, clock=self.clock)
+
+    def testHedgedSearch(self):
+        """
+        Searches and real-time gets that are slow to answer are sent to the
+        next node, and the slow request is cancelled.
+        """
+        self.cluster.nodes['node2'].index.add({'id': u'doc-1'})
+        self.cluster.nodes['node2'].index.commit()
+        self.cluster.slow.add('node1')
+        for read in (lambda: self.client.search(u'*:*'),
+                     lambda: self.client.get(u'doc-1')):
+            d = read()
+            self.assertNoResult(d)
+            self.clock.advance(0.1)
+            response = self.successResultOf(d)
+            self.assertEqual([doc['id'] for doc in response.results.docs],
+                             [u'doc-1'])
+        self.assertEqual(self.cluster.cancelled, ['node1', 'node1'])
+        self.assertEqual((self.hedging.stats.hedged, self.hedging.stats.wins),
+                         (2, 2))
+
+        self.cluster.slow.clear()
+        self.successResultOf(self.client.search(u'*:*'))
+        self.assertEqual(self.hedging.stats.hedged, 2)
+
+
+class HedgedClusterTest(TestCase):
+
+    def setUp(self):
+        self.slow = NodeResource(stalled=True)
+        self.fast = NodeResource()
+        self.ports = [reactor.listenTCP(0, Site(resource),
+                                        interface='127.0.0.1')
+                      for resource in (self.slow, self.fast)]
+        nodes = ['127.0.0.1:%d' % port.getHost().port
+                 for port in self.ports]
+        cluster = _clusterStatus(nodes)
+        self.slow.cluster = self.fast.cluster = cluster
+        self.urls = ['http://%s/solr' % node for node in nodes]
+        self.router = AffinityRouter()
+        self.client = CloudSolrClient(
+            self.urls, 'c', transport=AgentTransport(reactor),
+            queryRouter=self.router, hedging=HedgingPolicy(delay=0.05))
+
+    def tearDown(self):
+        return gatherResults([port.stopListening() for port in self.ports])
+
+    @inlineCallbacks
+    def testCancelledHedge(self):
+        """
+        When the hedge of a search answers first, the cancelled request to
+        the slow node is not taken for a failure of the node: the search is
+        not sent again and the state is not reloaded.
+        """
+        self.router.setNodes(self.urls)
+        key = [key for key in (u'key-%d' % i for i in range(100))
+               if self.router.candidates(key)[0] == self.urls[0]][0]
+        yield self.client.search(u'*:*', affinityKey=key)
+        yield gatherResults(self.slow.finished)
+        self.assertEqual((self.slow.searches, self.fast.searches), (1, 1))
+        self.assertEqual(self.slow.statusRequests +
+                         self.fast.statusRequests, 1)
+        self.assertEqual(self.router.candidates(key)[0], self.urls[0])
+        self.assertEqual(self.router.inFlight[self.urls[0]], 0)
@@ -0,0 +1,187 @@
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from txsolr.commit import CommitScheduler
+
+
+class FakeClient(object):
+    """A fake L{SolrClient} that records the commits and adds it receives."""
+
+    def __init__(self):
+        self.commits = []
+        self.adds = []
+        self.added = []
+
+    def commit(self, **kwargs):
+        deferred = Deferred()
+        self.commits.append((kwargs, deferred))
+        return deferred
+
+    def add(self, documents, overwrite=None, commitWithin=None):
+        self.adds.append((documents, overwrite, commitWithin))
+        deferred = Deferred()
+        self.added.append(deferred)
+        return deferred
+
+
+class CommitSchedulerTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.client = FakeClient()
+        self.scheduler = CommitScheduler(self.client, minInterval=10,
+                                         clock=self.clock)
+
+    def testCoalesceCommits(self):
+        """
+        L{CommitScheduler.commit} sends a single commit for all the commits
+        requested in the same reactor iteration, and fires all the
+        L{Deferred}s with its result.
+        """
+        deferreds = [self.scheduler.commit() for _ in range(10)]
+        self.clock.advance(0)
+        self.assertEqual(len(self.client.commits), 1)
+
+        results = []
+        for deferred in deferreds:
+            deferred.addCallback(results.append)
+        self.client.commits[0][1].callback('response')
+        self.assertEqual(results, ['response'] * 10)
+
+    def testCommitWhileInProgress(self):
+        """
+        L{CommitScheduler.commit} does not reuse a commit in progress, and
+        coalesces the commits requested meanwhile into the next one.
+        """
+        first = self.scheduler.commit()
+        self.clock.advance(0)
+        second = self.scheduler.commit()
+        third = self.scheduler.commit()
+        self.clock.advance(0)
+        self.assertEqual(len(self.client.commits), 1)
+
+        self.client.commits[0][1].callback('first')
+        self.assertEqual(self.successResultOf(first), 'first')
+        self.assertNoResult(second)
+
+        self.clock.advance(10)
+        self.assertEqual(len(self.client.commits), 2)
+        self.client.commits[1][1].callback('second')
+        self.assertEqual(self.successResultOf(second), 'second')
+        self.assertEqual(self.successResultOf(third), 'second')
+
+    def testMinInterval(self):
+        """
+        L{CommitScheduler} waits C{minInterval} seconds between two hard
+        commits.
+        """
+        self.scheduler.commit()
+        self.clock.advance(0)
+        self.client.commits[0][1].callback(None)
+
+        self.scheduler.commit()
+        self.clock.advance(9)
+        self.assertEqual(len(self.client.commits), 1)
+        self.clock.advance(1)
+        self.assertEqual(len(self.client.commits), 2)
+
+    def testHardCommitAfterSoftCommit(self):
+        """
+        A hard commit requested with a soft commit waits C{minInterval}
+        seconds after the previous hard commit.
+        """
+        self.scheduler.commit()
+        self.clock.advance(0)
+        self.client.commits[0][1].callback(None)
+
+        self.clock.advance(2)
+        self.scheduler.commit(softCommit=True)
+        self.scheduler.commit()
+        self.clock.advance(0)
+        self.assertEqual(len(self.client.commits), 1)
+        self.clock.advance(7)
+        self.assertEqual(len(self.client.commits), 1)
+        self.clock.advance(1)
+        self.assertEqual(len(self.client.commits), 2)
+        self.assertEqual(self.client.commits[1][0]['softCommit'], None)
+
+    def testSoftCommitsAreNotDelayed(self):
+        """
+        L{CommitScheduler} sends soft commits without waiting for
+        C{minInterval}.
+        """
+        self.scheduler.commit()
+        self.clock.advance(0)
+        self.client.commits[0][1].callback(None)
+
+        self.scheduler.commit(softCommit=True)
+        self.clock.advance(0)
+        self.assertEqual(len(self.client.commits), 2)
+        self.assertTrue(self.client.commits[1][0]['softCommit'])
+
+    def testMergeOptions(self):
+        """
+        L{CommitScheduler} sends a hard commit that opens a new searcher if
+        the coalesced requests ask for different options.
+        """
+        self.scheduler.commit(softCommit=True)
+        self.scheduler.commit(openSearcher=False)
+        self.scheduler.commit(openSearcher=True, waitSearcher=True)
+        self.clock.advance(0)
+        options = self.client.commits[0][0]
+        self.assertEqual(options['softCommit'], None)
+        self.assertEqual(options['openSearcher'], True)
+        self.assertEqual(options['waitSearcher'], True)
+        self.assertEqual(options['expungeDeletes'], None)
+
+    def testFailedCommit(self):
+        """
+        L{CommitScheduler.commit} errbacks all the coalesced requests if the
+        commit fails.
+        """
+        deferreds = [self.scheduler.commit() for _ in range(3)]
+        self.clock.advance(0)
+        self.client.commits[0][1].errback(ValueError('boom'))
+        for deferred in deferreds:
+            self.failureResultOf(deferred, ValueError)
+
+    def testCommitWithin(self):
+        """
+        L{CommitScheduler} translates hard commits into C{commitWithin} when
+        configured to do so.
+        """
+        scheduler = CommitScheduler(self.client, commitWithin=500,
+                                    clock=self.clock)
+        deferred = scheduler.commit()
+        self.clock.advance(0.4)
+        self.assertNoResult(deferred)
+        self.clock.advance(0.1)
+        self.successResultOf(deferred)
+
+        scheduler.add({'id': 1})
+        self.assertEqual(self.client.adds, [({'id': 1}, None, 500)])
+        deferred = scheduler.commit()
+        self.clock.advance(1)
+        self.assertNoResult(deferred)
+        self.client.added[0].callback(None)
+        self.clock.advance(0.4)
+        self.assertNoResult(deferred)
+        self.clock.advance(0.1)
+        self.successResultOf(deferred)
+        self.assertEqual(self.client.commits, [])
+
+        deferred = scheduler.commit()
+        self.clock.advance(0)
+        self.successResultOf(deferred)
+
+    def testCommitWithinOptions(self):
+        """
+        With C{commitWithin}, hard commits with options are sent to Solr.
+        """
+        scheduler = CommitScheduler(self.client, commitWithin=500,
+                                    clock=self.clock)
+        scheduler.commit(expungeDeletes=True)
+        self.clock.advance(0)
+        self.assertEqual(len(self.client.commits), 1)
+        self.assertEqual(self.client.commits[0][0]['expungeDeletes'], True)
@@ -0,0 +1,232 @@
+import json
+
+from twisted.internet import reactor
+from twisted.internet.defer import (Deferred, TimeoutError, inlineCallbacks,
+                                    succeed, fail)
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET, Site
+
+from txsolr.client import SolrClient
+from txsolr.errors import HTTPWrongStatus
+from txsolr.fanout import FanOutSearcher
+from txsolr.response import JSONSolrResponse
+from txsolr.transport import AgentTransport
+
+
+def _response(docs, numFound=None, facetFields=None, facetQueries=None):
+    response = {'responseHeader': {'status': 0, 'QTime': 0},
+                'response': {'numFound': numFound or len(docs), 'start': 0,
+                             'docs': docs}}
+    if docs and 'score' in docs[0]:
+        response['response']['maxScore'] = docs[0]['score']
+    if facetFields is not None or facetQueries is not None:
+        response['facet_counts'] = {'facet_fields': facetFields or {},
+                                    'facet_queries': facetQueries or {}}
+    return JSONSolrResponse(json.dumps(response))
+
+
+class FakeClient(object):
+    """A fake L{SolrClient} that answers searches with a given result."""
+
+    def __init__(self, result):
+        self.result = result
+        self.searches = []
+
+    def search(self, query, **kwargs):
+        self.searches.append((query, kwargs))
+        if isinstance(self.result, Deferred):
+            return self.result
+        if isinstance(self.result, Exception):
+            return fail(self.result)
+        return succeed(self.result)
+
+
+class StalledResource(Resource):
+    """A resource that never answers, recording when requests are closed."""
+
+    isLeaf = True
+
+    def __init__(self):
+        Resource.__init__(self)
+        self.finished = []
+
+    def render_GET(self, request):
+        self.finished.append(request.notifyFinish())
+        return NOT_DONE_YET
+
+
+class FanOutSearcherTest(TestCase):
+
+    def testMergeByScore(self):
+        """
+        L{FanOutSearcher.search} merges the top documents of all the cores
+        by score, and adds up the number of documents found.
+        """
+        clients = {
+            'a': FakeClient(_response([{'id': 'a1', 'score': 3.0},
+                                       {'id': 'a2', 'score': 1.0}], 5)),
+            'b': FakeClient(_response([{'id': 'b1', 'score': 2.0},
+                                       {'id': 'b2', 'score': 1.0}], 7))}
+        searcher = FanOutSearcher(clients)
+        results = self.successResultOf(searcher.search(u'title:solr',
+                                                       start=1, rows=2))
+        self.assertEqual(results.hits, [('b', {'id': 'b1', 'score': 2.0}),
+                                         ('a', {'id': 'a2', 'score': 1.0})])
+        self.assertEqual(results.numFound, 12)
+        self.assertEqual(results.maxScore, 3.0)
+        self.assertFalse(results.partial)
+
+        query, params = clients['a'].searches[0]
+        self.assertEqual(query, u'title:solr')
+        self.assertEqual(params, {'start': 0, 'rows': 3, 'fl': '*,score'})
+
+    def testMergeBySortFields(self):
+        """
+        L{FanOutSearcher.search} merges the documents by the sort fields,
+        adding them to the field list, and sorts documents without a value
+        last.
+        """
+        clients = {
+            'a': FakeClient(_response([{'id': 'a1', 'price': 10},
+                                       {'id': 'a2', 'price': 5},
+                                       {'id': 'a3'}])),
+            'b': FakeClient(_response([{'id': 'b1', 'price': 10},
+                                       {'id': 'b2', 'price': 7}]))}
+        searcher = FanOutSearcher(clients)
+        results = self.successResultOf(searcher.search(
+            u'*:*', rows=10, sort='price desc, id asc', fl='id'))
+        self.assertEqual([doc['id'] for doc in results.docs],
+                         ['a1', 'b1', 'b2', 'a2', 'a3'])
+        self.assertEqual(clients['b'].searches[0][1]['fl'], 'id,price')
+
+    def testMergeBySortFunction(self):
+        """
+        L{FanOutSearcher.search} merges the documents by the value of sort
+        functions, which are added to the field list even if it has C{*}.
+        """
+        clients = {
+            'a': FakeClient(_response([{'id': 'a1', 'div(price, 2)': 5.0},
+                                       {'id': 'a2', 'div(price, 2)': 1.0}])),
+            'b': FakeClient(_response([{'id': 'b1', 'div(price, 2)': 3.0}]))}
+        searcher = FanOutSearcher(clients)
+        results = self.successResultOf(searcher.search(
+            u'*:*', sort="div(price, 2) desc,field('id') asc",
+            fl='*,sum(a,b)'))
+        self.assertEqual([doc['id'] for doc in results.docs],
+                         ['a1', 'b1', 'a2'])
+        self.assertEqual(clients['a'].searches[0][1]['fl'],
+                         "*,sum(a,b),div(price, 2),field('id')")
+
+    def testFacetCounts(self):
+        """
+        L{FanOutSearcher.search} adds up the facet counts of all the cores,
+        and sorts the terms by count.
+        """
+        clients = {
+            'a': FakeClient(_response([], facetFields={'cat': ['x', 3,
+                                                               'y', 1]},
+                                      facetQueries={'price:[* TO 5]': 2})),
+            'b': FakeClient(_response([], facetFields={'cat': ['y', 4,
+                                                               'z', 1]},
+                                      facetQueries={'price:[* TO 5]': 1}))}
+        searcher = FanOutSearcher(clients)
+        results = self.successResultOf(searcher.search(
+            u'*:*', facet='true', facet_field='cat', facet_limit=2))
+        self.assertEqual(results.facetCounts.field('cat').top(10),
+                         [('y', 5), ('x', 3)])
+        self.assertEqual(results.facetCounts.queries,
+                         {'price:[* TO 5]': 3})
+
+    def testFieldFacetLimits(self):
+        """
+        The C{f.<field>.facet.limit} parameter of a field overrides
+        C{facet.limit} for its merged counts.
+        """
+        facetFields = {'cat': ['x', 3, 'y', 2, 'z', 1],
+                       'tag': ['x', 3, 'y', 2, 'z', 1]}
+        searcher = FanOutSearcher(
+            {'a': FakeClient(_response([], facetFields=facetFields))})
+        results = self.successResultOf(searcher.search(
+            u'*:*', facet='true', facet_field=['cat', 'tag'], facet_limit=2,
+            f_tag_facet_limit=1))
+        self.assertEqual(results.facetCounts.field('cat').top(10),
+                         [('x', 3), ('y', 2)])
+        self.assertEqual(results.facetCounts.field('tag').top(10),
+                         [('x', 3)])
+
+    def testPartialResults(self):
+        """
+        L{FanOutSearcher.search} reports the cores that failed or timed out,
+        and returns the results of the other ones.
+        """
+        clock = Clock()
+        clients = {'a': FakeClient(_response([{'id': 'a1', 'score': 1.0}])),
+                   'b': FakeClient(HTTPWrongStatus(500)),
+                   'c': FakeClient(Deferred())}
+        searcher = FanOutSearcher(clients, timeout=5, clock=clock)
+        d = searcher.search(u'*:*')
+        self.assertNoResult(d)
+        clock.advance(5)
+
+        results = self.successResultOf(d)
+        self.assertTrue(results.partial)
+        self.assertEqual(results.docs, [{'id': 'a1', 'score': 1.0}])
+        self.assertEqual(sorted(results.failures), ['b', 'c'])
+        self.assertTrue(results.failures['b'].check(HTTPWrongStatus))
+        self.assertTrue(results.failures['c'].check(TimeoutError))
+        self.assertEqual(results.responses.keys(), ['a'])
+
+    def testAllFailed(self):
+        """
+        L{FanOutSearcher.search} fails if none of the cores returned results.
+        """
+        searcher = FanOutSearcher({'a': FakeClient(HTTPWrongStatus(500))})
+        self.failureResultOf(searcher.search(u'*:*'), HTTPWrongStatus)
+
+    def testConcurrency(self):
+        """
+        L{FanOutSearcher.search} sends at most C{concurrency} queries at
+        once.
+        """
+        pending = [Deferred() for i in range(3)]
+        clients = dict((str(i), FakeClient(d))
+                       for i, d in enumerate(pending))
+        searcher = FanOutSearcher(clients, concurrency=2)
+        d = searcher.search(u'*:*')
+        self.assertEqual([len(clients[str(i)].searches) for i in range(3)],
+                         [1, 1, 0])
+        pending[0].callback(_response([]))
+        self.assertEqual(len(clients['2'].searches), 1)
+        pending[1].callback(_response([]))
+        pending[2].callback(_response([]))
+        self.assertEqual(self.successResultOf(d).numFound, 0)
+
+
+class FanOutTimeoutTest(TestCase):
+
+    def setUp(self):
+        self.resource = StalledResource()
+        self.port = reactor.listenTCP(0, Site(self.resource),
+                                      interface='127.0.0.1')
+        self.url = 'http://127.0.0.1:%d/solr' % self.port.getHost().port
+
+    def tearDown(self):
+        return self.port.stopListening()
+
+    @inlineCallbacks
+    def testTimeout(self):
+        """
+        A core of a L{SolrClient} that doesn't answer in time is reported as
+        timed out, and its HTTP request is stopped.
+        """
+        clients = {
+            'a': FakeClient(_response([{'id': 'a1', 'score': 1.0}])),
+            'b': SolrClient(self.url, transport=AgentTransport(reactor))}
+        searcher = FanOutSearcher(clients, timeout=0.5)
+        results = yield searcher.search(u'*:*')
+        self.assertEqual(results.docs, [{'id': 'a1', 'score': 1.0}])
+        self.assertTrue(results.failures['b'].check(TimeoutError))
+        [finished] = self.resource.finished
+        yield self.assertFailure(finished, Exception)
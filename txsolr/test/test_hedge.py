@@ -0,0 +1,247 @@
+from twisted.internet import reactor
+from twisted.internet.defer import (CancelledError, Deferred, fail,
+                                    gatherResults, inlineCallbacks, succeed)
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET, Site
+
+from txsolr.client import SolrClient
+from txsolr.errors import HTTPWrongStatus
+from txsolr.hedge import HedgingPolicy
+from txsolr.transport import AgentTransport
+
+
+class PendingTransport(object):
+    """
+    A transport whose requests never answer, recording the ones cancelled.
+    """
+
+    def __init__(self):
+        self.cancelled = 0
+
+    def request(self, method, url, headers, bodyProducer):
+        def cancel(d):
+            self.cancelled += 1
+        return Deferred(cancel)
+
+
+class StalledResource(Resource):
+    """
+    A resource that never finishes its responses, optionally writing the
+    start of the body.
+    """
+
+    isLeaf = True
+
+    def __init__(self, body=None):
+        Resource.__init__(self)
+        self.body = body
+        self.finished = []
+        self._waiting = []
+
+    def render_GET(self, request):
+        self.finished.append(request.notifyFinish())
+        if self.body is not None:
+            request.setHeader('Content-Type', 'application/json')
+            request.write(self.body)
+        for count, d in list(self._waiting):
+            if len(self.finished) >= count:
+                self._waiting.remove((count, d))
+                d.callback(None)
+        return NOT_DONE_YET
+
+    def received(self, count):
+        """
+        Returns a L{Deferred} that fires once C{count} requests arrived.
+        """
+        if len(self.finished) >= count:
+            return succeed(None)
+        d = Deferred()
+        self._waiting.append((count, d))
+        return d
+
+    def closed(self):
+        """
+        Returns a L{Deferred} that fires once all the connections are lost.
+        """
+        return gatherResults([d.addErrback(lambda _: None)
+                              for d in self.finished])
+
+
+class HedgingPolicyTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.policy = HedgingPolicy(delay=0.1, budget=0.5, burst=1,
+                                    clock=self.clock)
+        self.requests = []
+        self.cancelled = []
+
+    def _send(self, name):
+        def send():
+            d = Deferred(lambda _: self.cancelled.append(name))
+            self.requests.append((name, d))
+            return d
+        return send
+
+    def _hedged(self):
+        return self.policy.run(self._send('primary'), self._send('hedge'))
+
+    def testFastResponse(self):
+        """
+        A request answering before the delay is not hedged.
+        """
+        result = self._hedged()
+        self.requests[0][1].callback('response')
+        self.assertEqual(self.successResultOf(result), 'response')
+        self.clock.advance(1)
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(self.policy.stats.hedged, 0)
+
+        result = self.policy.run(lambda: succeed('sync'), self._send('h'))
+        self.assertEqual(self.successResultOf(result), 'sync')
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def testHedgeWins(self):
+        """
+        A slow request is hedged after the delay, the first response wins
+        and the other request is cancelled.
+        """
+        result = self._hedged()
+        self.clock.advance(0.1)
+        self.assertEqual([name for name, _ in self.requests],
+                         ['primary', 'hedge'])
+        self.requests[1][1].callback('hedged')
+        self.assertEqual(self.successResultOf(result), 'hedged')
+        self.assertEqual(self.cancelled, ['primary'])
+        stats = self.policy.stats
+        self.assertEqual((stats.requests, stats.hedged, stats.wins),
+                         (1, 1, 1))
+        self.assertEqual(stats.winRate, 1.0)
+
+    def testFailures(self):
+        """
+        A request failing before the delay is not hedged. Once hedged, a
+        failure waits for the other request, and the first failure is
+        returned if both fail.
+        """
+        result = self.policy.run(lambda: fail(HTTPWrongStatus(400)),
+                                 self._send('hedge'))
+        self.failureResultOf(result, HTTPWrongStatus)
+        self.assertEqual(self.requests, [])
+
+        result = self._hedged()
+        self.clock.advance(0.1)
+        self.requests[0][1].errback(HTTPWrongStatus(500))
+        self.assertNoResult(result)
+        self.requests[1][1].errback(ValueError())
+        error = self.failureResultOf(result, HTTPWrongStatus).value
+        self.assertEqual(error.args, (500,))
+
+    def testBudget(self):
+        """
+        Hedges are skipped once the budget is exhausted, and allowed again
+        as requests add to it.
+        """
+        self._hedged()
+        self.clock.advance(0.1)
+        self._hedged()
+        self.clock.advance(0.1)
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual(self.policy.stats.skipped, 1)
+        self._hedged()
+        self.clock.advance(0.1)
+        self.assertEqual(len(self.requests), 5)
+        self.assertEqual(self.policy.stats.hedgeRate, 2 / 3.0)
+
+    def testPercentile(self):
+        """
+        With a percentile, the delay is the percentile of the observed
+        latencies once there are enough of them.
+        """
+        self.policy.percentile = 90
+        for latency in range(1, 21):
+            result = self.policy.run(self._send('primary'), lambda: None)
+            self.clock.advance(latency / 1000.0)
+            self.requests[-1][1].callback(None)
+            self.successResultOf(result)
+        self.assertAlmostEqual(self.policy.delay, 0.019)
+
+    def testCancel(self):
+        """
+        Cancelling the result cancels the requests in flight, and cancelling
+        a L{SolrClient} request cancels the HTTP request.
+        """
+        transport = PendingTransport()
+        client = SolrClient('http://solr', transport=transport)
+        result = self.policy.run(lambda: client.search(u'*:*'),
+                                 lambda: client.search(u'*:*'))
+        self.clock.advance(0.1)
+        result.cancel()
+        self.failureResultOf(result, CancelledError)
+        self.assertEqual(transport.cancelled, 2)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+class HeadTransport(AgentTransport):
+    """
+    An L{AgentTransport} whose C{received} L{Deferred} fires in the reactor
+    iteration following the reception of a response head.
+    """
+
+    def __init__(self):
+        AgentTransport.__init__(self, reactor)
+        self.received = Deferred()
+
+    def request(self, method, url, headers, bodyProducer):
+        d = AgentTransport.request(self, method, url, headers, bodyProducer)
+        return d.addCallback(self._headReceived)
+
+    def _headReceived(self, response):
+        reactor.callLater(0, self.received.callback, None)
+        return response
+
+
+class AgentCancelTest(TestCase):
+
+    def _listen(self, body=None):
+        self.resource = StalledResource(body)
+        self.port = reactor.listenTCP(0, Site(self.resource),
+                                      interface='127.0.0.1')
+        url = 'http://127.0.0.1:%d/solr' % self.port.getHost().port
+        return SolrClient(url, transport=AgentTransport(reactor))
+
+    def tearDown(self):
+        return self.port.stopListening()
+
+    @inlineCallbacks
+    def testCancelHedge(self):
+        """
+        Cancelling hedged requests sent with an L{AgentTransport} fails with
+        L{CancelledError}, not with the error wrapping it in the L{Agent}.
+        """
+        clock = Clock()
+        policy = HedgingPolicy(delay=0.1, clock=clock)
+        client = self._listen()
+        result = policy.run(lambda: client.search(u'*:*'),
+                            lambda: client.search(u'*:*'))
+        clock.advance(0.1)
+        yield self.resource.received(2)
+        result.cancel()
+        self.failureResultOf(result, CancelledError)
+        yield self.resource.closed()
+
+    @inlineCallbacks
+    def testCancelBody(self):
+        """
+        Cancelling a request while its body is received stops the transport
+        and fails with L{CancelledError} only once.
+        """
+        client = self._listen('{"responseHeader": ')
+        client.transport = HeadTransport()
+        result = client.search(u'*:*')
+        yield client.transport.received
+        result.cancel()
+        self.failureResultOf(result, CancelledError)
+        yield self.resource.closed()
@@ -1,7 +1,9 @@
 import unittest
 from datetime import datetime, date
 
-from txsolr.input import SimpleXMLInputFactory, escapeTerm
+from txsolr.errors import InputError
+from txsolr.input import (SimpleXMLInputFactory, diffDocuments, escapeTerm,
+                          escapeTerms, joinTerms, termsQuery)
 
 
 class EscapingTest(unittest.TestCase):
@@ -16,6 +18,53 @@ class EscapingTest(unittest.TestCase):
         for raw, escaped in terms:
             self.assertEqual(escapeTerm(raw), escaped)
 
+    def testEscapeTermOperatorsAndSlash(self):
+        """
+        L{escapeTerm} escapes the C{&&} and C{||} operators and regular
+        expression delimiters.
+        """
+        self.assertEqual(escapeTerm('a && b || c'), r'a \&\& b \|\| c')
+        self.assertEqual(escapeTerm('/path/to'), r'\/path\/to')
+        self.assertEqual(escapeTerm(r'back\slash'), r'back\\slash')
+
+    def testEscapeTermUnicode(self):
+        """L{escapeTerm} keeps the type of C{unicode} terms."""
+        escaped = escapeTerm(u'\u30ab:\u30ab')
+        self.assertEqual(escaped, u'\u30ab\\:\u30ab')
+        self.assert_(isinstance(escaped, unicode))
+
+    def testEscapeTerms(self):
+        """L{escapeTerms} escapes special characters and whitespace."""
+        self.assertEqual(escapeTerms(['a b', 'c:d', 'e']),
+                         [r'a\ b', r'c\:d', 'e'])
+
+    def testJoinTerms(self):
+        """L{joinTerms} escapes and joins terms in a boolean group."""
+        self.assertEqual(joinTerms(['a', 'b:c', 'd e']),
+                         r'(a OR b\:c OR d\ e)')
+        self.assertEqual(joinTerms(['a', 'b'], field='id', operator='AND'),
+                         'id:(a AND b)')
+        self.assertRaises(InputError, joinTerms, [])
+
+    def testTermsQuery(self):
+        """L{termsQuery} builds a query for the C{terms} query parser."""
+        self.assertEqual(termsQuery('id', ['a:b', 'c']), '{!terms f=id}a:b,c')
+        self.assertEqual(termsQuery('id', ['a,b', 'c'], separator='|'),
+                         "{!terms f=id separator='|'}a,b|c")
+        self.assertRaises(InputError, termsQuery, 'id', ['a,b'])
+        self.assertRaises(InputError, termsQuery, 'id', [])
+
+    def testTermsQuerySeparator(self):
+        """
+        Without a separator, L{termsQuery} uses one that is not in the terms.
+        """
+        self.assertEqual(termsQuery('id', ['a', 'b'], None),
+                         '{!terms f=id}a,b')
+        self.assertEqual(termsQuery('id', ['a,b', 'c'], None),
+                         "{!terms f=id separator='|'}a,b|c")
+        self.assertEqual(termsQuery('id', ['a,|;\t||', 'c'], None),
+                         "{!terms f=id separator='|||'}a,|;\t|||||c")
+
 
 class SimpleXMLInputFactoryTest(unittest.TestCase):
 
@@ -80,6 +129,55 @@ class SimpleXMLInputFactoryTest(unittest.TestCase):
         input = self.input.createAdd(document).body
         self.assertEqual(input, expected, 'Wrong input')
 
+    def testCreateAddAtomicUpdate(self):
+        """
+        L{SimpleXMLInputFactory.createAdd} creates atomic updates for the
+        fields with a C{dict} of modifiers, and removes the values of the
+        fields set to C{None}.
+        """
+        document = {'id': 1, 'tags': {'add': ['a', 'b']},
+                    'title': {'set': None}}
+        input = self.input.createAdd(document).body
+        self.assertIn('<field name="id">1</field>', input)
+        self.assertIn('<field name="tags" update="add">a</field>'
+                      '<field name="tags" update="add">b</field>', input)
+        self.assertIn('<field name="title" null="true" update="set" />',
+                      input)
+        self.assertRaises(InputError, self.input.createAdd,
+                          {'id': 1, 'count': {'increment': 1}})
+
+    def testCreateAddWithChildDocuments(self):
+        """
+        L{SimpleXMLInputFactory.createAdd} writes the anonymous children of
+        a document as nested C{doc} elements, and the labeled children as
+        C{doc} elements inside their field.
+        """
+        document = {'id': 1,
+                    '_childDocuments_': [{'id': 2}, {'id': 3}],
+                    'comments': [{'id': 4, 'text': '<b>'}]}
+        input = self.input.createAdd(document).body
+        self.assertEqual(input,
+                         '<add><doc><field name="id">1</field>'
+                         '<field name="comments"><doc>'
+                         '<field name="text">&lt;b&gt;</field>'
+                         '<field name="id">4</field></doc></field>'
+                         '<doc><field name="id">2</field></doc>'
+                         '<doc><field name="id">3</field></doc>'
+                         '</doc></add>')
+
+    def testCreateAddEscaping(self):
+        """
+        L{SimpleXMLInputFactory.createAdd} escapes the values and the names
+        of the fields.
+        """
+        document = {'a"&\n': u'x"<>&\n'}
+        self.assertEqual(self.input.createAdd(document).body,
+                         '<add><doc><field name="a&quot;&amp;&#10;">'
+                         'x"&lt;&gt;&amp;\n</field></doc></add>')
+        self.assertEqual(self.input.createAdd([]).body, '<add />')
+        self.assertEqual(self.input.createAdd({}).body,
+                         '<add><doc /></add>')
+
     def testCreateAddWithWrongValues(self):
         """
         L{SimpleXMLInputFactory.createAdd} raises C{AttributeError} if one of
@@ -112,6 +210,29 @@ class SimpleXMLInputFactoryTest(unittest.TestCase):
         input = self.input.createAdd(document, commitWithin=80).body
         self.assertEqual(input, expected, 'Wrong input')
 
+    def testCreateAddWithOptions(self):
+        """
+        L{SimpleXMLInputFactory.createAdd} writes the options of the C{add}
+        element in alphabetical order, like L{ElementTree} did.
+        """
+        self.assertEqual(
+            self.input.createAdd({'id': 1}, overwrite=False,
+                                 commitWithin=80).body,
+            '<add commitWithin="80" overwrite="false">'
+            '<doc><field name="id">1</field></doc></add>')
+
+    def testCreateAddFieldNames(self):
+        """
+        L{SimpleXMLInputFactory.createAdd} encodes the C{unicode} names of
+        the fields as UTF-8, and writes the names given as C{str} unchanged.
+        """
+        input = self.input.createAdd({u'\xe9': {'set': 1}}).body
+        self.assertEqual(input, '<add><doc><field name="\xc3\xa9" '
+                         'update="set">1</field></doc></add>')
+        input = self.input.createAdd({'\xc3\xa9': 1}).body
+        self.assertEqual(input, '<add><doc><field name="\xc3\xa9">1</field>'
+                         '</doc></add>')
+
     def testCreateDelete(self):
         """
         L{SimpleXMLInputFactory.createDelete} creates a correct body for a
@@ -183,6 +304,24 @@ class SimpleXMLInputFactoryTest(unittest.TestCase):
         expected = '<commit expungeDeletes="true" />'
         self.assertEqual(input, expected)
 
+    def testCommitSoftCommit(self):
+        """
+        L{SimpleXMLInputFactory.createCommit} can add a C{softCommit}
+        parameter.
+        """
+        input = self.input.createCommit(softCommit=True).body
+        expected = '<commit softCommit="true" />'
+        self.assertEqual(input, expected)
+
+    def testCommitOpenSearcher(self):
+        """
+        L{SimpleXMLInputFactory.createCommit} can add an C{openSearcher}
+        parameter.
+        """
+        input = self.input.createCommit(openSearcher=False).body
+        expected = '<commit openSearcher="false" />'
+        self.assertEqual(input, expected)
+
     def testOptimize(self):
         """
         L{SimpleXMLInputFactory.createOptimize} creates a correct body for an
@@ -218,3 +357,28 @@ class SimpleXMLInputFactoryTest(unittest.TestCase):
         input = self.input.createOptimize(maxSegments=2).body
         expected = '<optimize maxSegments="2" />'
         self.assertEqual(input, expected)
+
+
+class DiffDocumentsTest(unittest.TestCase):
+
+    def testDiff(self):
+        """
+        L{diffDocuments} sets the changed and new fields, and removes the
+        missing ones.
+        """
+        old = {'id': 'a', 'x': 1, 'y': 2, 'z': [1, 2], '_version_': 7}
+        new = {'id': 'a', 'x': 1, 'z': [1, 2, 3], 'w': True}
+        self.assertEqual(diffDocuments(old, new),
+                         {'id': 'a', 'y': {'set': None},
+                          'z': {'set': [1, 2, 3]}, 'w': {'set': True}})
+
+    def testVersionAndNoChanges(self):
+        """
+        L{diffDocuments} includes the C{_version_} of the old document if
+        asked, and returns C{None} if nothing changed.
+        """
+        old = {'key': 'a', 'x': 1, '_version_': 7}
+        self.assertEqual(diffDocuments(old, {'key': 'a', 'x': 2}, 'key',
+                                       checkVersion=True),
+                         {'key': 'a', 'x': {'set': 2}, '_version_': 7})
+        self.assertIsNone(diffDocuments(old, {'key': 'a', 'x': 1}, 'key'))
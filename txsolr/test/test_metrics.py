@@ -0,0 +1,191 @@
+import json
+from urlparse import urlparse
+
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from txsolr.bulk import BulkIndexer
+from txsolr.client import SolrClient
+from txsolr.commit import CommitScheduler
+from txsolr.errors import HTTPWrongStatus
+from txsolr.metrics import (CacheStats, IndexStats, StatsPoller,
+                            adaptBatchSize, adaptCommitInterval)
+from txsolr.testing import FakeResponse
+
+
+def _luke(numDocs, segmentCount):
+    return {'responseHeader': {'status': 0, 'QTime': 1},
+            'index': {'numDocs': numDocs, 'maxDoc': numDocs + 5,
+                      'deletedDocs': 5, 'segmentCount': segmentCount,
+                      'version': 12}}
+
+
+def _mbeans(lookups, hits, warmupTime=0):
+    stats = {'CACHE.searcher.filterCache.lookups': 1,
+             'CACHE.searcher.filterCache.hits': 1,
+             'CACHE.searcher.filterCache.cumulative_lookups': lookups,
+             'CACHE.searcher.filterCache.cumulative_hits': hits,
+             'CACHE.searcher.filterCache.cumulative_evictions': 0,
+             'CACHE.searcher.filterCache.size': 10,
+             'CACHE.searcher.filterCache.warmupTime': warmupTime}
+    return {'responseHeader': {'status': 0, 'QTime': 1},
+            'solr-mbeans': ['CACHE', {'filterCache': {'stats': stats}}]}
+
+
+class StatsTransport(object):
+    """
+    A transport answering the Luke and MBeans requests with the bodies set
+    in its attributes.
+    """
+
+    def __init__(self):
+        self.luke = _luke(100, 3)
+        self.mbeans = _mbeans(0, 0)
+        self.paths = []
+        self.pending = None
+
+    def request(self, method, url, headers, bodyProducer):
+        path = urlparse(url).path
+        self.paths.append(path)
+        if self.pending is not None:
+            return self.pending
+        if self.luke is None:
+            return succeed(FakeResponse(500, ''))
+        body = self.luke if path.endswith('/luke') else self.mbeans
+        return succeed(FakeResponse(200, json.dumps(body)))
+
+
+class StatsTest(TestCase):
+
+    def testIndexStats(self):
+        """
+        L{IndexStats.fromLuke} computes the missing counts from the ones
+        given.
+        """
+        stats = IndexStats.fromLuke({'numDocs': 10, 'maxDoc': 12})
+        self.assertEqual((stats.deletedDocs, stats.segmentCount,
+                          stats.sizeInBytes), (2, 0, None))
+
+    def testCacheStats(self):
+        """
+        L{CacheStats.fromMBean} prefers the cumulative counters, and
+        supports the names of older versions of Solr.
+        """
+        stats = CacheStats.fromMBean('queryResultCache',
+                                     {'lookups': 8, 'hits': 2, 'size': 3})
+        self.assertEqual((stats.lookups, stats.hits, stats.size), (8, 2, 3))
+        self.assertEqual(stats.hitRatio, 0.25)
+        self.assertIdentical(CacheStats('c', 0, 0).hitRatio, None)
+
+
+class StatsPollerTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.transport = StatsTransport()
+        self.client = SolrClient('http://solr/core', transport=self.transport)
+        self.poller = StatsPoller(self.client, 60, self.clock)
+
+    def testPoll(self):
+        """
+        L{StatsPoller.poll} fetches the index and the cache statistics in a
+        L{StatsSnapshot}.
+        """
+        snapshot = self.successResultOf(self.poller.poll())
+        self.assertEqual(sorted(self.transport.paths),
+                         ['/core/admin/luke', '/core/admin/mbeans'])
+        self.assertEqual((snapshot.index.numDocs, snapshot.index.maxDoc,
+                          snapshot.index.segmentCount), (100, 105, 3))
+        self.assertEqual(snapshot.caches.keys(), ['filterCache'])
+        self.assertIdentical(self.poller.delta, None)
+
+    def testDelta(self):
+        """
+        The L{StatsDelta} of two snapshots gives the hit ratio of a cache
+        during the interval, or since the reload of the core if its counters
+        went back.
+        """
+        observed = []
+        self.poller.addObserver(lambda *args: observed.append(args))
+        self.transport.mbeans = _mbeans(100, 50)
+        self.poller.start()
+        self.transport.mbeans = _mbeans(200, 140)
+        self.transport.luke = _luke(150, 4)
+        self.clock.advance(60)
+
+        delta = self.poller.delta
+        self.assertEqual(delta.interval, 60)
+        self.assertEqual((delta.documents, delta.segments), (50, 1))
+        self.assertEqual(delta.lookups('filterCache'), 100)
+        self.assertEqual(delta.hitRatio('filterCache'), 0.9)
+        self.assertIdentical(delta.hitRatio('documentCache'), None)
+        self.assertEqual([delta for _, delta in observed][0], None)
+        self.assertEqual(observed[1][0], self.poller.snapshot)
+
+        self.transport.mbeans = _mbeans(10, 2)
+        self.clock.advance(60)
+        self.assertEqual(self.poller.delta.hitRatio('filterCache'), 0.2)
+
+    def testSchedule(self):
+        """
+        Failed polls don't stop the schedule, polls are skipped while the
+        previous one is in progress, and L{StatsPoller.stop} stops polling.
+        """
+        self.transport.luke = None
+        self.failureResultOf(self.poller.poll(), HTTPWrongStatus)
+        self.poller.start()
+        self.assertIdentical(self.poller.snapshot, None)
+
+        self.transport.pending = Deferred()
+        self.clock.advance(60)
+        self.clock.advance(60)
+        self.assertEqual(len(self.transport.paths), 6)
+
+        self.poller.stop()
+        self.clock.advance(60)
+        self.assertEqual(len(self.transport.paths), 6)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+class AdaptTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.transport = StatsTransport()
+        self.client = SolrClient('http://solr/core', transport=self.transport)
+        self.poller = StatsPoller(self.client, 60, self.clock)
+
+    def testAdaptBatchSize(self):
+        """
+        L{adaptBatchSize} halves the maximum batch size of an indexer while
+        the index has too many segments, and restores it afterwards.
+        """
+        indexer = BulkIndexer(self.client, minBatchSize=100,
+                              maxBatchSize=1000, clock=self.clock)
+        self.poller.addObserver(adaptBatchSize(indexer, maxSegments=10))
+        self.transport.luke = _luke(100, 20)
+        for expected in (500, 250, 125, 100):
+            self.successResultOf(self.poller.poll())
+            self.assertEqual(indexer.maxBatchSize, expected)
+
+        self.transport.luke = _luke(100, 5)
+        for expected in (200, 400, 800, 1000, 1000):
+            self.successResultOf(self.poller.poll())
+            self.assertEqual(indexer.maxBatchSize, expected)
+
+    def testAdaptCommitInterval(self):
+        """
+        L{adaptCommitInterval} keeps the hard commits slower than the warmup
+        of the caches.
+        """
+        scheduler = CommitScheduler(self.client, minInterval=1,
+                                    clock=self.clock)
+        self.poller.addObserver(adaptCommitInterval(scheduler))
+        self.transport.mbeans = _mbeans(0, 0, warmupTime=3000)
+        self.successResultOf(self.poller.poll())
+        self.assertEqual(scheduler.minInterval, 6)
+
+        self.transport.mbeans = _mbeans(0, 0, warmupTime=100)
+        self.successResultOf(self.poller.poll())
+        self.assertEqual(scheduler.minInterval, 1)
@@ -0,0 +1,76 @@
+import urlparse
+
+from twisted.trial.unittest import TestCase
+
+from txsolr.errors import HTTPWrongStatus, VersionConflictError
+from txsolr.request import (checkStatus, encodeParameters, queryRequest,
+                            updateRequest)
+
+
+class EncodeParametersTest(TestCase):
+
+    def testEncodeParameters(self):
+        """
+        L{encodeParameters} encodes C{unicode} values as UTF-8, repeats
+        multi-valued parameters and replaces underscores in their names by
+        dots.
+        """
+        encoded = encodeParameters({'q': u'name:\xf1', 'hl_fl': ['a', 'b']})
+        self.assertEqual(sorted(urlparse.parse_qsl(encoded)),
+                         [('hl.fl', 'a'), ('hl.fl', 'b'),
+                          ('q', 'name:\xc3\xb1')])
+
+
+class QueryRequestTest(TestCase):
+
+    def testGet(self):
+        """
+        L{queryRequest} builds a GET request when the full URL fits in
+        C{maxGetLength}, asking for a JSON response.
+        """
+        request = queryRequest('http://solr/core', '/select',
+                               {'q': u'id:1'}, 100)
+        self.assertEqual(request.method, 'GET')
+        path, query = request.path.split('?')
+        self.assertEqual(path, '/select')
+        self.assertEqual(urlparse.parse_qs(query),
+                         {'q': ['id:1'], 'wt': ['json']})
+        self.assertIdentical(request.body, None)
+
+    def testPost(self):
+        """
+        L{queryRequest} builds a form POST request when the full URL is
+        longer than C{maxGetLength}.
+        """
+        request = queryRequest('http://solr/core', '/select',
+                               {'q': u'id:' + u'a' * 100}, 100)
+        self.assertEqual(request.method, 'POST')
+        self.assertEqual(request.path, '/select')
+        self.assertEqual(request.headers['Content-type'],
+                         ['application/x-www-form-urlencoded'])
+        self.assertEqual(urlparse.parse_qs(request.body)['q'],
+                         ['id:' + 'a' * 100])
+
+
+class UpdateRequestTest(TestCase):
+
+    def testUpdate(self):
+        """L{updateRequest} builds a POST request to C{/update}."""
+        request = updateRequest('text/xml', '<commit />')
+        self.assertEqual((request.method, request.path, request.body),
+                         ('POST', '/update?wt=json', '<commit />'))
+        self.assertEqual(request.headers, {'Content-Type': ['text/xml']})
+
+
+class CheckStatusTest(TestCase):
+
+    def testCheckStatus(self):
+        """
+        L{checkStatus} accepts C{200}, raises L{VersionConflictError} for
+        C{409} and L{HTTPWrongStatus} for other status codes.
+        """
+        checkStatus(200)
+        self.assertRaises(VersionConflictError, checkStatus, 409)
+        error = self.assertRaises(HTTPWrongStatus, checkStatus, 500)
+        self.assertNotIsInstance(error, VersionConflictError)
+        self.assertEqual(error.args, (500,))
@@ -1,4 +1,5 @@
 from twisted.internet.defer import Deferred, inlineCallbacks
+from twisted.internet.error import ConnectionDone
 from twisted.python.failure import Failure
 from twisted.trial.unittest import TestCase
 from twisted.web.client import ResponseDone
@@ -6,7 +7,9 @@ from twisted.web.http import OK
 from twisted.web.http_headers import Headers
 
 from txsolr.errors import SolrResponseError
-from txsolr.response import JSONSolrResponse, ResponseConsumer
+from txsolr.response import (JSONSolrResponse, ResponseConsumer,
+                             StreamingFacetConsumer, DocumentStream,
+                             StreamingDocumentConsumer, TupleStream)
 
 
 class JSONSorlResponseTest(TestCase):
@@ -74,6 +77,527 @@ class JSONSorlResponseTest(TestCase):
         response = JSONSolrResponse(raw)
         self.assertEqual('SolrResponse: %r' % raw, repr(response))
 
+    def testRealTimeGetResponse(self):
+        """
+        L{JSONSolrResponse} represents the single document returned by the
+        real-time get handler as L{QueryResults}.
+        """
+        raw = """{
+                 "responseHeader":{"status":0,"QTime":0},
+                 "doc":{"id":"1","name":"manuel"}
+                 }"""
+        response = JSONSolrResponse(raw)
+        self.assertEqual(response.results.numFound, 1)
+        self.assertEqual(response.results.docs, [{'id': '1',
+                                                  'name': 'manuel'}])
+
+        raw = """{"responseHeader":{"status":0,"QTime":0},"doc":null}"""
+        response = JSONSolrResponse(raw)
+        self.assertEqual(response.results.numFound, 0)
+        self.assertEqual(response.results.docs, [])
+
+
+class FacetCountsTest(TestCase):
+
+    raw = """{
+             "responseHeader":{"status":0,"QTime":0},
+             "response":{"numFound":0,"start":0,"docs":[]},
+             "facet_counts":{
+              "facet_queries":{"price:[* TO 10]":4},
+              "facet_fields":{
+                "cat":["book",10,"music",5,"film",0],
+                "author":{"ann":2,"bob":1}},
+              "facet_ranges":{
+                "price":{"counts":["0.0",3,"10.0",1],
+                         "gap":10.0,"start":0.0,"end":20.0,"before":2}},
+              "facet_pivot":{
+                "cat,inStock":[
+                 {"field":"cat","value":"book","count":10,
+                  "pivot":[{"field":"inStock","value":true,"count":7}]}]}}
+             }"""
+
+    def testFields(self):
+        """
+        L{SolrResponse.facetCounts} converts the facet fields to
+        L{FacetField}s with parallel terms and counts.
+        """
+        facets = JSONSolrResponse(self.raw).facetCounts
+        cat = facets.field('cat')
+        self.assertEqual(cat.terms, ['book', 'music', 'film'])
+        self.assertEqual(list(cat.counts), [10, 5, 0])
+        self.assertEqual(list(cat), [('book', 10), ('music', 5),
+                                     ('film', 0)])
+        self.assertEqual(cat.top(2), [('book', 10), ('music', 5)])
+        self.assertEqual(cat['music'], 5)
+        self.assertEqual(cat.get('games'), None)
+        self.assertEqual(cat.asDict(), {'book': 10, 'music': 5, 'film': 0})
+        self.assertEqual(facets.field('author').asDict(),
+                         {'ann': 2, 'bob': 1})
+        self.assertEqual(facets.field('missing'), None)
+        self.assertEqual(sorted(facets.fields), ['author', 'cat'])
+
+    def testQueriesRangesAndPivots(self):
+        """
+        L{SolrResponse.facetCounts} gives access to facet queries, ranges and
+        pivots.
+        """
+        facets = JSONSolrResponse(self.raw).facetCounts
+        self.assertEqual(facets.queries, {'price:[* TO 10]': 4})
+
+        price = facets.range('price')
+        self.assertEqual(list(price), [('0.0', 3), ('10.0', 1)])
+        self.assertEqual((price.gap, price.start, price.end, price.before,
+                          price.after), (10.0, 0.0, 20.0, 2, None))
+
+        [book] = facets.pivot('cat,inStock')
+        self.assertEqual((book.field, book.value, book.count),
+                         ('cat', 'book', 10))
+        [inStock] = book.children
+        self.assertEqual((inStock.value, inStock.count, inStock.children),
+                         (True, 7, []))
+
+    def testNoFacets(self):
+        """
+        L{SolrResponse.facetCounts} is C{None} if the response has no facets.
+        """
+        raw = """{"responseHeader":{"status":0,"QTime":0}}"""
+        self.assertEqual(JSONSolrResponse(raw).facetCounts, None)
+
+
+class GroupingTest(TestCase):
+
+    raw = """{
+             "responseHeader":{"status":0,"QTime":0},
+             "grouped":{
+              "manu":{"matches":5,"ngroups":3,"groups":[
+                {"groupValue":"apache","doclist":{"numFound":3,"start":0,
+                  "docs":[{"id":"1"},{"id":"2"}]}},
+                {"groupValue":null,"doclist":{"numFound":2,"start":0,
+                  "docs":[{"id":"3"}]}}]},
+              "price:[0 TO 10]":{"matches":5,"doclist":{"numFound":1,
+                "start":0,"docs":[{"id":"4"}]}}}
+             }"""
+
+    def testGroups(self):
+        """
+        L{SolrResponse.grouping} gives the groups of each field command,
+        without copying their documents.
+        """
+        response = JSONSolrResponse(self.raw)
+        grouping = response.grouping
+        self.assertEqual(sorted(grouping.names), ['manu', 'price:[0 TO 10]'])
+        self.assertIdentical(response.results, None)
+
+        manu = grouping['manu']
+        self.assertEqual((manu.matches, manu.ngroups, len(manu)), (5, 3, 2))
+        self.assertEqual([(group.value, group.numFound) for group in manu],
+                         [('apache', 3), (None, 2)])
+        self.assertIdentical(manu[0].docs,
+                             response.grouped['manu']['groups'][0]
+                             ['doclist']['docs'])
+        self.assertEqual(manu.group('apache').results.docs,
+                         [{'id': '1'}, {'id': '2'}])
+        self.assertIdentical(manu.group('other'), None)
+        self.assertEqual([doc['id'] for doc in manu.docs()], ['1', '2', '3'])
+        self.assertIdentical(manu.results, None)
+
+    def testQueryCommand(self):
+        """
+        The documents of a C{group.query} command are in the C{results} of
+        its L{GroupCommand}.
+        """
+        query = JSONSolrResponse(self.raw).grouping.get('price:[0 TO 10]')
+        self.assertEqual(len(query), 0)
+        self.assertEqual(query.results.numFound, 1)
+        self.assertEqual(list(query.docs()), [{'id': '4'}])
+
+    def testNotGrouped(self):
+        """L{SolrResponse.grouping} is C{None} for ungrouped responses."""
+        raw = """{"responseHeader":{"status":0,"QTime":0}}"""
+        self.assertIdentical(JSONSolrResponse(raw).grouping, None)
+
+    def testExpandedGroups(self):
+        """
+        L{SolrResponse.expandedGroups} joins the head documents of collapsed
+        results with their expanded groups.
+        """
+        raw = """{
+                 "responseHeader":{"status":0,"QTime":0},
+                 "response":{"numFound":2,"start":0,"docs":[
+                   {"id":"1","manu":"apache","size":3},
+                   {"id":"5","manu":"acme","size":1}]},
+                 "expanded":{"apache":{"numFound":2,"start":0,
+                   "docs":[{"id":"2"},{"id":"3"}]}}
+                 }"""
+        [(first, apache), (second, acme)] = list(
+            JSONSolrResponse(raw).expandedGroups('manu'))
+        self.assertEqual(first['id'], '1')
+        self.assertEqual((apache.value, apache.numFound), ('apache', 2))
+        self.assertEqual(second['id'], '5')
+        self.assertIdentical(acme, None)
+
+
+class HitsTest(TestCase):
+
+    raw = """{
+             "responseHeader":{"status":0,"QTime":0},
+             "response":{"numFound":3,"start":0,"maxScore":2.0,"docs":[
+               {"id":"a","score":2.0},{"id":"b","score":1.0},{"id":"c"}]},
+             "highlighting":{
+               "a":{"title":["<em>solr</em> in action"]},
+               "b":{}},
+             "moreLikeThis":{
+               "a":{"numFound":1,"start":0,"docs":[{"id":"c"}]}},
+             "debug":{"explain":{"a":"2.0 = weight(title:solr)",
+                                 "b":"1.0 = weight(title:solr)"}}
+             }"""
+
+    def testHits(self):
+        """
+        L{SolrResponse.hits} joins the documents with their highlighting
+        snippets, score explanations and similar documents, in order.
+        """
+        response = JSONSolrResponse(self.raw)
+        hits = response.hits
+        self.assertEqual([hit.key for hit in hits], ['a', 'b', 'c'])
+        self.assertEqual([hit.score for hit in hits], [2.0, 1.0, None])
+        self.assertEqual(hits[0].doc, {'id': 'a', 'score': 2.0})
+        self.assertEqual(hits[0].highlighting,
+                         {'title': ['<em>solr</em> in action']})
+        self.assertEqual(hits[0].explain, '2.0 = weight(title:solr)')
+        self.assertEqual(hits[0].moreLikeThis['docs'], [{'id': 'c'}])
+        self.assertEqual((hits[1].highlighting, hits[1].moreLikeThis),
+                         ({}, None))
+        self.assertEqual((hits[2].highlighting, hits[2].explain), (None, None))
+        self.assertIdentical(response.hits, hits)
+        self.assertIdentical(response.hit('b'), hits[1])
+        self.assertRaises(KeyError, response.hit, 'd')
+
+    def testUniqueKey(self):
+        """
+        L{SolrResponse.hits} joins the sections using the C{uniqueKey} of the
+        response, and supports non-string keys and the C{[explain]} document
+        transformer.
+        """
+        raw = """{"responseHeader":{"status":0,"QTime":0},
+                  "response":{"numFound":1,"start":0,"docs":[
+                    {"isbn":123,"[explain]":"1.0 = weight"}]},
+                  "highlighting":{"123":{"title":["<em>x</em>"]}}}"""
+        response = JSONSolrResponse(raw)
+        response.uniqueKey = 'isbn'
+        hit = response.hit(123)
+        self.assertEqual(hit.highlighting, {'title': ['<em>x</em>']})
+        self.assertEqual(hit.explain, '1.0 = weight')
+
+    def testNoResults(self):
+        """L{SolrResponse.hits} is empty if the response has no results."""
+        raw = """{"responseHeader":{"status":0,"QTime":0}}"""
+        self.assertEqual(JSONSolrResponse(raw).hits, [])
+
+
+class StreamingFacetConsumerTest(TestCase):
+
+    raw = """{"responseHeader":{"status":0,"QTime":1,
+              "params":{"facet.field":["cat"],"q":"[x]"}},
+             "response":{"numFound":2,"start":0,"docs":[
+               {"id":"1","cat":["a","b"]},{"id":"2","cat":"b"}]},
+             "facet_counts":{"facet_queries":{},
+              "facet_fields":{
+               "cat" : [ "b" , 2, "a\\\"]" ,1,"3,4,",5,null,0 ],
+               "empty":[],
+               "name":["\u00f1and\u00fa",12345]}}}"""
+
+    def _consume(self, consumer, chunkSize=1):
+        for i in range(0, len(self.raw), chunkSize):
+            consumer.dataReceived(self.raw[i:i + chunkSize])
+        consumer.connectionLost(Failure(ResponseDone()))
+
+    def testCollect(self):
+        """
+        L{StreamingFacetConsumer} parses the facet fields as they arrive,
+        whatever the size of the chunks, and the rest of the response once
+        it's complete. Terms with commas are supported.
+        """
+        for chunkSize in (1, 7, len(self.raw)):
+            deferred = Deferred()
+            self._consume(StreamingFacetConsumer(deferred, JSONSolrResponse),
+                          chunkSize)
+            response = self.successResultOf(deferred)
+            self.assertEqual(response.results.numFound, 2)
+            self.assertEqual(response.header['params']['q'], '[x]')
+            facets = response.facetCounts
+            self.assertEqual(list(facets.field('cat')),
+                             [(u'b', 2), (u'a"]', 1), (u'3,4,', 5),
+                              (None, 0)])
+            self.assertEqual(list(facets.field('empty')), [])
+            self.assertEqual(list(facets.field('name')),
+                             [(u'\xf1and\xfa', 12345)])
+
+    def testCallback(self):
+        """
+        L{StreamingFacetConsumer} gives the facet counts to the callback, if
+        given, instead of keeping them.
+        """
+        counts = []
+        deferred = Deferred()
+        consumer = StreamingFacetConsumer(
+            deferred, JSONSolrResponse,
+            lambda field, term, count: counts.append((field, term, count)))
+        self._consume(consumer, 5)
+        response = self.successResultOf(deferred)
+        self.assertEqual(counts, [(u'cat', u'b', 2), (u'cat', u'a"]', 1),
+                                  (u'cat', u'3,4,', 5), (u'cat', None, 0),
+                                  (u'name', u'\xf1and\xfa', 12345)])
+        self.assertEqual(list(response.facetCounts.field('cat')), [])
+
+    def testIncomplete(self):
+        """
+        L{StreamingFacetConsumer} fails with L{SolrResponseError} if the body
+        ends in the middle of the facets.
+        """
+        deferred = Deferred()
+        consumer = StreamingFacetConsumer(deferred, JSONSolrResponse)
+        consumer.dataReceived(self.raw[:self.raw.index('null')])
+        consumer.connectionLost(Failure(ResponseDone()))
+        self.failureResultOf(deferred, SolrResponseError)
+
+
+class StreamingDocumentConsumerTest(TestCase):
+
+    raw = """{"responseHeader":{"status":0,"QTime":1,"params":{"q":"*:*"}},
+             "response":{"numFound":3,"start":0,"docs": [
+               {"id":"1","name":"a]},{"} ,
+               {"id":"2","tags":[1,2,{"x":null}]},
+               {"id":"\u00f1","price":1.5e3}
+             ]},
+             "highlighting":{"1":{}}}"""
+
+    def _consume(self, consumer, raw, chunkSize=1):
+        for i in range(0, len(raw), chunkSize):
+            consumer.dataReceived(raw[i:i + chunkSize])
+        consumer.connectionLost(Failure(ResponseDone()))
+
+    def testDocuments(self):
+        """
+        L{StreamingDocumentConsumer} gives each document to the callback as
+        soon as it's complete, whatever the size of the chunks, and parses
+        the rest of the response once it's complete.
+        """
+        for chunkSize in (1, 7, len(self.raw)):
+            documents = []
+            deferred = Deferred()
+            consumer = StreamingDocumentConsumer(deferred, JSONSolrResponse,
+                                                 documents.append)
+            self._consume(consumer, self.raw, chunkSize)
+            response = self.successResultOf(deferred)
+            self.assertEqual(documents,
+                             [{u'id': u'1', u'name': u'a]},{'},
+                              {u'id': u'2', u'tags': [1, 2, {u'x': None}]},
+                              {u'id': u'\xf1', u'price': 1500.0}])
+            self.assertEqual(response.results.numFound, 3)
+            self.assertEqual(response.results.docs, [])
+            self.assertEqual(response.highlighting, {u'1': {}})
+
+    def testNoDocuments(self):
+        """
+        L{StreamingDocumentConsumer} handles empty lists of documents.
+        """
+        documents = []
+        deferred = Deferred()
+        consumer = StreamingDocumentConsumer(deferred, JSONSolrResponse,
+                                             documents.append)
+        self._consume(consumer, '{"responseHeader":{"status":0},'
+                                '"response":{"numFound":0,"start":0,'
+                                '"docs":[ \n ]}}')
+        response = self.successResultOf(deferred)
+        self.assertEqual(documents, [])
+        self.assertEqual(response.results.numFound, 0)
+
+    def testIncomplete(self):
+        """
+        L{StreamingDocumentConsumer} fails with L{SolrResponseError} if the
+        body ends in the middle of a document.
+        """
+        documents = []
+        deferred = Deferred()
+        consumer = StreamingDocumentConsumer(deferred, JSONSolrResponse,
+                                             documents.append)
+        self._consume(consumer, self.raw[:self.raw.index('price')])
+        self.failureResultOf(deferred, SolrResponseError)
+        self.assertEqual(len(documents), 2)
+
+
+class FakeTransport(object):
+    """A transport recording whether it's paused or stopped."""
+
+    paused = False
+    stopped = False
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+    def stopProducing(self):
+        self.stopped = True
+
+
+class DocumentStreamTest(TestCase):
+
+    def _stream(self, bufferSize=100):
+        stream = DocumentStream(bufferSize)
+        deferred = Deferred()
+        deferred.addCallbacks(stream.finished, stream.failed)
+        consumer = stream.consumer(deferred)
+        consumer.makeConnection(FakeTransport())
+        return stream, consumer
+
+    def testNext(self):
+        """
+        L{DocumentStream.next} fires with the documents in order, waiting for
+        them if needed, and with C{None} at the end of the stream.
+        """
+        stream, consumer = self._stream()
+        first = stream.next()
+        self.assertNoResult(first)
+        consumer.dataReceived('{"responseHeader":{"status":0},'
+                              '"response":{"numFound":2,"start":0,"docs":['
+                              '{"id":"1"},{"id":"2"}]}')
+        self.assertEqual(self.successResultOf(first), {u'id': u'1'})
+        self.assertEqual(self.successResultOf(stream.next()), {u'id': u'2'})
+        last = stream.next()
+        self.assertNoResult(last)
+        self.assertIdentical(stream.response, None)
+        consumer.dataReceived('}')
+        consumer.connectionLost(Failure(ResponseDone()))
+        self.assertIdentical(self.successResultOf(last), None)
+        self.assertIdentical(self.successResultOf(stream.next()), None)
+        self.assertEqual(stream.response.results.numFound, 2)
+
+    def testBackPressure(self):
+        """
+        L{DocumentStream} pauses the transport when its buffer is full, and
+        resumes it when half of the buffer has been taken.
+        """
+        stream, consumer = self._stream(4)
+        consumer.dataReceived('{"responseHeader":{"status":0},'
+                              '"response":{"numFound":6,"start":0,"docs":['
+                              + ','.join('{"id":%d}' % i for i in range(6)))
+        self.assertTrue(consumer.transport.paused)
+        self.assertEqual(self.successResultOf(stream.next()), {u'id': 0})
+        self.assertEqual(self.successResultOf(stream.next()), {u'id': 1})
+        self.assertEqual(self.successResultOf(stream.next()), {u'id': 2})
+        self.assertTrue(consumer.transport.paused)
+        self.assertEqual(self.successResultOf(stream.next()), {u'id': 3})
+        self.assertFalse(consumer.transport.paused)
+
+    def testFailure(self):
+        """
+        L{DocumentStream.next} fails with the error of the query, once the
+        documents received before it have been taken.
+        """
+        stream, consumer = self._stream()
+        consumer.dataReceived('{"responseHeader":{"status":0},'
+                              '"response":{"numFound":2,"start":0,"docs":['
+                              '{"id":"1"},{"id":')
+        pending = stream.next()
+        consumer.connectionLost(Failure(ResponseDone()))
+        self.assertEqual(self.successResultOf(pending), {u'id': u'1'})
+        self.failureResultOf(stream.next(), SolrResponseError)
+
+    def testClose(self):
+        """
+        L{DocumentStream.close} stops the transport, drops the documents not
+        taken yet and ends the stream.
+        """
+        stream, consumer = self._stream(2)
+        consumer.dataReceived('{"responseHeader":{"status":0},'
+                              '"response":{"numFound":6,"start":0,"docs":['
+                              + ','.join('{"id":%d}' % i for i in range(3)))
+        self.assertTrue(consumer.transport.paused)
+        self.assertEqual(self.successResultOf(stream.next()), {u'id': 0})
+        stream.close()
+        self.assertTrue(consumer.transport.stopped)
+        self.assertIdentical(self.successResultOf(stream.next()), None)
+        consumer.connectionLost(Failure(ConnectionDone()))
+        self.assertIdentical(self.successResultOf(stream.next()), None)
+
+    def testCloseBeforeResponse(self):
+        """
+        The transport of a stream closed before its response was received is
+        stopped when a document is received.
+        """
+        stream = DocumentStream()
+        pending = stream.next()
+        stream.close()
+        self.assertIdentical(self.successResultOf(pending), None)
+        consumer = stream.consumer(Deferred())
+        consumer.makeConnection(FakeTransport())
+        consumer.dataReceived('{"response":{"docs":[{"id":"1"},')
+        self.assertTrue(consumer.transport.stopped)
+        self.assertIdentical(self.successResultOf(stream.next()), None)
+
+    @inlineCallbacks
+    def testAsyncIterator(self):
+        """
+        L{DocumentStream.__anext__} fires with the next document, and fails
+        with C{StopAsyncIteration} at the end of the stream.
+        """
+        stream, consumer = self._stream()
+        self.assertIdentical(stream.__aiter__(), stream)
+        consumer.dataReceived('{"responseHeader":{"status":0},'
+                              '"response":{"numFound":1,"start":0,"docs":['
+                              '{"id":"1"}]}}')
+        consumer.connectionLost(Failure(ResponseDone()))
+        document = yield stream.__anext__()
+        self.assertEqual(document, {u'id': u'1'})
+        failure = self.failureResultOf(stream.__anext__())
+        self.assertEqual(type(failure.value).__name__, 'StopAsyncIteration')
+
+
+class TupleStreamTest(TestCase):
+
+    def _stream(self):
+        stream = TupleStream()
+        deferred = Deferred()
+        deferred.addCallbacks(stream.finished, stream.failed)
+        consumer = stream.consumer(deferred, None, ('result-set', 'docs'))
+        consumer.makeConnection(FakeTransport())
+        return stream, consumer
+
+    def testEOF(self):
+        """
+        L{TupleStream} gives the tuples of a streaming expression, and ends
+        with its C{EOF} tuple, before the end of the body.
+        """
+        stream, consumer = self._stream()
+        consumer.dataReceived('{"result-set":{"docs":[{"a":1},{"a":2},'
+                              '{"EOF":true,"RESPONSE_TIME":5}')
+        self.assertEqual(self.successResultOf(stream.next()), {u'a': 1})
+        self.assertEqual(self.successResultOf(stream.next()), {u'a': 2})
+        self.assertIdentical(self.successResultOf(stream.next()), None)
+        self.assertEqual(stream.eof[u'RESPONSE_TIME'], 5)
+
+        consumer.dataReceived(']}}')
+        consumer.connectionLost(Failure(ResponseDone()))
+        self.assertIdentical(self.successResultOf(stream.next()), None)
+        self.assertIdentical(stream.response, None)
+
+    def testException(self):
+        """
+        L{TupleStream} fails with L{SolrResponseError} when it receives a
+        tuple with an C{EXCEPTION}.
+        """
+        stream, consumer = self._stream()
+        pending = stream.next()
+        consumer.dataReceived('{"result-set":{"docs":['
+                              '{"EXCEPTION":"Bad field","EOF":true}]}}')
+        failure = self.failureResultOf(pending, SolrResponseError)
+        self.assertEqual(failure.value.args, (u'Bad field',))
+        consumer.connectionLost(Failure(ResponseDone()))
+        self.failureResultOf(stream.next(), SolrResponseError)
+
 
 class ResponseConsumerTest(TestCase):
 
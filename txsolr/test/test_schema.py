@@ -0,0 +1,217 @@
+from datetime import date, datetime, timedelta, tzinfo
+
+from twisted.internet.defer import Deferred, fail
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from txsolr.client import SolrClient
+from txsolr.errors import HTTPWrongStatus
+from txsolr.schema import (Schema, SchemaCache, SchemaInputFactory,
+                           decodeDate, encodeDate)
+from txsolr.testing import FakeSolrTransport
+
+
+SCHEMA = {
+    'uniqueKey': 'id',
+    'fields': [{'name': 'id', 'type': 'string'},
+               {'name': 'created', 'type': 'pdate'},
+               {'name': 'tags', 'type': 'string', 'multiValued': True},
+               {'name': 'price', 'type': 'pdouble'},
+               {'name': 'visible', 'type': 'boolean'},
+               {'name': 'period', 'type': 'daterange'}],
+    'dynamicFields': [{'name': '*_dt', 'type': 'tdate'},
+                      {'name': '*', 'type': 'string'}],
+    'fieldTypes': [{'name': 'string', 'class': 'solr.StrField'},
+                   {'name': 'pdate', 'class': 'solr.DatePointField'},
+                   {'name': 'tdate', 'class': 'solr.TrieDateField'},
+                   {'name': 'pdouble', 'class': 'solr.DoublePointField'},
+                   {'name': 'boolean', 'class': 'solr.BoolField'},
+                   {'name': 'daterange', 'class': 'solr.DateRangeField'}]}
+
+
+class _Offset(tzinfo):
+
+    def __init__(self, hours):
+        self.offset = timedelta(hours=hours)
+
+    def utcoffset(self, dt):
+        return self.offset
+
+    def dst(self, dt):
+        return timedelta(0)
+
+
+class DateTest(TestCase):
+
+    def testEncodeDate(self):
+        """
+        L{encodeDate} keeps milliseconds, converts aware dates to UTC and
+        supports dates before 1900.
+        """
+        self.assertEqual(encodeDate(datetime(2011, 3, 4, 5, 6, 7, 890123)),
+                         u'2011-03-04T05:06:07.890Z')
+        self.assertEqual(
+            encodeDate(datetime(2011, 3, 4, 1, 0, 0, tzinfo=_Offset(2))),
+            u'2011-03-03T23:00:00Z')
+        self.assertEqual(encodeDate(date(1850, 1, 2)),
+                         u'1850-01-02T00:00:00Z')
+
+    def testDecodeDate(self):
+        """
+        L{decodeDate} parses dates with and without fractions of seconds,
+        and leaves other values unchanged.
+        """
+        self.assertEqual(decodeDate(u'2011-03-04T05:06:07Z'),
+                         datetime(2011, 3, 4, 5, 6, 7))
+        self.assertEqual(decodeDate(u'2011-03-04T05:06:07.89Z'),
+                         datetime(2011, 3, 4, 5, 6, 7, 890000))
+        self.assertEqual(decodeDate(u'NOW/DAY'), u'NOW/DAY')
+
+
+class SchemaTest(TestCase):
+
+    def setUp(self):
+        self.schema = Schema.fromDict(SCHEMA)
+
+    def testEncoders(self):
+        """
+        L{Schema.encoder} returns the encoder of the type of each field,
+        including the fields matching dynamic fields.
+        """
+        self.assertEqual(self.schema.uniqueKey, 'id')
+        self.assertEqual(self.schema.encoder('price')(0.1234567890123456),
+                         u'0.1234567890123456')
+        self.assertEqual(self.schema.encoder('visible')(False), u'false')
+        self.assertEqual(self.schema.encoder('seen_dt')(date(2011, 1, 2)),
+                         u'2011-01-02T00:00:00Z')
+        self.assertEqual(self.schema.encoder('other')(12), u'12')
+
+    def testDecodeDocument(self):
+        """
+        L{Schema.decodeDocument} converts the dates of date fields, single
+        or multi-valued, and leaves the other values unchanged.
+        """
+        document = self.schema.decodeDocument(
+            {'id': u'2011-01-01T00:00:00Z', 'created': u'2011-03-04T05:06:07Z',
+             'seen_dt': [u'2011-01-02T00:00:00Z'], 'price': 1.5})
+        self.assertEqual(document,
+                         {'id': u'2011-01-01T00:00:00Z',
+                          'created': datetime(2011, 3, 4, 5, 6, 7),
+                          'seen_dt': [datetime(2011, 1, 2)], 'price': 1.5})
+
+    def testDateRange(self):
+        """
+        The full dates of a C{DateRangeField} are converted, and the ranges
+        and truncated dates are left unchanged.
+        """
+        document = self.schema.decodeDocument(
+            {'period': [u'2011-03-04T05:06:07Z', u'[2000 TO 2010]',
+                        u'2011-03']})
+        self.assertEqual(document['period'],
+                         [datetime(2011, 3, 4, 5, 6, 7), u'[2000 TO 2010]',
+                          u'2011-03'])
+        self.assertEqual(self.schema.encoder('period')(date(2011, 1, 2)),
+                         u'2011-01-02T00:00:00Z')
+
+    def testInputFactory(self):
+        """
+        L{SchemaInputFactory} encodes the values with the encoders of the
+        schema.
+        """
+        factory = SchemaInputFactory(self.schema)
+        body = factory.createAdd({'created': datetime(2011, 3, 4, 5, 6, 7,
+                                                      8000),
+                                  'visible': True}).body
+        self.assertIn('<field name="created">2011-03-04T05:06:07.008Z'
+                      '</field>', body)
+        self.assertIn('<field name="visible">true</field>', body)
+
+
+class SchemaCacheTest(TestCase):
+
+    def setUp(self):
+        self.transport = FakeSolrTransport(schema=SCHEMA)
+        self.client = SolrClient('http://solr/core', transport=self.transport)
+        self.clock = Clock()
+        self.cache = SchemaCache(self.client, 60, self.clock)
+
+    def testRefresh(self):
+        """
+        L{SchemaCache.get} fetches the schema once, and again after the
+        refresh interval.
+        """
+        schema = self.successResultOf(self.cache.get())
+        self.assertEqual(schema.uniqueKey, 'id')
+        self.assertIdentical(self.successResultOf(self.cache.get()), schema)
+        self.assertEqual(len(self.transport.requests), 1)
+
+        self.clock.advance(60)
+        self.assertNotIdentical(self.successResultOf(self.cache.get()),
+                                schema)
+        self.assertEqual(len(self.transport.requests), 2)
+
+    def testConcurrentRequests(self):
+        """
+        Requests for the schema while it's being fetched share the same
+        request, and get its error if it fails.
+        """
+        pending = Deferred()
+        self.client.getSchema = lambda: pending
+        first, second = self.cache.get(), self.cache.get()
+        pending.errback(HTTPWrongStatus(500))
+        self.failureResultOf(first, HTTPWrongStatus)
+        self.failureResultOf(second, HTTPWrongStatus)
+
+        self.client.getSchema = lambda: fail(HTTPWrongStatus(404))
+        self.failureResultOf(self.cache.get(), HTTPWrongStatus)
+
+
+class SchemaClientTest(TestCase):
+
+    def setUp(self):
+        self.schema = dict(SCHEMA)
+        self.transport = FakeSolrTransport(schema=self.schema)
+        self.client = SolrClient('http://solr/core', transport=self.transport)
+        self.clock = Clock()
+        self.client.schemaCache = SchemaCache(self.client, 60, self.clock)
+        self.client.inputFactory = SchemaInputFactory(self.client.schemaCache)
+
+    def testEncodeAndDecode(self):
+        """
+        A L{SolrClient} with a C{schemaCache} encodes the documents added
+        with the schema, once it's fetched, and decodes the documents of the
+        responses of searches and real-time gets.
+        """
+        self.successResultOf(self.client.add(
+            {'id': u'a', 'created': datetime(2011, 3, 4, 5, 6, 7, 8000)}))
+        self.assertIn('<field name="created">2011-03-04T05:06:07.008Z'
+                      '</field>', self.transport.requests[-1][2])
+        self.successResultOf(self.client.commit())
+
+        expected = [{'id': u'a',
+                     'created': datetime(2011, 3, 4, 5, 6, 7, 8000)}]
+        response = self.successResultOf(self.client.search(u'*:*'))
+        self.assertEqual(response.results.docs, expected)
+        response = self.successResultOf(self.client.get(u'a'))
+        self.assertEqual(response.results.docs, expected)
+        results = self.successResultOf(self.client.getByIds([u'a'],
+                                                            realtime=False))
+        self.assertEqual(results.docs, expected)
+
+    def testRefresh(self):
+        """
+        L{SchemaInputFactory} encodes the values with the current schema of
+        its L{SchemaCache}, which changes when it's refreshed.
+        """
+        document = {'id': u'a', 'price': 0.1234567890123456}
+        self.successResultOf(self.client.add(document))
+        self.assertIn('<field name="price">0.1234567890123456</field>',
+                      self.transport.requests[-1][2])
+
+        self.schema['fields'] = [field for field in SCHEMA['fields']
+                                 if field['name'] != 'price']
+        self.schema['dynamicFields'] = []
+        self.clock.advance(60)
+        self.successResultOf(self.client.add(document))
+        self.assertIn('<field name="price">0.123456789012</field>',
+                      self.transport.requests[-1][2])
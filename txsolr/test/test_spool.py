@@ -0,0 +1,244 @@
+import os
+
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from txsolr.errors import HTTPWrongStatus, SpoolFullError
+from txsolr.input import SimpleXMLInputFactory
+from txsolr.spool import UpdateSpool, SpooledUpdater
+
+
+class UpdateSpoolTest(TestCase):
+
+    def setUp(self):
+        self.directory = self.mktemp()
+
+    def _segments(self):
+        return sorted(name for name in os.listdir(self.directory)
+                      if name.endswith('.spool'))
+
+    def testAppendAndRead(self):
+        """L{UpdateSpool.read} returns the records in the order appended."""
+        spool = UpdateSpool(self.directory)
+        for body in ('<add/>', '<delete/>', '<commit/>'):
+            spool.append(body)
+        records = spool.read(10)
+        self.assertEqual([body for body, _ in records],
+                         ['<add/>', '<delete/>', '<commit/>'])
+        self.assertEqual([body for body, _ in spool.read(2)],
+                         ['<add/>', '<delete/>'])
+
+    def testAcknowledge(self):
+        """
+        L{UpdateSpool.acknowledge} removes the records up to the given
+        position.
+        """
+        spool = UpdateSpool(self.directory)
+        for body in ('a', 'b', 'c'):
+            spool.append(body)
+        spool.acknowledge(spool.read(2)[-1][1])
+        self.assertEqual([body for body, _ in spool.read(10)], ['c'])
+
+    def testReopen(self):
+        """
+        An L{UpdateSpool} keeps the records that were not acknowledged when
+        it's opened again.
+        """
+        spool = UpdateSpool(self.directory)
+        for body in ('a', 'b', 'c'):
+            spool.append(body)
+        spool.acknowledge(spool.read(1)[-1][1])
+        spool.close()
+
+        spool = UpdateSpool(self.directory)
+        self.assertEqual([body for body, _ in spool.read(10)], ['b', 'c'])
+        spool.append('d')
+        self.assertEqual([body for body, _ in spool.read(10)],
+                         ['b', 'c', 'd'])
+
+    def testSegments(self):
+        """
+        L{UpdateSpool} starts a new segment when the current one is larger
+        than C{segmentSize}, and removes segments that were acknowledged.
+        """
+        spool = UpdateSpool(self.directory, segmentSize=30)
+        for i in range(10):
+            spool.append('record %d' % i)
+        self.assertTrue(len(self._segments()) > 1)
+
+        records = spool.read(10)
+        self.assertEqual([body for body, _ in records],
+                         ['record %d' % i for i in range(10)])
+        spool.acknowledge(records[5][1])
+        self.assertEqual([body for body, _ in spool.read(10)],
+                         ['record %d' % i for i in range(6, 10)])
+
+        spool.acknowledge(records[-1][1])
+        self.assertEqual(spool.read(10), [])
+        self.assertEqual(len(self._segments()), 1)
+        self.assertEqual(spool.size, 0)
+
+    def testMaxBytes(self):
+        """
+        L{UpdateSpool.append} raises L{SpoolFullError} if the record does not
+        fit in C{maxBytes}.
+        """
+        spool = UpdateSpool(self.directory, maxBytes=30)
+        spool.append('0123456789')
+        self.assertRaises(SpoolFullError, spool.append, '0123456789')
+        spool.acknowledge(spool.read(1)[-1][1])
+        spool.append('0123456789')
+
+    def testIncompleteRecord(self):
+        """
+        L{UpdateSpool} discards a partially written record when it's opened.
+        """
+        spool = UpdateSpool(self.directory)
+        spool.append('complete')
+        spool.append('incomplete')
+        spool.close()
+
+        path = os.path.join(self.directory, self._segments()[-1])
+        with open(path, 'r+b') as segment:
+            segment.truncate(os.path.getsize(path) - 3)
+
+        spool = UpdateSpool(self.directory)
+        spool.append('new')
+        self.assertEqual([body for body, _ in spool.read(10)],
+                         ['complete', 'new'])
+
+    def testCorruptRecord(self):
+        """L{UpdateSpool.read} stops reading a segment at a corrupt record."""
+        spool = UpdateSpool(self.directory)
+        spool.append('first')
+        spool.append('second')
+        spool.close()
+
+        path = os.path.join(self.directory, self._segments()[-1])
+        with open(path, 'r+b') as segment:
+            segment.seek(-1, os.SEEK_END)
+            segment.write('X')
+
+        spool = UpdateSpool(self.directory)
+        self.assertEqual([body for body, _ in spool.read(10)], ['first'])
+
+
+class FakeClient(object):
+    """A fake L{SolrClient} that records the update requests it receives."""
+
+    def __init__(self):
+        self.inputFactory = SimpleXMLInputFactory()
+        self.requests = []
+
+    def _update(self, input):
+        deferred = Deferred()
+        self.requests.append((input.body, deferred))
+        return deferred
+
+
+class SpooledUpdaterTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.client = FakeClient()
+        self.spool = UpdateSpool(self.mktemp())
+        self.updater = SpooledUpdater(self.client, self.spool, batchSize=2,
+                                      retryDelay=1, clock=self.clock)
+
+    def testAcknowledgeImmediately(self):
+        """
+        L{SpooledUpdater.add} fires as soon as the update is spooled, without
+        waiting for Solr.
+        """
+        self.successResultOf(self.updater.add({'id': 1}))
+        self.assertEqual(len(self.client.requests), 1)
+        self.assertNoResult(self.client.requests[0][1])
+
+    def testReplayInBatches(self):
+        """
+        L{SpooledUpdater} replays the spooled updates in order and in batches.
+        """
+        self.updater.add({'id': 1})
+        self.updater.delete(2)
+        self.updater.commit()
+        self.client.requests[0][1].callback(None)
+        self.clock.advance(0)
+
+        self.assertEqual(len(self.client.requests), 2)
+        self.assertEqual(self.client.requests[1][0],
+                         '<update><delete><id>2</id></delete>'
+                         '<commit /></update>')
+        self.client.requests[1][1].callback(None)
+        self.clock.advance(0)
+        self.assertEqual(self.spool.read(10), [])
+
+    def testRetry(self):
+        """
+        L{SpooledUpdater} keeps the updates in the spool and retries with
+        exponential backoff while Solr is unavailable.
+        """
+        self.updater.add({'id': 1})
+        self.client.requests[0][1].errback(ValueError('down'))
+        self.clock.advance(1)
+        self.assertEqual(len(self.client.requests), 2)
+        self.client.requests[1][1].errback(ValueError('down'))
+        self.clock.advance(1)
+        self.assertEqual(len(self.client.requests), 2)
+        self.clock.advance(1)
+        self.assertEqual(len(self.client.requests), 3)
+        self.assertEqual(len(self.spool.read(10)), 1)
+
+        self.client.requests[2][1].callback(None)
+        self.assertEqual(self.spool.read(10), [])
+
+    def testDiscardRejectedUpdate(self):
+        """
+        L{SpooledUpdater} replays a batch rejected by Solr one update at a
+        time and discards the rejected update.
+        """
+        self.spool.append('<add>bad</add>')
+        self.spool.append('<add>good</add>')
+        self.updater.replay()
+        self.client.requests[0][1].errback(HTTPWrongStatus(400))
+        self.clock.advance(0)
+
+        self.assertEqual(self.client.requests[1][0], '<add>bad</add>')
+        self.client.requests[1][1].errback(HTTPWrongStatus(400))
+        self.clock.advance(0)
+        self.assertEqual(self.updater.discarded, 1)
+
+        self.assertEqual(self.client.requests[2][0], '<add>good</add>')
+        self.client.requests[2][1].callback(None)
+        self.assertEqual(self.spool.read(10), [])
+
+    def testSingleUpdatesUntilRejected(self):
+        """
+        L{SpooledUpdater} sends all the updates of a rejected batch one at a
+        time, and goes back to batches after them.
+        """
+        self.updater.batchSize = 3
+        for body in ('<add>1</add>', '<add>2</add>', '<add>bad</add>',
+                     '<add>4</add>', '<add>5</add>'):
+            self.spool.append(body)
+        self.updater.replay()
+        self.client.requests[0][1].errback(HTTPWrongStatus(400))
+        self.clock.advance(0)
+
+        for index in (1, 2):
+            self.client.requests[index][1].callback(None)
+            self.clock.advance(0)
+        self.client.requests[3][1].errback(HTTPWrongStatus(400))
+        self.clock.advance(0)
+        self.assertEqual([body for body, _ in self.client.requests[1:4]],
+                         ['<add>1</add>', '<add>2</add>', '<add>bad</add>'])
+        self.assertEqual(self.client.requests[4][0],
+                         '<update><add>4</add><add>5</add></update>')
+
+    def testSpoolFull(self):
+        """
+        L{SpooledUpdater.add} fails with L{SpoolFullError} if the spool is
+        full.
+        """
+        self.spool.maxBytes = 10
+        self.failureResultOf(self.updater.add({'id': 1}), SpoolFullError)
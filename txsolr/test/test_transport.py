@@ -0,0 +1,527 @@
+import json
+
+from twisted.internet import reactor
+from twisted.internet.defer import (CancelledError, Deferred, gatherResults,
+                                    fail, inlineCallbacks, succeed)
+from twisted.internet.protocol import Factory, Protocol
+from twisted.trial.unittest import TestCase
+from twisted.web.http_headers import Headers
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET, Site
+
+from txsolr.client import SolrClient
+from txsolr.errors import HTTPWrongStatus, VersionConflictError
+from txsolr.input import StringProducer
+from txsolr.testing import FakeResponse, FakeSolrIndex, FakeSolrTransport
+from txsolr.transport import AgentTransport, PipeliningTransport
+
+
+class PingResource(Resource):
+
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.setHeader('Content-Type', 'application/json')
+        return json.dumps({'responseHeader': {'status': 0, 'QTime': 0},
+                           'status': 'OK'})
+
+
+class AgentTransportTest(TestCase):
+
+    def setUp(self):
+        site = Site(PingResource())
+        self.port = reactor.listenTCP(0, site, interface='127.0.0.1')
+        self.url = 'http://127.0.0.1:%d/solr' % self.port.getHost().port
+
+    def tearDown(self):
+        return self.port.stopListening()
+
+    @inlineCallbacks
+    def testRequest(self):
+        """L{AgentTransport} sends the requests of a L{SolrClient}."""
+        client = SolrClient(self.url, transport=AgentTransport(reactor))
+        response = yield client.ping()
+        self.assertEqual(response.status, 'OK')
+
+    def testDefaultTransport(self):
+        """L{SolrClient} uses an L{AgentTransport} by default."""
+        client = SolrClient(self.url)
+        self.assertIsInstance(client.transport, AgentTransport)
+
+
+class StalledDocumentsResource(Resource):
+    """
+    A resource writing the start of a response with some documents, and
+    never finishing it.
+    """
+
+    isLeaf = True
+
+    def __init__(self):
+        Resource.__init__(self)
+        self.finished = []
+
+    def render_GET(self, request):
+        self.finished.append(request.notifyFinish())
+        request.setHeader('Content-Type', 'application/json')
+        request.write('{"response":{"numFound":100,"start":0,"docs":[' +
+                      ','.join('{"id":"%d"}' % i for i in range(10)))
+        return NOT_DONE_YET
+
+
+class DocumentStreamCloseTest(TestCase):
+
+    def setUp(self):
+        self.resource = StalledDocumentsResource()
+        self.port = reactor.listenTCP(0, Site(self.resource),
+                                      interface='127.0.0.1')
+        self.url = 'http://127.0.0.1:%d/solr' % self.port.getHost().port
+
+    def tearDown(self):
+        return self.port.stopListening()
+
+    @inlineCallbacks
+    def testClose(self):
+        """
+        Closing a L{DocumentStream} that is not read until its end closes the
+        connection of its paused transport.
+        """
+        client = SolrClient(self.url, transport=AgentTransport(reactor))
+        stream = client.streamDocuments(u'*:*', bufferSize=2)
+        document = yield stream.next()
+        self.assertEqual(document, {u'id': u'0'})
+        stream.close()
+        document = yield stream.next()
+        self.assertIdentical(document, None)
+        [finished] = self.resource.finished
+        yield self.assertFailure(finished, Exception)
+
+
+class EchoResource(Resource):
+
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.setHeader('Content-Type', 'application/json')
+        return json.dumps({'responseHeader': {'status': 0, 'QTime': 0},
+                           'q': request.args['q'][0]})
+
+
+class ManualHTTPServer(Protocol):
+    """
+    A minimal HTTP server that records the requests it receives and only
+    answers them when the test says so.
+    """
+
+    def connectionMade(self):
+        self.buffer = ''
+        self.factory.connections.append(self)
+
+    def dataReceived(self, data):
+        self.buffer += data
+        while '\r\n\r\n' in self.buffer:
+            head, self.buffer = self.buffer.split('\r\n\r\n', 1)
+            self.factory.received.append((self, head.split()[1]))
+            waiting, self.factory.waiting = self.factory.waiting, []
+            for count, d in waiting:
+                if len(self.factory.received) >= count:
+                    d.callback(None)
+                else:
+                    self.factory.waiting.append((count, d))
+
+    def respond(self, body, version='HTTP/1.1', headers=()):
+        lines = ['%s 200 OK' % version,
+                 'Content-Length: %d' % len(body)] + list(headers)
+        self.transport.write('\r\n'.join(lines) + '\r\n\r\n' + body)
+
+    def respondChunked(self, chunks):
+        self.transport.write('HTTP/1.1 200 OK\r\n'
+                             'Transfer-Encoding: chunked\r\n\r\n')
+        for chunk in chunks + ['']:
+            self.transport.write('%x\r\n%s\r\n' % (len(chunk), chunk))
+
+
+class ManualHTTPFactory(Factory):
+
+    protocol = ManualHTTPServer
+
+    def __init__(self):
+        self.connections = []
+        self.received = []
+        self.waiting = []
+
+    def waitForRequests(self, count):
+        """Returns a L{Deferred} that fires once C{count} requests arrived."""
+        d = Deferred()
+        if len(self.received) >= count:
+            d.callback(None)
+        else:
+            self.waiting.append((count, d))
+        return d
+
+
+class RecordingTransport(object):
+    """A fallback transport that records the requests it receives."""
+
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, url, headers, bodyProducer):
+        self.requests.append((method, url))
+        return succeed(FakeResponse(200, 'fallback'))
+
+
+class PipeliningTransportTest(TestCase):
+
+    def setUp(self):
+        self.factory = ManualHTTPFactory()
+        self.port = reactor.listenTCP(0, self.factory, interface='127.0.0.1')
+        self.url = 'http://127.0.0.1:%d/solr' % self.port.getHost().port
+        self.fallback = RecordingTransport()
+        self.transport = PipeliningTransport(reactor, maxConnections=1,
+                                             fallback=self.fallback)
+
+    def tearDown(self):
+        for connection in self.factory.connections:
+            connection.transport.loseConnection()
+        return self.port.stopListening()
+
+    def _get(self, path):
+        return self.transport.request('GET', self.url + path, Headers(),
+                                      None)
+
+    @inlineCallbacks
+    def testPipelining(self):
+        """
+        L{PipeliningTransport} sends the requests without waiting for the
+        previous responses, so they all take a single round trip, and gives
+        the responses to the requests in order.
+        """
+        requests = [self._get('/select?q=%d' % i) for i in range(3)]
+        yield self.factory.waitForRequests(3)
+        self.assertEqual(len(self.factory.connections), 1)
+        self.assertEqual([path for _, path in self.factory.received],
+                         ['/solr/select?q=%d' % i for i in range(3)])
+
+        server = self.factory.connections[0]
+        server.respond('zero')
+        server.respondChunked(['o', 'ne'])
+        server.respond('two')
+        responses = yield gatherResults(requests)
+        self.assertEqual([response.body for response in responses],
+                         ['zero', 'one', 'two'])
+        self.assertEqual(self.fallback.requests, [])
+
+    @inlineCallbacks
+    def testCancel(self):
+        """
+        Cancelling a pipelined request discards its response without
+        affecting the other requests on the connection.
+        """
+        requests = [self._get('/select?q=%d' % i) for i in range(3)]
+        yield self.factory.waitForRequests(3)
+        requests[1].cancel()
+        self.failureResultOf(requests[1], CancelledError)
+
+        server = self.factory.connections[0]
+        for body in ('zero', 'one', 'two'):
+            server.respond(body)
+        first = yield requests[0]
+        third = yield requests[2]
+        self.assertEqual((first.body, third.body), ('zero', 'two'))
+
+    @inlineCallbacks
+    def testAnnouncedClose(self):
+        """
+        Requests sent after a response announcing the end of the connection
+        are sent again on a new connection.
+        """
+        requests = [self._get('/select?q=%d' % i) for i in range(2)]
+        yield self.factory.waitForRequests(2)
+        self.factory.connections[0].respond('zero',
+                                            headers=['Connection: close'])
+        self.factory.connections[0].transport.loseConnection()
+
+        yield self.factory.waitForRequests(3)
+        self.assertEqual(len(self.factory.connections), 2)
+        self.factory.connections[1].respond('one')
+        responses = yield gatherResults(requests)
+        self.assertEqual([response.body for response in responses],
+                         ['zero', 'one'])
+        self.assertEqual(self.transport.unsupported, set())
+
+    @inlineCallbacks
+    def testFallbackHTTP10(self):
+        """
+        L{PipeliningTransport} stops pipelining to a server answering with
+        HTTP/1.0, and sends the requests lost with the connection to the
+        fallback transport.
+        """
+        requests = [self._get('/select?q=%d' % i) for i in range(2)]
+        yield self.factory.waitForRequests(2)
+        server = self.factory.connections[0]
+        server.respond('zero', version='HTTP/1.0')
+        server.transport.loseConnection()
+
+        responses = yield gatherResults(requests)
+        self.assertEqual([response.body for response in responses],
+                         ['zero', 'fallback'])
+        self.assertEqual(self.transport.unsupported,
+                         set([('127.0.0.1', self.port.getHost().port)]))
+
+        response = yield self._get('/select?q=2')
+        self.assertEqual(response.body, 'fallback')
+        self.assertEqual(self.fallback.requests,
+                         [('GET', self.url + '/select?q=1'),
+                          ('GET', self.url + '/select?q=2')])
+
+    @inlineCallbacks
+    def _respondMalformed(self, head):
+        """
+        Sends two requests, answers them with a malformed response head and
+        checks that they are sent to the fallback transport.
+        """
+        requests = [self._get('/select?q=%d' % i) for i in range(2)]
+        yield self.factory.waitForRequests(2)
+        server = self.factory.connections[0]
+        server.transport.write(head + '\r\n\r\n')
+
+        responses = yield gatherResults(requests)
+        self.assertEqual([response.body for response in responses],
+                         ['fallback', 'fallback'])
+        self.assertEqual(self.transport.unsupported,
+                         set([('127.0.0.1', self.port.getHost().port)]))
+
+    def testMalformedStatusLine(self):
+        """
+        L{PipeliningTransport} closes a connection receiving a malformed
+        status line, stops pipelining to the server and sends the pending
+        requests to the fallback transport.
+        """
+        return self._respondMalformed('garbage')
+
+    def testMalformedHeader(self):
+        """
+        A header line without a colon is a malformed response head.
+        """
+        return self._respondMalformed('HTTP/1.1 200 OK\r\nno colon')
+
+    @inlineCallbacks
+    def testFallbackFailure(self):
+        """
+        The failures of the fallback transport are given to the requests it
+        receives.
+        """
+        self.fallback.request = lambda *args: fail(ValueError('failed'))
+        requests = [self._get('/select?q=%d' % i) for i in range(2)]
+        yield self.factory.waitForRequests(2)
+        server = self.factory.connections[0]
+        server.respond('zero', version='HTTP/1.0')
+        server.transport.loseConnection()
+
+        response = yield requests[0]
+        self.assertEqual(response.body, 'zero')
+        yield self.assertFailure(requests[1], ValueError)
+
+    def testNotIdempotent(self):
+        """
+        L{PipeliningTransport} sends the requests with a body using the
+        fallback transport.
+        """
+        self.transport.request('POST', self.url + '/update', Headers(),
+                               StringProducer('<commit/>'))
+        self.assertEqual(self.fallback.requests,
+                         [('POST', self.url + '/update')])
+
+
+class PipeliningClientTest(TestCase):
+
+    def setUp(self):
+        self.port = reactor.listenTCP(0, Site(EchoResource()),
+                                      interface='127.0.0.1')
+        self.url = 'http://127.0.0.1:%d/solr' % self.port.getHost().port
+        self.transport = PipeliningTransport(reactor, maxConnections=1)
+
+    @inlineCallbacks
+    def tearDown(self):
+        for connections in self.transport._connections.values():
+            for connection in connections:
+                connection.transport.loseConnection()
+        yield self.port.stopListening()
+
+    @inlineCallbacks
+    def testSearch(self):
+        """
+        A L{SolrClient} using a L{PipeliningTransport} gets the responses of
+        concurrent queries from a real HTTP server.
+        """
+        client = SolrClient(self.url, transport=self.transport)
+        responses = yield gatherResults([client.search(u'id:%d' % i)
+                                         for i in range(10)])
+        self.assertEqual([response.q for response in responses],
+                         [u'id:%d' % i for i in range(10)])
+
+
+class FakeSolrTransportTest(TestCase):
+
+    def setUp(self):
+        self.index = FakeSolrIndex()
+        self.transport = FakeSolrTransport(self.index)
+        self.client = SolrClient('http://solr/core', transport=self.transport)
+
+    def _result(self, deferred):
+        return self.successResultOf(deferred)
+
+    def testAddAndCommit(self):
+        """
+        L{FakeSolrTransport} stores added documents and makes them searchable
+        after a commit.
+        """
+        self._result(self.client.add([{'id': 'a', 'tags': ['x', 'y']},
+                                      {'id': 'b', 'tags': 'y'}]))
+        response = self._result(self.client.search('*:*'))
+        self.assertEqual(response.results.numFound, 0)
+
+        self._result(self.client.commit())
+        response = self._result(self.client.search('tags:y', sort='id desc'))
+        self.assertEqual([doc['id'] for doc in response.results.docs],
+                         ['b', 'a'])
+        response = self._result(self.client.search('tags:x'))
+        self.assertEqual(response.results.docs,
+                         [{'id': 'a', 'tags': ['x', 'y']}])
+
+    def testSearchParameters(self):
+        """
+        L{FakeSolrTransport} supports filter queries, C{{!terms}} queries,
+        paging and field lists.
+        """
+        self._result(self.client.add([{'id': str(i), 'even': str(i % 2 == 0)}
+                                      for i in range(10)]))
+        self._result(self.client.commit())
+        response = self._result(self.client.search(
+            '{!terms f=id}1,2,3,4', fq='even:True', fl='id', rows=1, start=1))
+        self.assertEqual(response.results.numFound, 2)
+        self.assertEqual(response.results.docs, [{'id': '4'}])
+
+    def testRealTimeGet(self):
+        """L{FakeSolrTransport} returns uncommitted documents from C{/get}."""
+        self._result(self.client.add({'id': 'a'}))
+        response = self._result(self.client.get('a'))
+        self.assertEqual(response.results.docs, [{'id': 'a'}])
+
+        self._result(self.client.delete('a'))
+        results = self._result(self.client.getByIds(['a']))
+        self.assertEqual(results.missing, ['a'])
+
+    def testDeleteByQueryAndRollback(self):
+        """L{FakeSolrTransport} supports deletes by query and rollbacks."""
+        self._result(self.client.add([{'id': 'a'}, {'id': 'b'}]))
+        self._result(self.client.commit())
+        self._result(self.client.deleteByQuery('id:a'))
+        self._result(self.client.rollback())
+        self._result(self.client.deleteByQuery('id:b'))
+        self._result(self.client.commit())
+        self.assertEqual(self.index.documents.keys(), ['a'])
+
+    def testFacets(self):
+        """
+        L{FakeSolrTransport} supports field and query facets, which can be
+        streamed with L{SolrClient.streamFacets}.
+        """
+        self._result(self.client.add([{'id': '1', 'cat': ['a', 'b']},
+                                      {'id': '2', 'cat': 'b'}]))
+        self._result(self.client.commit())
+        response = self._result(self.client.search(
+            '*:*', facet='true', facet_field='cat', facet_query='id:1'))
+        self.assertEqual(list(response.facetCounts.field('cat')),
+                         [('b', 2), ('a', 1)])
+        self.assertEqual(response.facetCounts.queries, {'id:1': 1})
+
+        counts = []
+        response = self._result(self.client.streamFacets(
+            '*:*', lambda *count: counts.append(count), facet_field='cat',
+            rows=0))
+        self.assertEqual(counts, [('cat', 'b', 2), ('cat', 'a', 1)])
+        self.assertEqual(response.results.numFound, 2)
+
+    def testStreamDocuments(self):
+        """
+        The documents found by L{FakeSolrTransport} can be streamed with
+        L{SolrClient.streamDocuments}.
+        """
+        self._result(self.client.add([{'id': str(i)} for i in range(3)]))
+        self._result(self.client.commit())
+        stream = self.client.streamDocuments('*:*', sort='id asc')
+        documents = [self._result(stream.next()) for _ in range(4)]
+        self.assertEqual(documents, [{'id': '0'}, {'id': '1'}, {'id': '2'},
+                                     None])
+        self.assertEqual(stream.response.results.numFound, 3)
+
+    def testAtomicUpdates(self):
+        """
+        L{FakeSolrTransport} applies atomic updates, like the ones sent by
+        L{SolrClient.addChanges}, and rejects updates with a stale
+        C{_version_} with L{VersionConflictError}.
+        """
+        self._result(self.client.add({'id': 'a', 'tags': ['x', 'y'],
+                                      'count': 1}))
+        self._result(self.client.add({'id': 'a', 'tags': {'remove': 'x'},
+                                      'count': {'inc': 2}}))
+        self.assertEqual(self.index.get('a'),
+                         {'id': 'a', 'tags': 'y', 'count': '3'})
+
+        old = dict(self.index.get('a'), _version_=self.index.versions['a'])
+        self._result(self.client.addChanges(old, {'id': 'a', 'tags': 'z'},
+                                            checkVersion=True))
+        self.assertEqual(self.index.get('a'), {'id': 'a', 'tags': 'z'})
+        self.failureResultOf(
+            self.client.addChanges(old, {'id': 'a'}, checkVersion=True),
+            VersionConflictError)
+        self.assertIdentical(
+            self._result(self.client.addChanges(old, old)), None)
+
+    def testChildDocuments(self):
+        """
+        L{FakeSolrTransport} stores child documents in their parent, and
+        returns them only with the C{[child]} transformer.
+        """
+        self._result(self.client.add({'id': 'a', '_childDocuments_': [
+            {'id': 'a1'}], 'comments': [{'id': 'a2'}, {'id': 'a3'}]}))
+        self._result(self.client.commit())
+        response = self._result(self.client.search('id:a'))
+        self.assertEqual(response.results.docs, [{'id': 'a'}])
+
+        response = self._result(self.client.search('id:a', fl='*,[child]'))
+        [hit] = response.hits
+        self.assertEqual(hit.children(), [{'id': 'a1'}])
+        self.assertEqual(hit.children('comments'),
+                         [{'id': 'a2'}, {'id': 'a3'}])
+        self.assertEqual(hit.children('missing'), [])
+
+    def testExport(self):
+        """
+        The documents found by L{FakeSolrTransport} can be exported with
+        L{SolrClient.export}.
+        """
+        self._result(self.client.add([{'id': str(i)} for i in range(3)]))
+        self._result(self.client.commit())
+        stream = self.client.export('*:*', 'id desc', 'id')
+        documents = [self._result(stream.next()) for _ in range(4)]
+        self.assertEqual(documents, [{'id': '2'}, {'id': '1'}, {'id': '0'},
+                                     None])
+        self.assertEqual(stream.response.results.numFound, 3)
+
+    def testPing(self):
+        """L{FakeSolrTransport} answers pings."""
+        response = self._result(self.client.ping())
+        self.assertEqual(response.status, 'OK')
+
+    def testErrors(self):
+        """
+        L{FakeSolrTransport} answers with an error status to unknown handlers
+        and unsupported queries.
+        """
+        self.failureResultOf(self.client._query('/unknown', {}),
+                             HTTPWrongStatus)
+        self.failureResultOf(self.client.search('not a query'),
+                             HTTPWrongStatus)
@@ -0,0 +1,513 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Testing helpers.
+
+This module contains an in-memory fake Solr server that can be used as the
+transport of a L{SolrClient}, to test and benchmark code that uses txSolr
+without a real Solr server and without any network.
+
+The fake implements a small subset of Solr:
+
+ - C{/select} with C{*:*}, C{field:value} and C{{!terms f=field}} queries
+   and filter queries, the C{start}, C{rows}, C{fl} and C{sort}
+   parameters, and field and query facets.
+ - C{/update} with XML C{add}, C{delete}, C{commit}, C{optimize} and
+   C{rollback} messages. Values are stored as C{unicode} strings. Atomic
+   updates and optimistic concurrency with C{_version_} are supported, but
+   the versions are not returned in the documents. Child documents are
+   stored in their parent, and returned with the C{[child]} transformer,
+   but they can't be searched.
+ - C{/get} with the C{id} and C{ids} parameters.
+ - C{/export} with the same queries as C{/select}, and the required C{sort}
+   and C{fl} parameters.
+ - C{ETag} validation of C{/select} GET requests, with an C{ETag} that
+   changes on every commit.
+ - C{/admin/ping}.
+ - C{/schema}, returning a fixed schema.
+"""
+import json
+import re
+import urlparse
+from xml.etree import cElementTree as ElementTree
+
+from zope.interface import implements
+from twisted.internet.defer import succeed
+from twisted.web.http_headers import Headers
+
+from txsolr.transport import BufferedResponse, ISolrTransport
+
+
+__all__ = ['FakeSolrIndex', 'FakeSolrTransport', 'FakeResponse']
+
+
+class _QueryError(ValueError):
+    """Raised when the fake is unable to parse a query."""
+
+
+class _VersionConflict(Exception):
+    """Raised when the C{_version_} of an update doesn't match."""
+
+
+class FakeSolrIndex(object):
+    """The documents of a fake Solr core.
+
+    @param uniqueKey: The name of the unique key field.
+    @ivar documents: A C{dict} mapping unique keys to committed documents.
+    @ivar pending: A C{dict} mapping unique keys to the documents added since
+        the last commit, or to C{None} for the deleted ones.
+    @ivar commits: The number of commits received.
+    @ivar versions: A C{dict} mapping unique keys to the C{_version_} of the
+        latest version of each document.
+    """
+
+    def __init__(self, uniqueKey='id'):
+        self.uniqueKey = uniqueKey
+        self.documents = {}
+        self.pending = {}
+        self.commits = 0
+        self.versions = {}
+        self._lastVersion = 0
+
+    def add(self, document, overwrite=True):
+        key = document[self.uniqueKey]
+        if not overwrite and self.get(key) is not None:
+            return
+        self.pending[key] = document
+        self._lastVersion += 1
+        self.versions[key] = self._lastVersion
+
+    def delete(self, key):
+        self.pending[key] = None
+        self.versions.pop(key, None)
+
+    def checkVersion(self, key, version):
+        """
+        Raises L{_VersionConflict} if the version of an update doesn't
+        match the document, with the semantics of Solr: a positive version
+        must be the current one, C{1} only requires the document to exist and
+        a negative one requires it to not exist.
+        """
+        current = self.versions.get(key)
+        if ((version > 1 and current != version) or
+                (version == 1 and current is None) or
+                (version < 0 and current is not None)):
+            raise _VersionConflict(key)
+
+    def deleteByQuery(self, query):
+        for document in self.search(query, realtime=True):
+            self.delete(document[self.uniqueKey])
+
+    def commit(self):
+        for key, document in self.pending.iteritems():
+            if document is None:
+                self.documents.pop(key, None)
+            else:
+                self.documents[key] = document
+        self.pending.clear()
+        self.commits += 1
+
+    def rollback(self):
+        self.pending.clear()
+
+    def get(self, key):
+        """Returns the latest version of a document, even if uncommitted."""
+        if key in self.pending:
+            return self.pending[key]
+        return self.documents.get(key)
+
+    def search(self, query, filterQueries=(), realtime=False):
+        """Returns the documents matching a query and filter queries."""
+        if realtime:
+            documents = dict(self.documents)
+            for key, document in self.pending.iteritems():
+                if document is None:
+                    documents.pop(key, None)
+                else:
+                    documents[key] = document
+        else:
+            documents = self.documents
+
+        matchers = [_parseQuery(q) for q in [query] + list(filterQueries)]
+        candidates = documents.itervalues()
+        for matcher in matchers:
+            # Queries on the unique key are resolved without a full scan.
+            if getattr(matcher, 'field', None) == self.uniqueKey:
+                candidates = [documents[key] for key in matcher.values
+                              if key in documents]
+                break
+
+        return sorted((document for document in candidates
+                       if all(matcher(document) for matcher in matchers)),
+                      key=lambda document: document[self.uniqueKey])
+
+
+def _unescape(term):
+    result = []
+    escaped = False
+    for char in term:
+        if escaped or char != '\\':
+            result.append(char)
+            escaped = False
+        else:
+            escaped = True
+    return u''.join(result)
+
+
+def _parseQuery(query):
+    """Returns a callable that tells if a document matches a query."""
+    query = query.strip()
+    if query in ('*:*', '*'):
+        return lambda document: True
+
+    if query.startswith('{!terms'):
+        localParams, terms = query[len('{!terms'):].split('}', 1)
+        params = dict(param.split('=', 1) for param in localParams.split())
+        separator = params.get('separator', ',').strip('\'"')
+        return _FieldMatcher(params['f'], set(terms.split(separator)))
+
+    if ':' not in query:
+        raise _QueryError('Unsupported query: %r' % query)
+
+    field, value = query.split(':', 1)
+    if value.startswith('"') and value.endswith('"'):
+        value = value[1:-1]
+    if value == '*':
+        return lambda document: field in document
+    return _FieldMatcher(field, set([_unescape(value)]))
+
+
+class _FieldMatcher(object):
+    """Matches the documents with any of the given values in a field."""
+
+    def __init__(self, field, values):
+        self.field = field
+        self.values = values
+
+    def __call__(self, document):
+        value = document.get(self.field)
+        if isinstance(value, list):
+            return any(v in self.values for v in value)
+        return value in self.values
+
+
+class _BodyCollector(object):
+    """A consumer that collects the body written by an L{IBodyProducer}."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(data)
+
+
+class FakeResponse(BufferedResponse):
+    """A fake L{IResponse} that delivers its whole body at once.
+
+    @param code: The HTTP status code.
+    @param body: The body of the response as a C{str}.
+    @param headers: Optionally, a L{Headers} instance.
+    """
+
+    def __init__(self, code, body, headers=None):
+        BufferedResponse.__init__(
+            self, ('HTTP', 1, 1), code, 'OK' if code == 200 else 'Error',
+            headers or Headers({'Content-Type': ['application/json']}), body)
+
+
+class FakeSolrTransport(object):
+    """An L{ISolrTransport} answering requests from a L{FakeSolrIndex}.
+
+    The requests are answered synchronously, so the L{Deferred}s returned by
+    the L{SolrClient} using this transport fire before the call returns.
+
+    @param index: The L{FakeSolrIndex} with the documents. A new empty index
+        is used by default.
+    @param schema: Optionally, the C{dict} returned by the Schema API at
+        C{/schema}. By default, the schema only has the unique key field.
+    @ivar requests: A C{list} of C{(method, url, body)} tuples with the
+        requests received.
+    """
+
+    implements(ISolrTransport)
+
+    def __init__(self, index=None, schema=None):
+        if index is None:
+            index = FakeSolrIndex()
+        if schema is None:
+            schema = {'uniqueKey': index.uniqueKey,
+                      'fields': [{'name': index.uniqueKey,
+                                  'type': 'string'}],
+                      'fieldTypes': [{'name': 'string',
+                                      'class': 'solr.StrField'}]}
+        self.index = index
+        self.schema = schema
+        self.requests = []
+
+    def request(self, method, url, headers, bodyProducer):
+        body = ''
+        if bodyProducer is not None:
+            collector = _BodyCollector()
+            bodyProducer.startProducing(collector)
+            body = ''.join(collector.parts)
+        self.requests.append((method, url, body))
+
+        parsed = urlparse.urlparse(url)
+        params = urlparse.parse_qs(parsed.query)
+        if method == 'POST' and not parsed.path.endswith('/update'):
+            for key, values in urlparse.parse_qs(body).iteritems():
+                params.setdefault(key, []).extend(values)
+        params = dict((key, [value.decode('utf-8') for value in values])
+                      for key, values in params.iteritems())
+
+        handlers = {'/select': self._select,
+                    '/export': self._export,
+                    '/update': self._update,
+                    '/get': self._get,
+                    '/admin/ping': self._ping,
+                    '/schema': self._schema}
+        for suffix, handler in handlers.iteritems():
+            if parsed.path.endswith(suffix):
+                break
+        else:
+            return succeed(FakeResponse(404, 'Not Found'))
+
+        try:
+            result = handler(params, body)
+        except _VersionConflict:
+            return succeed(FakeResponse(409, 'Conflict'))
+        except (_QueryError, SyntaxError, KeyError, ValueError):
+            return succeed(FakeResponse(400, 'Bad Request'))
+
+        # Like in Solr, the real-time get handler omits the header by default.
+        omitHeader = u'true' if suffix == '/get' else u'false'
+        if params.get('omitHeader', [omitHeader])[0] != u'true':
+            result['responseHeader'] = {'status': 0, 'QTime': 0}
+
+        responseHeaders = Headers({'Content-Type': ['application/json']})
+        if method == 'GET' and suffix == '/select':
+            # Like Solr's HTTP caching, the ETag changes on every commit.
+            etag = '"%d"' % self.index.commits
+            responseHeaders.setRawHeaders('ETag', [etag])
+            if headers is not None and etag in headers.getRawHeaders(
+                    'if-none-match', []):
+                return succeed(FakeResponse(304, '', responseHeaders))
+        return succeed(FakeResponse(200, json.dumps(result), responseHeaders))
+
+    def _select(self, params, body):
+        index = self.index
+        documents = index.search(params.get('q', [u'*:*'])[0],
+                                 params.get('fq', []))
+
+        if 'sort' in params:
+            field, direction = params['sort'][0].split()
+            documents.sort(key=lambda document: document.get(field),
+                           reverse=direction == 'desc')
+
+        start = int(params.get('start', [0])[0])
+        rows = int(params.get('rows', [10])[0])
+        docs = [self._fields(document, params)
+                for document in documents[start:start + rows]]
+        result = {'response': {'numFound': len(documents), 'start': start,
+                               'docs': docs}}
+        if params.get('facet', [u'false'])[0] == u'true':
+            result['facet_counts'] = self._facets(documents, params)
+        return result
+
+    def _export(self, params, body):
+        if 'fl' not in params:
+            raise KeyError('The export handler requires fl')
+        field, direction = params['sort'][0].split()
+        documents = sorted(self.index.search(params.get('q', [u'*:*'])[0],
+                                             params.get('fq', [])),
+                           key=lambda document: document.get(field),
+                           reverse=direction == 'desc')
+        docs = [self._fields(document, params) for document in documents]
+        return {'response': {'numFound': len(docs), 'docs': docs}}
+
+    def _facets(self, documents, params):
+        limit = int(params.get('facet.limit', [100])[0])
+        minCount = int(params.get('facet.mincount', [0])[0])
+        fields = {}
+        for field in params.get('facet.field', []):
+            counts = {}
+            for document in documents:
+                values = document.get(field, [])
+                if not isinstance(values, list):
+                    values = [values]
+                for value in values:
+                    counts[value] = counts.get(value, 0) + 1
+            terms = sorted((term for term in counts.iteritems()
+                            if term[1] >= minCount),
+                           key=lambda (term, count): (-count, term))
+            if limit >= 0:
+                terms = terms[:limit]
+            fields[field] = [value for term in terms for value in term]
+
+        queries = {}
+        for query in params.get('facet.query', []):
+            matcher = _parseQuery(query)
+            queries[query] = len([document for document in documents
+                                  if matcher(document)])
+        return {'facet_fields': fields, 'facet_queries': queries}
+
+    def _fields(self, document, params):
+        fields = set()
+        for fl in params.get('fl', [u'*']):
+            fields.update(field.strip() for field in fl.split(','))
+        children = u'[child]' in fields
+        return dict((key, value) for key, value in document.iteritems()
+                    if (u'*' in fields or key in fields) and
+                    (children or not _isChildren(value)))
+
+    def _update(self, params, body):
+        root = ElementTree.fromstring(body)
+        commands = list(root) if root.tag == 'update' else [root]
+        for command in commands:
+            if command.tag == 'add':
+                overwrite = command.get('overwrite', 'true') == 'true'
+                for doc in command.findall('doc'):
+                    self._add(doc, overwrite)
+                if command.get('commitWithin') is not None:
+                    self.index.commit()
+            elif command.tag == 'delete':
+                for id in command.findall('id'):
+                    self.index.delete(_text(id))
+                for query in command.findall('query'):
+                    self.index.deleteByQuery(_text(query))
+            elif command.tag in ('commit', 'optimize'):
+                self.index.commit()
+            elif command.tag == 'rollback':
+                self.index.rollback()
+            else:
+                raise ValueError('Unknown command %r' % command.tag)
+        return {}
+
+    def _add(self, element, overwrite):
+        document, updates = self._parseDocument(element)
+        key = document[self.index.uniqueKey]
+        version = document.pop('_version_', None)
+        if version is not None:
+            self.index.checkVersion(key, int(version))
+        if updates:
+            stored = self.index.get(key)
+            document = dict(stored or {}, **document)
+            self._applyUpdates(document, updates)
+        self.index.add(document, overwrite)
+
+    def _parseDocument(self, element):
+        """
+        Returns the fields of a C{doc} element, with its children, and its
+        atomic updates.
+        """
+        document = {}
+        updates = []
+        for field in element.findall('field'):
+            name = field.get('name')
+            children = field.findall('doc')
+            if children:
+                document.setdefault(name, []).extend(
+                    self._parseDocument(child)[0] for child in children)
+                continue
+            value = None if field.get('null') == 'true' else _text(field)
+            if field.get('update') is not None:
+                updates.append((name, field.get('update'), value))
+            elif name in document:
+                if not isinstance(document[name], list):
+                    document[name] = [document[name]]
+                document[name].append(value)
+            else:
+                document[name] = value
+
+        children = element.findall('doc')
+        if children:
+            document['_childDocuments_'] = [self._parseDocument(child)[0]
+                                            for child in children]
+        return document, updates
+
+    def _applyUpdates(self, document, updates):
+        replaced = set()
+        for name, modifier, value in updates:
+            current = document.get(name)
+            if current is None:
+                values = []
+            elif isinstance(current, list):
+                values = list(current)
+            else:
+                values = [current]
+
+            if modifier == 'set':
+                if name not in replaced:
+                    replaced.add(name)
+                    values = []
+                if value is not None:
+                    values.append(value)
+            elif modifier in ('add', 'add-distinct'):
+                if modifier == 'add' or value not in values:
+                    values.append(value)
+            elif modifier == 'remove':
+                values = [v for v in values if v != value]
+            elif modifier == 'removeregex':
+                values = [v for v in values
+                          if not re.match('(?:%s)\\Z' % value, v)]
+            elif modifier == 'inc':
+                values = [unicode(int(values[0] if values else 0) +
+                                  int(value))]
+            else:
+                raise ValueError('Unknown atomic update %r' % modifier)
+
+            if not values:
+                document.pop(name, None)
+            elif len(values) == 1:
+                document[name] = values[0]
+            else:
+                document[name] = values
+
+    def _get(self, params, body):
+        keys = list(params.get('id', []))
+        for ids in params.get('ids', []):
+            keys.extend(ids.split(','))
+
+        docs = []
+        for key in keys:
+            document = self.index.get(key)
+            if document is not None:
+                docs.append(self._fields(document, params))
+
+        if len(keys) == 1 and 'ids' not in params:
+            return {'doc': docs[0] if docs else None}
+        return {'response': {'numFound': len(docs), 'start': 0,
+                             'docs': docs}}
+
+    def _ping(self, params, body):
+        return {'status': 'OK'}
+
+    def _schema(self, params, body):
+        return {'schema': self.schema}
+
+
+def _isChildren(value):
+    """Returns C{True} if a field value is a list of child documents."""
+    return isinstance(value, list) and bool(value) and \
+        isinstance(value[0], dict)
+
+
+def _text(element):
+    text = element.text or u''
+    if isinstance(text, str):
+        text = text.decode('utf-8')
+    return text
@@ -0,0 +1,450 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+HTTP transports.
+
+A transport sends the HTTP requests of a L{SolrClient}. The default
+transport uses Twisted's L{Agent}. Other transports can be used to change how
+connections are handled, like L{PipeliningTransport}, or to avoid the network
+altogether in tests and benchmarks (see L{txsolr.testing}).
+"""
+import logging
+import urlparse
+from collections import deque
+
+from zope.interface import Interface, implements
+from twisted.internet.defer import Deferred
+from twisted.internet.protocol import ClientCreator, Protocol
+from twisted.python.failure import Failure
+from twisted.web.client import Agent, HTTPConnectionPool, ResponseDone
+# These decoders are private API of Twisted, which may change them without
+# a deprecation period. They are only imported here.
+from twisted.web.http import _ChunkedTransferDecoder, _IdentityTransferDecoder
+from twisted.web.http_headers import Headers
+
+
+__all__ = ['ISolrTransport', 'AgentTransport', 'PipeliningTransport',
+           'BufferedResponse']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+class ISolrTransport(Interface):
+    """An object able to send HTTP requests to Solr."""
+
+    def request(method, url, headers, bodyProducer):
+        """Sends an HTTP request.
+
+        @param method: The HTTP method of the request, like C{GET}.
+        @param url: The full URL of the request.
+        @param headers: A L{Headers} instance with the request headers.
+        @param bodyProducer: An L{IBodyProducer} with the body of the request,
+            or C{None}.
+        @return: A L{Deferred} that fires with an L{IResponse} provider once
+            the response headers are received.
+        """
+
+
+class AgentTransport(object):
+    """A transport that uses Twisted's L{Agent}.
+
+    @param reactor: The reactor used for the connections. Default is the
+        global reactor.
+    @param pool: Optionally, an L{HTTPConnectionPool} used to keep persistent
+        connections to Solr. Without it, a new connection is made for each
+        request.
+    """
+
+    implements(ISolrTransport)
+
+    def __init__(self, reactor=None, pool=None):
+        if reactor is None:
+            from twisted.internet import reactor
+
+        if pool is None:
+            self.agent = Agent(reactor)
+        else:
+            self.agent = Agent(reactor, pool=pool)
+
+    def request(self, method, url, headers, bodyProducer):
+        return self.agent.request(method, url, headers, bodyProducer)
+
+
+class _BodyTransport(object):
+    """The transport given to the protocols consuming a L{BufferedResponse}.
+    """
+
+    def pauseProducing(self):
+        pass
+
+    def resumeProducing(self):
+        pass
+
+    def stopProducing(self):
+        pass
+
+
+class BufferedResponse(object):
+    """An L{IResponse} whose body was already received, delivered at once.
+
+    @param version: The HTTP version of the response, like
+        C{('HTTP', 1, 1)}.
+    @param code: The HTTP status code.
+    @param phrase: The HTTP status phrase.
+    @param headers: A L{Headers} instance.
+    @param body: The body of the response as a C{str}.
+    """
+
+    def __init__(self, version, code, phrase, headers, body):
+        self.version = version
+        self.code = code
+        self.phrase = phrase
+        self.headers = headers
+        self.length = len(body)
+        self.body = body
+
+    def deliverBody(self, protocol):
+        protocol.makeConnection(_BodyTransport())
+        protocol.dataReceived(self.body)
+        protocol.connectionLost(Failure(ResponseDone()))
+
+
+def _parseResponseHead(head):
+    """Parses the status line and the headers of an HTTP response.
+
+    @param head: The head of the response, without the empty line after it.
+    @raise ValueError: If the head is malformed.
+    @return: A C{tuple} with the version, like C{('HTTP', 1, 1)}, the status
+        code, the status phrase and the L{Headers}.
+    """
+    lines = head.split('\r\n')
+    version, code, phrase = (lines[0].split(' ', 2) + ['', ''])[:3]
+    protocol, _, number = version.partition('/')
+    major, _, minor = number.partition('.')
+    if protocol != 'HTTP' or not (major.isdigit() and minor.isdigit() and
+                                  code.isdigit()):
+        raise ValueError('Malformed status line: %r' % lines[0])
+    headers = Headers()
+    for line in lines[1:]:
+        name, separator, value = line.partition(':')
+        if not separator:
+            raise ValueError('Malformed header line: %r' % line)
+        headers.addRawHeader(name.strip(), value.strip())
+    return ('HTTP', int(major), int(minor)), int(code), phrase, headers
+
+
+class _PipelinedRequest(object):
+    """A request waiting to be sent or answered on a pipelined connection."""
+
+    def __init__(self, method, url, headers):
+        self.method = method
+        self.url = url
+        self.headers = headers
+        self.deferred = None
+        self.attempts = 0
+        self.cancelled = False
+        self.fallback = None
+
+
+class _PipeliningProtocol(Protocol):
+    """An HTTP/1.1 client connection that pipelines its requests.
+
+    Requests are written as soon as they are given to L{send}, without
+    waiting for the previous responses. The responses are matched to the
+    requests in order.
+
+    @ivar pending: The requests sent and not answered yet, in order.
+    @ivar closing: C{True} once the server said it will close the
+        connection, so no more requests must be sent on it.
+    """
+
+    def __init__(self, pool, key):
+        self._pool = pool
+        self._key = key
+        self.pending = deque()
+        self.closing = False
+        self._buffer = ''
+        self._decoder = None
+        self._response = None
+        self._body = []
+        self._untilClosed = False
+
+    def send(self, request):
+        scheme, netloc, path, params, query, fragment = urlparse.urlparse(
+            request.url)
+        path = urlparse.urlunparse(('', '', path or '/', params, query, ''))
+        lines = ['%s %s HTTP/1.1' % (request.method, path),
+                 'Host: %s' % netloc]
+        for name, values in request.headers.getAllRawHeaders():
+            lines.extend('%s: %s' % (name, value) for value in values)
+        self.transport.write('\r\n'.join(lines) + '\r\n\r\n')
+        self.pending.append(request)
+
+    def dataReceived(self, data):
+        self._buffer += data
+        try:
+            while self._buffer:
+                if self._decoder is not None:
+                    data, self._buffer = self._buffer, ''
+                    self._decoder.dataReceived(data)
+                elif self.closing or not self.pending:
+                    return
+                elif not self._parseHead():
+                    return
+        except ValueError as e:
+            # The server is not answering the pipelined requests correctly.
+            # The requests of the connection are sent to the fallback when
+            # it's lost.
+            self._pool._notSupported(self._key,
+                                     'sent a malformed response: %s' % e)
+            self.closing = True
+            self._buffer = ''
+            self._decoder = None
+            self.transport.loseConnection()
+
+    def _parseHead(self):
+        """Parses the status line and the headers of the next response.
+
+        @return: C{True} if the head was complete, C{False} otherwise.
+        """
+        head, separator, rest = self._buffer.partition('\r\n\r\n')
+        if not separator:
+            return False
+        self._buffer = rest
+
+        self._response = _parseResponseHead(head)
+        version, code, phrase, headers = self._response
+
+        connection = ','.join(headers.getRawHeaders('connection', []))
+        if version < ('HTTP', 1, 1):
+            # HTTP/1.0 servers close the connection after each response.
+            self._pool._notSupported(self._key,
+                                     'responds with HTTP/%d.%d' % version[1:])
+            self.closing = True
+        elif 'close' in connection.lower():
+            self.closing = True
+
+        request = self.pending[0]
+        encoding = ','.join(headers.getRawHeaders('transfer-encoding', []))
+        length = headers.getRawHeaders('content-length')
+        if (request.method == 'HEAD' or code in (204, 304)
+                or 100 <= code < 200 or length == ['0']):
+            self._finishResponse(self._buffer)
+        elif 'chunked' in encoding.lower():
+            self._decoder = _ChunkedTransferDecoder(self._body.append,
+                                                    self._finishResponse)
+        elif length:
+            self._decoder = _IdentityTransferDecoder(
+                int(length[0]), self._body.append, self._finishResponse)
+        else:
+            # The body ends when the connection is closed.
+            self._pool._notSupported(self._key, 'responds without a length')
+            self.closing = True
+            self._untilClosed = True
+            self._decoder = _IdentityTransferDecoder(
+                None, self._body.append, self._finishResponse)
+        return True
+
+    def _finishResponse(self, rest):
+        version, code, phrase, headers = self._response
+        body = ''.join(self._body)
+        self._response = None
+        self._decoder = None
+        self._body = []
+        self._buffer = rest
+
+        request = self.pending.popleft()
+        if self.closing:
+            self.transport.loseConnection()
+        if not request.cancelled:
+            request.deferred.callback(
+                BufferedResponse(version, code, phrase, headers, body))
+        self._pool._dispatch(self._key)
+
+    def connectionLost(self, reason):
+        if self._untilClosed and self._decoder is not None:
+            # The end of the connection is the end of the response.
+            self._finishResponse('')
+
+        pipelined = len(self.pending) > 1 and not self.closing
+        if pipelined:
+            self._pool._notSupported(
+                self._key, 'closed a connection with %d pipelined requests'
+                % len(self.pending))
+        self._pool._connectionLost(self._key, self,
+                                   [request for request in self.pending
+                                    if not request.cancelled])
+        self.pending.clear()
+
+
+class PipeliningTransport(object):
+    """A transport that pipelines GET requests on persistent connections.
+
+    With HTTP/1.1 pipelining, requests are sent on a connection without
+    waiting for the responses of the requests sent before them, so a burst
+    of small queries to a distant server pays one round trip instead of one
+    per request. Only idempotent requests (C{GET} and C{HEAD} without a
+    body) are pipelined; the rest are sent with the C{fallback} transport.
+
+    The responses of a connection are given to the requests in the order
+    they were sent. Cancelling a request that was already sent discards its
+    response when it arrives, without affecting the other requests.
+
+    If a server answers with HTTP/1.0, without a body length, or closes a
+    connection with pipelined requests without saying it would, the
+    transport assumes the server doesn't support pipelining and sends all
+    the following requests to it with the C{fallback} transport. Requests
+    lost in a closed connection are sent again, since they are idempotent.
+
+    @param reactor: The reactor used for the connections. Default is the
+        global reactor.
+    @param maxConnections: The maximum number of connections to each server.
+    @param maxPipelineDepth: The maximum number of requests waiting for a
+        response on each connection.
+    @param fallback: The L{ISolrTransport} used for the requests that are
+        not pipelined. Default is an L{AgentTransport} with persistent
+        connections.
+    @ivar unsupported: A C{set} with the C{(host, port)} tuples of the
+        servers that don't support pipelining.
+    """
+
+    implements(ISolrTransport)
+
+    def __init__(self, reactor=None, maxConnections=2, maxPipelineDepth=8,
+                 fallback=None):
+        if reactor is None:
+            from twisted.internet import reactor
+
+        if fallback is None:
+            fallback = AgentTransport(reactor, HTTPConnectionPool(reactor))
+        self.reactor = reactor
+        self.maxConnections = maxConnections
+        self.maxPipelineDepth = maxPipelineDepth
+        self.fallback = fallback
+        self.unsupported = set()
+
+        self._connections = {}
+        self._connecting = {}
+        self._waiting = {}
+
+    def request(self, method, url, headers, bodyProducer):
+        parsed = urlparse.urlparse(url)
+        key = (parsed.hostname, parsed.port or 80)
+        if (method not in ('GET', 'HEAD') or bodyProducer is not None
+                or parsed.scheme != 'http' or key in self.unsupported):
+            return self.fallback.request(method, url, headers, bodyProducer)
+
+        if headers is None:
+            headers = Headers()
+        request = _PipelinedRequest(method, url, headers)
+        request.deferred = Deferred(lambda _: self._cancel(key, request))
+        self._waiting.setdefault(key, deque()).append(request)
+        self._dispatch(key)
+        return request.deferred
+
+    def _cancel(self, key, request):
+        request.cancelled = True
+        waiting = self._waiting.get(key, ())
+        if request in waiting:
+            waiting.remove(request)
+        if request.fallback is not None:
+            request.fallback.cancel()
+
+    def _dispatch(self, key):
+        """Sends the waiting requests to a server on the open connections,
+        connecting if needed."""
+        waiting = self._waiting.get(key)
+        while waiting:
+            if key in self.unsupported:
+                self._sendToFallback(waiting.popleft())
+                continue
+
+            available = [connection
+                         for connection in self._connections.get(key, [])
+                         if not connection.closing and
+                         len(connection.pending) < self.maxPipelineDepth]
+            if available:
+                connection = min(available,
+                                 key=lambda connection:
+                                 len(connection.pending))
+                request = waiting.popleft()
+                request.attempts += 1
+                connection.send(request)
+                continue
+
+            connections = (len(self._connections.get(key, [])) +
+                           self._connecting.get(key, 0))
+            if connections < self.maxConnections:
+                self._connect(key)
+            return
+
+    def _connect(self, key):
+        self._connecting[key] = self._connecting.get(key, 0) + 1
+        creator = ClientCreator(self.reactor, _PipeliningProtocol, self, key)
+        d = creator.connectTCP(*key)
+
+        def connected(connection):
+            self._connecting[key] -= 1
+            self._connections.setdefault(key, []).append(connection)
+            self._dispatch(key)
+
+        def failed(failure):
+            self._connecting[key] -= 1
+            if self._connections.get(key) or self._connecting[key]:
+                return
+            waiting = self._waiting.pop(key, ())
+            for request in waiting:
+                request.deferred.errback(failure)
+
+        d.addCallbacks(connected, failed)
+
+    def _connectionLost(self, key, connection, unanswered):
+        connections = self._connections.get(key, [])
+        if connection in connections:
+            connections.remove(connection)
+
+        # Lost requests are sent again once on a new connection, and then
+        # with the fallback transport.
+        waiting = self._waiting.setdefault(key, deque())
+        for request in reversed(unanswered):
+            if request.attempts > 1 or key in self.unsupported:
+                self._sendToFallback(request)
+            else:
+                waiting.appendleft(request)
+        self._dispatch(key)
+
+    def _notSupported(self, key, reason):
+        if key not in self.unsupported:
+            _logger.warning('Pipelining disabled for %s:%d, the server %s'
+                            % (key + (reason,)))
+            self.unsupported.add(key)
+
+    def _sendToFallback(self, request):
+        d = self.fallback.request(request.method, request.url,
+                                  request.headers, None)
+        request.fallback = d
+
+        def fire(response):
+            if not request.deferred.called:
+                request.deferred.callback(response)
+
+        def fireFailure(failure):
+            if not request.deferred.called:
+                request.deferred.errback(failure)
+
+        d.addCallbacks(fire, fireFailure)